@@ -0,0 +1,123 @@
+"""
+Benchmark độ trễ của bước lập kế hoạch câu hỏi (trước RAG) trên hot path.
+
+So sánh hai cách xử lý:
+- legacy: LLM router_chain -> SplitQueryHandler -> rephrase từng câu hỏi con (1 + 1 + K lần gọi LLM nối tiếp)
+- planner: QueryPlanner trả về route + câu hỏi con + câu truy vấn tìm kiếm (1 lần gọi LLM)
+
+Cache chain ghi vào thư mục tạm để mọi lần gọi đều đi tới LLM (không đo cache hit).
+
+Usage:
+    python benchmarks/bench_query_planner.py
+    python benchmarks/bench_query_planner.py --mock --llm-latency "lognormal:700,0.4"
+    python benchmarks/bench_query_planner.py --queries "Liều dùng vitamin C? Có tác dụng phụ không?"
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+DEFAULT_QUERIES = [
+    "Paracetamol có tác dụng gì?",
+    "Thuốc ho cho trẻ em",
+    "Thuốc dị ứng nào không gây buồn ngủ?",
+    "Liều dùng vitamin C cho người lớn? Có tác dụng phụ không?",
+    "Ibuprofen và aspirin khác nhau thế nào? Uống cùng lúc được không?",
+    "Thống kê tồn kho theo nhà cung cấp",
+    "Top 10 thuốc có giá trị nhập cao nhất",
+]
+
+
+def percentile(values, q: float) -> float:
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(q * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def count_llm_runs(runs) -> int:
+    """Đếm số lần gọi LLM trong cây run đã trace (kể cả structured output của provider mock)."""
+    total = 0
+    stack = list(runs)
+    while stack:
+        run = stack.pop()
+        if run.run_type == "llm" or run.name.startswith("MockStructured"):
+            total += 1
+        stack.extend(run.child_runs or [])
+    return total
+
+
+def run_legacy(router, split_handler, medical_pipeline, query: str):
+    """Luồng cũ: route bằng LLM, split, rồi rephrase từng câu hỏi con."""
+    route = router.router_chain.invoke({"question": query})
+    if route.datasource != "medical_knowledge":
+        return route, []
+    sub_queries = split_handler.split(query).queries
+    return route, [medical_pipeline.process_medical_rephrase(sub_query) for sub_query in sub_queries]
+
+
+def run_planner(planner, query: str):
+    return planner.plan(query)
+
+
+def bench(name: str, runner, queries, repeat: int) -> dict:
+    from langchain_core.tracers.context import collect_runs
+
+    latencies = []
+    llm_calls = 0
+    for _ in range(repeat):
+        for query in queries:
+            started = time.perf_counter()
+            with collect_runs() as collector:
+                runner(query)
+            latencies.append((time.perf_counter() - started) * 1000)
+            llm_calls += count_llm_runs(collector.traced_runs)
+    return {"mode": name, "requests": len(latencies), "llm_calls": llm_calls, "latencies": latencies}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="So sánh độ trễ router + split + rephrase với QueryPlanner")
+    parser.add_argument("--queries", nargs="+", default=DEFAULT_QUERIES, help="Danh sách câu hỏi dùng để benchmark")
+    parser.add_argument("--repeat", type=int, default=1, help="Số lần lặp lại tập câu hỏi")
+    parser.add_argument("--mock", action="store_true", help="Dùng provider mock (không gọi API)")
+    parser.add_argument("--llm-latency", default=None, help='Phân phối độ trễ LLM khi --mock, vd "lognormal:700,0.4"')
+    args = parser.parse_args()
+
+    # Cấu hình phải có trước khi import pipeline
+    if args.mock:
+        os.environ["MEDAGENT_MOCK"] = "1"
+        os.environ.setdefault("MEDAGENT_MOCK_QDRANT_DOCS", "100")  # benchmark không search Qdrant
+        if args.llm_latency:
+            os.environ["MEDAGENT_MOCK_LATENCY_LLM"] = args.llm_latency
+    os.environ["MEDAGENT_CACHE_DIR"] = tempfile.mkdtemp(prefix="medagent-planner-")
+
+    from query.medical.medical_pipeline import MedicalPipeline
+    from query.query_planner import QueryPlanner
+    from query.router import Router
+    from query.split_query import SplitQueryHandler
+
+    router = Router(use_cache=False)
+    split_handler = SplitQueryHandler()
+    medical_pipeline = MedicalPipeline()
+    planner = QueryPlanner()
+
+    modes = [
+        ("legacy", lambda query: run_legacy(router, split_handler, medical_pipeline, query)),
+        ("planner", lambda query: run_planner(planner, query)),
+    ]
+
+    print("=" * 60)
+    print(f"{'mode':<10}{'llm/req':>10}{'mean ms':>10}{'p50 ms':>10}{'p95 ms':>10}")
+    print("=" * 60)
+    for name, runner in modes:
+        stats = bench(name, runner, args.queries, args.repeat)
+        latencies = stats["latencies"]
+        print(f"{name:<10}{stats['llm_calls'] / stats['requests']:>10.2f}"
+              f"{sum(latencies) / len(latencies):>10.0f}{percentile(latencies, 0.5):>10.0f}"
+              f"{percentile(latencies, 0.95):>10.0f}")
+
+
+if __name__ == "__main__":
+    main()
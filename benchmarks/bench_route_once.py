@@ -0,0 +1,99 @@
+"""
+Benchmark số lần gọi LLM trên mỗi request của RouterPipeline.
+
+So sánh hai cách xử lý:
+- legacy: Router.route() rồi process_query() tự routing lại (2 lần gọi router LLM / request)
+- routed_once: process_query_unified() truyền RoutingContext xuống (1 lần gọi router LLM / request)
+
+Usage:
+    python benchmarks/bench_route_once.py
+    python benchmarks/bench_route_once.py --queries "Paracetamol có tác dụng gì?" "Top 10 thuốc có giá trị nhập cao nhất"
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from langchain_core.tracers.context import collect_runs
+
+from query.router_pipeline import RouterPipeline
+
+DEFAULT_QUERIES = [
+    "Paracetamol có tác dụng gì?",
+    "Thuốc ho cho trẻ em",
+    "Thống kê tồn kho theo nhà cung cấp",
+    "Vẽ biểu đồ doanh thu nhập hàng theo tháng",
+    "Top 10 thuốc có giá trị nhập cao nhất",
+]
+
+
+def count_llm_runs(runs) -> int:
+    """Đếm số lần gọi LLM (run_type == 'llm') trong cây run đã trace."""
+    total = 0
+    stack = list(runs)
+    while stack:
+        run = stack.pop()
+        if run.run_type == "llm":
+            total += 1
+        stack.extend(run.child_runs or [])
+    return total
+
+
+def run_legacy(pipeline: RouterPipeline, query: str):
+    """Mô phỏng luồng cũ: routing để lấy steps, rồi process_query routing lại."""
+    pipeline.router.route(query)
+    return pipeline.process_query(query)
+
+
+def run_routed_once(pipeline: RouterPipeline, query: str):
+    return pipeline.process_query_unified(query)
+
+
+def bench(pipeline: RouterPipeline, queries, mode: str) -> dict:
+    runner = run_legacy if mode == "legacy" else run_routed_once
+    router_calls_before = pipeline.router.llm_calls
+    llm_calls = 0
+    start = time.perf_counter()
+
+    for query in queries:
+        with collect_runs() as collector:
+            runner(pipeline, query)
+        llm_calls += count_llm_runs(collector.traced_runs)
+
+    elapsed = time.perf_counter() - start
+    return {
+        "mode": mode,
+        "requests": len(queries),
+        "router_llm_calls": pipeline.router.llm_calls - router_calls_before,
+        "total_llm_calls": llm_calls,
+        "seconds": elapsed,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark số lần gọi LLM / request của RouterPipeline")
+    parser.add_argument("--queries", nargs="+", default=DEFAULT_QUERIES, help="Danh sách câu hỏi dùng để benchmark")
+    args = parser.parse_args()
+
+    pipeline = RouterPipeline(max_retries=1)
+
+    print("=" * 60)
+    print(f"{'mode':<14}{'router/req':>12}{'llm/req':>10}{'s/req':>10}")
+    print("=" * 60)
+    for mode in ("legacy", "routed_once"):
+        stats = bench(pipeline, args.queries, mode)
+        n = stats["requests"]
+        print(f"{mode:<14}{stats['router_llm_calls'] / n:>12.2f}"
+              f"{stats['total_llm_calls'] / n:>10.2f}{stats['seconds'] / n:>10.2f}")
+
+    router_stats = pipeline.router.get_stats()
+    print("=" * 60)
+    print(f"Router rules: {router_stats['rule_hits']}/{router_stats['requests']} ({router_stats['rule_rate']:.0%}), "
+          f"fast path: {router_stats['fast_path_hits']}/{router_stats['requests']} ({router_stats['fast_path_rate']:.0%}), "
+          f"router LLM calls: {router_stats['llm_calls']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+"""
+Load test RouterPipeline hoàn toàn offline bằng provider mock (MEDAGENT_MOCK=1).
+
+LLM, embedding, Qdrant (":memory:" nạp từ drugs-data-main) và web search đều là mock nên
+không tốn API budget và không cần mạng; độ trễ của từng loại lấy từ phân phối cấu hình được.
+Cache chain/route ghi vào thư mục tạm để mỗi lần chạy bắt đầu từ cache rỗng.
+
+Usage:
+    python benchmarks/load_test.py
+    python benchmarks/load_test.py --requests 500 --concurrency 50 --llm-latency "lognormal:900,0.5"
+    python benchmarks/load_test.py --latency-scale 0 --max-docs 500   # chỉ đo overhead CPU của pipeline
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+DEFAULT_QUERIES = [
+    "Paracetamol có tác dụng gì?",
+    "Thuốc ho cho trẻ em",
+    "Thuốc dị ứng nào không gây buồn ngủ?",
+    "Liều dùng vitamin C cho người lớn? Có tác dụng phụ không?",
+    "Thuốc nhỏ mắt cho người bị khô mắt",
+    "Thống kê tồn kho theo nhà cung cấp",
+    "Top 10 thuốc có giá trị nhập cao nhất",
+    "Doanh thu nhập hàng theo tháng",
+]
+
+
+def percentile(values, q: float) -> float:
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(q * (len(ordered) - 1))))
+    return ordered[index]
+
+
+async def run(pipeline, queries, concurrency: int) -> list:
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def one(query: str):
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                await pipeline.aprocess_query_unified(query)
+                latencies.append((time.perf_counter() - started, None))
+            except Exception as e:
+                latencies.append((time.perf_counter() - started, e))
+
+    await asyncio.gather(*(one(query) for query in queries))
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test RouterPipeline với provider mock")
+    parser.add_argument("--requests", type=int, default=200, help="Tổng số request")
+    parser.add_argument("--concurrency", type=int, default=20, help="Số request chạy đồng thời")
+    parser.add_argument("--queries", nargs="+", default=DEFAULT_QUERIES, help="Tập câu hỏi để lấy mẫu")
+    parser.add_argument("--seed", type=int, default=0, help="Seed chọn câu hỏi")
+    parser.add_argument("--llm-latency", default=None, help='Phân phối độ trễ LLM, vd "lognormal:700,0.4"')
+    parser.add_argument("--embedding-latency", default=None, help='Phân phối độ trễ embedding, vd "fixed:50"')
+    parser.add_argument("--web-latency", default=None, help='Phân phối độ trễ web search, vd "uniform:1000,4000"')
+    parser.add_argument("--latency-scale", type=float, default=None, help="Hệ số nhân mọi độ trễ (0 = không chờ)")
+    parser.add_argument("--max-docs", type=int, default=None, help="Số tài liệu tối đa nạp vào Qdrant mock")
+    parser.add_argument("--speculative", action="store_true", help="Bật speculative routing")
+    parser.add_argument("--no-coalesce", action="store_true", help="Tắt single-flight")
+    args = parser.parse_args()
+
+    # Cấu hình phải có trước khi import pipeline
+    os.environ["MEDAGENT_MOCK"] = "1"
+    os.environ.setdefault("MEDAGENT_CACHE_DIR", tempfile.mkdtemp(prefix="medagent-load-"))
+    for name, value in (("LLM", args.llm_latency), ("EMBEDDING", args.embedding_latency), ("WEB", args.web_latency)):
+        if value:
+            os.environ[f"MEDAGENT_MOCK_LATENCY_{name}"] = value
+    if args.latency_scale is not None:
+        os.environ["MEDAGENT_MOCK_LATENCY_SCALE"] = str(args.latency_scale)
+    if args.max_docs:
+        os.environ["MEDAGENT_MOCK_QDRANT_DOCS"] = str(args.max_docs)
+
+    from query.core import get_chain_cache_stats, get_cascade_stats, get_context_stats, get_embedding_batcher_stats, get_singleflight_stats, \
+        get_sparse_index_stats, get_vector_mirror_stats, get_drug_resolver_stats
+    from query.router_pipeline import RouterPipeline
+
+    started = time.perf_counter()
+    pipeline = RouterPipeline(max_retries=1, speculative=args.speculative, coalesce=not args.no_coalesce)
+    print(f"Khởi tạo pipeline (kèm nạp Qdrant mock): {time.perf_counter() - started:.1f}s")
+
+    rng = random.Random(args.seed)
+    queries = [rng.choice(args.queries) for _ in range(args.requests)]
+
+    started = time.perf_counter()
+    results = asyncio.run(run(pipeline, queries, args.concurrency))
+    elapsed = time.perf_counter() - started
+
+    latencies = [latency * 1000 for latency, _ in results]
+    errors = [error for _, error in results if error is not None]
+    print("=" * 60)
+    print(f"requests: {len(results)}  concurrency: {args.concurrency}  errors: {len(errors)}")
+    print(f"throughput: {len(results) / elapsed:.1f} req/s  ({elapsed:.1f}s)")
+    print(f"latency ms  p50: {percentile(latencies, 0.5):.0f}  p95: {percentile(latencies, 0.95):.0f}  "
+          f"p99: {percentile(latencies, 0.99):.0f}  max: {max(latencies):.0f}")
+    if errors:
+        print(f"lỗi đầu tiên: {errors[0]!r}")
+    print("=" * 60)
+    print(f"Router: {pipeline.router.get_stats()}")
+    print(f"Single-flight: {get_singleflight_stats()}")
+    print(f"Chain cache: {get_chain_cache_stats()}")
+    print(f"Cascade: {get_cascade_stats()}")
+    print(f"Context: {get_context_stats()}")
+    print(f"Embedding batcher: {get_embedding_batcher_stats()}")
+    print(f"Vector mirror: {get_vector_mirror_stats()}")
+    print(f"Sparse index: {get_sparse_index_stats()}")
+    print(f"Drug names: {get_drug_resolver_stats()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -84,25 +84,57 @@ def format_answer(answer_text: str, sources: List[str], confidence: float) -> st
     return answer_text
 
 
-def chat_with_bot(message: str, history: List[Tuple[str, Union[str, tuple]]]) -> Tuple[str, List[Tuple[str, Union[str, tuple]]]]:
+def format_progress(steps: List[str], partial_answer: str) -> str:
     """
-    Xử lý tin nhắn từ người dùng và trả về phản hồi từ chatbot.
+    Format phản hồi đang xử lý: các bước đã chạy và phần câu trả lời đã stream được.
+    
+    Args:
+        steps: Các bước xử lý đã hoàn thành
+        partial_answer: Phần câu trả lời đã nhận
+        
+    Returns:
+        str: Markdown hiển thị trong khung chat
+    """
+    steps_block = "\n".join(steps)
+    if not partial_answer:
+        return f"⏳ Đang xử lý...\n\n```\n{steps_block}\n```"
+    return f"<details><summary>Các bước xử lý</summary>\n\n```\n{steps_block}\n```\n</details>\n\n{partial_answer}▌"
+
+
+async def chat_with_bot(message: str, history: List[Tuple[str, Union[str, tuple]]]):
+    """
+    Xử lý tin nhắn từ người dùng và stream phản hồi từ chatbot.
     Hỗ trợ hiển thị cả text và hình ảnh (biểu đồ thống kê).
+    Các bước xử lý hiện ngay khi chạy xong, câu trả lời cuối được stream từng token.
     
     Args:
         message: Tin nhắn từ người dùng
         history: Lịch sử chat (list of tuples (user_message, bot_response))
         
-    Returns:
+    Yields:
         Tuple[str, List]: (empty string để clear input, updated history)
     """
     if not message or not message.strip():
-        return "", history
+        yield "", history
+        return
     
     try:
         # Xử lý câu hỏi qua router pipeline
         logger.info(f"User query: {message}")
-        result = pipeline.process_query_unified(message)
+        history.append((message, format_progress([], "")))
+        yield "", history
+        
+        steps, tokens, result = [], [], None
+        async for event in pipeline.astream_query_unified(message):
+            if event["type"] == "step":
+                steps.append(event["text"])
+            elif event["type"] == "token":
+                tokens.append(event["text"])
+            elif event["type"] == "final":
+                result = event["result"]
+                break
+            history[-1] = (message, format_progress(steps, "".join(tokens)))
+            yield "", history
         
         # Kiểm tra xem có phải là kết quả có hình ảnh không
         is_image = result.get("is_image", False)
@@ -136,19 +168,23 @@ def chat_with_bot(message: str, history: List[Tuple[str, Union[str, tuple]]]) ->
                 result.get("confidence", 0.0)
             )
         
-        # Cập nhật lịch sử
-        history.append((message, bot_response))
+        # Cập nhật lịch sử (thay phần đang xử lý bằng câu trả lời hoàn chỉnh)
+        history[-1] = (message, bot_response)
         chat_history.extend(history)
         
-        logger.info(f"Bot response generated with confidence: {result.get('confidence', 0.0):.2f}, is_image: {is_image}")
+        logger.info(f"Bot response generated with confidence: {result.get('confidence', 0.0):.2f}, is_image: {is_image}, "
+                    f"first token: {result.get('timings', {}).get('first_token', 0.0):.0f} ms")
         
-        return "", history
+        yield "", history
         
     except Exception as e:
         logger.error(f"Error processing query: {e}", exc_info=True)
         error_message = f"Xin lỗi, đã xảy ra lỗi khi xử lý câu hỏi của bạn. Vui lòng thử lại.\n\nLỗi: {str(e)}"
-        history.append((message, error_message))
-        return "", history
+        if history and history[-1][0] == message:
+            history[-1] = (message, error_message)
+        else:
+            history.append((message, error_message))
+        yield "", history
 
 
 
@@ -818,6 +854,8 @@ if __name__ == "__main__":
     print("=" * 60)
     
     demo = create_interface()
+    # Handler là async nên không cần giới hạn số request đồng thời theo số thread
+    demo.queue(default_concurrency_limit=None)
     demo.launch(
         server_name="0.0.0.0",
         server_port=7860,
@@ -1,9 +1,21 @@
-__all__ = ["get_llm", "get_rag_client", "get_embedding_model",
-           "RouteQuery", "AnswerQuery", "RephraseQuery", "SummarizeQuery", "SplitQuery", "EvalAnswer",
+__all__ = ["get_llm", "get_llm_pool_stats", "HistoryManager", "HistoryStore", "CachedChain", "get_chain_cache_stats", "CascadeChain", "get_cascade_stats", "ContextAssembler", "ContextChunk", "get_context_stats", "SingleFlight", "AsyncSingleFlight", "get_singleflight_stats", "priority_lane", "get_rate_limit_stats", "get_rag_client", "get_async_rag_client", "ensure_payload_indexes", "get_embedding_model", "get_embedding_profile", "EmbeddingProfile", "EmbeddingCache", "get_embedding_cache_stats", "MicroBatchEmbedder", "get_embedding_batcher_stats", "VectorMirror", "get_vector_mirror", "get_vector_mirror_stats", "SparseIndex", "get_sparse_index", "get_sparse_index_stats", "DrugNameResolver", "get_drug_resolver", "get_drug_resolver_stats",
+           "RouteQuery", "SubQuery", "PlannedQuery", "AnswerQuery", "AnswerWithAssessment", "RephraseQuery", "SummarizeQuery", "SplitQuery", "EvalAnswer",
            "SummaryAnswer", "FinalAnswer", "FaithfulnessEval", "LLMEvalResult", 'SplitQueryEval', "QueryPlan"]
 
-from .llm import get_llm, HistoryManager
-from .rag import get_rag_client
-from .embedding import get_embedding_model
-from .structure import RouteQuery, AnswerQuery, RephraseQuery, SummarizeQuery, SplitQuery, EvalAnswer, SummaryAnswer, FinalAnswer, \
+from .llm import get_llm, get_llm_pool_stats
+from .history import HistoryManager
+from .history_store import HistoryStore
+from .chain_cache import CachedChain, get_chain_cache_stats
+from .context_assembler import ContextAssembler, ContextChunk, get_context_stats
+from .cascade import CascadeChain, get_cascade_stats
+from .singleflight import SingleFlight, AsyncSingleFlight, get_singleflight_stats
+from .rate_limit import priority_lane, get_rate_limit_stats
+from .rag import get_rag_client, get_async_rag_client, ensure_payload_indexes
+from .embedding import get_embedding_model, get_embedding_profile, EmbeddingProfile
+from .embedding_cache import EmbeddingCache, get_embedding_cache_stats
+from .embedding_batcher import MicroBatchEmbedder, get_embedding_batcher_stats
+from .vector_mirror import VectorMirror, get_vector_mirror, get_vector_mirror_stats
+from .sparse_index import SparseIndex, get_sparse_index, get_sparse_index_stats
+from .drug_names import DrugNameResolver, get_drug_resolver, get_drug_resolver_stats
+from .structure import RouteQuery, SubQuery, PlannedQuery, AnswerQuery, AnswerWithAssessment, RephraseQuery, SummarizeQuery, SplitQuery, EvalAnswer, SummaryAnswer, FinalAnswer, \
     FaithfulnessEval, LLMEvalResult, SplitQueryEval, QueryPlan
\ No newline at end of file
@@ -0,0 +1,315 @@
+"""
+Model cascade - chạy chain bằng model rẻ/nhanh trước, chỉ chuyển lên model mạnh hơn
+khi structured output không qua được validator (hoặc model lỗi).
+
+Tier mặc định của từng chain nằm trong CASCADE_TIERS, có thể ghi đè bằng biến môi trường
+MEDAGENT_CASCADE_<CHAIN> (vd: MEDAGENT_CASCADE_SPLIT_QUERY="llama3,gpt-4o-mini,gpt-4o").
+Tier thuộc provider chưa có API key sẽ bị bỏ qua.
+"""
+import os
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Type
+
+from pydantic import BaseModel
+
+from .chain_cache import CachedChain
+from .llm import get_llm, MODEL_ALIASES, DEFAULT_MODEL
+from .structure import AnswerQuery, AnswerWithAssessment, EvalAnswer, FinalAnswer, PlannedQuery, QueryPlan, RephraseQuery, SplitQuery
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TIERS = ["gpt-4o-mini", "gpt-4o"]
+
+CASCADE_TIERS = {
+    "query_planner": ["gpt-4o-mini", "gpt-4o"],
+    "split_query": ["gpt-4o-mini", "gpt-4o"],
+    "medical_rephrase": ["gpt-4o-mini", "gpt-4o"],
+    "medical_answer": ["gpt-4o-mini", "gpt-4o"],
+    "medical_assessed_answer": ["gpt-4o-mini", "gpt-4o"],
+    "eval_answer": ["gpt-4o-mini", "gpt-4o"],
+    "final_direct": ["gpt-4o-mini", "gpt-4o"],
+    "store_plan": ["gpt-4o-mini", "gpt-4o"],
+    "store_answer": ["gpt-4o-mini", "gpt-4o"],
+}
+
+_PROVIDER_API_KEYS = {
+    "openai": "OPENAI_API_KEY",
+    "google": "GOOGLE_API_KEY",
+    "cerebras": "CEREBRAS_API_KEY",
+}
+
+
+# ---------------------------------------------------------------------------
+# Validators: trả về True nếu output đủ tốt để dùng, False để chuyển tier
+# ---------------------------------------------------------------------------
+
+def validate_answer(result: AnswerQuery) -> bool:
+    return bool(result.answer and result.answer.strip())
+
+
+def validate_assessed_answer(result: AnswerWithAssessment) -> bool:
+    """Câu trả lời không rỗng, coverage/confidence trong [0, 1] và không tự tin cao khi context không trả lời gì."""
+    if not validate_answer(result):
+        return False
+    if not (0.0 <= result.coverage <= 1.0 and 0.0 <= result.confidence <= 1.0):
+        return False
+    return not (result.coverage == 0.0 and result.confidence > 0.8)
+
+
+def validate_final_answer(result: FinalAnswer) -> bool:
+    return bool(result.answer and result.answer.strip()) and 0.0 <= result.confidence <= 1.0
+
+
+def validate_rephrase(result: RephraseQuery) -> bool:
+    return bool(result.rephrased_question and result.rephrased_question.strip())
+
+
+def validate_split(result: SplitQuery) -> bool:
+    return bool(result.queries) and all(query and query.strip() for query in result.queries)
+
+
+def validate_planned_query(result: PlannedQuery) -> bool:
+    """Phải có 1-3 câu hỏi con, mỗi câu có cả câu hỏi và câu truy vấn tìm kiếm."""
+    if not 1 <= len(result.sub_queries) <= 3:
+        return False
+    return all(sub.question.strip() and sub.search_query.strip() for sub in result.sub_queries)
+
+
+def validate_eval_answer(result: EvalAnswer) -> bool:
+    """Score phải nằm trong [0, 1] và không mâu thuẫn rõ ràng với is_satisfactory."""
+    if not 0.0 <= result.score <= 1.0:
+        return False
+    if result.is_satisfactory and result.score < 0.3:
+        return False
+    if not result.is_satisfactory and result.score > 0.8:
+        return False
+    return True
+
+
+def make_sql_validator(db) -> Callable[[QueryPlan], bool]:
+    """
+    Validator cho QueryPlan: SQL phải là câu SELECT và được SQLite chấp nhận (EXPLAIN, không thực thi).
+
+    Args:
+        db: SQLDatabase của StorePipeline
+    """
+    def validate_plan(result: QueryPlan) -> bool:
+        sql = (result.sql or "").strip().rstrip(";")
+        if not sql.lower().startswith(("select", "with")):
+            return False
+        try:
+            db.run(f"EXPLAIN {sql}", fetch="one")
+            return True
+        except Exception as e:
+            logger.info(f"QueryPlan SQL không hợp lệ: {e}")
+            return False
+
+    return validate_plan
+
+
+def _has_api_key(provider: str) -> bool:
+    # Provider không cần key (mock) luôn dùng được
+    env_name = _PROVIDER_API_KEYS.get(provider)
+    return env_name is None or bool(os.getenv(env_name))
+
+
+def _resolve_tiers(name: str, tiers: Optional[List[str]]) -> List[str]:
+    env_value = os.getenv(f"MEDAGENT_CASCADE_{name.upper()}")
+    if env_value:
+        tiers = [tier.strip() for tier in env_value.split(",") if tier.strip()]
+    tiers = tiers or CASCADE_TIERS.get(name, DEFAULT_TIERS)
+    available = [
+        tier for tier in tiers
+        if _has_api_key(MODEL_ALIASES.get(tier, DEFAULT_MODEL)[0])
+    ]
+    # Không tier nào có key: giữ tier đầu để lỗi hiện ra như trước
+    return available or tiers[:1]
+
+
+class CascadeChain:
+    """
+    Chain có nhiều tier model, mỗi tier là một CachedChain. Dùng như một chain bình thường.
+    """
+
+    def __init__(self, name: str, prompt, schema: Type[BaseModel],
+                 validator: Optional[Callable[[BaseModel], bool]] = None,
+                 tiers: Optional[List[str]] = None, temperature: float = 0.3, **cache_kwargs):
+        """
+        Khởi tạo CascadeChain.
+
+        Args:
+            name: Tên chain (dùng cho cache, thống kê và tra CASCADE_TIERS)
+            prompt: ChatPromptTemplate
+            schema: Pydantic model của structured output
+            validator: Hàm kiểm tra output; None -> chỉ chuyển tier khi model lỗi
+            tiers: Danh sách model theo thứ tự thử (mặc định: CASCADE_TIERS[name])
+            temperature: Temperature cho mọi tier
+            **cache_kwargs: Tham số truyền cho CachedChain (semantic_field, similarity_threshold...)
+        """
+        self.name = name
+        self.schema = schema
+        self.validator = validator
+        self.tiers = _resolve_tiers(name, tiers)
+        self.chains = [
+            CachedChain(name, prompt, get_llm(tier, temperature), schema, validator=validator, **cache_kwargs)
+            for tier in self.tiers
+        ]
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.escalations = 0
+        self.tier_stats = {tier: {"calls": 0, "rejected": 0, "errors": 0, "total_ms": 0.0} for tier in self.tiers}
+        # Đăng ký sau cùng: get_cascade_stats() ở thread khác có thể đọc ngay
+        _register(self)
+
+    def _accept(self, result) -> bool:
+        if self.validator is None:
+            return True
+        try:
+            return bool(self.validator(result))
+        except Exception as e:
+            logger.warning(f"Validator của '{self.name}' lỗi: {e}")
+            return False
+
+    def _record(self, tier: str, started: float, outcome: Optional[str]):
+        with self._lock:
+            stats = self.tier_stats[tier]
+            stats["calls"] += 1
+            stats["total_ms"] += (time.perf_counter() - started) * 1000
+            if outcome is not None:
+                stats[outcome] += 1
+
+    def _finish(self, escalated: bool):
+        with self._lock:
+            self.calls += 1
+            if escalated:
+                self.escalations += 1
+
+    def invoke(self, inputs: dict, config=None, max_tiers: Optional[int] = None, **kwargs):
+        """
+        Chạy lần lượt các tier tới khi có output hợp lệ.
+        Nếu không tier nào hợp lệ, trả về output cuối cùng (hoặc raise lỗi của tier cuối).
+
+        Args:
+            max_tiers: Chỉ thử chừng này tier đầu (giới hạn số lần gọi LLM); output của tier cuối được
+                thử mà không đạt thì trả về None thay vì output đó (None: thử mọi tier)
+        """
+        result = None
+        tiers = list(zip(self.tiers, self.chains))[:max_tiers]
+        truncated = len(tiers) < len(self.chains)
+        for index, (tier, chain) in enumerate(tiers):
+            last = index == len(tiers) - 1
+            started = time.perf_counter()
+            try:
+                result = chain.invoke(inputs, config=config, **kwargs)
+            except Exception as e:
+                self._record(tier, started, "errors")
+                if last:
+                    self._finish(escalated=index > 0)
+                    raise
+                logger.warning(f"Cascade '{self.name}': {tier} lỗi ({e}), chuyển sang {self.tiers[index + 1]}")
+                continue
+            accepted = self._accept(result)
+            if accepted or (last and not truncated):
+                self._record(tier, started, None)
+                self._finish(escalated=index > 0)
+                return result
+            self._record(tier, started, "rejected")
+            if last:
+                self._finish(escalated=index > 0)
+                return None
+            logger.info(f"Cascade '{self.name}': output của {tier} không đạt, chuyển sang {self.tiers[index + 1]}")
+        return result
+
+    async def ainvoke(self, inputs: dict, config=None, max_tiers: Optional[int] = None, **kwargs):
+        """Bản async của invoke()."""
+        result = None
+        tiers = list(zip(self.tiers, self.chains))[:max_tiers]
+        truncated = len(tiers) < len(self.chains)
+        for index, (tier, chain) in enumerate(tiers):
+            last = index == len(tiers) - 1
+            started = time.perf_counter()
+            try:
+                result = await chain.ainvoke(inputs, config=config, **kwargs)
+            except Exception as e:
+                self._record(tier, started, "errors")
+                if last:
+                    self._finish(escalated=index > 0)
+                    raise
+                logger.warning(f"Cascade '{self.name}': {tier} lỗi ({e}), chuyển sang {self.tiers[index + 1]}")
+                continue
+            accepted = self._accept(result)
+            if accepted or (last and not truncated):
+                self._record(tier, started, None)
+                self._finish(escalated=index > 0)
+                return result
+            self._record(tier, started, "rejected")
+            if last:
+                self._finish(escalated=index > 0)
+                return None
+            logger.info(f"Cascade '{self.name}': output của {tier} không đạt, chuyển sang {self.tiers[index + 1]}")
+        return result
+
+    def get_stats(self) -> dict:
+        """
+        Thống kê của cascade.
+
+        Returns:
+            dict: calls, escalations, escalation_rate, tiers ({model: calls, rejected, errors, avg_ms})
+        """
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "escalations": self.escalations,
+                "escalation_rate": self.escalations / self.calls if self.calls else 0.0,
+                "tiers": {
+                    tier: {
+                        "calls": stats["calls"],
+                        "rejected": stats["rejected"],
+                        "errors": stats["errors"],
+                        "avg_ms": stats["total_ms"] / stats["calls"] if stats["calls"] else 0.0,
+                    }
+                    for tier, stats in self.tier_stats.items()
+                },
+            }
+
+
+_cascades_lock = threading.Lock()
+_cascades: Dict[str, List[CascadeChain]] = {}
+
+
+def _register(cascade: CascadeChain):
+    with _cascades_lock:
+        _cascades.setdefault(cascade.name, []).append(cascade)
+
+
+def get_cascade_stats() -> dict:
+    """
+    Thống kê cascade theo từng chain (gộp mọi instance cùng tên).
+
+    Returns:
+        dict: {chain: {calls, escalations, escalation_rate, tiers}}
+    """
+    with _cascades_lock:
+        cascades = {name: list(items) for name, items in _cascades.items()}
+    result = {}
+    for name, items in cascades.items():
+        merged = {"calls": 0, "escalations": 0, "tiers": {}}
+        for cascade in items:
+            stats = cascade.get_stats()
+            merged["calls"] += stats["calls"]
+            merged["escalations"] += stats["escalations"]
+            for tier, tier_stats in stats["tiers"].items():
+                target = merged["tiers"].setdefault(tier, {"calls": 0, "rejected": 0, "errors": 0, "total_ms": 0.0})
+                target["calls"] += tier_stats["calls"]
+                target["rejected"] += tier_stats["rejected"]
+                target["errors"] += tier_stats["errors"]
+                target["total_ms"] += tier_stats["avg_ms"] * tier_stats["calls"]
+        merged["escalation_rate"] = merged["escalations"] / merged["calls"] if merged["calls"] else 0.0
+        for tier_stats in merged["tiers"].values():
+            total_ms = tier_stats.pop("total_ms")
+            tier_stats["avg_ms"] = total_ms / tier_stats["calls"] if tier_stats["calls"] else 0.0
+        result[name] = merged
+    return result
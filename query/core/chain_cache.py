@@ -0,0 +1,402 @@
+"""
+Chain cache - cache kết quả của các chain `prompt | llm.with_structured_output(Schema)`.
+
+Hai tầng:
+- Exact: khóa = hash(prompt template version, model, temperature, inputs)
+- Semantic (tùy chọn): embedding của một trường input (vd: "query"), lấy kết quả của
+  câu gần nhất nếu cosine similarity >= ngưỡng và các input còn lại giống hệt
+Kết quả lưu trong SQLite dưới dạng JSON nén zstd (zlib nếu chưa cài zstandard).
+Chỉ mục vector của tầng semantic giữ trong bộ nhớ tối đa SEMANTIC_INDEX_SIZE entry mới nhất
+mỗi (chain, context) và được đọc lại từ SQLite sau SEMANTIC_INDEX_REFRESH giây (thấy entry
+do process khác ghi).
+Khi prompt template hoặc schema đổi, version đổi và các entry cũ của chain bị xóa.
+"""
+import asyncio
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional, Type
+
+import numpy as np
+from pydantic import BaseModel
+
+from .compress import compress, decompress
+from .paths import CACHE_DIR
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+CHAIN_CACHE_PATH = CACHE_DIR / "chain_cache.sqlite3"
+SEMANTIC_INDEX_SIZE = 5000
+SEMANTIC_INDEX_REFRESH = 60.0
+
+
+def _hash(data: Any) -> str:
+    return hashlib.sha256(json.dumps(data, sort_keys=True, ensure_ascii=False, default=str).encode("utf-8")).hexdigest()
+
+
+def template_version(prompt, schema: Type[BaseModel]) -> str:
+    """
+    Version của chain: hash nội dung prompt template và JSON schema của output.
+
+    Args:
+        prompt: ChatPromptTemplate của chain
+        schema: Pydantic model của structured output
+
+    Returns:
+        str: 16 ký tự hex
+    """
+    parts = []
+    for message in getattr(prompt, "messages", [prompt]):
+        inner = getattr(message, "prompt", message)
+        parts.append(f"{type(message).__name__}:{getattr(inner, 'template', repr(inner))}")
+    parts.append(json.dumps(schema.model_json_schema(), sort_keys=True))
+    return hashlib.sha1("\n".join(parts).encode("utf-8")).hexdigest()[:16]
+
+
+class ChainCacheStore:
+    """
+    Kho SQLite dùng chung cho mọi CachedChain trong process (WAL, an toàn giữa các thread).
+    """
+
+    def __init__(self, path: Optional[Path] = CHAIN_CACHE_PATH, ttl: float = 7 * 24 * 3600):
+        """
+        Khởi tạo ChainCacheStore.
+
+        Args:
+            path: File SQLite (None: chỉ lưu trong bộ nhớ)
+            ttl: Thời gian sống mặc định (giây) của một entry
+        """
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._vectors = {}
+        self.stats: Dict[str, Dict[str, int]] = {}
+        self._conn = self._connect(path)
+
+    def _connect(self, path: Optional[Path]) -> sqlite3.Connection:
+        if path is None:
+            conn = sqlite3.connect(":memory:", check_same_thread=False)
+        else:
+            path = Path(path)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(str(path), check_same_thread=False, timeout=5.0)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS chain_cache ("
+            " key TEXT PRIMARY KEY,"
+            " chain TEXT NOT NULL,"
+            " template_version TEXT NOT NULL,"
+            " context_hash TEXT,"
+            " vector BLOB,"
+            " value BLOB NOT NULL,"
+            " expires_at REAL NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_chain_cache_chain ON chain_cache (chain, template_version, context_hash)")
+        conn.execute("DELETE FROM chain_cache WHERE expires_at <= ?", (time.time(),))
+        conn.commit()
+        return conn
+
+    def register(self, chain: str, version: str):
+        """Đăng ký chain và xóa các entry thuộc version prompt cũ."""
+        with self._lock:
+            self.stats.setdefault(chain, {"exact_hits": 0, "semantic_hits": 0, "misses": 0})
+            try:
+                deleted = self._conn.execute(
+                    "DELETE FROM chain_cache WHERE chain = ? AND template_version != ?", (chain, version)
+                ).rowcount
+                self._conn.commit()
+                if deleted:
+                    logger.info(f"Chain cache '{chain}': xóa {deleted} entry của prompt version cũ")
+            except sqlite3.Error as e:
+                logger.warning(f"Lỗi khi dọn chain cache '{chain}': {e}")
+
+    def count(self, chain: str, outcome: str):
+        with self._lock:
+            self.stats[chain][outcome] += 1
+
+    def get(self, key: str) -> Optional[dict]:
+        with self._lock:
+            try:
+                row = self._conn.execute(
+                    "SELECT value, expires_at FROM chain_cache WHERE key = ?", (key,)
+                ).fetchone()
+            except sqlite3.Error as e:
+                logger.warning(f"Lỗi khi đọc chain cache: {e}")
+                return None
+        if row is None or row[1] <= time.time():
+            return None
+        return json.loads(decompress(row[0]))
+
+    def _load_vectors(self, chain: str, version: str, context_hash: str):
+        index_key = (chain, version, context_hash)
+        index = self._vectors.get(index_key)
+        if index is None or time.monotonic() - index[2] > SEMANTIC_INDEX_REFRESH:
+            # Entry mới nhất trước (expires_at = lúc ghi + ttl), rồi đảo lại để entry cũ bị cắt trước
+            rows = self._conn.execute(
+                "SELECT key, vector FROM chain_cache "
+                "WHERE chain = ? AND template_version = ? AND context_hash = ? AND vector IS NOT NULL AND expires_at > ? "
+                "ORDER BY expires_at DESC LIMIT ?",
+                (chain, version, context_hash, time.time(), SEMANTIC_INDEX_SIZE),
+            ).fetchall()[::-1]
+            index = ([row[0] for row in rows], [np.frombuffer(row[1], dtype=np.float32) for row in rows],
+                     time.monotonic())
+            self._vectors[index_key] = index
+        return index
+
+    def nearest(self, chain: str, version: str, context_hash: str, vector: np.ndarray,
+                threshold: float) -> Optional[dict]:
+        """
+        Tìm entry có embedding gần nhất (cosine) với cùng context.
+
+        Returns:
+            dict hoặc None nếu không có entry nào đạt ngưỡng
+        """
+        with self._lock:
+            try:
+                keys, vectors, _ = self._load_vectors(chain, version, context_hash)
+            except sqlite3.Error as e:
+                logger.warning(f"Lỗi khi đọc vector chain cache: {e}")
+                return None
+            if not keys:
+                return None
+            scores = np.stack(vectors) @ vector
+            best = int(np.argmax(scores))
+            if scores[best] < threshold:
+                return None
+            key = keys[best]
+        return self.get(key)
+
+    def put(self, chain: str, version: str, key: str, value: dict,
+            context_hash: Optional[str] = None, vector: Optional[np.ndarray] = None):
+        blob = compress(json.dumps(value, ensure_ascii=False).encode("utf-8"))
+        vector_blob = vector.astype(np.float32).tobytes() if vector is not None else None
+        with self._lock:
+            try:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO chain_cache "
+                    "(key, chain, template_version, context_hash, vector, value, expires_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (key, chain, version, context_hash, vector_blob, blob, time.time() + self.ttl),
+                )
+                self._conn.commit()
+            except sqlite3.Error as e:
+                logger.warning(f"Lỗi khi ghi chain cache: {e}")
+                return
+            index = self._vectors.get((chain, version, context_hash))
+            if vector is not None and index is not None:
+                index[0].append(key)
+                index[1].append(vector.astype(np.float32))
+                if len(index[0]) > SEMANTIC_INDEX_SIZE:
+                    del index[0][0], index[1][0]
+
+    def get_stats(self) -> dict:
+        """
+        Thống kê hit/miss theo từng chain.
+
+        Returns:
+            dict: {chain: {exact_hits, semantic_hits, misses, hit_rate}}
+        """
+        with self._lock:
+            result = {}
+            for chain, counters in self.stats.items():
+                total = sum(counters.values())
+                hits = counters["exact_hits"] + counters["semantic_hits"]
+                result[chain] = {**counters, "hit_rate": hits / total if total else 0.0}
+            return result
+
+
+_store_lock = threading.Lock()
+_store = None
+
+
+def get_chain_cache() -> ChainCacheStore:
+    """Kho chain cache dùng chung cho toàn process (fallback về bộ nhớ nếu không mở được file)."""
+    global _store
+    with _store_lock:
+        if _store is None:
+            try:
+                _store = ChainCacheStore()
+            except Exception as e:
+                logger.warning(f"Không thể mở chain cache tại {CHAIN_CACHE_PATH}, dùng cache trong bộ nhớ: {e}")
+                _store = ChainCacheStore(path=None)
+        return _store
+
+
+def get_chain_cache_stats() -> dict:
+    """Hit rate của chain cache theo từng chain."""
+    return get_chain_cache().get_stats()
+
+
+class CachedChain:
+    """
+    Chain `prompt | llm.with_structured_output(schema)` có cache hai tầng.
+    Dùng như một chain bình thường: `chain.invoke({...})`.
+    """
+
+    def __init__(self, name: str, prompt, llm, schema: Type[BaseModel],
+                 semantic_field: Optional[str] = None, similarity_threshold: float = 0.95,
+                 embedder=None, store: Optional[ChainCacheStore] = None,
+                 validator: Optional[Callable[[BaseModel], bool]] = None):
+        """
+        Khởi tạo CachedChain.
+
+        Args:
+            name: Tên chain (dùng cho thống kê và invalidation)
+            prompt: ChatPromptTemplate
+            llm: LLM từ get_llm()
+            schema: Pydantic model của structured output
+            semantic_field: Trường input dùng cho tầng semantic (None: tắt tầng semantic)
+            similarity_threshold: Ngưỡng cosine similarity của tầng semantic
+            embedder: Model embedding có .encode() (mặc định: get_embedding_model() khi cần)
+            store: ChainCacheStore (mặc định: kho dùng chung của process)
+            validator: Chỉ cache kết quả mà validator(result) trả về True
+        """
+        self.name = name
+        self.prompt = prompt
+        self.llm = llm
+        self.schema = schema
+        self.chain = prompt | llm.with_structured_output(schema)
+        self.semantic_field = semantic_field
+        self.similarity_threshold = similarity_threshold
+        self._embedder = embedder
+        self.validator = validator
+        self.store = store or get_chain_cache()
+        self.version = template_version(prompt, schema)
+        self.model = getattr(llm, "model_name", None) or getattr(llm, "model", None) or type(llm).__name__
+        self.temperature = getattr(llm, "temperature", None)
+        self.store.register(name, self.version)
+
+    def _exact_key(self, inputs: dict) -> str:
+        return _hash({
+            "chain": self.name,
+            "version": self.version,
+            "model": self.model,
+            "temperature": self.temperature,
+            "inputs": inputs,
+        })
+
+    def _context_hash(self, inputs: dict) -> str:
+        rest = {k: v for k, v in inputs.items() if k != self.semantic_field}
+        # Vector của các model embedding khác nhau không so sánh được với nhau
+        embedder = self._get_embedder()
+        embedder_name = getattr(embedder, "model_name", type(embedder).__name__)
+        return _hash({"model": self.model, "temperature": self.temperature, "embedder": embedder_name, "inputs": rest})
+
+    def _get_embedder(self):
+        if self._embedder is None:
+            from .embedding import get_embedding_model
+            self._embedder = get_embedding_model()
+        return self._embedder
+
+    def _normalize_vector(self, embedding) -> Optional[np.ndarray]:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else None
+
+    def _wants_semantic(self, inputs: dict) -> bool:
+        return bool(self.semantic_field) and isinstance(inputs.get(self.semantic_field), str)
+
+    def _embed(self, text: str) -> Optional[np.ndarray]:
+        try:
+            return self._normalize_vector(self._get_embedder().encode([text])[0])
+        except Exception as e:
+            logger.warning(f"Chain cache '{self.name}': không embed được input, bỏ qua tầng semantic: {e}")
+            return None
+
+    async def _aembed(self, text: str) -> Optional[np.ndarray]:
+        try:
+            embedder = self._get_embedder()
+            if hasattr(embedder, "aencode"):
+                embeddings = await embedder.aencode([text])
+            else:
+                embeddings = await asyncio.to_thread(embedder.encode, [text])
+            return self._normalize_vector(embeddings[0])
+        except Exception as e:
+            logger.warning(f"Chain cache '{self.name}': không embed được input, bỏ qua tầng semantic: {e}")
+            return None
+
+    def _lookup_exact(self, key: str):
+        cached = self.store.get(key)
+        if cached is None:
+            return None
+        self.store.count(self.name, "exact_hits")
+        return self.schema.model_validate(cached)
+
+    def _lookup_semantic(self, inputs: dict, vector: Optional[np.ndarray]):
+        if vector is None:
+            return None, None
+        context_hash = self._context_hash(inputs)
+        cached = self.store.nearest(self.name, self.version, context_hash, vector, self.similarity_threshold)
+        if cached is None:
+            return None, context_hash
+        self.store.count(self.name, "semantic_hits")
+        return self.schema.model_validate(cached), context_hash
+
+    def _save(self, key: str, result, context_hash: Optional[str], vector: Optional[np.ndarray]):
+        if isinstance(result, self.schema) and (self.validator is None or self.validator(result)):
+            self.store.put(self.name, self.version, key, result.model_dump(),
+                           context_hash=context_hash, vector=vector)
+
+    def invoke(self, inputs: dict, config=None, refresh: bool = False, **kwargs):
+        """
+        Chạy chain, ưu tiên kết quả đã cache.
+
+        Args:
+            inputs: Input của prompt
+            config: RunnableConfig truyền xuống chain
+            refresh: Bỏ qua kết quả đã cache, gọi model lấy mẫu mới (vẫn ghi đè vào cache)
+
+        Returns:
+            Instance của schema
+        """
+        key = self._exact_key(inputs)
+        cached = None if refresh else self._lookup_exact(key)
+        if cached is not None:
+            return cached
+
+        vector = self._embed(inputs[self.semantic_field]) if self._wants_semantic(inputs) else None
+        if refresh:
+            context_hash = self._context_hash(inputs) if vector is not None else None
+        else:
+            cached, context_hash = self._lookup_semantic(inputs, vector)
+            if cached is not None:
+                return cached
+
+        self.store.count(self.name, "misses")
+        result = self.chain.invoke(inputs, config=config, **kwargs)
+        self._save(key, result, context_hash, vector)
+        return result
+
+    async def ainvoke(self, inputs: dict, config=None, refresh: bool = False, **kwargs):
+        """
+        Bản async của invoke() (tầng SQLite đủ nhanh nên đọc/ghi trực tiếp).
+
+        Args:
+            inputs: Input của prompt
+            config: RunnableConfig truyền xuống chain
+            refresh: Bỏ qua kết quả đã cache, gọi model lấy mẫu mới (vẫn ghi đè vào cache)
+
+        Returns:
+            Instance của schema
+        """
+        key = self._exact_key(inputs)
+        cached = None if refresh else self._lookup_exact(key)
+        if cached is not None:
+            return cached
+
+        vector = await self._aembed(inputs[self.semantic_field]) if self._wants_semantic(inputs) else None
+        if refresh:
+            context_hash = self._context_hash(inputs) if vector is not None else None
+        else:
+            cached, context_hash = self._lookup_semantic(inputs, vector)
+            if cached is not None:
+                return cached
+
+        self.store.count(self.name, "misses")
+        result = await self.chain.ainvoke(inputs, config=config, **kwargs)
+        self._save(key, result, context_hash, vector)
+        return result
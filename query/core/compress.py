@@ -0,0 +1,35 @@
+"""
+Nén dữ liệu lưu trong SQLite (chain cache, lịch sử hội thoại...).
+Dùng zstd nếu đã cài zstandard, ngược lại dùng zlib; byte đầu của blob cho biết thuật toán.
+"""
+import zlib
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+    logger.info("zstandard chưa được cài, dữ liệu nén bằng zlib")
+
+_ZSTD_PREFIX = b"Z"
+_ZLIB_PREFIX = b"z"
+
+
+def compress(data: bytes) -> bytes:
+    """Nén bytes (zstd nếu có, ngược lại zlib)."""
+    if zstandard is not None:
+        return _ZSTD_PREFIX + zstandard.ZstdCompressor(level=3).compress(data)
+    return _ZLIB_PREFIX + zlib.compress(data)
+
+
+def decompress(blob: bytes) -> bytes:
+    """Giải nén blob tạo bởi compress()."""
+    prefix, payload = blob[:1], blob[1:]
+    if prefix == _ZSTD_PREFIX:
+        if zstandard is None:
+            raise ValueError("Dữ liệu được nén bằng zstd nhưng zstandard chưa được cài")
+        return zstandard.ZstdDecompressor().decompress(payload)
+    return zlib.decompress(payload)
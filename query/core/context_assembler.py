@@ -0,0 +1,266 @@
+"""
+Ghép context cho các prompt sinh câu trả lời theo ngân sách token.
+
+- Đếm token bằng tiktoken (tokens.count_tokens), ngân sách tính trên TOÀN BỘ prompt
+  (system + human + context) theo từng model
+- Bỏ đoạn trùng lặp và cắt phần chồng lấn giữa các chunk liền nhau của cùng một tài liệu
+  (lúc ingest các chunk chồng nhau 200 ký tự - CHUNK_OVERLAP trong embed_to_qdrant.py)
+- Xếp các đoạn theo score, lấy lần lượt cho tới khi hết ngân sách
+- Ghi lại số token prompt của mỗi lần gọi (get_context_stats())
+"""
+import threading
+from typing import Callable, Dict, List, NamedTuple, Optional, Sequence
+
+from .tokens import count_tokens
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Ngân sách token của cả prompt (không gồm output) cho từng model - giới hạn chi phí
+# và độ trễ, nhỏ hơn nhiều so với context window
+MODEL_PROMPT_BUDGETS = {
+    "gpt-4o-mini": 4000,
+    "gpt-4o": 4000,
+    "gpt-3.5-turbo": 3000,
+    "gemini-2.5-flash-lite": 6000,
+    "gpt-oss-120b": 4000,
+}
+DEFAULT_PROMPT_BUDGET = 4000
+
+
+class ContextChunk(NamedTuple):
+    """Một đoạn văn bản ứng viên cho context."""
+
+    text: str
+    score: float = 0.0
+    source: str = ""
+
+
+def _overlap(left: str, right: str, min_overlap: int, max_overlap: int) -> int:
+    """Độ dài phần cuối của `left` trùng với phần đầu của `right` (0 nếu ngắn hơn min_overlap)."""
+    if len(left) < min_overlap or len(right) < min_overlap:
+        return 0
+    tail = left[-max_overlap:]
+    probe = right[:min_overlap]
+    start = tail.find(probe)
+    while start != -1:
+        size = len(tail) - start
+        if right.startswith(tail[start:]):
+            return size
+        start = tail.find(probe, start + 1)
+    return 0
+
+
+class ContextAssembler:
+    """
+    Ghép các đoạn văn bản thành context vừa ngân sách token của prompt.
+    """
+
+    def __init__(self, name: str, prompt=None, model: str = "gpt-4o-mini", max_prompt_tokens: Optional[int] = None,
+                 context_key: str = "context", separator: str = "\n\n", label: Optional[str] = None,
+                 min_overlap: int = 50, max_overlap: int = 400):
+        """
+        Khởi tạo ContextAssembler.
+
+        Args:
+            name: Tên dùng cho log và thống kê
+            prompt: ChatPromptTemplate dùng context (None: ngân sách chỉ tính cho context)
+            model: Model sinh câu trả lời (chọn bảng mã tiktoken và ngân sách mặc định)
+            max_prompt_tokens: Ngân sách token của cả prompt (None: theo MODEL_PROMPT_BUDGETS)
+            context_key: Tên biến context trong prompt
+            separator: Chuỗi nối giữa các đoạn
+            label: Định dạng mỗi đoạn, ví dụ "[Nguồn: {source}] {text}" (None: chỉ text)
+            min_overlap: Số ký tự chồng lấn tối thiểu để cắt phần trùng giữa hai đoạn
+            max_overlap: Số ký tự chồng lấn tối đa được kiểm tra
+        """
+        self.name = name
+        self.prompt = prompt
+        self.model = model
+        self.max_prompt_tokens = max_prompt_tokens or MODEL_PROMPT_BUDGETS.get(model, DEFAULT_PROMPT_BUDGET)
+        self.context_key = context_key
+        self.separator = separator
+        self.label = label
+        self.min_overlap = min_overlap
+        self.max_overlap = max_overlap
+        self._lock = threading.Lock()
+        self._stats = {
+            "calls": 0, "chunks_in": 0, "chunks_used": 0, "duplicates": 0, "overlap_chars": 0,
+            "dropped": 0, "truncated": 0, "context_tokens": 0, "prompt_tokens": 0, "peak_prompt_tokens": 0,
+        }
+        _register(self)
+
+    def _count(self, text: str) -> int:
+        return count_tokens(text, self.model)
+
+    def _overhead(self, inputs: dict) -> int:
+        """Số token của prompt khi context rỗng."""
+        if self.prompt is None:
+            return 0
+        try:
+            messages = self.prompt.format_messages(**{**inputs, self.context_key: ""})
+        except KeyError as e:
+            logger.warning(f"Context '{self.name}': thiếu biến {e} để đếm token prompt")
+            return 0
+        return sum(self._count(str(message.content)) for message in messages)
+
+    def _format(self, chunk: ContextChunk, text: str) -> str:
+        if self.label is None:
+            return text
+        return self.label.format(text=text, source=chunk.source or "unknown")
+
+    def _dedupe(self, chunks: Sequence[ContextChunk], stats: dict) -> List[tuple]:
+        """Bỏ đoạn trùng và cắt phần chồng lấn; trả về [(chunk, text đã cắt)] theo score giảm dần."""
+        kept: List[tuple] = []
+        seen = set()
+        for chunk in sorted(chunks, key=lambda c: c.score, reverse=True):
+            text = chunk.text.strip()
+            key = " ".join(text.split()).lower()
+            if not text or key in seen:
+                stats["duplicates"] += 1
+                continue
+            seen.add(key)
+            for other, other_text in kept:
+                if chunk.source and other.source and chunk.source != other.source:
+                    continue
+                if text in other_text:
+                    text = ""
+                    break
+                # Đoạn này nằm ngay sau đoạn đã chọn: bỏ phần đầu trùng với đuôi đoạn kia
+                size = _overlap(other_text, text, self.min_overlap, self.max_overlap)
+                if size:
+                    text = text[size:].lstrip()
+                    stats["overlap_chars"] += size
+                    continue
+                # Đoạn này nằm ngay trước đoạn đã chọn: bỏ phần đuôi trùng với đầu đoạn kia
+                size = _overlap(text, other_text, self.min_overlap, self.max_overlap)
+                if size:
+                    text = text[:-size].rstrip()
+                    stats["overlap_chars"] += size
+            if not text:
+                stats["duplicates"] += 1
+                continue
+            kept.append((chunk, text))
+        return kept
+
+    def assemble(self, chunks: Sequence[ContextChunk], **inputs) -> str:
+        """
+        Ghép context từ các đoạn ứng viên, ưu tiên score cao, trong ngân sách token.
+
+        Args:
+            chunks: Các đoạn ứng viên
+            **inputs: Các biến còn lại của prompt (vd query) để tính phần token cố định
+
+        Returns:
+            str: Context (rỗng nếu không có đoạn nào)
+        """
+        stats = {"duplicates": 0, "overlap_chars": 0, "dropped": 0, "truncated": 0}
+        overhead = self._overhead(inputs)
+        budget = max(self.max_prompt_tokens - overhead, 0)
+        separator_tokens = self._count(self.separator)
+
+        parts: List[str] = []
+        used = 0
+        for chunk, text in self._dedupe(chunks, stats):
+            part = self._format(chunk, text)
+            tokens = self._count(part) + (separator_tokens if parts else 0)
+            if used + tokens <= budget:
+                parts.append(part)
+                used += tokens
+                continue
+            if not parts and budget > 0:
+                # Đoạn tốt nhất một mình đã vượt ngân sách: cắt bớt thay vì trả về context rỗng
+                part = part[:max(len(part) * budget // tokens, 1)]
+                parts.append(part)
+                used = self._count(part)
+                stats["truncated"] += 1
+                continue
+            stats["dropped"] += 1
+
+        context = self.separator.join(parts)
+        self._record(len(chunks), len(parts), used, overhead, stats)
+        return context
+
+    def fit_rows(self, render: Callable[[int], str], total_rows: int, max_rows: Optional[int] = None, **inputs) -> str:
+        """
+        Chọn số dòng lớn nhất của một bảng mà prompt vẫn vừa ngân sách (tìm nhị phân).
+
+        Args:
+            render: Hàm nhận số dòng n, trả về context của n dòng đầu
+            total_rows: Tổng số dòng
+            max_rows: Số dòng tối đa (None: không giới hạn)
+            **inputs: Các biến còn lại của prompt (vd query) để tính phần token cố định
+
+        Returns:
+            str: Context của n dòng đầu, n lớn nhất vừa ngân sách (ít nhất 1 dòng nếu có dữ liệu)
+        """
+        overhead = self._overhead(inputs)
+        budget = max(self.max_prompt_tokens - overhead, 0)
+        upper = min(total_rows, max_rows) if max_rows is not None else total_rows
+        low, high = min(upper, 1), upper
+        context = render(high)
+        tokens = self._count(context)
+        if tokens > budget:
+            while low < high:
+                middle = (low + high + 1) // 2
+                if self._count(render(middle)) <= budget:
+                    low = middle
+                else:
+                    high = middle - 1
+            context = render(low)
+            tokens = self._count(context)
+            high = low
+        stats = {"duplicates": 0, "overlap_chars": 0, "dropped": total_rows - high, "truncated": 0}
+        self._record(total_rows, high, tokens, overhead, stats)
+        return context
+
+    def _record(self, chunks_in: int, chunks_used: int, context_tokens: int, overhead: int, stats: dict):
+        prompt_tokens = context_tokens + overhead
+        with self._lock:
+            self._stats["calls"] += 1
+            self._stats["chunks_in"] += chunks_in
+            self._stats["chunks_used"] += chunks_used
+            self._stats["context_tokens"] += context_tokens
+            self._stats["prompt_tokens"] += prompt_tokens
+            self._stats["peak_prompt_tokens"] = max(self._stats["peak_prompt_tokens"], prompt_tokens)
+            for key, value in stats.items():
+                self._stats[key] += value
+        logger.info(
+            f"Context '{self.name}': {chunks_used}/{chunks_in} đoạn, {context_tokens} token context, "
+            f"{prompt_tokens}/{self.max_prompt_tokens} token prompt"
+        )
+
+    def get_stats(self) -> dict:
+        """
+        Thống kê của assembler.
+
+        Returns:
+            dict: calls, chunks_in, chunks_used, duplicates, overlap_chars, dropped, truncated,
+                context_tokens, prompt_tokens, peak_prompt_tokens, avg_prompt_tokens, budget
+        """
+        with self._lock:
+            stats = dict(self._stats)
+        stats["avg_prompt_tokens"] = stats["prompt_tokens"] / stats["calls"] if stats["calls"] else 0.0
+        stats["budget"] = self.max_prompt_tokens
+        return stats
+
+
+_registry_lock = threading.Lock()
+_registry: Dict[str, ContextAssembler] = {}
+
+
+def _register(assembler: ContextAssembler):
+    with _registry_lock:
+        _registry[assembler.name] = assembler
+
+
+def get_context_stats() -> dict:
+    """
+    Thống kê token prompt của mọi ContextAssembler đã tạo, theo tên.
+
+    Returns:
+        dict: {name: stats}
+    """
+    with _registry_lock:
+        assemblers = list(_registry.values())
+    return {assembler.name: assembler.get_stats() for assembler in assemblers}
@@ -0,0 +1,468 @@
+"""
+Từ điển tên thuốc: nhận ra câu hỏi đang nói về thuốc nào mà không cần vector search.
+
+Mỗi thuốc là một file drugs-data-main/data/details/<danh mục>/<slug>.json (slug = file_name trong
+payload Qdrant, vd "alenta-10mg-4810"). Từ điển được build từ các file đó:
+
+- Khóa của một thuốc: tên sản phẩm trong phần mô tả ("Thuốc Toganin 500 Trường Thọ Pharma điều trị...",
+  cắt ở phần công dụng) và slug (bỏ mã số, quy cách đóng gói), đều bỏ dấu và bỏ các từ chỉ dạng bào chế
+  ở đầu ("thuốc", "viên nén", "siro ho"...) -> "toganin 500 truong tho pharma", "toganin 500mg truong tho"
+- Trie theo từ: mỗi node biết có bao nhiêu thuốc bên dưới, nên một tiền tố đủ phân biệt ("toganin 500")
+  đã xác định được thuốc; cũng dùng để gợi ý tên (complete())
+- Một đoạn khớp chỉ được chấp nhận khi chứa một từ "riêng" (ít gặp trong phần mô tả của các thuốc, không
+  phải tên hoạt chất) hoặc khớp trọn một khóa dài; "paracetamol", "dầu", "trị ho" không chốt được thuốc nào.
+  Khớp tiền tố còn cần thêm ít nhất một từ nữa của khóa: "extra" trong "panadol extra" không chốt "extra deep heat"
+- Chịu lỗi gõ kiểu SymSpell: mọi biến thể xóa 1-2 ký tự của từ trong từ điển được đánh chỉ mục trước,
+  từ lạ trong câu hỏi (không có trong dữ liệu) được sửa bằng cách tra các biến thể xóa của nó
+  ("toganim" -> "toganin")
+- Build mất vài giây nên chạy ở background; trong lúc đó get_drug_resolver() trả về None
+"""
+import json
+import re
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+from typing import Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
+
+from .paths import BASE_DIR
+from .sparse_index import tokenize
+from .text import normalize_text
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+DRUG_DATA_DIR = BASE_DIR / "drugs-data-main" / "data" / "details"
+
+# Từ chỉ dạng bào chế / cách dùng đứng trước tên riêng của thuốc (đã bỏ dấu)
+FORM_WORDS = frozenset(
+    "thuoc vien nen bao phim ngam sui nang mem cung nhai dung dich siro ho gel kem boi thoa nho mat tai mui "
+    "xit hong goi bot pha uong tiem ong cao xoa dau mieng dan chai tuyp thut truc trang hon dich nuoc suc "
+    "mo tra keo tam dat am dao hat com tinh chat nhu tuong".split()
+)
+# Phần công dụng bắt đầu sau tên sản phẩm trong dòng mô tả
+_INDICATION_RE = re.compile(
+    r"\s(?:dieu tri|ho tro|phong ngua|phong va|ngan ngua|giam|giup|chong|bo sung|cai thien|lam |sat trung|"
+    r"tri |dung cho|dung de|ha sot|tang cuong|bao ve|kich thich|khang|duong am)|\("
+)
+# Đuôi slug: mã sản phẩm, quy cách đóng gói ("12x5", "100v", "hop-3-vi-x-10-vien")
+_SLUG_TAIL_RE = re.compile(r"^(?:\d+|\d+x\d+|\d+(?:v|vien|goi|ong|chai|lo|tuyp|hop|vi)|x\d*|hop|vi|vien|chai|lo|"
+                           r"tuyp|goi|ong)$")
+_WORD_RE = re.compile(r"[a-z0-9]+")
+# Từ ngắn hơn thì không sửa lỗi gõ (dễ nhầm với từ thường)
+MIN_CORRECTION_LENGTH = 5
+# Từ xuất hiện trong mô tả của nhiều thuốc hơn thì là từ thường, không phải tên riêng
+MAX_NAME_WORD_DOCS = 30
+# Số file tối đa của cùng một sản phẩm (cùng tên, khác quy cách đóng gói) được gộp thành một thuốc
+MAX_VARIANTS = 4
+# Khớp trọn một khóa toàn từ thường ("xoang nhat nhat") cần ít nhất chừng này từ
+MIN_COMMON_KEY_LENGTH = 3
+# Khớp một phần khóa (tiền tố) cần ít nhất chừng này từ, kể cả khi có tên riêng
+MIN_PREFIX_LENGTH = 2
+
+
+class DrugEntry(NamedTuple):
+    """Một thuốc trong từ điển."""
+
+    file_name: str
+    name: str
+    category: str
+
+
+class DrugMatch(NamedTuple):
+    """Một thuốc được nhắc tới trong câu hỏi (có thể gồm vài file cùng tên sản phẩm, khác quy cách)."""
+
+    file_names: Tuple[str, ...]
+    name: str
+    matched: str
+    corrections: int
+
+
+class _TrieNode:
+    __slots__ = ("children", "drugs", "count", "last")
+
+    def __init__(self):
+        self.children: Dict[str, "_TrieNode"] = {}
+        self.drugs: List[int] = []
+        # Số thuốc khác nhau có khóa đi qua node này
+        self.count = 0
+        self.last = -1
+
+
+def _name_tokens(text: str) -> List[str]:
+    return tokenize(text, bigrams=False)
+
+
+def _leading_form_words(tokens: List[str]) -> List[str]:
+    end = 0
+    while end < len(tokens) - 1 and tokens[end] in FORM_WORDS:
+        end += 1
+    return tokens[:end]
+
+
+def _strip_form_words(tokens: List[str]) -> List[str]:
+    return tokens[len(_leading_form_words(tokens)):]
+
+
+def _edit_distance(left: str, right: str, limit: int) -> int:
+    """Khoảng cách Damerau-Levenshtein (optimal string alignment), dừng sớm khi vượt limit."""
+    if abs(len(left) - len(right)) > limit:
+        return limit + 1
+    previous2 = None
+    previous = list(range(len(right) + 1))
+    for i in range(1, len(left) + 1):
+        current = [i] + [0] * len(right)
+        for j in range(1, len(right) + 1):
+            cost = 0 if left[i - 1] == right[j - 1] else 1
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if previous2 is not None and i > 1 and j > 1 and left[i - 1] == right[j - 2] and left[i - 2] == right[j - 1]:
+                current[j] = min(current[j], previous2[j - 2] + 1)
+        if min(current) > limit:
+            return limit + 1
+        previous2, previous = previous, current
+    return previous[-1]
+
+
+def _deletes(word: str, distance: int) -> Set[str]:
+    """Mọi biến thể của word sau khi xóa tối đa distance ký tự."""
+    results = {word}
+    frontier = {word}
+    for _ in range(distance):
+        frontier = {variant[:i] + variant[i + 1:] for variant in frontier for i in range(len(variant))}
+        results |= frontier
+    return results
+
+
+def _max_distance(word: str) -> int:
+    return 2 if len(word) >= 9 else 1
+
+
+def load_drug_entries(data_dir: Path = DRUG_DATA_DIR) -> Tuple[List[DrugEntry], Set[str], Counter]:
+    """
+    Đọc danh sách thuốc từ thư mục dữ liệu.
+
+    Args:
+        data_dir: Thư mục chứa <danh mục>/<slug>.json
+
+    Returns:
+        (entries, ingredient_tokens, word_docs): các thuốc, tập từ của tên hoạt chất (dòng "Thành phần"
+        trong mô tả) và số thuốc có mỗi từ trong phần mô tả
+    """
+    entries, ingredients, word_docs = [], set(), Counter()
+    for path in sorted(Path(data_dir).rglob("*.json")):
+        try:
+            data = json.loads(path.read_text(encoding="utf-8"))
+        except (OSError, ValueError) as e:
+            logger.warning(f"Bỏ qua file thuốc {path}: {e}")
+            continue
+        describe = data.get("describe") or ""
+        lines = [line.strip() for line in describe.split("\n")]
+        # Dòng mô tả: "Thương hiệu:", <thương hiệu>, <tên sản phẩm + công dụng + quy cách>
+        name = lines[2] if len(lines) > 2 and lines[0].startswith("Thương hiệu") else path.stem.replace("-", " ")
+        entries.append(DrugEntry(file_name=path.stem, name=name, category=path.parent.name))
+        if "Thành phần" in lines:
+            position = lines.index("Thành phần") + 1
+            if position < len(lines):
+                ingredients.update(_name_tokens(lines[position]))
+        word_docs.update(set(_WORD_RE.findall(normalize_text(describe, fold=True))))
+    return entries, ingredients, word_docs
+
+
+class DrugNameResolver:
+    """
+    Tra tên thuốc trong câu hỏi -> file_name (slug) của thuốc trong Qdrant.
+    """
+
+    def __init__(self, entries: Iterable[DrugEntry], ingredient_tokens: Iterable[str] = (),
+                 word_docs: Optional[Dict[str, int]] = None):
+        """
+        Build trie và chỉ mục sửa lỗi gõ.
+
+        Args:
+            entries: Các thuốc (load_drug_entries())
+            ingredient_tokens: Tên hoạt chất; trùng tên hoạt chất (vd "paracetamol") thì không phải tên riêng
+            word_docs: Số thuốc có mỗi từ trong phần mô tả (từ thường vs tên riêng, và từ nào là từ đã biết)
+        """
+        self.entries: List[DrugEntry] = list(entries)
+        self.ingredient_tokens = frozenset(ingredient_tokens)
+        self.word_docs = word_docs or {}
+        self.root = _TrieNode()
+        self.vocabulary: Dict[str, int] = {}
+        # Khóa đầu tiên (tên sản phẩm) của mỗi thuốc, để nhận ra các file cùng một sản phẩm
+        self._titles: List[Tuple[str, ...]] = []
+        # Các từ dạng bào chế đứng trước tên ("vien", "nhai"), để chọn đúng file khi tên trùng nhau
+        self._forms: List[frozenset] = []
+        for index, entry in enumerate(self.entries):
+            keys = self.keys(entry)
+            self._titles.append(keys[0] if keys else ())
+            self._forms.append(frozenset(_leading_form_words(_name_tokens(normalize_text(entry.name, fold=True)))))
+            for key in keys:
+                self._insert(key, index)
+        # SymSpell: biến thể xóa -> các từ trong từ điển sinh ra nó (chỉ tên riêng mới cần sửa lỗi gõ)
+        self._deletes: Dict[str, List[str]] = {}
+        for word in self.vocabulary:
+            if len(word) >= MIN_CORRECTION_LENGTH and word.isalpha() and self.is_name_word(word):
+                for variant in _deletes(word, _max_distance(word)):
+                    self._deletes.setdefault(variant, []).append(word)
+        self._lock = threading.Lock()
+        self.stats = {"lookups": 0, "resolved": 0, "ambiguous": 0, "corrections": 0}
+
+    @staticmethod
+    def keys(entry: DrugEntry) -> List[Tuple[str, ...]]:
+        """Các khóa (dãy từ không dấu) của một thuốc: tên sản phẩm và slug."""
+        folded = normalize_text(entry.name, fold=True)
+        title = _strip_form_words(_name_tokens(folded))
+        # Cắt ở phần công dụng đầu tiên nằm sau tên riêng ("Dầu trị bỏng Trancumin" không cắt ở "trị")
+        for cut in _INDICATION_RE.finditer(folded):
+            head = _strip_form_words(_name_tokens(folded[:cut.start()]))
+            if head and head[0] not in FORM_WORDS:
+                title = head
+                break
+        slug = _name_tokens(entry.file_name.replace("-", " "))
+        while len(slug) > 1 and _SLUG_TAIL_RE.match(slug[-1]):
+            slug.pop()
+        slug = _strip_form_words(slug)
+        return list(dict.fromkeys(tuple(key) for key in (title, slug) if key))
+
+    def _insert(self, key: Tuple[str, ...], index: int):
+        node = self.root
+        for token in key:
+            node = node.children.setdefault(token, _TrieNode())
+            # Các khóa của cùng một thuốc được thêm liên tiếp nên chỉ cần nhớ thuốc cuối cùng
+            if node.last != index:
+                node.last = index
+                node.count += 1
+            self.vocabulary[token] = self.vocabulary.get(token, 0) + 1
+        if index not in node.drugs:
+            node.drugs.append(index)
+
+    def is_name_word(self, token: str) -> bool:
+        """Từ có phải tên riêng không (ít gặp trong mô tả, không phải tên hoạt chất, dạng bào chế hay số)."""
+        return (len(token) >= 3 and token[0].isalpha() and token not in FORM_WORDS
+                and token not in self.ingredient_tokens and self.word_docs.get(token, 0) <= MAX_NAME_WORD_DOCS)
+
+    def correct(self, token: str, candidates: Optional[Dict[str, "_TrieNode"]] = None) -> Optional[str]:
+        """
+        Sửa lỗi gõ của một từ theo từ điển (SymSpell).
+
+        Args:
+            token: Từ đã bỏ dấu
+            candidates: Chỉ chấp nhận các từ trong tập này (vd các nhánh con của một node trie)
+
+        Returns:
+            Tên riêng gần nhất trong từ điển (ít sửa nhất, rồi phổ biến nhất), hoặc None
+            (từ đã có trong dữ liệu thì không phải lỗi gõ)
+        """
+        if len(token) < MIN_CORRECTION_LENGTH or not token.isalpha() or token in self.word_docs:
+            return None
+        limit = _max_distance(token)
+        best, best_key = None, None
+        for variant in _deletes(token, limit):
+            for word in self._deletes.get(variant, ()):
+                if candidates is not None and word not in candidates:
+                    continue
+                distance = _edit_distance(token, word, limit)
+                if distance > limit:
+                    continue
+                key = (distance, -self.vocabulary[word], word)
+                if best_key is None or key < best_key:
+                    best, best_key = word, key
+        return best
+
+    def _variants(self, node: _TrieNode) -> Optional[Tuple[int, ...]]:
+        """Các thuốc dưới node nếu tất cả là cùng một sản phẩm (cùng tên), không thì None."""
+        if node.count > MAX_VARIANTS:
+            return None
+        found, stack = [], [node]
+        while stack:
+            current = stack.pop()
+            found.extend(index for index in current.drugs if index not in found)
+            stack.extend(current.children.values())
+        if not found or len({self._titles[index] for index in found}) > 1:
+            return None
+        return tuple(sorted(found))
+
+    def _pick_form(self, drugs: Tuple[int, ...], preceding: List[str]) -> Tuple[int, ...]:
+        """Trong các file cùng tên, giữ các file có dạng bào chế khớp nhất với các từ đứng trước tên trong câu hỏi."""
+        forms = {token for token in preceding if token in FORM_WORDS}
+        if not forms:
+            return drugs
+        overlap = {index: len(self._forms[index] & forms) for index in drugs}
+        best = max(overlap.values())
+        return tuple(index for index in drugs if overlap[index] == best)
+
+    def _walk(self, tokens: List[str], start: int) -> Optional[Tuple[Tuple[int, ...], int, int]]:
+        """
+        Đi trie từ tokens[start] càng xa càng tốt.
+
+        Returns:
+            (các file của thuốc, số từ khớp, số từ đã sửa), hoặc None nếu không xác định được đúng một thuốc
+        """
+        node, depth, corrections, named = self.root, 0, 0, False
+        best = None
+        for token in tokens[start:]:
+            child = node.children.get(token)
+            if child is None:
+                token = self.correct(token, node.children)
+                if token is None:
+                    break
+                child = node.children[token]
+                corrections += 1
+            node, depth = child, depth + 1
+            named = named or self.is_name_word(token)
+            if node.drugs and (named or depth >= MIN_COMMON_KEY_LENGTH):
+                # Khớp trọn một khóa
+                drugs = tuple(node.drugs) if len(node.drugs) == 1 else self._variants(node)
+            elif named and depth >= MIN_PREFIX_LENGTH:
+                # Tiền tố chỉ còn một sản phẩm bên dưới; một từ đơn lẻ thì chưa đủ
+                # ("panadol extra" không phải "extra deep heat")
+                drugs = self._variants(node)
+            else:
+                drugs = None
+            if drugs is not None:
+                best = (drugs, depth, corrections)
+        if best is not None and best[2] > max(1, best[1] // 2):
+            return None
+        return best
+
+    def resolve(self, query: str) -> List[DrugMatch]:
+        """
+        Tìm các thuốc được nhắc tới trong câu hỏi.
+
+        Args:
+            query: Câu hỏi (có dấu hoặc không)
+
+        Returns:
+            List[DrugMatch]: Các thuốc theo thứ tự xuất hiện (không trùng lặp)
+        """
+        tokens = _name_tokens(query)
+        matches: Dict[Tuple[int, ...], DrugMatch] = {}
+        position = 0
+        while position < len(tokens):
+            found = self._walk(tokens, position)
+            if found is None:
+                position += 1
+                continue
+            drugs, depth, corrections = found
+            if len(drugs) > 1:
+                drugs = self._pick_form(drugs, tokens[max(0, position - 3):position])
+            entry = self.entries[drugs[0]]
+            matches.setdefault(drugs, DrugMatch(file_names=tuple(self.entries[index].file_name for index in drugs),
+                                                name=entry.name, matched=" ".join(tokens[position:position + depth]),
+                                                corrections=corrections))
+            position += depth
+        with self._lock:
+            self.stats["lookups"] += 1
+            self.stats["resolved"] += bool(matches)
+            self.stats["corrections"] += sum(match.corrections for match in matches.values())
+        return list(matches.values())
+
+    def resolve_one(self, query: str, max_drugs: int = 1) -> List[DrugMatch]:
+        """
+        Như resolve() nhưng chỉ trả kết quả khi câu hỏi nói về tối đa max_drugs thuốc.
+
+        Returns:
+            List[DrugMatch]: 1..max_drugs thuốc, hoặc rỗng (không có / quá nhiều thuốc)
+        """
+        matches = self.resolve(query)
+        if len(matches) > max_drugs:
+            with self._lock:
+                self.stats["ambiguous"] += 1
+            return []
+        return matches
+
+    def complete(self, prefix: str, limit: int = 10) -> List[DrugEntry]:
+        """
+        Gợi ý thuốc theo tiền tố tên (từ cuối có thể chưa gõ hết).
+
+        Args:
+            prefix: Phần tên đã gõ, vd "toganin 5"
+            limit: Số gợi ý tối đa
+
+        Returns:
+            List[DrugEntry]
+        """
+        tokens = _strip_form_words(_name_tokens(prefix))
+        if not tokens:
+            return []
+        node = self.root
+        for token in tokens[:-1]:
+            node = node.children.get(token)
+            if node is None:
+                return []
+        stack = [child for token, child in sorted(node.children.items(), reverse=True) if token.startswith(tokens[-1])]
+        results: Dict[int, DrugEntry] = {}
+        while stack and len(results) < limit:
+            node = stack.pop()
+            for index in node.drugs:
+                results.setdefault(index, self.entries[index])
+            stack.extend(child for _, child in sorted(node.children.items(), reverse=True))
+        return list(results.values())[:limit]
+
+    def get_stats(self) -> dict:
+        """
+        Returns:
+            dict: lookups, resolved, ambiguous, corrections, resolve_rate, drugs, words
+        """
+        with self._lock:
+            stats = dict(self.stats)
+        stats["resolve_rate"] = stats["resolved"] / stats["lookups"] if stats["lookups"] else 0.0
+        stats["drugs"] = len(self.entries)
+        stats["words"] = len(self.vocabulary)
+        return stats
+
+
+_resolver_lock = threading.Lock()
+_resolver: Optional[DrugNameResolver] = None
+_build_thread: Optional[threading.Thread] = None
+
+
+def _build(data_dir: Path):
+    global _resolver
+    started = time.perf_counter()
+    try:
+        entries, ingredients, word_docs = load_drug_entries(data_dir)
+        if not entries:
+            logger.warning(f"Không có dữ liệu thuốc trong {data_dir}, bỏ qua tra tên thuốc")
+            return
+        resolver = DrugNameResolver(entries, ingredients, word_docs)
+    except Exception as e:
+        logger.warning(f"Lỗi khi build từ điển tên thuốc: {e}")
+        return
+    _resolver = resolver
+    logger.info(f"Từ điển tên thuốc: {len(entries)} thuốc, {len(resolver.vocabulary)} từ "
+                f"trong {time.perf_counter() - started:.1f}s")
+
+
+def get_drug_resolver(data_dir: Path = DRUG_DATA_DIR, wait: bool = False) -> Optional[DrugNameResolver]:
+    """
+    DrugNameResolver dùng chung trong process; lần gọi đầu bắt đầu build ở background.
+
+    Args:
+        data_dir: Thư mục dữ liệu thuốc
+        wait: Chờ build xong thay vì trả về None ngay
+
+    Returns:
+        DrugNameResolver, hoặc None nếu đang build / không có dữ liệu thuốc
+    """
+    global _build_thread
+    if _resolver is not None:
+        return _resolver
+    with _resolver_lock:
+        if _build_thread is None:
+            _build_thread = threading.Thread(target=_build, args=(Path(data_dir),), name="drug-names", daemon=True)
+            _build_thread.start()
+    if wait:
+        _build_thread.join()
+    return _resolver
+
+
+def get_drug_resolver_stats() -> dict:
+    """
+    Thống kê tra tên thuốc (rỗng nếu chưa build từ điển).
+
+    Returns:
+        dict: lookups, resolved, ambiguous, corrections, resolve_rate, drugs, words
+    """
+    return _resolver.get_stats() if _resolver is not None else {}
@@ -1,13 +1,16 @@
 """
 Script để embedding dữ liệu thuốc và upload lên Qdrant
-Sử dụng Google Generative AI Embeddings (text-embedding-004)
+Model và collection lấy theo embedding profile (MEDAGENT_EMBEDDING_PROFILE):
+- google (mặc định): Google Generative AI Embeddings (text-embedding-004) -> embedding_data
+- local / local-int8: model ONNX chạy trên CPU (fastembed) -> embedding_data_local / embedding_data_local_int8
+Chatbot chạy với cùng profile sẽ query đúng collection.
 """
 import os
+import sys
 import json
 from pathlib import Path
 from typing import List, Dict, Any
 from dotenv import load_dotenv
-from langchain_google_genai import GoogleGenerativeAIEmbeddings
 from langchain_qdrant import QdrantVectorStore
 from langchain_core.documents import Document
 from langchain_text_splitters import RecursiveCharacterTextSplitter
@@ -15,6 +18,12 @@ from qdrant_client import QdrantClient
 from qdrant_client.models import Distance, VectorParams
 import time
 
+# Cho phép chạy trực tiếp file này như một script
+sys.path.append(str(Path(__file__).resolve().parents[2]))
+from query.core.embedding import LOCAL_PREFIX, get_embedding_model, get_embedding_profile
+from query.core.rag import ensure_payload_indexes
+from query.core.rate_limit import priority_lane, get_rate_limit_stats
+from query.core.sparse_index import build_sparse_index, sparse_index_path
 
 env_path = Path(__file__).parent / ".env"
 if env_path.exists():
@@ -27,8 +36,11 @@ else:
 QDRANT_URL = os.getenv("QDRANT_URL")
 QDRANT_API_KEY = os.getenv("QDRANT_API_KEY")
 GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
-COLLECTION_NAME = "embedding_data"
-EMBEDDING_MODEL = "models/text-embedding-004"
+EMBEDDING_PROFILE = get_embedding_profile()
+COLLECTION_NAME = EMBEDDING_PROFILE.collection
+EMBEDDING_MODEL = EMBEDDING_PROFILE.model
+EMBEDDING_DIM = EMBEDDING_PROFILE.dim
+USE_LOCAL_EMBEDDING = EMBEDDING_MODEL.startswith(LOCAL_PREFIX)
 
 # Đường dẫn đến thư mục data
 # Tự động detect Kaggle environment
@@ -38,12 +50,13 @@ if Path("/kaggle/working").exists():
     DATA_DIR = BASE_DIR / "drugs-data-main" / "data" / "details"
 else:
     # Chạy local
-    DATA_DIR = Path(__file__).parent.parent / "drugs-data-main" / "data" / "details"
+    DATA_DIR = Path(__file__).resolve().parents[2] / "drugs-data-main" / "data" / "details"
 
 # Cấu hình chunking
 # Google text-embedding-004 có giới hạn ~2048 tokens
 # Ước tính: 1 token ≈ 4 ký tự (tiếng Việt)
 # Chunk size: 1500 ký tự ≈ 375 tokens (an toàn, để lại buffer)
+# Model local mặc định (paraphrase-multilingual-mpnet) cắt input ở 384 tokens, xấp xỉ cỡ chunk này
 # Chunk overlap: 200 ký tự để giữ ngữ cảnh giữa các chunks
 CHUNK_SIZE = 1500
 CHUNK_OVERLAP = 200
@@ -208,6 +221,7 @@ def setup_qdrant_collection(client: QdrantClient, collection_name: str, embeddin
                     print(f"Đã xóa collection '{collection_name}'")
                 else:
                     print("Sử dụng collection hiện có.")
+                    ensure_payload_indexes(client, collection_name)
                     return
         
         # Tạo collection mới
@@ -219,6 +233,7 @@ def setup_qdrant_collection(client: QdrantClient, collection_name: str, embeddin
             )
         )
         print(f"Đã tạo collection '{collection_name}' với dimension {embedding_dim}")
+        ensure_payload_indexes(client, collection_name)
     
     except Exception as e:
         print(f"Lỗi khi setup collection: {e}")
@@ -230,11 +245,9 @@ def upload_to_qdrant(documents: List[Document], batch_size: int = 100):
     Upload documents lên Qdrant với embedding
     """
     # Khởi tạo embeddings
-    # GoogleGenerativeAIEmbeddings sẽ tự động lấy GOOGLE_API_KEY từ environment variable
-    print("\nĐang khởi tạo Google Generative AI Embeddings...")
-    embeddings = GoogleGenerativeAIEmbeddings(
-        model=EMBEDDING_MODEL
-    )
+    # Google: dùng wrapper chung để đi qua rate limiter (cùng quota với chatbot)
+    print(f"\nĐang khởi tạo embedding model {EMBEDDING_MODEL}...")
+    embeddings = get_embedding_model(EMBEDDING_MODEL, batching=False)
     
     # Khởi tạo Qdrant client
     print("Đang kết nối với Qdrant...")
@@ -246,7 +259,7 @@ def upload_to_qdrant(documents: List[Document], batch_size: int = 100):
     
     # Setup collection
     print("\nĐang setup collection...")
-    setup_qdrant_collection(client, COLLECTION_NAME, embedding_dim=768, auto_delete=KAGGLE_MODE)
+    setup_qdrant_collection(client, COLLECTION_NAME, embedding_dim=EMBEDDING_DIM, auto_delete=KAGGLE_MODE)
     
     # Khởi tạo vector store
     print("\nĐang khởi tạo vector store...")
@@ -263,6 +276,23 @@ def upload_to_qdrant(documents: List[Document], batch_size: int = 100):
     
     start_time = time.time()
     
+    # Lane "batch": nhường quota cho request interactive của chatbot đang chạy cùng lúc
+    with priority_lane("batch"):
+        _upload_batches(vector_store, documents, batch_size)
+    
+    total_time = time.time() - start_time
+    print(f"\n{'='*60}")
+    print(f"Hoàn thành!")
+    print(f"Tổng số documents: {total_docs}")
+    print(f"Thời gian: {total_time/60:.2f} phút")
+    print(f"Rate limiter: {get_rate_limit_stats()}")
+    print(f"{'='*60}")
+
+
+def _upload_batches(vector_store: QdrantVectorStore, documents: List[Document], batch_size: int):
+    total_docs = len(documents)
+    start_time = time.time()
+    
     for i in range(0, total_docs, batch_size):
         batch = documents[i:i + batch_size]
         batch_num = (i // batch_size) + 1
@@ -283,13 +313,6 @@ def upload_to_qdrant(documents: List[Document], batch_size: int = 100):
         except Exception as e:
             print(f"Lỗi khi upload batch {batch_num}: {e}")
             continue
-    
-    total_time = time.time() - start_time
-    print(f"\n{'='*60}")
-    print(f"Hoàn thành!")
-    print(f"Tổng số documents: {total_docs}")
-    print(f"Thời gian: {total_time/60:.2f} phút")
-    print(f"{'='*60}")
 
 
 def main():
@@ -313,7 +336,7 @@ def main():
         print("GOOGLE_API_KEY=your_google_api_key")
         return
     
-    if not GOOGLE_API_KEY:
+    if not GOOGLE_API_KEY and not USE_LOCAL_EMBEDDING:
         print("Lỗi: Thiếu GOOGLE_API_KEY trong file .env")
         print("Vui lòng thêm GOOGLE_API_KEY vào file .env")
         return
@@ -342,6 +365,12 @@ def main():
     
     # Upload lên Qdrant
     upload_to_qdrant(documents)
+    
+    # Chỉ mục BM25 trên đúng các chunk vừa upload (hybrid search trong MedicalRAG)
+    index_path = sparse_index_path(COLLECTION_NAME)
+    build_sparse_index([doc.page_content for doc in documents], [doc.metadata for doc in documents],
+                       index_path, name=COLLECTION_NAME)
+    print(f"Chỉ mục BM25: {index_path}")
 
 
 if __name__ == "__main__":
@@ -1,65 +1,131 @@
 import os
-from typing import List
-import numpy as np
+from typing import List, NamedTuple, Optional
 from langchain_google_genai import GoogleGenerativeAIEmbeddings
 from dotenv import load_dotenv
+from .rate_limit import get_rate_limiter, call_with_backoff, acall_with_backoff, estimate_tokens
+from .mock import MockEmbeddings, is_mock_mode
+from .embedding_cache import CachedEmbeddings, EmbeddingCache, get_embedding_cache
+from .embedding_batcher import get_batched_embedder
+from .local_embedding import LOCAL_PREFIX, DEFAULT_LOCAL_MODEL, LocalEmbedding, local_model_key, parse_local_model
+
+import logging
+
+logger = logging.getLogger(__name__)
 
 # Tìm file .env trong thư mục MedAgent (thư mục gốc của project)
 env_path = os.path.join(os.path.dirname(__file__), "../../.env")
 load_dotenv(dotenv_path=env_path)
 
+DEFAULT_GOOGLE_MODEL = "models/text-embedding-004"
+
+
+class EmbeddingProfile(NamedTuple):
+    """Cặp model embedding + collection Qdrant được embed bằng đúng model đó."""
+
+    model: str
+    collection: str
+    dim: int
+
+
+# Chọn bằng MEDAGENT_EMBEDDING_PROFILE; embed_to_qdrant.py dùng cùng bảng này khi tạo collection
+EMBEDDING_PROFILES = {
+    "google": EmbeddingProfile(DEFAULT_GOOGLE_MODEL, "embedding_data", 768),
+    "local": EmbeddingProfile(local_model_key(DEFAULT_LOCAL_MODEL, False), "embedding_data_local", 768),
+    "local-int8": EmbeddingProfile(local_model_key(DEFAULT_LOCAL_MODEL, True), "embedding_data_local_int8", 768),
+}
+DEFAULT_EMBEDDING_PROFILE = "google"
+
+
+def get_embedding_profile(name: Optional[str] = None) -> EmbeddingProfile:
+    """
+    Profile embedding của deployment.
+
+    Args:
+        name: Tên profile trong EMBEDDING_PROFILES (None: MEDAGENT_EMBEDDING_PROFILE, mặc định "google")
+
+    Returns:
+        EmbeddingProfile
+    """
+    if is_mock_mode():
+        # Mock Qdrant chỉ có collection của profile google (MockEmbeddings 768 chiều)
+        return EMBEDDING_PROFILES[DEFAULT_EMBEDDING_PROFILE]
+    name = name or os.getenv("MEDAGENT_EMBEDDING_PROFILE", DEFAULT_EMBEDDING_PROFILE)
+    profile = EMBEDDING_PROFILES.get(name.lower())
+    if profile is None:
+        logger.warning(f"Không có embedding profile '{name}', dùng '{DEFAULT_EMBEDDING_PROFILE}'")
+        profile = EMBEDDING_PROFILES[DEFAULT_EMBEDDING_PROFILE]
+    return profile
+
 
-class GoogleEmbeddingWrapper:
+class GoogleEmbeddingWrapper(CachedEmbeddings):
     """
     Wrapper để tương thích GoogleGenerativeAIEmbeddings với interface của SentenceTransformer.
-    Cho phép sử dụng method .encode() giống như SentenceTransformer.
+    Cho phép sử dụng method .encode() giống như SentenceTransformer, đồng thời là một
+    LangChain Embeddings (dùng được cho QdrantVectorStore, FAISS...).
+    Mọi lời gọi đi qua rate limiter dùng chung của ("google", model_name).
+    Embedding đã tính được cache theo (model_name, sha256(text)); chỉ các text chưa có
+    trong cache được gửi lên API, gộp thành một batch.
     """
-    def __init__(self, model_name: str = "models/text-embedding-004"):
+    def __init__(self, model_name: str = DEFAULT_GOOGLE_MODEL, cache: Optional[EmbeddingCache] = None,
+                 use_cache: bool = True):
         """
         Khởi tạo Google embedding model.
         
         Args:
             model_name: Tên model embedding của Google (mặc định: "models/text-embedding-004")
+            cache: EmbeddingCache riêng (None: cache dùng chung của model trong CACHE_DIR/embeddings)
+            use_cache: Có dùng embedding cache không
         """
         self.google_embeddings = GoogleGenerativeAIEmbeddings(
             model=model_name,
             google_api_key=os.getenv("GOOGLE_API_KEY"),
         )
         self.model_name = model_name
+        self.rate_limiter = get_rate_limiter("google", model_name)
+        self.cache = (cache or get_embedding_cache(model_name)) if use_cache else None
     
-    def encode(self, texts: List[str], convert_to_numpy: bool = True, **kwargs):
-        """
-        Encode danh sách texts thành embeddings.
-        Tương thích với interface của SentenceTransformer.
-        
-        Args:
-            texts: Danh sách các text cần encode
-            convert_to_numpy: Có chuyển đổi sang numpy array không (mặc định True)
-            **kwargs: Các tham số bổ sung (không sử dụng cho Google embedding)
-            
-        Returns:
-            numpy array hoặc list chứa embeddings
-        """
-        # Google embedding trả về list of lists
-        embeddings = self.google_embeddings.embed_documents(texts)
-        
-        if convert_to_numpy:
-            return np.array(embeddings)
-        return embeddings
+    def _embed_uncached(self, texts: List[str]) -> List[List[float]]:
+        return call_with_backoff(
+            lambda: self.google_embeddings.embed_documents(texts),
+            self.rate_limiter,
+            tokens=estimate_tokens(texts),
+        )
+    
+    async def _aembed_uncached(self, texts: List[str]) -> List[List[float]]:
+        return await acall_with_backoff(
+            lambda: self.google_embeddings.aembed_documents(texts),
+            self.rate_limiter,
+            tokens=estimate_tokens(texts),
+        )
 
 
-def get_embedding_model(model_name: str = None):
+def get_embedding_model(model_name: str = None, batching: bool = True):
     """
-    Lấy embedding model mặc định của Google.
+    Lấy embedding model (mặc định theo embedding profile của deployment).
     
     Args:
-        model_name: Tên model (mặc định None sẽ dùng model mặc định của Google)
+        model_name: Tên model (mặc định None sẽ dùng model của get_embedding_profile();
+            "local:<model>" hoặc "local:<model>:int8" dùng model ONNX chạy trong process;
+            "mock" hoặc MEDAGENT_MOCK=1 dùng embedding giả lập, không cần mạng)
+        batching: Trả về front-end micro-batching dùng chung trong process (text của các
+            request đồng thời được gộp thành một lời gọi model)
         
     Returns:
-        GoogleEmbeddingWrapper: Wrapper cho Google embedding model
+        MicroBatchEmbedder bọc GoogleEmbeddingWrapper / LocalEmbedding (MockEmbeddings khi mock);
+        model thật nếu batching=False
     """
-    # Sử dụng model mặc định của Google nếu không chỉ định
-    if model_name is None:
-        model_name = "models/text-embedding-004"
+    if model_name == "mock" or is_mock_mode():
+        model_name, factory = "mock", MockEmbeddings
+    else:
+        if model_name is None:
+            model_name = get_embedding_profile().model
+        if model_name.startswith(LOCAL_PREFIX):
+            local_model, quantized = parse_local_model(model_name)
+            model_name = local_model_key(local_model, quantized)
+            factory = lambda: LocalEmbedding(local_model, quantized=quantized)
+        else:
+            factory = lambda: GoogleEmbeddingWrapper(model_name=model_name)
     
-    return GoogleEmbeddingWrapper(model_name=model_name)
+    if not batching:
+        return factory()
+    return get_batched_embedder(model_name, factory)
@@ -0,0 +1,316 @@
+"""
+Micro-batching cho embedding: gộp text của các request chạy đồng thời thành một lời gọi API.
+
+Mỗi caller (thread hoặc coroutine) đưa text vào hàng đợi chung rồi chờ Future của mình.
+Thread dispatcher lấy request đầu tiên, gom thêm trong tối đa max_wait_ms hoặc tới khi đủ
+max_batch_size text, gửi MỘT lời gọi embed_documents (chạy trong pool tối đa
+max_concurrent_batches batch cùng lúc) rồi trả từng phần kết quả về đúng Future.
+Khi mọi slot đang bận, dispatcher chờ slot trống và hàng đợi tự tích lũy thành batch lớn hơn.
+
+Request đã có từ max_batch_size text trở lên (vd FAISS.from_documents cho trang web) gọi thẳng model.
+
+Thread của pool không thừa hưởng contextvar của caller, nên priority lane (rate_limit) được ghi lại
+cho từng request lúc đưa vào hàng đợi; batch chạy với lane "interactive" nếu có ít nhất một request
+interactive, không thì "batch".
+"""
+import asyncio
+import bisect
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Sequence
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from .rate_limit import current_lane, priority_lane
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+QUEUE_WAIT_BUCKETS_MS = [0.5, 1, 2, 5, 10, 20, 50, 100, 250, 500, 1000]
+BATCH_SIZE_BUCKETS = [1, 2, 4, 8, 16, 32, 64, 128, 256]
+
+
+class Histogram:
+    """Histogram với các bucket cố định (cận trên), an toàn giữa các thread."""
+
+    def __init__(self, bounds: Sequence[float]):
+        self.bounds = list(bounds)
+        self._counts = [0] * (len(self.bounds) + 1)
+        self._count = 0
+        self._sum = 0.0
+        self._max = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        with self._lock:
+            self._counts[bisect.bisect_left(self.bounds, value)] += 1
+            self._count += 1
+            self._sum += value
+            self._max = max(self._max, value)
+
+    def _quantile(self, q: float) -> float:
+        """Cận trên của bucket chứa phân vị q (max nếu rơi vào bucket +Inf)."""
+        rank = q * self._count
+        seen = 0
+        for bound, count in zip(self.bounds, self._counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self._max)
+        return self._max
+
+    def snapshot(self) -> dict:
+        """
+        Returns:
+            dict: count, mean, p50, p95, p99, max, buckets {"<=bound": count, "+Inf": count}
+        """
+        with self._lock:
+            if not self._count:
+                return {"count": 0}
+            buckets = {f"<={bound:g}": count for bound, count in zip(self.bounds, self._counts)}
+            buckets["+Inf"] = self._counts[-1]
+            return {
+                "count": self._count,
+                "mean": self._sum / self._count,
+                "p50": self._quantile(0.5),
+                "p95": self._quantile(0.95),
+                "p99": self._quantile(0.99),
+                "max": self._max,
+                "buckets": buckets,
+            }
+
+
+class _Pending:
+    __slots__ = ("texts", "future", "enqueued_at", "lane")
+
+    def __init__(self, texts: List[str]):
+        self.texts = texts
+        self.future: Future = Future()
+        self.enqueued_at = time.perf_counter()
+        self.lane = current_lane()
+
+
+class MicroBatchEmbedder(Embeddings):
+    """
+    Front-end micro-batching cho một embedding model (GoogleEmbeddingWrapper, MockEmbeddings...).
+    Có cùng interface: embed_documents/embed_query, bản async, encode()/aencode().
+    """
+
+    def __init__(self, embedder, max_batch_size: int = 64, max_wait_ms: float = 3.0,
+                 max_concurrent_batches: int = 4, name: Optional[str] = None):
+        """
+        Khởi tạo MicroBatchEmbedder.
+
+        Args:
+            embedder: Embedding model thật (có embed_documents)
+            max_batch_size: Số text tối đa trong một batch
+            max_wait_ms: Thời gian tối đa (ms) chờ gom thêm text sau request đầu tiên của batch
+            max_concurrent_batches: Số batch tối đa được gửi đồng thời
+            name: Tên dùng cho thống kê (mặc định: model_name của embedder)
+        """
+        self.embedder = embedder
+        self.model_name = getattr(embedder, "model_name", type(embedder).__name__)
+        self.name = name or self.model_name
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self._queue: "queue.Queue[_Pending]" = queue.Queue()
+        self._carry: Optional[_Pending] = None
+        self._slots = threading.BoundedSemaphore(max_concurrent_batches)
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrent_batches, thread_name_prefix="embed-batch")
+        self._dispatcher: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self.stats = {"requests": 0, "texts": 0, "batches": 0, "batched_texts": 0, "direct": 0, "deduplicated": 0,
+                      "errors": 0}
+        self.queue_wait_ms = Histogram(QUEUE_WAIT_BUCKETS_MS)
+        self.batch_size = Histogram(BATCH_SIZE_BUCKETS)
+
+    # ------------------------------------------------------------------
+    # Dispatcher
+    # ------------------------------------------------------------------
+
+    def _ensure_dispatcher(self):
+        if self._dispatcher is not None:
+            return
+        with self._start_lock:
+            if self._dispatcher is None:
+                self._dispatcher = threading.Thread(target=self._dispatch_loop, name=f"embed-dispatch-{self.name}",
+                                                    daemon=True)
+                self._dispatcher.start()
+
+    def _next(self, timeout: Optional[float]) -> Optional[_Pending]:
+        if self._carry is not None:
+            pending, self._carry = self._carry, None
+            return pending
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def _dispatch_loop(self):
+        while True:
+            first = self._next(None)
+            batch, size = [first], len(first.texts)
+            deadline = time.perf_counter() + self.max_wait
+            while size < self.max_batch_size:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                pending = self._next(remaining)
+                if pending is None:
+                    break
+                if size + len(pending.texts) > self.max_batch_size:
+                    self._carry = pending
+                    break
+                batch.append(pending)
+                size += len(pending.texts)
+            self._slots.acquire()
+            try:
+                self._executor.submit(self._run_batch, batch)
+            except RuntimeError as e:  # Executor đã shutdown (process đang thoát)
+                self._slots.release()
+                for pending in batch:
+                    pending.future.set_exception(e)
+
+    def _run_batch(self, batch: List[_Pending]):
+        started = time.perf_counter()
+        try:
+            for pending in batch:
+                self.queue_wait_ms.observe((started - pending.enqueued_at) * 1000)
+            texts = [text for pending in batch for text in pending.texts]
+            unique = list(dict.fromkeys(texts))
+            self.batch_size.observe(len(unique))
+            with self._stats_lock:
+                self.stats["batches"] += 1
+                self.stats["batched_texts"] += len(unique)
+                self.stats["deduplicated"] += len(texts) - len(unique)
+            lane = "interactive" if any(pending.lane == "interactive" for pending in batch) else "batch"
+            try:
+                with priority_lane(lane):
+                    vectors = dict(zip(unique, self.embedder.embed_documents(unique)))
+            except Exception as e:
+                with self._stats_lock:
+                    self.stats["errors"] += 1
+                for pending in batch:
+                    pending.future.set_exception(e)
+                return
+            for pending in batch:
+                pending.future.set_result([vectors[text] for text in pending.texts])
+        finally:
+            self._slots.release()
+
+    def _submit(self, texts: List[str]) -> Future:
+        pending = _Pending(list(texts))
+        with self._stats_lock:
+            self.stats["requests"] += 1
+            self.stats["texts"] += len(texts)
+        self._ensure_dispatcher()
+        self._queue.put(pending)
+        return pending.future
+
+    def _record_direct(self, texts: List[str]):
+        self.batch_size.observe(len(texts))
+        with self._stats_lock:
+            self.stats["requests"] += 1
+            self.stats["texts"] += len(texts)
+            self.stats["direct"] += 1
+
+    # ------------------------------------------------------------------
+    # Embeddings interface
+    # ------------------------------------------------------------------
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        if len(texts) >= self.max_batch_size:
+            self._record_direct(texts)
+            return self.embedder.embed_documents(texts)
+        return self._submit(texts).result()
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        if len(texts) >= self.max_batch_size:
+            self._record_direct(texts)
+            if hasattr(self.embedder, "aembed_documents"):
+                return await self.embedder.aembed_documents(texts)
+            return await asyncio.to_thread(self.embedder.embed_documents, texts)
+        return await asyncio.wrap_future(self._submit(texts))
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return (await self.aembed_documents([text]))[0]
+
+    def encode(self, texts: List[str], convert_to_numpy: bool = True, **kwargs):
+        """
+        Encode danh sách texts thành embeddings (tương thích SentenceTransformer).
+
+        Args:
+            texts: Danh sách các text cần encode
+            convert_to_numpy: Có chuyển đổi sang numpy array không (mặc định True)
+
+        Returns:
+            numpy array hoặc list chứa embeddings
+        """
+        embeddings = self.embed_documents(texts)
+        return np.array(embeddings) if convert_to_numpy else embeddings
+
+    async def aencode(self, texts: List[str], convert_to_numpy: bool = True, **kwargs):
+        """Bản async của encode()."""
+        embeddings = await self.aembed_documents(texts)
+        return np.array(embeddings) if convert_to_numpy else embeddings
+
+    def get_stats(self) -> dict:
+        """
+        Thống kê micro-batching.
+
+        Returns:
+            dict: requests, texts, batches, batched_texts, direct, deduplicated, errors, avg_batch_size,
+                queue_wait_ms (histogram), batch_size (histogram)
+        """
+        with self._stats_lock:
+            stats = dict(self.stats)
+        stats["avg_batch_size"] = stats["batched_texts"] / stats["batches"] if stats["batches"] else 0.0
+        stats["queue_wait_ms"] = self.queue_wait_ms.snapshot()
+        stats["batch_size"] = self.batch_size.snapshot()
+        return stats
+
+
+_registry_lock = threading.Lock()
+_registry: Dict[str, MicroBatchEmbedder] = {}
+
+
+def get_batched_embedder(name: str, factory: Callable[[], object], **kwargs) -> MicroBatchEmbedder:
+    """
+    MicroBatchEmbedder dùng chung trong process cho một model (mọi caller gom chung một hàng đợi).
+
+    Args:
+        name: Khóa của model (vd tên model embedding)
+        factory: Hàm tạo embedding model thật, chỉ gọi khi chưa có batcher
+        **kwargs: Tham số của MicroBatchEmbedder
+
+    Returns:
+        MicroBatchEmbedder
+    """
+    with _registry_lock:
+        # Tạo trong lock để hai thread không tạo hai batcher cho cùng một model
+        if name not in _registry:
+            _registry[name] = MicroBatchEmbedder(factory(), name=name, **kwargs)
+        return _registry[name]
+
+
+def get_embedding_batcher_stats() -> dict:
+    """
+    Thống kê micro-batching của mọi embedding model trong process, theo tên.
+
+    Returns:
+        dict: {name: stats}
+    """
+    with _registry_lock:
+        batchers = list(_registry.values())
+    return {batcher.name: batcher.get_stats() for batcher in batchers}
@@ -0,0 +1,375 @@
+"""
+Embedding cache theo nội dung - khóa = (model_name, sha256(text)).
+
+Hai tầng:
+- Bộ nhớ: LRU các vector float32 dùng gần nhất
+- Đĩa (mỗi model một cặp file trong CACHE_DIR/embeddings):
+  * <model>.npy - ma trận (capacity, dim) float16/float32, mở bằng memmap, chỉ ghi thêm dòng
+  * <model>.idx - index offset: dòng thứ i của file là digest 32 byte của vector ở dòng i của ma trận
+  Vector được ghi và flush TRƯỚC khi digest được ghi vào index, nên index chỉ trỏ tới các dòng
+  đã ghi xong. Khi ma trận đầy, file .npy được chép sang file mới gấp đôi capacity rồi os.replace.
+  Nhiều process dùng chung thư mục cache: ghi được khóa bằng flock trên file .lock, đọc thì
+  đồng bộ phần index mới do process khác ghi thêm.
+
+CachedEmbeddings là base cho các embedding model dùng cache này (Google, local ONNX).
+"""
+import asyncio
+import hashlib
+import os
+import re
+import threading
+from abc import abstractmethod
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+try:
+    import fcntl
+except ImportError:  # Windows: chỉ khóa trong process
+    fcntl = None
+
+from .paths import CACHE_DIR
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_CACHE_DIR = CACHE_DIR / "embeddings"
+DIGEST_SIZE = 32
+
+
+def text_digest(text: str) -> bytes:
+    return hashlib.sha256(text.encode("utf-8")).digest()
+
+
+class EmbeddingCache:
+    """
+    Cache embedding của một model: LRU trong bộ nhớ + ma trận memmap append-only trên đĩa.
+    """
+
+    def __init__(self, model_name: str, directory: Optional[Path] = EMBEDDING_CACHE_DIR,
+                 dtype: str = "float16", max_memory_entries: int = 20000, initial_capacity: int = 4096):
+        """
+        Khởi tạo EmbeddingCache.
+
+        Args:
+            model_name: Tên model embedding (mỗi model một cặp file riêng)
+            directory: Thư mục chứa file cache (None: chỉ dùng tầng bộ nhớ)
+            dtype: Kiểu lưu trên đĩa - "float16" (nửa dung lượng) hoặc "float32"
+            max_memory_entries: Số vector tối đa trong LRU bộ nhớ
+            initial_capacity: Số dòng của ma trận khi tạo file lần đầu
+        """
+        self.model_name = model_name
+        self.dtype = np.dtype(dtype)
+        self.max_memory_entries = max_memory_entries
+        self.initial_capacity = initial_capacity
+        # _lock: LRU, index trong bộ nhớ và thống kê (giữ ngắn); _write_lock: một thread ghi đĩa một lúc
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._memory: "OrderedDict[bytes, np.ndarray]" = OrderedDict()
+        self._offsets: Dict[bytes, int] = {}
+        self._index_size = 0
+        self._matrix = None
+        self._matrix_inode = None
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "writes": 0}
+
+        self._paths = None
+        if directory is not None:
+            directory = Path(directory)
+            directory.mkdir(parents=True, exist_ok=True)
+            stem = re.sub(r"[^A-Za-z0-9_.-]+", "_", model_name)
+            self._paths = {
+                "matrix": directory / f"{stem}.npy",
+                "index": directory / f"{stem}.idx",
+                "lock": directory / f"{stem}.lock",
+            }
+            try:
+                self._sync_index()
+            except OSError as e:
+                logger.warning(f"Không đọc được embedding cache của '{model_name}', chỉ dùng bộ nhớ: {e}")
+                self._paths = None
+
+    # ------------------------------------------------------------------
+    # Tầng đĩa
+    # ------------------------------------------------------------------
+
+    def _sync_index(self):
+        """Đọc phần index do process khác (hoặc lần chạy trước) ghi thêm."""
+        path = self._paths["index"]
+        if not path.exists():
+            return
+        size = path.stat().st_size
+        size -= size % DIGEST_SIZE  # Bỏ digest ghi dở (process bị dừng giữa chừng)
+        if size <= self._index_size:
+            return
+        with open(path, "rb") as f:
+            f.seek(self._index_size)
+            data = f.read(size - self._index_size)
+        row = self._index_size // DIGEST_SIZE
+        for start in range(0, len(data), DIGEST_SIZE):
+            self._offsets.setdefault(data[start:start + DIGEST_SIZE], row)
+            row += 1
+        self._index_size = size
+
+    def _open_matrix(self):
+        """Mở (lại) memmap nếu chưa mở hoặc file đã được thay bằng file lớn hơn."""
+        path = self._paths["matrix"]
+        if not path.exists():
+            self._matrix, self._matrix_inode = None, None
+            return None
+        inode = path.stat().st_ino
+        if self._matrix is None or inode != self._matrix_inode:
+            self._matrix = np.load(path, mmap_mode="r+")
+            self._matrix_inode = inode
+        return self._matrix
+
+    def _grow(self, rows_needed: int, dim: int):
+        """Đảm bảo ma trận có ít nhất rows_needed dòng (tạo mới hoặc chép sang file gấp đôi)."""
+        matrix = self._open_matrix()
+        if matrix is not None and matrix.shape[0] >= rows_needed:
+            return matrix
+        capacity = self.initial_capacity if matrix is None else matrix.shape[0]
+        while capacity < rows_needed:
+            capacity *= 2
+        path = self._paths["matrix"]
+        tmp = path.with_suffix(".npy.tmp")
+        grown = np.lib.format.open_memmap(tmp, mode="w+", dtype=self.dtype, shape=(capacity, dim))
+        if matrix is not None:
+            grown[:matrix.shape[0]] = matrix
+        grown.flush()
+        del grown
+        os.replace(tmp, path)
+        logger.info(f"Embedding cache '{self.model_name}': mở rộng ma trận lên {capacity} dòng")
+        return self._open_matrix()
+
+    def _file_lock(self):
+        return open(self._paths["lock"], "a+b")
+
+    def _write_disk(self, items: List[tuple]):
+        """
+        Ghi vector rồi index ra đĩa, giữ _write_lock + flock nhưng KHÔNG giữ _lock trong lúc ghi
+        (get_many vẫn chạy được); _lock chỉ được lấy ngắn để đọc / cập nhật index trong bộ nhớ.
+        Dòng mới chỉ vào _offsets sau khi đã flush nên reader không bao giờ đọc dòng ghi dở.
+        """
+        with self._write_lock:
+            lock_file = self._file_lock()
+            try:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX)
+                with self._lock:
+                    self._sync_index()
+                    items = [(digest, vector) for digest, vector in items if digest not in self._offsets]
+                    start = self._index_size // DIGEST_SIZE
+                if not items:
+                    return
+                matrix = self._grow(start + len(items), len(items[0][1]))
+                if matrix.shape[1] != len(items[0][1]):
+                    logger.warning(f"Embedding cache '{self.model_name}': sai số chiều "
+                                   f"({len(items[0][1])} != {matrix.shape[1]}), bỏ qua ghi đĩa")
+                    return
+                for i, (_, vector) in enumerate(items):
+                    matrix[start + i] = vector
+                matrix.flush()
+                with open(self._paths["index"], "ab") as f:
+                    f.write(b"".join(digest for digest, _ in items))
+                with self._lock:
+                    # Đọc lại phần index vừa ghi (reader có thể đã sync một phần trong lúc ghi)
+                    self._sync_index()
+                    self.stats["writes"] += len(items)
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+                lock_file.close()
+
+    # ------------------------------------------------------------------
+    # Tầng bộ nhớ
+    # ------------------------------------------------------------------
+
+    def _remember(self, digest: bytes, vector: np.ndarray):
+        self._memory[digest] = vector
+        self._memory.move_to_end(digest)
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+
+    # ------------------------------------------------------------------
+    # API
+    # ------------------------------------------------------------------
+
+    def get_many(self, texts: Sequence[str]) -> List[Optional[np.ndarray]]:
+        """
+        Lấy embedding đã cache của nhiều text.
+
+        Args:
+            texts: Danh sách text
+
+        Returns:
+            List[Optional[np.ndarray]]: Vector float32 theo đúng thứ tự, None nếu chưa có
+        """
+        results: List[Optional[np.ndarray]] = []
+        with self._lock:
+            synced = False
+            for text in texts:
+                digest = text_digest(text)
+                vector = self._memory.get(digest)
+                if vector is not None:
+                    self._memory.move_to_end(digest)
+                    self.stats["memory_hits"] += 1
+                    results.append(vector)
+                    continue
+                if self._paths is not None:
+                    if digest not in self._offsets and not synced:
+                        self._sync_index()
+                        synced = True
+                    row = self._offsets.get(digest)
+                    matrix = self._open_matrix() if row is not None else None
+                    if matrix is not None and row < matrix.shape[0]:
+                        vector = np.array(matrix[row], dtype=np.float32)
+                        self._remember(digest, vector)
+                        self.stats["disk_hits"] += 1
+                        results.append(vector)
+                        continue
+                self.stats["misses"] += 1
+                results.append(None)
+        return results
+
+    def put_many(self, texts: Sequence[str], vectors: Sequence[Sequence[float]]):
+        """
+        Lưu embedding của nhiều text (bộ nhớ + đĩa).
+
+        Args:
+            texts: Danh sách text
+            vectors: Embedding tương ứng
+        """
+        items = []
+        with self._lock:
+            for text, vector in zip(texts, vectors):
+                digest = text_digest(text)
+                array = np.asarray(vector, dtype=np.float32)
+                self._remember(digest, array)
+                items.append((digest, array))
+        if self._paths is None or not items:
+            return
+        # Ghi đĩa ngoài _lock: các lookup khác không phải chờ I/O (hay chép ma trận khi mở rộng)
+        try:
+            self._write_disk(items)
+        except OSError as e:
+            logger.warning(f"Lỗi khi ghi embedding cache '{self.model_name}': {e}")
+
+    def get_stats(self) -> dict:
+        """
+        Thống kê của cache.
+
+        Returns:
+            dict: memory_hits, disk_hits, misses, writes, hit_rate, memory_entries, disk_entries
+        """
+        with self._lock:
+            stats = dict(self.stats)
+            stats["memory_entries"] = len(self._memory)
+            stats["disk_entries"] = len(self._offsets)
+        lookups = stats["memory_hits"] + stats["disk_hits"] + stats["misses"]
+        stats["hit_rate"] = (stats["memory_hits"] + stats["disk_hits"]) / lookups if lookups else 0.0
+        return stats
+
+
+_caches_lock = threading.Lock()
+_caches: Dict[str, EmbeddingCache] = {}
+
+
+def get_embedding_cache(model_name: str) -> EmbeddingCache:
+    """
+    EmbeddingCache dùng chung trong process cho một model.
+
+    Args:
+        model_name: Tên model embedding
+
+    Returns:
+        EmbeddingCache
+    """
+    with _caches_lock:
+        if model_name not in _caches:
+            _caches[model_name] = EmbeddingCache(model_name)
+        return _caches[model_name]
+
+
+def get_embedding_cache_stats() -> dict:
+    """
+    Thống kê của mọi embedding cache trong process, theo tên model.
+
+    Returns:
+        dict: {model_name: stats}
+    """
+    with _caches_lock:
+        caches = list(_caches.values())
+    return {cache.model_name: cache.get_stats() for cache in caches}
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Base cho embedding model có EmbeddingCache: chỉ các text chưa có trong cache (không trùng)
+    được gửi tới _embed_uncached, gộp thành một batch. Có sẵn encode()/aencode() tương thích
+    SentenceTransformer. Lớp con gán self.model_name, self.cache và cài _embed_uncached.
+    """
+
+    model_name: str
+    cache: Optional[EmbeddingCache] = None
+
+    @abstractmethod
+    def _embed_uncached(self, texts: List[str]) -> List[List[float]]:
+        """Gọi model thật cho các text chưa có trong cache."""
+
+    async def _aembed_uncached(self, texts: List[str]) -> List[List[float]]:
+        return await asyncio.to_thread(self._embed_uncached, texts)
+
+    def _lookup(self, texts: List[str]):
+        """Vector đã cache theo thứ tự texts và danh sách text (không trùng) cần tính."""
+        cached = self.cache.get_many(texts)
+        misses = list(dict.fromkeys(text for text, vector in zip(texts, cached) if vector is None))
+        return cached, misses
+
+    def _merge(self, texts: List[str], cached: list, misses: List[str], embeddings: List[List[float]]) -> List[List[float]]:
+        if misses:
+            self.cache.put_many(misses, embeddings)
+        fresh = dict(zip(misses, embeddings))
+        return [fresh[text] if vector is None else vector.tolist() for text, vector in zip(texts, cached)]
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if self.cache is None:
+            return self._embed_uncached(texts)
+        cached, misses = self._lookup(texts)
+        return self._merge(texts, cached, misses, self._embed_uncached(misses) if misses else [])
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        if self.cache is None:
+            return await self._aembed_uncached(texts)
+        cached, misses = self._lookup(texts)
+        return self._merge(texts, cached, misses, await self._aembed_uncached(misses) if misses else [])
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return (await self.aembed_documents([text]))[0]
+
+    def encode(self, texts: List[str], convert_to_numpy: bool = True, **kwargs):
+        """
+        Encode danh sách texts thành embeddings.
+        Tương thích với interface của SentenceTransformer.
+
+        Args:
+            texts: Danh sách các text cần encode
+            convert_to_numpy: Có chuyển đổi sang numpy array không (mặc định True)
+            **kwargs: Các tham số bổ sung (không sử dụng)
+
+        Returns:
+            numpy array hoặc list chứa embeddings
+        """
+        embeddings = self.embed_documents(texts)
+        return np.array(embeddings) if convert_to_numpy else embeddings
+
+    async def aencode(self, texts: List[str], convert_to_numpy: bool = True, **kwargs):
+        """Bản async của encode()."""
+        embeddings = await self.aembed_documents(texts)
+        return np.array(embeddings) if convert_to_numpy else embeddings
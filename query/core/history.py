@@ -0,0 +1,344 @@
+"""
+Lịch sử hội thoại theo người dùng, có tóm tắt cuốn chiếu (rolling summary).
+
+- Mỗi hội thoại giữ bộ đếm token cộng dồn, không dựng lại chuỗi hội thoại sau mỗi tin nhắn
+- Khi vượt ngưỡng token, phần cũ được tóm tắt trong worker nền: put_history() không bao giờ
+  chờ LLM; các tin nhắn mới đến trong lúc tóm tắt vẫn được giữ nguyên
+- Kho theo người dùng có giới hạn: LRU theo số người dùng, TTL theo thời gian không hoạt động
+  và trần bộ nhớ (byte nội dung) cho toàn bộ kho
+- Hoặc lưu trong HistoryStore (SQLite) để lịch sử còn sau khi khởi động lại và được chia sẻ
+  giữa nhiều worker process; khi đó không giữ hội thoại nào trong RAM
+"""
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from typing import List, Optional
+
+from langchain_core.prompts import ChatPromptTemplate
+
+from ..prompt_templates.base import SUMMARIZE_HISTORY_PROMPT, SUMMARIZE_SYSTEM_PROMPT
+from .history_store import HistoryStore
+from .structure import SummarizeQuery
+from .tokens import count_tokens
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class _Conversation:
+    __slots__ = ("messages", "summary", "summary_tokens", "tokens", "bytes", "last_access", "summarizing")
+
+    def __init__(self):
+        # Mỗi phần tử: (role, content, tokens, bytes)
+        self.messages: List[tuple] = []
+        self.summary = ""
+        self.summary_tokens = 0
+        self.tokens = 0
+        self.bytes = 0
+        self.last_access = time.time()
+        self.summarizing = False
+
+
+def _format(role: str, content: str) -> str:
+    return f"{role}: {content}"
+
+
+class HistoryManager:
+    """
+    Quản lý lịch sử hội thoại của nhiều người dùng, an toàn khi dùng từ nhiều thread.
+    """
+
+    def __init__(self, llm, max_tokens: int = 1000, keep_recent: int = 2, max_users: int = 10000,
+                 ttl: float = 24 * 3600, max_memory_bytes: int = 64 * 1024 * 1024,
+                 token_model: str = "gpt-4o-mini", background: bool = True,
+                 store: Optional[HistoryStore] = None):
+        """
+        Khởi tạo HistoryManager.
+
+        Args:
+            llm: LLM dùng để tóm tắt hội thoại
+            max_tokens: Ngưỡng token của một hội thoại (tóm tắt + tin nhắn) để bắt đầu tóm tắt
+            keep_recent: Số tin nhắn gần nhất giữ nguyên văn, không đưa vào tóm tắt
+            max_users: Số hội thoại tối đa giữ trong bộ nhớ (LRU)
+            ttl: Thời gian (giây) không hoạt động trước khi hội thoại bị xóa
+            max_memory_bytes: Trần tổng dung lượng nội dung (UTF-8) của mọi hội thoại
+            token_model: Model dùng để chọn bảng mã tiktoken
+            background: Tóm tắt trong worker nền (False: tóm tắt ngay trên thread gọi)
+            store: Kho SQLite dùng chung giữa các process (None: giữ trong RAM của process;
+                max_users / max_memory_bytes chỉ áp dụng cho chế độ RAM, ttl do store quản lý)
+        """
+        self.llm = llm
+        self.max_tokens = max_tokens
+        self.keep_recent = keep_recent
+        self.max_users = max_users
+        self.ttl = ttl
+        self.max_memory_bytes = max_memory_bytes
+        self.token_model = token_model
+        self.background = background
+        self.store = store
+        self.history = OrderedDict()
+        self._lock = threading.RLock()
+        self._bytes = 0
+        self._pending: List[Future] = []
+        self._executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="history-summary") if background else None
+        self.stats = {"summaries": 0, "summary_errors": 0, "evicted_lru": 0, "evicted_ttl": 0, "evicted_memory": 0}
+        self._init_prompt()
+        self._init_chain()
+
+    def _init_prompt(self):
+        self.prompt = ChatPromptTemplate.from_messages([
+            ("system", SUMMARIZE_SYSTEM_PROMPT),
+            ("user", SUMMARIZE_HISTORY_PROMPT),
+        ])
+
+    def _init_chain(self):
+        self.structured_llm = self.llm.with_structured_output(SummarizeQuery)
+        self.history_chain = self.prompt | self.structured_llm
+
+    def put_history(self, user_id: str, role: str, message: str):
+        """
+        Thêm một tin nhắn vào hội thoại. Không chờ LLM: nếu hội thoại vượt ngưỡng token,
+        việc tóm tắt được đưa vào worker nền.
+
+        Args:
+            user_id: ID người dùng
+            role: Vai trò ("user", "assistant"...)
+            message: Nội dung tin nhắn
+        """
+        tokens = count_tokens(_format(role, message), self.token_model)
+        if self.store is not None:
+            total, pending = self.store.append(user_id, role, message, tokens)
+            if total > self.max_tokens and pending > self.keep_recent and self.store.claim_summary(user_id):
+                self._schedule(self._summarize_stored, user_id)
+            return
+
+        size = len(message.encode("utf-8"))
+        with self._lock:
+            conversation = self._touch(user_id, create=True)
+            conversation.messages.append((role, message, tokens, size))
+            conversation.tokens += tokens
+            conversation.bytes += size
+            self._bytes += size
+            should_summarize = self._needs_summary(conversation)
+            if should_summarize:
+                conversation.summarizing = True
+            self._evict()
+
+        if should_summarize:
+            self._schedule(self._summarize, user_id, conversation)
+
+    def get_history(self, user_id: str, last_n: Optional[int] = None) -> str:
+        """
+        Lịch sử hội thoại dạng text (tóm tắt phần cũ + các tin nhắn chưa tóm tắt).
+
+        Args:
+            user_id: ID người dùng
+            last_n: Chỉ lấy N tin nhắn gần nhất (None: mọi tin nhắn chưa tóm tắt)
+
+        Returns:
+            str: Lịch sử hội thoại, "" nếu chưa có
+        """
+        if self.store is not None:
+            summary, messages = self.store.recent(user_id, last_n)
+        else:
+            with self._lock:
+                conversation = self._touch(user_id)
+                if conversation is None:
+                    return ""
+                summary = conversation.summary
+                messages = [(role, content) for role, content, _, _ in conversation.messages]
+        if last_n is not None:
+            messages = messages[-last_n:] if last_n > 0 else []
+        lines = [_format("system", f"Tóm tắt hội thoại: {summary}")] if summary else []
+        lines.extend(_format(role, content) for role, content in messages)
+        return "\n".join(lines)
+
+    def summarize_history(self, user_id: str) -> str:
+        """
+        Tóm tắt toàn bộ hội thoại hiện tại (đồng bộ, không thay đổi lịch sử).
+
+        Args:
+            user_id: ID người dùng
+
+        Returns:
+            str: Bản tóm tắt
+        """
+        history_text = self.get_history(user_id)
+        if not history_text:
+            return "No history available."
+        result = self.history_chain.invoke({"history": history_text})
+        return result.summary
+
+    def clear(self, user_id: str):
+        """Xóa hội thoại của một người dùng."""
+        if self.store is not None:
+            self.store.delete(user_id)
+            return
+        with self._lock:
+            conversation = self.history.pop(user_id, None)
+            if conversation is not None:
+                self._bytes -= conversation.bytes
+
+    def flush(self, timeout: Optional[float] = None):
+        """Chờ các lượt tóm tắt nền đang chạy hoàn tất (dùng khi tắt ứng dụng)."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._lock:
+                pending = [future for future in self._pending if not future.done()]
+            if not pending:
+                return
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                return
+            # Một lượt tóm tắt xong có thể lên lịch lượt tiếp theo nên phải kiểm tra lại
+            wait(pending, timeout=remaining)
+
+    def get_stats(self) -> dict:
+        """
+        Thống kê của kho hội thoại.
+
+        Returns:
+            dict: users, memory_bytes, pending_summaries, summaries, summary_errors, evicted_*
+        """
+        with self._lock:
+            stats = {
+                "users": len(self.history),
+                "memory_bytes": self._bytes,
+                "pending_summaries": sum(1 for future in self._pending if not future.done()),
+                **self.stats,
+            }
+        if self.store is not None:
+            stats["store"] = self.store.get_stats()
+        return stats
+
+    # ------------------------------------------------------------------
+    # Nội bộ (các hàm _touch/_evict/_needs_summary gọi khi đang giữ self._lock)
+    # ------------------------------------------------------------------
+
+    def _touch(self, user_id: str, create: bool = False) -> Optional[_Conversation]:
+        conversation = self.history.get(user_id)
+        now = time.time()
+        if conversation is not None and now - conversation.last_access > self.ttl:
+            self.history.pop(user_id)
+            self._bytes -= conversation.bytes
+            self.stats["evicted_ttl"] += 1
+            conversation = None
+        if conversation is None:
+            if not create:
+                return None
+            conversation = self.history[user_id] = _Conversation()
+        conversation.last_access = now
+        self.history.move_to_end(user_id)
+        return conversation
+
+    def _evict(self):
+        # Hội thoại hết hạn nằm ở đầu OrderedDict (ít được dùng gần đây nhất)
+        now = time.time()
+        while self.history:
+            user_id, conversation = next(iter(self.history.items()))
+            if now - conversation.last_access <= self.ttl:
+                break
+            self._drop(user_id, "evicted_ttl")
+        while len(self.history) > self.max_users:
+            self._drop(next(iter(self.history)), "evicted_lru")
+        # Giữ lại ít nhất hội thoại vừa dùng
+        while self._bytes > self.max_memory_bytes and len(self.history) > 1:
+            self._drop(next(iter(self.history)), "evicted_memory")
+
+    def _drop(self, user_id: str, reason: str):
+        conversation = self.history.pop(user_id)
+        self._bytes -= conversation.bytes
+        self.stats[reason] += 1
+
+    def _needs_summary(self, conversation: _Conversation) -> bool:
+        return (not conversation.summarizing
+                and conversation.tokens > self.max_tokens
+                and len(conversation.messages) > self.keep_recent)
+
+    def _schedule(self, fn, *args):
+        if self._executor is None:
+            fn(*args)
+            return
+        future = self._executor.submit(fn, *args)
+        with self._lock:
+            self._pending = [pending for pending in self._pending if not pending.done()]
+            self._pending.append(future)
+
+    def _summarize(self, user_id: str, conversation: _Conversation):
+        """Tóm tắt phần cũ của hội thoại (chạy ngoài lock, chỉ khóa khi ghi kết quả)."""
+        with self._lock:
+            upto = len(conversation.messages) - self.keep_recent
+            old = conversation.messages[:upto]
+            lines = [_format("system", f"Tóm tắt hội thoại: {conversation.summary}")] if conversation.summary else []
+        lines.extend(_format(role, content) for role, content, _, _ in old)
+
+        try:
+            summary = self.history_chain.invoke({"history": "\n".join(lines)}).summary
+        except Exception as e:
+            logger.warning(f"Không thể tóm tắt hội thoại của {user_id}: {e}")
+            with self._lock:
+                conversation.summarizing = False
+                self.stats["summary_errors"] += 1
+            return
+
+        summary_tokens = count_tokens(_format("system", f"Tóm tắt hội thoại: {summary}"), self.token_model)
+        with self._lock:
+            removed_tokens = sum(tokens for _, _, tokens, _ in old)
+            delta_bytes = (len(summary.encode("utf-8")) - len(conversation.summary.encode("utf-8"))
+                           - sum(size for _, _, _, size in old))
+            # Tin nhắn đến trong lúc tóm tắt nằm sau `upto` nên được giữ nguyên
+            del conversation.messages[:upto]
+            conversation.tokens += summary_tokens - conversation.summary_tokens - removed_tokens
+            conversation.bytes += delta_bytes
+            conversation.summary = summary
+            conversation.summary_tokens = summary_tokens
+            conversation.summarizing = False
+            self.stats["summaries"] += 1
+            # Hội thoại có thể đã bị evict trong lúc tóm tắt
+            if self.history.get(user_id) is conversation:
+                self._bytes += delta_bytes
+            again = self._needs_summary(conversation) and self.history.get(user_id) is conversation
+            if again:
+                conversation.summarizing = True
+        if again:
+            self._schedule(self._summarize, user_id, conversation)
+
+    def _summarize_stored(self, user_id: str):
+        """Bản của _summarize() cho HistoryStore; gọi khi đã giành được lease tóm tắt."""
+        try:
+            summary, old = self.store.load_for_summary(user_id, self.keep_recent)
+        except Exception as e:
+            logger.warning(f"Không thể đọc hội thoại của {user_id} để tóm tắt: {e}")
+            old = []
+        if not old:
+            self.store.release_summary(user_id)
+            return
+        lines = [_format("system", f"Tóm tắt hội thoại: {summary}")] if summary else []
+        lines.extend(_format(role, content) for _, role, content, _ in old)
+
+        try:
+            summary = self.history_chain.invoke({"history": "\n".join(lines)}).summary
+            summary_tokens = count_tokens(_format("system", f"Tóm tắt hội thoại: {summary}"), self.token_model)
+            total, pending = self.store.save_summary(user_id, summary, summary_tokens, old)
+        except Exception as e:
+            logger.warning(f"Không thể tóm tắt hội thoại của {user_id}: {e}")
+            self.store.release_summary(user_id)
+            with self._lock:
+                self.stats["summary_errors"] += 1
+            return
+
+        with self._lock:
+            self.stats["summaries"] += 1
+        if total > self.max_tokens and pending > self.keep_recent and self.store.claim_summary(user_id):
+            self._schedule(self._summarize_stored, user_id)
+
+
+if __name__ == "__main__":
+    from .llm import get_llm
+
+    history = HistoryManager(get_llm())
+    history.put_history("user1", "user", "Hello, how are you?")
+    history.put_history("user1", "assistant", "I'm fine, thank you!")
+    print(history.get_history("user1"))
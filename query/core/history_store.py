@@ -0,0 +1,258 @@
+"""
+Kho lịch sử hội thoại trên SQLite (WAL mode) cho HistoryManager.
+
+- history_messages: mỗi tin nhắn là một dòng chỉ thêm (append-only); các dòng đã được
+  gộp vào tóm tắt sẽ bị xóa để file luôn gọn
+- history_sessions: một dòng mỗi hội thoại - tóm tắt (nén zstd), bộ đếm token/tin nhắn
+  chưa tóm tắt, thời điểm truy cập cuối và lease tóm tắt (tránh hai worker cùng tóm tắt)
+Lấy "tóm tắt + N lượt cuối" chỉ cần một lookup theo khóa chính và một index seek,
+nên mọi worker process phục vụ được mọi phiên mà không phải giữ hội thoại trong RAM.
+"""
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+from .compress import compress, decompress
+from .paths import CACHE_DIR
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+HISTORY_DB_PATH = CACHE_DIR / "history.sqlite3"
+
+
+class HistoryStore:
+    """
+    Kho hội thoại SQLite dùng chung giữa nhiều process.
+    """
+
+    def __init__(self, path: Optional[Path] = HISTORY_DB_PATH, ttl: float = 30 * 24 * 3600):
+        """
+        Khởi tạo HistoryStore.
+
+        Args:
+            path: File SQLite (None: SQLite trong bộ nhớ, chỉ dùng trong process)
+            ttl: Thời gian (giây) kể từ tin nhắn cuối trước khi hội thoại bị xóa
+        """
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._conn = self._connect(path)
+
+    def _connect(self, path: Optional[Path]) -> sqlite3.Connection:
+        if path is None:
+            conn = sqlite3.connect(":memory:", check_same_thread=False)
+        else:
+            path = Path(path)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(str(path), check_same_thread=False, timeout=5.0)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS history_messages ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " user_id TEXT NOT NULL,"
+            " role TEXT NOT NULL,"
+            " content TEXT NOT NULL,"
+            " tokens INTEGER NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_history_messages_user ON history_messages (user_id, id)")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS history_sessions ("
+            " user_id TEXT PRIMARY KEY,"
+            " summary BLOB,"
+            " summary_tokens INTEGER NOT NULL DEFAULT 0,"
+            " summarized_upto INTEGER NOT NULL DEFAULT 0,"
+            " tokens INTEGER NOT NULL DEFAULT 0,"
+            " pending INTEGER NOT NULL DEFAULT 0,"
+            " last_access REAL NOT NULL,"
+            " lease_until REAL)"
+        )
+        conn.commit()
+        self._purge(conn)
+        return conn
+
+    def _purge(self, conn: sqlite3.Connection):
+        cutoff = time.time() - self.ttl
+        conn.execute(
+            "DELETE FROM history_messages WHERE user_id IN "
+            "(SELECT user_id FROM history_sessions WHERE last_access < ?)", (cutoff,)
+        )
+        deleted = conn.execute("DELETE FROM history_sessions WHERE last_access < ?", (cutoff,)).rowcount
+        conn.commit()
+        if deleted:
+            logger.info(f"History store: xóa {deleted} hội thoại hết hạn")
+
+    def purge_expired(self):
+        """Xóa các hội thoại không hoạt động quá ttl."""
+        with self._lock:
+            try:
+                self._purge(self._conn)
+            except sqlite3.Error as e:
+                logger.warning(f"Lỗi khi dọn history store: {e}")
+
+    def append(self, user_id: str, role: str, content: str, tokens: int) -> Tuple[int, int]:
+        """
+        Thêm một tin nhắn và cập nhật bộ đếm của hội thoại (một transaction).
+
+        Args:
+            user_id: ID người dùng
+            role: Vai trò
+            content: Nội dung tin nhắn
+            tokens: Số token của tin nhắn
+
+        Returns:
+            (tokens, pending): Tổng token (tóm tắt + tin nhắn chưa tóm tắt) và số tin nhắn chưa tóm tắt
+        """
+        now = time.time()
+        with self._lock:
+            try:
+                with self._conn:
+                    self._conn.execute(
+                        "INSERT INTO history_messages (user_id, role, content, tokens) VALUES (?, ?, ?, ?)",
+                        (user_id, role, content, tokens),
+                    )
+                    row = self._conn.execute(
+                        "INSERT INTO history_sessions (user_id, tokens, pending, last_access) VALUES (?, ?, 1, ?) "
+                        "ON CONFLICT (user_id) DO UPDATE SET tokens = tokens + excluded.tokens, "
+                        "pending = pending + 1, last_access = excluded.last_access "
+                        "RETURNING tokens, pending",
+                        (user_id, tokens, now),
+                    ).fetchone()
+                return row[0], row[1]
+            except sqlite3.Error as e:
+                logger.warning(f"Lỗi khi ghi history store: {e}")
+                return 0, 0
+
+    def recent(self, user_id: str, last_n: Optional[int] = None) -> Tuple[str, List[Tuple[str, str]]]:
+        """
+        Tóm tắt và các tin nhắn chưa tóm tắt gần nhất của hội thoại.
+
+        Args:
+            user_id: ID người dùng
+            last_n: Số tin nhắn gần nhất cần lấy (None: mọi tin nhắn chưa tóm tắt)
+
+        Returns:
+            (summary, [(role, content)]): Tóm tắt ("" nếu chưa có) và tin nhắn theo thứ tự thời gian
+        """
+        with self._lock:
+            try:
+                session = self._conn.execute(
+                    "SELECT summary, summarized_upto FROM history_sessions WHERE user_id = ?", (user_id,)
+                ).fetchone()
+                if session is None:
+                    return "", []
+                rows = self._conn.execute(
+                    "SELECT role, content FROM history_messages WHERE user_id = ? AND id > ? "
+                    "ORDER BY id DESC LIMIT ?",
+                    (user_id, session[1], -1 if last_n is None else last_n),
+                ).fetchall()
+            except sqlite3.Error as e:
+                logger.warning(f"Lỗi khi đọc history store: {e}")
+                return "", []
+        summary = decompress(session[0]).decode("utf-8") if session[0] else ""
+        return summary, rows[::-1]
+
+    def claim_summary(self, user_id: str, lease: float = 120.0) -> bool:
+        """
+        Giành quyền tóm tắt hội thoại trong `lease` giây (chỉ một worker/process được tóm tắt cùng lúc).
+
+        Returns:
+            bool: True nếu giành được
+        """
+        now = time.time()
+        with self._lock:
+            try:
+                claimed = self._conn.execute(
+                    "UPDATE history_sessions SET lease_until = ? "
+                    "WHERE user_id = ? AND (lease_until IS NULL OR lease_until < ?)",
+                    (now + lease, user_id, now),
+                ).rowcount
+                self._conn.commit()
+                return claimed == 1
+            except sqlite3.Error as e:
+                logger.warning(f"Lỗi khi giành lease tóm tắt: {e}")
+                return False
+
+    def release_summary(self, user_id: str):
+        """Trả lại lease tóm tắt (khi tóm tắt lỗi)."""
+        with self._lock:
+            try:
+                self._conn.execute("UPDATE history_sessions SET lease_until = NULL WHERE user_id = ?", (user_id,))
+                self._conn.commit()
+            except sqlite3.Error as e:
+                logger.warning(f"Lỗi khi trả lease tóm tắt: {e}")
+
+    def load_for_summary(self, user_id: str, keep_recent: int) -> Tuple[str, List[tuple]]:
+        """
+        Tóm tắt hiện tại và các tin nhắn cần gộp vào tóm tắt (trừ `keep_recent` tin nhắn cuối).
+
+        Returns:
+            (summary, [(id, role, content, tokens)])
+        """
+        summary = ""
+        with self._lock:
+            session = self._conn.execute(
+                "SELECT summary, summarized_upto FROM history_sessions WHERE user_id = ?", (user_id,)
+            ).fetchone()
+            if session is None:
+                return "", []
+            rows = self._conn.execute(
+                "SELECT id, role, content, tokens FROM history_messages WHERE user_id = ? AND id > ? ORDER BY id",
+                (user_id, session[1]),
+            ).fetchall()
+        if session[0]:
+            summary = decompress(session[0]).decode("utf-8")
+        return summary, rows[:max(len(rows) - keep_recent, 0)]
+
+    def save_summary(self, user_id: str, summary: str, summary_tokens: int, messages: List[tuple]) -> Tuple[int, int]:
+        """
+        Lưu tóm tắt mới, xóa các tin nhắn đã gộp vào tóm tắt và trả lease.
+
+        Args:
+            user_id: ID người dùng
+            summary: Tóm tắt mới
+            summary_tokens: Số token của tóm tắt
+            messages: Các tin nhắn đã gộp (kết quả của load_for_summary)
+
+        Returns:
+            (tokens, pending): Bộ đếm của hội thoại sau khi cập nhật
+        """
+        upto = messages[-1][0]
+        removed_tokens = sum(row[3] for row in messages)
+        with self._lock:
+            with self._conn:
+                row = self._conn.execute(
+                    "UPDATE history_sessions SET summary = ?, "
+                    "tokens = tokens - summary_tokens - ? + ?, summary_tokens = ?, "
+                    "pending = pending - ?, summarized_upto = ?, lease_until = NULL "
+                    "WHERE user_id = ? RETURNING tokens, pending",
+                    (compress(summary.encode("utf-8")), removed_tokens, summary_tokens, summary_tokens,
+                     len(messages), upto, user_id),
+                ).fetchone()
+                self._conn.execute("DELETE FROM history_messages WHERE user_id = ? AND id <= ?", (user_id, upto))
+        return (row[0], row[1]) if row is not None else (0, 0)
+
+    def delete(self, user_id: str):
+        """Xóa toàn bộ hội thoại của một người dùng."""
+        with self._lock:
+            try:
+                with self._conn:
+                    self._conn.execute("DELETE FROM history_messages WHERE user_id = ?", (user_id,))
+                    self._conn.execute("DELETE FROM history_sessions WHERE user_id = ?", (user_id,))
+            except sqlite3.Error as e:
+                logger.warning(f"Lỗi khi xóa hội thoại: {e}")
+
+    def get_stats(self) -> dict:
+        """
+        Thống kê của kho.
+
+        Returns:
+            dict: sessions, messages
+        """
+        with self._lock:
+            sessions = self._conn.execute("SELECT COUNT(*) FROM history_sessions").fetchone()[0]
+            messages = self._conn.execute("SELECT COUNT(*) FROM history_messages").fetchone()[0]
+        return {"sessions": sessions, "messages": messages}
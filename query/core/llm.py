@@ -1,136 +1,215 @@
+import asyncio
 import os
+import threading
+import weakref
+import httpx
 from dotenv import load_dotenv
 from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain_core.prompts import ChatPromptTemplate
 from langchain_openai import ChatOpenAI
-from ..prompt_templates.base import SUMMARIZE_HISTORY_PROMPT, SUMMARIZE_SYSTEM_PROMPT
-from ..core.structure import SummarizeQuery
+from .rate_limit import get_rate_limiter, LangChainRateLimiter, RateLimitCallback
+from .mock import MockChatModel, is_mock_mode
+# HistoryManager trước đây nằm trong module này
+from .history import HistoryManager  # noqa: F401
 
 # Tìm file .env trong thư mục MedAgent (thư mục gốc của project)
 env_path = os.path.join(os.path.dirname(__file__), "../../.env")
 load_dotenv(dotenv_path=env_path)
 
-def get_llm(type_model="gpt-4o-mini", temperature: float = 0.3):
+# Tên model ngắn gọn -> (provider, tên model của provider)
+MODEL_ALIASES = {
+    "gpt": ("openai", "gpt-4o"),
+    "gpt-4o": ("openai", "gpt-4o"),
+    "gpt-4o-mini": ("openai", "gpt-4o-mini"),
+    "gpt-3.5": ("openai", "gpt-3.5-turbo"),
+    "gemini": ("google", "gemini-2.5-flash-lite"),
+    "openai-oss": ("cerebras", "gpt-oss-120b"),
+    "llama3": ("cerebras", "llama-3.3-70b"),
+    "qwen3": ("cerebras", "qwen-3-32b"),
+    "mock": ("mock", "mock"),
+}
+DEFAULT_MODEL = ("openai", "gpt-4o-mini")
+CEREBRAS_API_BASE = "https://api.cerebras.ai/v1"
+
+# Connection pool dùng chung cho mọi client OpenAI-compatible (keep-alive + HTTP/2)
+HTTP_LIMITS = httpx.Limits(max_connections=100, max_keepalive_connections=20, keepalive_expiry=120.0)
+HTTP_TIMEOUT = httpx.Timeout(60.0, connect=10.0)
+
+_registry_lock = threading.Lock()
+_llm_registry = {}
+_registry_stats = {"hits": 0, "misses": 0}
+_http_client = None
+_http_async_client = None
+
+
+def _http2_available() -> bool:
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+def get_http_client() -> httpx.Client:
+    """Client httpx đồng bộ dùng chung cho toàn process."""
+    global _http_client
+    with _registry_lock:
+        if _http_client is None:
+            _http_client = httpx.Client(http2=_http2_available(), limits=HTTP_LIMITS, timeout=HTTP_TIMEOUT)
+        return _http_client
+
+
+class _PerLoopAsyncTransport(httpx.AsyncBaseTransport):
     """
-    Lấy LLM model theo loại được chỉ định.
-    
-    Args:
-        type_model: Loại model ("gpt", "gpt-4o", "gpt-4o-mini", "gemini", "openai-oss", "llama3", "qwen3")
-        temperature: Độ ngẫu nhiên của output (0.0 - 1.0)
-    
-    Returns:
-        ChatOpenAI hoặc ChatGoogleGenerativeAI instance
+    Transport giữ một connection pool riêng cho mỗi event loop: connection của httpcore gắn với
+    loop đã mở nó, nên dùng chung một pool giữa app (uvicorn/Gradio), asyncio.run() của benchmark
+    và loop trong thread khác sẽ lỗi. Pool của loop đã bị thu hồi tự bị bỏ theo.
     """
-    # GPT Models (OpenAI) - Mặc định
-    if type_model == "gpt" or type_model == "gpt-4o":
-        return ChatOpenAI(
-            model="gpt-4o",
-            openai_api_key=os.getenv("OPENAI_API_KEY"),
-            temperature=temperature,
-        )
-    elif type_model == "gpt-4o-mini":
-        return ChatOpenAI(
-            model="gpt-4o-mini",
-            openai_api_key=os.getenv("OPENAI_API_KEY"),
-            temperature=temperature,
-        )
-    elif type_model == "gpt-3.5":
-        return ChatOpenAI(
-            model="gpt-3.5-turbo",
-            openai_api_key=os.getenv("OPENAI_API_KEY"),
-            temperature=temperature,
-        )
+
+    def __init__(self, **transport_kwargs):
+        self._transport_kwargs = transport_kwargs
+        self._transports: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, httpx.AsyncHTTPTransport]" = \
+            weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+
+    def _current(self) -> httpx.AsyncHTTPTransport:
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            transport = self._transports.get(loop)
+            if transport is None:
+                transport = self._transports[loop] = httpx.AsyncHTTPTransport(**self._transport_kwargs)
+            return transport
+
+    def transports(self) -> list:
+        with self._lock:
+            return list(self._transports.values())
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        return await self._current().handle_async_request(request)
+
+    async def aclose(self):
+        # Chỉ đóng được pool của loop đang chạy
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            transport = self._transports.pop(loop, None)
+        if transport is not None:
+            await transport.aclose()
+
+
+def get_async_http_client() -> httpx.AsyncClient:
+    """Client httpx bất đồng bộ dùng chung cho toàn process (mỗi event loop một connection pool)."""
+    global _http_async_client
+    with _registry_lock:
+        if _http_async_client is None:
+            transport = _PerLoopAsyncTransport(http2=_http2_available(), limits=HTTP_LIMITS)
+            _http_async_client = httpx.AsyncClient(transport=transport, timeout=HTTP_TIMEOUT)
+        return _http_async_client
+
+
+def _create_llm(provider: str, model: str, temperature: float):
+    # Model giả lập cho load test offline (không gọi API, không cần rate limit)
+    if provider == "mock":
+        return MockChatModel(model_name=model, temperature=temperature)
+    # Mọi instance cùng (provider, model) dùng chung một limiter RPM/TPM
+    limiter = get_rate_limiter(provider, model)
+    rate_limit_kwargs = {
+        "rate_limiter": LangChainRateLimiter(limiter),
+        "callbacks": [RateLimitCallback(limiter)],
+    }
     # Gemini Models (Google)
-    elif type_model == "gemini":
+    if provider == "google":
         return ChatGoogleGenerativeAI(
-            model="gemini-2.5-flash-lite",
+            model=model,
             temperature=temperature,
             google_api_key=os.getenv("GOOGLE_API_KEY"),
+            **rate_limit_kwargs,
         )
     # Cerebras Models (OpenAI compatible)
-    elif type_model == "openai-oss":
-        return ChatOpenAI(
-            model="gpt-oss-120b",
-            openai_api_base="https://api.cerebras.ai/v1",
-            openai_api_key=os.getenv("CEREBRAS_API_KEY"),
-            temperature=temperature,
-        )
-    elif type_model == "llama3":
-        return ChatOpenAI(
-            model="llama-3.3-70b",
-            openai_api_base="https://api.cerebras.ai/v1",
-            openai_api_key=os.getenv("CEREBRAS_API_KEY"),
-            temperature=temperature,
-        )
-    elif type_model == 'qwen3':
+    if provider == "cerebras":
         return ChatOpenAI(
-            model="qwen-3-32b",
-            openai_api_base="https://api.cerebras.ai/v1",
+            model=model,
+            openai_api_base=CEREBRAS_API_BASE,
             openai_api_key=os.getenv("CEREBRAS_API_KEY"),
             temperature=temperature,
+            http_client=get_http_client(),
+            http_async_client=get_async_http_client(),
+            **rate_limit_kwargs,
         )
-    else:
-        # Fallback to GPT-4o-mini nếu không nhận ra model
-        return ChatOpenAI(
-            model="gpt-4o-mini",
-            openai_api_key=os.getenv("OPENAI_API_KEY"),
-            temperature=temperature,
-        )
+    # GPT Models (OpenAI) - Mặc định
+    return ChatOpenAI(
+        model=model,
+        openai_api_key=os.getenv("OPENAI_API_KEY"),
+        temperature=temperature,
+        http_client=get_http_client(),
+        http_async_client=get_async_http_client(),
+        **rate_limit_kwargs,
+    )
+
 
-class HistoryManager:
-    def __init__(self, llm, max_length: int = 500):
-        self.history = {}
-        self.llm = llm
-        self._init_prompt()
-        self._init_chain()
-        self.max_length = max_length
+def get_llm(type_model="gpt-4o-mini", temperature: float = 0.3):
+    """
+    Lấy LLM model theo loại được chỉ định.
+    Instance được dùng chung trong toàn process theo khóa (provider, model, temperature),
+    các client OpenAI-compatible dùng chung một connection pool httpx.
     
-    def _init_prompt(self):
-        self.prompt = ChatPromptTemplate.from_messages([
-            ("system", SUMMARIZE_SYSTEM_PROMPT),
-            ("user", SUMMARIZE_HISTORY_PROMPT),
-        ])
+    Args:
+        type_model: Loại model ("gpt", "gpt-4o", "gpt-4o-mini", "gemini", "openai-oss", "llama3", "qwen3", "mock").
+            Khi MEDAGENT_MOCK=1 mọi loại đều trả về model mock.
+        temperature: Độ ngẫu nhiên của output (0.0 - 1.0)
     
-    def _init_chain(self):
-        self.structured_llm = self.llm.with_structured_output(SummarizeQuery)
-        self.history_chain = self.prompt | self.structured_llm
- 
+    Returns:
+        ChatOpenAI hoặc ChatGoogleGenerativeAI instance
+    """
+    # Fallback to GPT-4o-mini nếu không nhận ra model
+    provider, model = MODEL_ALIASES.get(type_model, DEFAULT_MODEL)
+    if is_mock_mode():
+        provider, model = MODEL_ALIASES["mock"]
+    key = (provider, model, float(temperature))
     
-    def put_history(self, user_id: str, role: str, message: str):
-        if user_id not in self.history:
-            self.history[user_id] = []
-        self.history[user_id].append({"role": role, "content": message})
-        
-        # Nếu hội thoại quá dài, tự động tóm tắt lại
-        full_text = self._history_to_text(user_id)
-        if len(full_text) > self.max_length:
-            summary = self.summarize_history(user_id)
-            self.history[user_id] = [{"role": "system", "content": f"Tóm tắt hội thoại: {summary}"}]
-        
-    def _history_to_text(self, user_id: str) -> str:
-        if user_id not in self.history:
-            return ""
-        return "\n".join([f"{entry['role']}: {entry['content']}" for entry in self.history[user_id]])
-
-    def get_history(self, user_id: str) -> str:
-        if user_id not in self.history:
-            return ""
-        return self._history_to_text(user_id)        
-
-    def summarize_history(self, user_id: str) -> str:
-
-        if user_id not in self.history or not self.history[user_id]:
-            return "No history available."
-
-        history_text = self.get_history(user_id)
-        
-        result = self.history_chain.invoke({"history": history_text})
-        return result.summary
+    with _registry_lock:
+        llm = _llm_registry.get(key)
+        if llm is not None:
+            _registry_stats["hits"] += 1
+            return llm
     
+    # Tạo ngoài lock vì _create_llm cần lấy http client (cũng dùng lock)
+    llm = _create_llm(provider, model, temperature)
+    with _registry_lock:
+        # Có thể thread khác đã tạo xong trước
+        llm = _llm_registry.setdefault(key, llm)
+        _registry_stats["misses"] += 1
+    return llm
+
+
+def _pool_connection_stats(transports) -> dict:
+    """Đọc số connection của các pool httpcore bên dưới (chỉ để theo dõi)."""
+    try:
+        connections = [conn for transport in transports for conn in transport._pool.connections]
+        return {
+            "connections": len(connections),
+            "idle": sum(1 for conn in connections if conn.is_idle()),
+            "http2": sum(1 for conn in connections if getattr(conn, "_connection", None) is not None
+                         and type(conn._connection).__name__ == "HTTP2Connection"),
+        }
+    except Exception:
+        return {}
+
+
+def get_llm_pool_stats() -> dict:
+    """
+    Thống kê registry LLM và connection pool dùng chung.
     
-if __name__ == "__main__":
-    # Test the LLM setup
-    history = HistoryManager(get_llm())
-    history.put_history("user1", "user", "Hello, how are you?")
-    history.put_history("user1", "assistant", "I'm fine, thank you!")
-    print(history.get_history("user1"))
+    Returns:
+        dict: instances, hits, misses, http (sync pool), http_async (async pool, cộng mọi event loop)
+    """
+    with _registry_lock:
+        stats = {
+            "instances": [f"{provider}:{model}@{temperature}" for provider, model, temperature in _llm_registry],
+            "hits": _registry_stats["hits"],
+            "misses": _registry_stats["misses"],
+        }
+        http_client, http_async_client = _http_client, _http_async_client
+    stats["http"] = _pool_connection_stats([http_client._transport]) if http_client is not None else {}
+    stats["http_async"] = (
+        _pool_connection_stats(http_async_client._transport.transports()) if http_async_client is not None else {}
+    )
+    return stats
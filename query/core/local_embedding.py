@@ -0,0 +1,142 @@
+"""
+Embedding chạy trong process trên CPU (fastembed + onnxruntime) - không có round trip mạng.
+
+- Chọn bằng get_embedding_model("local:<model>") hoặc "local:<model>:int8" (bản lượng tử hóa)
+- Text được chia thành các batch, chạy song song trên một thread pool dùng chung một
+  InferenceSession (onnxruntime nhả GIL khi chạy); số thread nội bộ của session được chia
+  theo số worker để không tranh CPU
+- int8: model ONNX gốc được lượng tử hóa động (onnxruntime.quantization, trọng số int8)
+  một lần vào CACHE_DIR/local_models/<model>-int8 rồi dùng lại
+- Vector được cache theo nội dung như GoogleEmbeddingWrapper (EmbeddingCache)
+"""
+import os
+import re
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+try:
+    from fastembed import TextEmbedding
+except ImportError:  # fastembed là dependency tùy chọn, chỉ cần cho backend local
+    TextEmbedding = None
+
+from .embedding_cache import CachedEmbeddings, EmbeddingCache, get_embedding_cache
+from .paths import CACHE_DIR
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+LOCAL_PREFIX = "local:"
+QUANTIZED_SUFFIX = ":int8"
+# Đa ngôn ngữ (có tiếng Việt), 768 chiều, không cần prefix "query:"/"passage:"
+DEFAULT_LOCAL_MODEL = "sentence-transformers/paraphrase-multilingual-mpnet-base-v2"
+LOCAL_MODEL_DIR = CACHE_DIR / "local_models"
+
+
+def parse_local_model(spec: str) -> Tuple[str, bool]:
+    """
+    Tách tên model và tùy chọn lượng tử hóa từ "local:<model>[:int8]".
+
+    Args:
+        spec: Tên model dạng "local:<model>", "local:<model>:int8" hoặc "local:" (model mặc định)
+
+    Returns:
+        (model, quantized)
+    """
+    name = spec[len(LOCAL_PREFIX):] if spec.startswith(LOCAL_PREFIX) else spec
+    quantized = name.endswith(QUANTIZED_SUFFIX)
+    if quantized:
+        name = name[:-len(QUANTIZED_SUFFIX)]
+    return name or DEFAULT_LOCAL_MODEL, quantized
+
+
+def local_model_key(model: str, quantized: bool) -> str:
+    """Tên chuẩn "local:<model>[:int8]" (khóa của cache và batcher)."""
+    return f"{LOCAL_PREFIX}{model}{QUANTIZED_SUFFIX if quantized else ''}"
+
+
+class LocalEmbedding(CachedEmbeddings):
+    """
+    Embedding ONNX trong process, cùng interface với GoogleEmbeddingWrapper
+    (embed_documents/embed_query, bản async, encode()/aencode()).
+    """
+
+    def __init__(self, model_name: str = DEFAULT_LOCAL_MODEL, quantized: bool = False, batch_size: int = 32,
+                 max_workers: Optional[int] = None, cache: Optional[EmbeddingCache] = None, use_cache: bool = True,
+                 model_dir: Path = LOCAL_MODEL_DIR):
+        """
+        Khởi tạo LocalEmbedding (tải model về model_dir ở lần đầu).
+
+        Args:
+            model_name: Tên model fastembed (xem TextEmbedding.list_supported_models())
+            quantized: Dùng bản lượng tử hóa int8 (nhanh hơn, nhỏ hơn, sai khác nhỏ so với fp32)
+            batch_size: Số text trong một lần chạy model
+            max_workers: Số batch chạy song song (mặc định: nửa số CPU, tối đa 4)
+            cache: EmbeddingCache riêng (None: cache dùng chung của model trong CACHE_DIR/embeddings)
+            use_cache: Có dùng embedding cache không
+            model_dir: Thư mục chứa file model
+        """
+        if TextEmbedding is None:
+            raise ImportError("Backend embedding local cần fastembed và onnxruntime (pip install fastembed)")
+        cpu_count = os.cpu_count() or 1
+        self.max_workers = max_workers or max(1, min(4, cpu_count // 2))
+        self.batch_size = batch_size
+        self.model_name = local_model_key(model_name, quantized)
+        self.model_dir = Path(model_dir)
+        self._model = self._load(model_name, quantized, max(1, cpu_count // self.max_workers))
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="local-embed")
+        self.cache = (cache or get_embedding_cache(self.model_name)) if use_cache else None
+
+    def _load(self, model_name: str, quantized: bool, threads: int):
+        if not quantized:
+            return TextEmbedding(model_name=model_name, cache_dir=str(self.model_dir), threads=threads)
+        # lazy_load: chỉ tải file, chưa tạo session fp32
+        base = TextEmbedding(model_name=model_name, cache_dir=str(self.model_dir), threads=threads, lazy_load=True)
+        quantized_dir = self._quantize(base, model_name)
+        if quantized_dir is None:
+            logger.warning(f"Không lượng tử hóa được '{model_name}', dùng model fp32")
+            self.model_name = local_model_key(model_name, False)
+            base.model.load_onnx_model()
+            return base
+        return TextEmbedding(model_name=model_name, cache_dir=str(self.model_dir), threads=threads,
+                             specific_model_path=str(quantized_dir))
+
+    def _quantize(self, base, model_name: str) -> Optional[Path]:
+        """Lượng tử hóa động model ONNX gốc sang int8 (chỉ lần đầu); trả về thư mục model int8."""
+        source_dir = getattr(base.model, "_model_dir", None)
+        model_file = base.model.model_description.model_file
+        if source_dir is None:
+            return None
+        target_dir = self.model_dir / (re.sub(r"[^A-Za-z0-9_.-]+", "_", model_name) + "-int8")
+        target = target_dir / model_file
+        if target.exists():
+            return target_dir
+        try:
+            from onnxruntime.quantization import QuantType, quantize_dynamic
+        except ImportError as e:  # onnxruntime.quantization cần package onnx
+            logger.warning(f"Thiếu thư viện để lượng tử hóa model: {e}")
+            return None
+        try:
+            # Tokenizer/config chép nguyên, chỉ file .onnx được thay bằng bản int8
+            shutil.copytree(source_dir, target_dir, dirs_exist_ok=True,
+                            ignore=shutil.ignore_patterns("*.onnx", "*.onnx_data"))
+            target.parent.mkdir(parents=True, exist_ok=True)
+            tmp = target.with_suffix(".onnx.tmp")
+            quantize_dynamic(str(Path(source_dir) / model_file), str(tmp), weight_type=QuantType.QInt8)
+            os.replace(tmp, target)
+        except Exception as e:
+            logger.warning(f"Lỗi khi lượng tử hóa model '{model_name}': {e}")
+            return None
+        logger.info(f"Đã lượng tử hóa model '{model_name}' sang int8: {target}")
+        return target_dir
+
+    def _run(self, batch: List[str]) -> List[List[float]]:
+        return [vector.tolist() for vector in self._model.embed(batch, batch_size=len(batch))]
+
+    def _embed_uncached(self, texts: List[str]) -> List[List[float]]:
+        batches = [texts[i:i + self.batch_size] for i in range(0, len(texts), self.batch_size)]
+        if len(batches) <= 1:
+            return self._run(texts) if texts else []
+        return [vector for batch in self._executor.map(self._run, batches) for vector in batch]
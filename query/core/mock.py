@@ -0,0 +1,470 @@
+"""
+Provider giả lập (mock) cho LLM, embedding, Qdrant và web search - dùng để load test
+toàn bộ pipeline mà không tốn API budget và không cần mạng.
+
+Bật cho cả process bằng MEDAGENT_MOCK=1 (get_llm, get_embedding_model, get_rag_client và
+web search đều chuyển sang mock), hoặc chọn riêng từng phần bằng get_llm("mock") /
+get_embedding_model("mock").
+
+- Output có cấu trúc là tất định theo nội dung prompt: cùng prompt -> cùng kết quả
+- Độ trễ lấy mẫu từ phân phối cấu hình được (MEDAGENT_MOCK_LATENCY_<LLM|EMBEDDING|WEB>),
+  cũng tất định theo prompt, vd: "lognormal:700,0.4" (median ms, sigma), "uniform:50,150",
+  "normal:300,50", "fixed:0". MEDAGENT_MOCK_LATENCY_SCALE nhân toàn bộ độ trễ (0 = không chờ).
+- Qdrant: qdrant-client ":memory:" nạp dữ liệu từ drugs-data-main/data/details
+"""
+import asyncio
+import hashlib
+import json
+import math
+import os
+import random
+import re
+import threading
+import time
+from typing import AsyncIterator, Iterator, List, Literal, Optional, Type, get_args, get_origin
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage, HumanMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from langchain_core.runnables import RunnableLambda
+from pydantic import BaseModel
+
+from .paths import BASE_DIR
+from .structure import AnswerWithAssessment, EvalAnswer, FinalAnswer, PlannedQuery, QueryPlan, RouteQuery, SplitQuery, SplitQueryEval, SubQuery
+from .text import normalize_text
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+MOCK_DATA_DIR = BASE_DIR / "drugs-data-main" / "data" / "details"
+MOCK_COLLECTION = "embedding_data"
+MOCK_EMBEDDING_DIM = 768
+
+DEFAULT_LATENCY = {
+    "llm": "lognormal:700,0.4",
+    "embedding": "lognormal:60,0.3",
+    "web": "lognormal:2500,0.5",
+}
+
+# Từ khóa (không dấu) để mock router chọn nhánh database
+_STORE_KEYWORDS = ("ton kho", "doanh thu", "nhap hang", "gia tri nhap", "thong ke", "bieu do",
+                   "nha cung cap", "top ", "so luong", "hoa don", "ban chay")
+
+
+def is_mock_mode() -> bool:
+    """MEDAGENT_MOCK=1: mọi provider (LLM, embedding, Qdrant, web search) dùng mock."""
+    return os.getenv("MEDAGENT_MOCK", "").lower() in ("1", "true", "yes")
+
+
+def _hash_fraction(text: str) -> float:
+    """Số thực tất định trong [0, 1) suy ra từ nội dung."""
+    digest = hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "big") / 2 ** 64
+
+
+class LatencyModel:
+    """
+    Phân phối độ trễ (ms) của mock provider, lấy mẫu tất định theo khóa.
+    """
+
+    def __init__(self, spec: str, scale: float = 1.0):
+        """
+        Args:
+            spec: "<kind>:<p1>[,<p2>]" với kind là fixed | uniform | normal | lognormal
+            scale: Hệ số nhân độ trễ
+        """
+        kind, _, params = spec.partition(":")
+        self.kind = kind.strip().lower()
+        self.params = [float(p) for p in params.split(",") if p.strip()] or [0.0]
+        if self.kind not in ("fixed", "uniform", "normal", "lognormal"):
+            raise ValueError(f"Phân phối độ trễ không hợp lệ: {spec}")
+        self.spec = spec
+        self.scale = scale
+
+    def sample(self, key: str) -> float:
+        """
+        Lấy mẫu độ trễ cho một lời gọi.
+
+        Args:
+            key: Nội dung lời gọi (cùng key -> cùng độ trễ)
+
+        Returns:
+            float: Độ trễ (giây)
+        """
+        rng = random.Random(f"{self.spec}:{key}")
+        p = self.params
+        if self.kind == "fixed":
+            ms = p[0]
+        elif self.kind == "uniform":
+            ms = rng.uniform(p[0], p[1] if len(p) > 1 else p[0])
+        elif self.kind == "normal":
+            ms = rng.gauss(p[0], p[1] if len(p) > 1 else 0.0)
+        else:
+            ms = rng.lognormvariate(math.log(max(p[0], 1e-3)), p[1] if len(p) > 1 else 0.0)
+        return max(ms, 0.0) * self.scale / 1000
+
+
+def get_latency_model(kind: str) -> LatencyModel:
+    """
+    Phân phối độ trễ cấu hình cho một loại mock.
+
+    Args:
+        kind: "llm", "embedding" hoặc "web"
+    """
+    spec = os.getenv(f"MEDAGENT_MOCK_LATENCY_{kind.upper()}", DEFAULT_LATENCY[kind])
+    return LatencyModel(spec, scale=float(os.getenv("MEDAGENT_MOCK_LATENCY_SCALE", "1")))
+
+
+# ---------------------------------------------------------------------------
+# LLM
+# ---------------------------------------------------------------------------
+
+# Nhãn đứng trước câu hỏi trong các prompt của project, theo thứ tự ưu tiên
+# ("câu hỏi sau đây" trước "câu hỏi gốc" vì prompt rephrase có ví dụ "Câu hỏi gốc: ...")
+_QUESTION_LABELS = [
+    re.compile(rf"{label}\s*:\s*(.+)", re.IGNORECASE)
+    for label in ("câu hỏi sau đây", "câu hỏi (?:của )?người dùng", "câu hỏi gốc", "câu hỏi")
+]
+
+
+def _question(messages: List[BaseMessage]) -> str:
+    """Lấy câu hỏi của người dùng từ prompt đã format (fallback: human message cuối)."""
+    text = "\n".join(str(message.content) for message in messages)
+    for pattern in _QUESTION_LABELS:
+        match = pattern.search(text)
+        if match and match.group(1).strip(" {}"):
+            return match.group(1).strip()
+    for message in reversed(messages):
+        if isinstance(message, HumanMessage):
+            return str(message.content)
+    return str(messages[-1].content) if messages else ""
+
+
+def mock_text(question: str) -> str:
+    """Câu trả lời dạng text tất định cho một prompt."""
+    question = " ".join(question.split())[:200]
+    return f"[mock] Thông tin tham khảo cho: {question}. Vui lòng hỏi ý kiến bác sĩ hoặc dược sĩ trước khi dùng thuốc."
+
+
+def _mock_value(annotation, name: str, question: str, field=None):
+    origin = get_origin(annotation)
+    if origin is not None and type(None) in get_args(annotation):
+        annotation = next(arg for arg in get_args(annotation) if arg is not type(None))
+        origin = get_origin(annotation)
+    if origin is Literal:
+        return get_args(annotation)[0]
+    if origin in (list, List):
+        return [question]
+    if isinstance(annotation, type) and issubclass(annotation, BaseModel):
+        return mock_structured_output(annotation, question)
+    if annotation is bool:
+        return True
+    if annotation is int:
+        bounds = [getattr(m, "le", None) for m in getattr(field, "metadata", [])]
+        upper = next((b for b in bounds if b is not None), 5)
+        return max(1, upper - 1)
+    if annotation is float:
+        return 0.8
+    if name in ("answer", "summary", "rephrased_question"):
+        return mock_text(question)
+    return f"[mock] {name}"
+
+
+def mock_structured_output(schema: Type[BaseModel], question: str) -> BaseModel:
+    """
+    Output có cấu trúc tất định cho một schema trong structure.py.
+
+    Args:
+        schema: Pydantic model cần sinh
+        question: Câu hỏi của người dùng lấy từ prompt
+
+    Returns:
+        Instance của schema
+    """
+    folded = normalize_text(question, fold=True)
+    store = any(keyword in folded for keyword in _STORE_KEYWORDS)
+    parts = [f"{part.strip()}?" for part in question.replace(";", "?").split("?") if part.strip()] or [question]
+    if schema is RouteQuery:
+        return RouteQuery(datasource="store_database" if store else "medical_knowledge",
+                          reasoning="[mock] keyword routing")
+    if schema in (SplitQuery, SplitQueryEval):
+        return schema(queries=parts, reasoning="[mock] split by '?'")
+    if schema is PlannedQuery:
+        return PlannedQuery(
+            datasource="store_database" if store else "medical_knowledge",
+            reasoning="[mock] keyword routing + split by '?'",
+            sub_queries=[SubQuery(question=part, search_query=part.rstrip("?")) for part in (parts[:3] if not store else [question])],
+        )
+    if schema is EvalAnswer:
+        # ~10% câu trả lời bị đánh giá chưa đạt để load test đi qua cả nhánh retry / web search
+        score = 0.5 + 0.5 * _hash_fraction(question)
+        satisfactory = score >= 0.55
+        return EvalAnswer(is_satisfactory=satisfactory, score=score,
+                          reasoning="[mock] hash score", should_retry=not satisfactory)
+    if schema is AnswerWithAssessment:
+        # ~15% câu trả lời có coverage dưới ngưỡng mặc định (0.7) để đi qua nhánh retry / web search
+        coverage = 0.65 + 0.35 * _hash_fraction(question)
+        return AnswerWithAssessment(answer=mock_text(question), source="mock", coverage=coverage,
+                                    confidence=0.9, missing="" if coverage >= 0.7 else "[mock] missing")
+    if schema is FinalAnswer:
+        return FinalAnswer(answer=mock_text(question), sources=["mock"], confidence=0.8)
+    if schema is QueryPlan:
+        return QueryPlan(sql="SELECT name FROM sqlite_master WHERE type = 'table'", need_chart=False)
+    values = {
+        name: _mock_value(field.annotation, name, question, field)
+        for name, field in schema.model_fields.items()
+        if field.is_required()
+    }
+    return schema(**values)
+
+
+class MockChatModel(BaseChatModel):
+    """
+    Chat model giả lập: trả lời tất định, độ trễ theo get_latency_model("llm"),
+    hỗ trợ invoke/ainvoke/stream/astream và with_structured_output().
+    """
+
+    model_name: str = "mock"
+    temperature: float = 0.0
+
+    @property
+    def _llm_type(self) -> str:
+        return "mock"
+
+    def _respond(self, messages: List[BaseMessage]):
+        question = _question(messages)
+        prompt = "\n".join(str(message.content) for message in messages)
+        return question, get_latency_model("llm").sample(prompt)
+
+    def _result(self, question: str) -> ChatResult:
+        text = mock_text(question)
+        tokens = len(text) // 4
+        message = AIMessage(content=text, usage_metadata={
+            "input_tokens": len(question) // 4, "output_tokens": tokens, "total_tokens": len(question) // 4 + tokens,
+        })
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        question, delay = self._respond(messages)
+        time.sleep(delay)
+        return self._result(question)
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        question, delay = self._respond(messages)
+        await asyncio.sleep(delay)
+        return self._result(question)
+
+    def _chunks(self, question: str, delay: float):
+        # 30% độ trễ trước token đầu tiên, phần còn lại chia đều cho các token
+        words = mock_text(question).split(" ")
+        per_token = delay * 0.7 / max(len(words), 1)
+        return delay * 0.3, per_token, [word + " " for word in words]
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs) -> Iterator[ChatGenerationChunk]:
+        first, per_token, words = self._chunks(*self._respond(messages))
+        time.sleep(first)
+        for word in words:
+            time.sleep(per_token)
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=word))
+            if run_manager:
+                run_manager.on_llm_new_token(word, chunk=chunk)
+            yield chunk
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs) -> AsyncIterator[ChatGenerationChunk]:
+        first, per_token, words = self._chunks(*self._respond(messages))
+        await asyncio.sleep(first)
+        for word in words:
+            await asyncio.sleep(per_token)
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=word))
+            if run_manager:
+                await run_manager.on_llm_new_token(word, chunk=chunk)
+            yield chunk
+
+    def with_structured_output(self, schema, **kwargs):
+        def structured(value):
+            question, delay = self._respond(self._convert_input(value).to_messages())
+            time.sleep(delay)
+            return mock_structured_output(schema, question)
+
+        async def astructured(value):
+            question, delay = self._respond(self._convert_input(value).to_messages())
+            await asyncio.sleep(delay)
+            return mock_structured_output(schema, question)
+
+        return RunnableLambda(structured, afunc=astructured, name=f"MockStructured[{schema.__name__}]")
+
+
+# ---------------------------------------------------------------------------
+# Embedding
+# ---------------------------------------------------------------------------
+
+class MockEmbeddings(Embeddings):
+    """
+    Embedding giả lập: feature hashing trên từ và cặp từ (không dấu), tất định, không cần mạng.
+    Có cùng interface encode()/aencode() với GoogleEmbeddingWrapper.
+
+    Vector = bias chung + bag-of-words, để cosine của hai văn bản không liên quan ~0.6 và
+    tăng dần theo số từ chung - cùng khoảng điểm với embedding thật, nên các ngưỡng
+    similarity của pipeline vẫn có ý nghĩa.
+    """
+
+    def __init__(self, model_name: str = "mock", dim: int = MOCK_EMBEDDING_DIM, bias: float = 0.6):
+        self.model_name = model_name
+        self.dim = dim
+        self._bias = np.zeros(dim, dtype=np.float32)
+        self._bias[0] = math.sqrt(bias)
+        self._weight = math.sqrt(1 - bias)
+
+    def _vector(self, text: str) -> np.ndarray:
+        tokens = normalize_text(text, fold=True).split()
+        features = tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for feature in features:
+            value = int.from_bytes(hashlib.blake2b(feature.encode("utf-8"), digest_size=4).digest(), "big")
+            # Chiều 0 dành cho bias
+            vector[1 + value % (self.dim - 1)] += 1.0 if value & 1 else -1.0
+        norm = np.linalg.norm(vector)
+        if norm > 0:
+            vector /= norm
+        return self._bias + self._weight * vector
+
+    def _embed(self, texts: List[str]) -> List[List[float]]:
+        return [self._vector(text).tolist() for text in texts]
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        time.sleep(get_latency_model("embedding").sample("\n".join(texts)))
+        return self._embed(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        await asyncio.sleep(get_latency_model("embedding").sample("\n".join(texts)))
+        return self._embed(texts)
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return (await self.aembed_documents([text]))[0]
+
+    def encode(self, texts: List[str], convert_to_numpy: bool = True, **kwargs):
+        embeddings = self.embed_documents(texts)
+        return np.array(embeddings) if convert_to_numpy else embeddings
+
+    async def aencode(self, texts: List[str], convert_to_numpy: bool = True, **kwargs):
+        embeddings = await self.aembed_documents(texts)
+        return np.array(embeddings) if convert_to_numpy else embeddings
+
+
+# ---------------------------------------------------------------------------
+# Qdrant + web search
+# ---------------------------------------------------------------------------
+
+_mock_lock = threading.Lock()
+_mock_client = None
+
+
+def _load_mock_documents(max_docs: Optional[int], max_chars: int = 1500) -> List[dict]:
+    documents = []
+    for path in sorted(MOCK_DATA_DIR.rglob("*.json")):
+        if max_docs is not None and len(documents) >= max_docs:
+            break
+        try:
+            data = json.loads(path.read_text(encoding="utf-8"))
+        except (OSError, ValueError) as e:
+            logger.warning(f"Bỏ qua file dữ liệu mock {path}: {e}")
+            continue
+        parts = [f"Danh mục:\n{path.parent.name}\n\nTên thuốc:\n{path.stem}"]
+        for label, key in (("Mô tả", "describe"), ("Thành phần", "ingredient"), ("Công dụng", "usage"),
+                           ("Liều dùng", "dosage"), ("Tác dụng phụ", "adverse_effect"), ("Lưu ý", "careful")):
+            if data.get(key):
+                parts.append(f"{label}:\n{data[key]}")
+        documents.append({"id": path.stem, "category": path.parent.name, "text": "\n\n".join(parts)[:max_chars]})
+    return documents
+
+
+def get_mock_rag_client():
+    """
+    Qdrant in-process (":memory:") đã nạp collection "embedding_data" từ dữ liệu thuốc
+    bằng MockEmbeddings. Tạo một lần cho cả process.
+    Số tài liệu tối đa: MEDAGENT_MOCK_QDRANT_DOCS (mặc định: tất cả).
+
+    Returns:
+        QdrantClient
+    """
+    global _mock_client
+    from qdrant_client import QdrantClient, models
+
+    with _mock_lock:
+        if _mock_client is not None:
+            return _mock_client
+        started = time.perf_counter()
+        max_docs = os.getenv("MEDAGENT_MOCK_QDRANT_DOCS")
+        documents = _load_mock_documents(int(max_docs) if max_docs else None)
+        embedder = MockEmbeddings()
+        client = QdrantClient(":memory:")
+        client.create_collection(
+            MOCK_COLLECTION,
+            vectors_config=models.VectorParams(size=embedder.dim, distance=models.Distance.COSINE),
+        )
+        for offset in range(0, len(documents), 500):
+            batch = documents[offset:offset + 500]
+            client.upsert(MOCK_COLLECTION, points=[
+                models.PointStruct(id=offset + i, vector=embedder._vector(doc["text"]).tolist(),
+                                   payload={"text": doc["text"], "metadata": {"id": doc["id"], "category": doc["category"],
+                                                                     "file_name": doc["id"]}})
+                for i, doc in enumerate(batch)
+            ])
+        logger.info(f"Mock Qdrant: nạp {len(documents)} tài liệu trong {time.perf_counter() - started:.1f}s")
+        _mock_client = client
+        return client
+
+
+class MockAsyncQdrantClient:
+    """
+    Bản async của client mock: gọi client ":memory:" dùng chung trong thread
+    (AsyncQdrantClient(":memory:") là một kho riêng, không chia sẻ được dữ liệu đã nạp).
+    """
+
+    def __init__(self, client=None):
+        self._client = client or get_mock_rag_client()
+
+    def __getattr__(self, name: str):
+        method = getattr(self._client, name)
+
+        async def call(*args, **kwargs):
+            return await asyncio.to_thread(method, *args, **kwargs)
+
+        return call
+
+
+def _search_pages(query: str, max_results: int) -> dict:
+    hits = get_mock_rag_client().search(
+        collection_name=MOCK_COLLECTION,
+        query_vector=MockEmbeddings()._vector(query).tolist(),
+        limit=max_results,
+    )
+    return {f"mock://{hit.payload['metadata']['id']}": hit.payload["text"] for hit in hits}
+
+
+def mock_web_pages(query: str, max_results: int = 3) -> dict:
+    """
+    Web search + crawl giả lập: trả về các trang "mock://<thuốc>" lấy từ Qdrant mock,
+    độ trễ theo get_latency_model("web").
+
+    Args:
+        query: Câu hỏi tìm kiếm
+        max_results: Số trang tối đa
+
+    Returns:
+        dict: {url: nội dung} giống WebSearchCrawler.search_and_crawl()
+    """
+    time.sleep(get_latency_model("web").sample(query))
+    return _search_pages(query, max_results)
+
+
+async def amock_web_pages(query: str, max_results: int = 3) -> dict:
+    """Bản async của mock_web_pages()."""
+    await asyncio.sleep(get_latency_model("web").sample(query))
+    return await asyncio.to_thread(_search_pages, query, max_results)
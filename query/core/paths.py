@@ -0,0 +1,11 @@
+"""
+Đường dẫn dùng chung của project (thư mục gốc, thư mục cache).
+"""
+import os
+from pathlib import Path
+
+# Thư mục gốc của project (MedAgent/)
+BASE_DIR = Path(__file__).resolve().parent.parent.parent
+
+# Thư mục chứa các file cache (có thể đổi bằng biến môi trường MEDAGENT_CACHE_DIR)
+CACHE_DIR = Path(os.getenv("MEDAGENT_CACHE_DIR", BASE_DIR / ".cache"))
@@ -1,19 +1,14 @@
 import os
 from xmlrpc import client
-from qdrant_client import QdrantClient, models
+from qdrant_client import QdrantClient, AsyncQdrantClient, models
 from dotenv import load_dotenv
+from .mock import get_mock_rag_client, MockAsyncQdrantClient, is_mock_mode
 
 # Tìm file .env trong thư mục MedAgent (thư mục gốc của project)
 env_path = os.path.join(os.path.dirname(__file__), "../../.env")
 load_dotenv(dotenv_path=env_path)
 
-def get_rag_client():
-    """
-    Khởi tạo Qdrant client từ biến môi trường.
-    
-    Returns:
-        QdrantClient: Client kết nối đến Qdrant
-    """
+def _get_qdrant_config():
     qdrant_url = os.getenv("QDRANT_URL")
     qdrant_api_key = os.getenv("QDRANT_API_KEY")
     
@@ -29,9 +24,49 @@ def get_rag_client():
             "Vui lòng kiểm tra file .env trong thư mục MedAgent/"
         )
     
+    return qdrant_url, qdrant_api_key
+
+
+def get_rag_client():
+    """
+    Khởi tạo Qdrant client từ biến môi trường.
+    
+    Returns:
+        QdrantClient: Client kết nối đến Qdrant (Qdrant ":memory:" đã nạp dữ liệu khi MEDAGENT_MOCK=1)
+    """
+    if is_mock_mode():
+        return get_mock_rag_client()
+    qdrant_url, qdrant_api_key = _get_qdrant_config()
     client = QdrantClient(url=qdrant_url, api_key=qdrant_api_key, timeout=60)
     return client
 
+
+def get_async_rag_client():
+    """
+    Khởi tạo Qdrant client bất đồng bộ từ biến môi trường.
+    
+    Returns:
+        AsyncQdrantClient: Client async kết nối đến Qdrant
+    """
+    if is_mock_mode():
+        return MockAsyncQdrantClient()
+    qdrant_url, qdrant_api_key = _get_qdrant_config()
+    return AsyncQdrantClient(url=qdrant_url, api_key=qdrant_api_key, timeout=60)
+
+
+def ensure_payload_indexes(client: QdrantClient, collection_name: str):
+    """
+    Tạo các payload index mà chatbot cần (gọi lại nhiều lần không sao, index đã có thì giữ nguyên).
+    metadata.file_name: lấy thẳng các chunk của một thuốc theo tên (không vector search).
+    
+    Args:
+        client: Qdrant client
+        collection_name: Collection đã tồn tại
+    """
+    client.create_payload_index(collection_name, field_name="metadata.file_name",
+                                field_schema=models.PayloadSchemaType.KEYWORD)
+
+
 if __name__ == "__main__":
     rag_client = get_rag_client()
     
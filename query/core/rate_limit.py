@@ -0,0 +1,378 @@
+"""
+Rate limiter dùng chung cho mọi lời gọi LLM và embedding trong process.
+
+- Mỗi (provider, model) có hai token bucket: requests/phút (RPM) và tokens/phút (TPM).
+  TPM được trừ theo usage thực tế sau mỗi lời gọi nên bucket có thể âm,
+  khi đó các request sau phải chờ bucket hồi lại.
+- Priority lane (contextvar): "interactive" (mặc định) luôn được cấp trước "batch";
+  job batch (embed_to_qdrant, script đánh giá...) chạy trong `with priority_lane("batch")`.
+- Khi provider trả 429, toàn bộ (provider, model) tạm dừng theo exponential backoff có jitter.
+
+Giới hạn mặc định lấy từ DEFAULT_LIMITS, có thể ghi đè bằng biến môi trường
+MEDAGENT_RPM_<PROVIDER> / MEDAGENT_TPM_<PROVIDER> (vd: MEDAGENT_RPM_OPENAI=3000).
+"""
+import asyncio
+import os
+import random
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict, Iterable, Optional
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.rate_limiters import BaseRateLimiter
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+LANES = ("interactive", "batch")
+
+DEFAULT_LIMITS = {
+    "openai": {"rpm": 500, "tpm": 200_000},
+    "cerebras": {"rpm": 30, "tpm": 60_000},
+    "google": {"rpm": 1500, "tpm": 1_000_000},
+}
+
+_current_lane: ContextVar[str] = ContextVar("rate_limit_lane", default="interactive")
+
+
+@contextmanager
+def priority_lane(lane: str):
+    """
+    Chạy các lời gọi LLM / embedding bên trong với lane chỉ định.
+
+    Args:
+        lane: "interactive" hoặc "batch"
+    """
+    if lane not in LANES:
+        raise ValueError(f"Lane không hợp lệ: {lane} (chỉ hỗ trợ {LANES})")
+    token = _current_lane.set(lane)
+    try:
+        yield
+    finally:
+        _current_lane.reset(token)
+
+
+def current_lane() -> str:
+    return _current_lane.get()
+
+
+def estimate_tokens(texts: Iterable[str]) -> int:
+    """Ước lượng số token (1 token ≈ 4 ký tự tiếng Việt)."""
+    return sum(len(text) for text in texts) // 4 + 1
+
+
+def is_rate_limit_error(error: BaseException) -> bool:
+    """Lỗi 429 / quota của OpenAI, Google hoặc provider OpenAI-compatible."""
+    if getattr(error, "status_code", None) == 429 or getattr(error, "code", None) == 429:
+        return True
+    name = type(error).__name__
+    message = str(error)
+    return "RateLimit" in name or "ResourceExhausted" in name or "429" in message or "RESOURCE_EXHAUSTED" in message
+
+
+class TokenBucket:
+    """Token bucket hồi theo thời gian; không tự khóa (RateLimiter giữ lock)."""
+
+    def __init__(self, per_minute: float, burst_seconds: float = 10.0):
+        self.rate = per_minute / 60.0
+        self.capacity = max(1.0, self.rate * burst_seconds)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """Số giây cần chờ để bucket đủ `amount` (amount lớn hơn capacity chỉ cần bucket đầy)."""
+        self._refill(now)
+        needed = min(amount, self.capacity) - self.tokens
+        return needed / self.rate if needed > 0 else 0.0
+
+    def consume(self, amount: float):
+        self.tokens -= amount
+
+
+class RateLimiter:
+    """
+    Giới hạn RPM/TPM cho một (provider, model), có priority lane và backoff khi bị 429.
+    """
+
+    def __init__(self, provider: str, model: str, rpm: float, tpm: float,
+                 base_backoff: float = 1.0, max_backoff: float = 60.0):
+        """
+        Khởi tạo RateLimiter.
+
+        Args:
+            provider: Tên provider (openai, google, cerebras)
+            model: Tên model
+            rpm: Số request tối đa mỗi phút
+            tpm: Số token tối đa mỗi phút
+            base_backoff: Thời gian dừng (giây) sau lần 429 đầu tiên
+            max_backoff: Thời gian dừng tối đa (giây)
+        """
+        self.provider = provider
+        self.model = model
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self._lock = threading.Lock()
+        self._requests = TokenBucket(rpm)
+        self._tokens = TokenBucket(tpm)
+        self._blocked_until = 0.0
+        self._consecutive_throttles = 0
+        self._waiting = Counter()
+        self.stats = {
+            "acquired": Counter(),
+            "waited": Counter(),
+            "wait_ms": Counter(),
+            "max_queue_depth": Counter(),
+            "throttled": 0,
+            "tokens": 0,
+        }
+
+    def _try_acquire(self, lane: str, tokens: int) -> float:
+        """Cấp quyền nếu được (trả về 0), nếu không trả về số giây nên chờ. Gọi khi đang giữ lock."""
+        if lane != "interactive" and self._waiting["interactive"] > 0:
+            # Nhường cho request interactive đang chờ
+            return 0.05
+        now = time.monotonic()
+        wait = max(
+            self._blocked_until - now,
+            self._requests.wait_time(1, now),
+            self._tokens.wait_time(tokens, now),
+        )
+        if wait > 0:
+            return wait
+        self._requests.consume(1)
+        self._tokens.consume(tokens)
+        return 0.0
+
+    def _enter(self, lane: str):
+        with self._lock:
+            self._waiting[lane] += 1
+            depth = self._waiting[lane]
+            if depth > self.stats["max_queue_depth"][lane]:
+                self.stats["max_queue_depth"][lane] = depth
+
+    def _leave(self, lane: str, started: float, waited: bool):
+        with self._lock:
+            self._waiting[lane] -= 1
+            self.stats["acquired"][lane] += 1
+            if waited:
+                self.stats["waited"][lane] += 1
+                self.stats["wait_ms"][lane] += (time.monotonic() - started) * 1000
+
+    def acquire(self, tokens: int = 0, lane: Optional[str] = None, blocking: bool = True) -> bool:
+        """
+        Chờ tới khi được phép gửi request.
+
+        Args:
+            tokens: Số token ước lượng trừ trước (0: chỉ trừ theo usage thực tế sau lời gọi)
+            lane: Lane ưu tiên (mặc định: lane của context hiện tại)
+            blocking: False -> trả về ngay nếu chưa được phép
+
+        Returns:
+            bool: True nếu đã được cấp quyền
+        """
+        lane = lane or current_lane()
+        started = time.monotonic()
+        waited = False
+        self._enter(lane)
+        try:
+            while True:
+                with self._lock:
+                    wait = self._try_acquire(lane, tokens)
+                if wait <= 0:
+                    return True
+                if not blocking:
+                    return False
+                waited = True
+                time.sleep(min(wait, 1.0) * random.uniform(1.0, 1.1))
+        finally:
+            self._leave(lane, started, waited)
+
+    async def aacquire(self, tokens: int = 0, lane: Optional[str] = None, blocking: bool = True) -> bool:
+        """Bản async của acquire()."""
+        lane = lane or current_lane()
+        started = time.monotonic()
+        waited = False
+        self._enter(lane)
+        try:
+            while True:
+                with self._lock:
+                    wait = self._try_acquire(lane, tokens)
+                if wait <= 0:
+                    return True
+                if not blocking:
+                    return False
+                waited = True
+                await asyncio.sleep(min(wait, 1.0) * random.uniform(1.0, 1.1))
+        finally:
+            self._leave(lane, started, waited)
+
+    def record_usage(self, tokens: int):
+        """Trừ số token thực tế đã dùng vào bucket TPM."""
+        with self._lock:
+            self._tokens.consume(tokens)
+            self.stats["tokens"] += tokens
+
+    def record_success(self):
+        with self._lock:
+            self._consecutive_throttles = 0
+
+    def record_throttled(self):
+        """Provider trả 429: tạm dừng (provider, model) với exponential backoff + jitter."""
+        with self._lock:
+            self._consecutive_throttles += 1
+            self.stats["throttled"] += 1
+            backoff = min(self.max_backoff, self.base_backoff * 2 ** (self._consecutive_throttles - 1))
+            backoff *= random.uniform(0.5, 1.5)
+            self._blocked_until = max(self._blocked_until, time.monotonic() + backoff)
+        logger.warning(f"Rate limited by {self.provider}:{self.model}, tạm dừng {backoff:.1f}s")
+
+    def get_stats(self) -> dict:
+        """
+        Thống kê của limiter.
+
+        Returns:
+            dict: queue_depth, max_queue_depth, acquired, waited, avg_wait_ms theo lane; throttled, tokens
+        """
+        with self._lock:
+            return {
+                "queue_depth": {lane: self._waiting[lane] for lane in LANES},
+                "max_queue_depth": {lane: self.stats["max_queue_depth"][lane] for lane in LANES},
+                "acquired": {lane: self.stats["acquired"][lane] for lane in LANES},
+                "waited": {lane: self.stats["waited"][lane] for lane in LANES},
+                "avg_wait_ms": {
+                    lane: self.stats["wait_ms"][lane] / self.stats["waited"][lane] if self.stats["waited"][lane] else 0.0
+                    for lane in LANES
+                },
+                "throttled": self.stats["throttled"],
+                "tokens": self.stats["tokens"],
+            }
+
+
+_registry_lock = threading.Lock()
+_limiters: Dict[str, RateLimiter] = {}
+
+
+def _limit_from_env(provider: str, kind: str, default: float) -> float:
+    value = os.getenv(f"MEDAGENT_{kind.upper()}_{provider.upper()}")
+    return float(value) if value else default
+
+
+def get_rate_limiter(provider: str, model: str) -> RateLimiter:
+    """
+    Limiter dùng chung cho (provider, model).
+
+    Args:
+        provider: Tên provider (openai, google, cerebras)
+        model: Tên model
+
+    Returns:
+        RateLimiter
+    """
+    key = f"{provider}:{model}"
+    with _registry_lock:
+        limiter = _limiters.get(key)
+        if limiter is None:
+            defaults = DEFAULT_LIMITS.get(provider, DEFAULT_LIMITS["openai"])
+            limiter = RateLimiter(
+                provider,
+                model,
+                rpm=_limit_from_env(provider, "rpm", defaults["rpm"]),
+                tpm=_limit_from_env(provider, "tpm", defaults["tpm"]),
+            )
+            _limiters[key] = limiter
+        return limiter
+
+
+def get_rate_limit_stats() -> dict:
+    """Thống kê của mọi limiter, theo khóa "provider:model"."""
+    with _registry_lock:
+        limiters = dict(_limiters)
+    return {key: limiter.get_stats() for key, limiter in limiters.items()}
+
+
+class LangChainRateLimiter(BaseRateLimiter):
+    """Adapter để truyền RateLimiter vào `rate_limiter=` của chat model LangChain."""
+
+    def __init__(self, limiter: RateLimiter):
+        self.limiter = limiter
+
+    def acquire(self, *, blocking: bool = True) -> bool:
+        return self.limiter.acquire(blocking=blocking)
+
+    async def aacquire(self, *, blocking: bool = True) -> bool:
+        return await self.limiter.aacquire(blocking=blocking)
+
+
+class RateLimitCallback(BaseCallbackHandler):
+    """Trừ token thực tế vào TPM sau mỗi lời gọi LLM và kích hoạt backoff khi gặp 429."""
+
+    def __init__(self, limiter: RateLimiter):
+        self.limiter = limiter
+
+    def on_llm_end(self, response, **kwargs):
+        tokens = 0
+        usage = (response.llm_output or {}).get("token_usage") or {}
+        if usage.get("total_tokens"):
+            tokens = usage["total_tokens"]
+        else:
+            for generations in response.generations:
+                for generation in generations:
+                    metadata = getattr(getattr(generation, "message", None), "usage_metadata", None)
+                    if metadata:
+                        tokens += metadata.get("total_tokens", 0)
+        if tokens:
+            self.limiter.record_usage(tokens)
+        self.limiter.record_success()
+
+    def on_llm_error(self, error: BaseException, **kwargs):
+        if is_rate_limit_error(error):
+            self.limiter.record_throttled()
+
+
+def call_with_backoff(fn: Callable, limiter: RateLimiter, tokens: int = 0, max_retries: int = 5):
+    """
+    Gọi fn() qua limiter; gặp 429 thì backoff (có jitter) rồi thử lại.
+
+    Args:
+        fn: Hàm không tham số thực hiện lời gọi
+        limiter: RateLimiter của (provider, model)
+        tokens: Số token ước lượng của lời gọi
+        max_retries: Số lần thử lại tối đa khi bị 429
+
+    Returns:
+        Kết quả của fn()
+    """
+    for attempt in range(max_retries + 1):
+        limiter.acquire(tokens)
+        try:
+            result = fn()
+        except Exception as e:
+            if not is_rate_limit_error(e) or attempt == max_retries:
+                raise
+            limiter.record_throttled()
+            continue
+        limiter.record_success()
+        return result
+
+
+async def acall_with_backoff(fn: Callable, limiter: RateLimiter, tokens: int = 0, max_retries: int = 5):
+    """Bản async của call_with_backoff(); fn() trả về awaitable."""
+    for attempt in range(max_retries + 1):
+        await limiter.aacquire(tokens)
+        try:
+            result = await fn()
+        except Exception as e:
+            if not is_rate_limit_error(e) or attempt == max_retries:
+                raise
+            limiter.record_throttled()
+            continue
+        limiter.record_success()
+        return result
@@ -0,0 +1,253 @@
+"""
+Single-flight - gộp các request giống hệt nhau đang chạy cùng lúc.
+
+Request đầu tiên với một khóa (leader) thực sự chạy công việc; các request trùng khóa
+đến trong lúc đó (follower) chờ và nhận cùng kết quả (hoặc cùng lỗi).
+Khóa được tạo bằng query_fingerprint nên câu hỏi chỉ khác hoa thường/khoảng trắng vẫn được gộp.
+Kết quả không được giữ lại sau khi xong - đây không phải cache.
+
+- SingleFlight: cho code đồng bộ (nhiều thread)
+- AsyncSingleFlight: cho coroutine và async generator (stream) trong cùng event loop
+"""
+import asyncio
+import threading
+from concurrent.futures import Future
+from typing import AsyncIterator, Callable, Dict, List
+
+from .text import query_fingerprint
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class _FlightStats:
+    def __init__(self, name: str):
+        self.name = name
+        self.leaders = 0
+        self.followers = 0
+        _register(self)
+
+    def get_stats(self) -> dict:
+        """
+        Thống kê single-flight.
+
+        Returns:
+            dict: leaders (số lần chạy thật), followers (số request được gộp), coalesce_rate
+        """
+        total = self.leaders + self.followers
+        return {
+            "leaders": self.leaders,
+            "followers": self.followers,
+            "coalesce_rate": self.followers / total if total else 0.0,
+        }
+
+
+class SingleFlight(_FlightStats):
+    """
+    Single-flight cho code đồng bộ: follower chặn thread cho tới khi leader xong.
+    """
+
+    def __init__(self, name: str):
+        """
+        Args:
+            name: Tên dùng trong get_singleflight_stats()
+        """
+        super().__init__(name)
+        self._lock = threading.Lock()
+        self._calls: Dict[str, Future] = {}
+
+    def do(self, query: str, fn: Callable, *args, **kwargs):
+        """
+        Chạy fn(*args, **kwargs) một lần cho mọi request trùng câu hỏi đang chạy đồng thời.
+
+        Args:
+            query: Câu hỏi dùng để tạo khóa
+            fn: Hàm thực hiện công việc
+
+        Returns:
+            Kết quả của fn (dùng chung giữa leader và các follower)
+        """
+        key = query_fingerprint(query)
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._calls[key] = Future()
+                self.leaders += 1
+            else:
+                self.followers += 1
+
+        if not leader:
+            logger.info(f"Single-flight '{self.name}': gộp với request đang chạy")
+            return future.result()
+
+        try:
+            result = fn(*args, **kwargs)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+
+
+class _Flight:
+    def __init__(self, task: asyncio.Future):
+        self.task = task
+        self.waiters = 0
+
+
+class _StreamFlight:
+    def __init__(self):
+        self.task = None
+        self.waiters = 0
+        self.events: List = []
+        self.done = False
+        self.error = None
+        self.changed = asyncio.Event()
+
+    def notify(self):
+        self.changed.set()
+        self.changed = asyncio.Event()
+
+
+class AsyncSingleFlight(_FlightStats):
+    """
+    Single-flight cho asyncio. Công việc chạy trong một task riêng nên một follower bị hủy
+    không ảnh hưởng tới các request khác; task chỉ bị hủy khi mọi request chờ nó đều đã hủy.
+    """
+
+    def __init__(self, name: str):
+        """
+        Args:
+            name: Tên dùng trong get_singleflight_stats()
+        """
+        super().__init__(name)
+        self._calls: Dict[tuple, _Flight] = {}
+        self._streams: Dict[tuple, _StreamFlight] = {}
+
+    @staticmethod
+    def _key(query: str) -> tuple:
+        # Task chỉ await được trong event loop đã tạo ra nó
+        return id(asyncio.get_running_loop()), query_fingerprint(query)
+
+    async def do(self, query: str, fn: Callable, *args, **kwargs):
+        """
+        Bản async của SingleFlight.do(); fn là hàm trả về coroutine.
+
+        Args:
+            query: Câu hỏi dùng để tạo khóa
+            fn: Hàm async thực hiện công việc
+
+        Returns:
+            Kết quả của fn (dùng chung giữa leader và các follower)
+        """
+        key = self._key(query)
+        flight = self._calls.get(key)
+        if flight is None:
+            flight = self._calls[key] = _Flight(asyncio.ensure_future(fn(*args, **kwargs)))
+            flight.task.add_done_callback(lambda _: self._forget(self._calls, key, flight))
+            self.leaders += 1
+        else:
+            logger.info(f"Single-flight '{self.name}': gộp với request đang chạy")
+            self.followers += 1
+
+        flight.waiters += 1
+        try:
+            return await asyncio.shield(flight.task)
+        finally:
+            flight.waiters -= 1
+            if flight.waiters == 0 and not flight.task.done():
+                self._forget(self._calls, key, flight)
+                flight.task.cancel()
+
+    async def stream(self, query: str, factory: Callable[[], AsyncIterator]) -> AsyncIterator:
+        """
+        Single-flight cho async generator: follower nhận lại các event đã phát
+        rồi tiếp tục nhận event mới cùng lúc với leader.
+
+        Args:
+            query: Câu hỏi dùng để tạo khóa
+            factory: Hàm tạo async generator thực hiện công việc
+
+        Yields:
+            Các event của generator (cùng object cho mọi request)
+        """
+        key = self._key(query)
+        flight = self._streams.get(key)
+        if flight is None:
+            flight = self._streams[key] = _StreamFlight()
+            flight.task = asyncio.ensure_future(self._pump(key, flight, factory()))
+            self.leaders += 1
+        else:
+            logger.info(f"Single-flight '{self.name}': gộp stream với request đang chạy")
+            self.followers += 1
+
+        flight.waiters += 1
+        index = 0
+        try:
+            while True:
+                changed = flight.changed
+                while index < len(flight.events):
+                    yield flight.events[index]
+                    index += 1
+                if flight.done:
+                    break
+                await changed.wait()
+            if flight.error is not None:
+                raise flight.error
+        finally:
+            flight.waiters -= 1
+            if flight.waiters == 0 and not flight.done:
+                self._forget(self._streams, key, flight)
+                flight.task.cancel()
+
+    async def _pump(self, key: tuple, flight: _StreamFlight, events: AsyncIterator):
+        try:
+            async for event in events:
+                flight.events.append(event)
+                flight.notify()
+        except Exception as e:
+            flight.error = e
+        finally:
+            flight.done = True
+            flight.notify()
+            self._forget(self._streams, key, flight)
+
+    @staticmethod
+    def _forget(calls: dict, key: tuple, flight):
+        if calls.get(key) is flight:
+            del calls[key]
+
+
+_flights_lock = threading.Lock()
+_flights: List[_FlightStats] = []
+
+
+def _register(flight: _FlightStats):
+    with _flights_lock:
+        _flights.append(flight)
+
+
+def get_singleflight_stats() -> dict:
+    """
+    Thống kê single-flight theo tên (gộp mọi instance cùng tên).
+
+    Returns:
+        dict: {name: {leaders, followers, coalesce_rate}}
+    """
+    with _flights_lock:
+        flights = list(_flights)
+    result = {}
+    for flight in flights:
+        merged = result.setdefault(flight.name, {"leaders": 0, "followers": 0})
+        merged["leaders"] += flight.leaders
+        merged["followers"] += flight.followers
+    for merged in result.values():
+        total = merged["leaders"] + merged["followers"]
+        merged["coalesce_rate"] = merged["followers"] / total if total else 0.0
+    return result
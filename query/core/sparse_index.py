@@ -0,0 +1,345 @@
+"""
+Chỉ mục BM25 (sparse) trên các chunk dữ liệu thuốc, dùng kèm dense search (Qdrant / mirror).
+
+Dense embedding hay bỏ sót tên thuốc và hàm lượng chính xác ("Alenta 10mg", "methocarbamol 500mg");
+BM25 bắt được các chuỗi đó, kết quả hai bên được gộp bằng reciprocal rank fusion (RRF).
+
+- Tokenize: chữ thường, bỏ dấu tiếng Việt, tách theo âm tiết + bigram âm tiết liền nhau
+  ("tac_dung") + token số-đơn vị ("500mg", "2.5mg/ml", "10%")
+- Chỉ mục kiểu CSR: term (hash 64-bit, đã sắp xếp) -> indptr -> postings (doc, trọng số BM25
+  tính sẵn), nên một query chỉ là searchsorted + cộng các đoạn postings
+- Build một lần (offline, vector hóa bằng numpy) khi embed dữ liệu: embed_to_qdrant.py gọi
+  build_sparse_index() trên đúng các chunk đã upload, hoặc chạy `python -m query.core.sparse_index`
+- Toàn bộ chỉ mục (kể cả text/metadata của chunk, nén zstd) nằm trong một file, mở bằng memmap
+"""
+import argparse
+import hashlib
+import json
+import os
+import re
+import struct
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .compress import compress, decompress
+from .paths import CACHE_DIR
+from .text import normalize_text
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+SPARSE_INDEX_DIR = CACHE_DIR / "sparse_index"
+_MAGIC = b"MEDBM25\x01"
+_ALIGN = 64
+
+# Số-đơn vị ("500 mg", "2,5mg/5ml", "10%") là MỘT token; còn lại tách theo âm tiết
+_TOKEN_RE = re.compile(
+    r"(?P<number>\d+(?:[.,]\d+)?)\s*(?P<unit>mcg|mg|ug|kg|g|ml|l|iu|ui|mmol|meq|%)"
+    r"(?:\s*/\s*(?P<per>\d*\s*(?:ml|l|g|kg|vien|goi|ong)))?(?![a-z0-9])"
+    r"|[a-z0-9]+"
+)
+
+
+def tokenize(text: str, bigrams: bool = True) -> List[str]:
+    """
+    Tách text tiếng Việt thành token cho BM25.
+
+    Args:
+        text: Văn bản
+        bigrams: Có thêm bigram âm tiết không
+
+    Returns:
+        List[str]: Token (âm tiết không dấu, bigram "a_b", số-đơn vị "500mg")
+    """
+    tokens = []
+    for match in _TOKEN_RE.finditer(normalize_text(text, fold=True)):
+        if match.group("number") is None:
+            tokens.append(match.group(0))
+            continue
+        token = match.group("number").replace(",", ".") + match.group("unit")
+        per = match.group("per")
+        tokens.append(f"{token}/{per.replace(' ', '')}" if per else token)
+    if bigrams:
+        tokens += [f"{left}_{right}" for left, right in zip(tokens, tokens[1:])]
+    return tokens
+
+
+def _term_hashes(terms: Sequence[str]) -> np.ndarray:
+    return np.fromiter(
+        (int.from_bytes(hashlib.blake2b(term.encode("utf-8"), digest_size=8).digest(), "little") for term in terms),
+        dtype=np.uint64, count=len(terms),
+    )
+
+
+def chunk_key(payload: dict) -> str:
+    """Khóa để gộp cùng một chunk giữa dense và sparse: chunk_id nếu có, không thì hash của text."""
+    metadata = payload.get("metadata") or {}
+    if metadata.get("chunk_id"):
+        return str(metadata["chunk_id"])
+    text = payload.get("text") or payload.get("page_content") or ""
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+def reciprocal_rank_fusion(rankings: Sequence[Sequence[str]], k: int = 60) -> List[Tuple[str, float]]:
+    """
+    Gộp nhiều danh sách xếp hạng: score(d) = sum 1 / (k + rank).
+
+    Args:
+        rankings: Các danh sách khóa, tốt nhất trước
+        k: Hằng số làm mượt của RRF
+
+    Returns:
+        [(khóa, điểm RRF)] theo điểm giảm dần
+    """
+    scores: Dict[str, float] = {}
+    for ranking in rankings:
+        for rank, key in enumerate(ranking, 1):
+            scores[key] = scores.get(key, 0.0) + 1.0 / (k + rank)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
+
+
+def _write_arrays(path: Path, arrays: Dict[str, np.ndarray], meta: dict):
+    """Ghi các mảng vào một file: magic + độ dài header + header JSON + dữ liệu căn lề 64 byte."""
+    layout = {}
+    offset = 0
+    for name, array in arrays.items():
+        offset = -(-offset // _ALIGN) * _ALIGN
+        layout[name] = {"dtype": array.dtype.str, "shape": list(array.shape), "offset": offset}
+        offset += array.nbytes
+    header = json.dumps({"meta": meta, "arrays": layout}).encode("utf-8")
+    base = -(-(len(_MAGIC) + 8 + len(header)) // _ALIGN) * _ALIGN
+    tmp = path.with_suffix(path.suffix + f".{os.getpid()}.tmp")
+    with open(tmp, "wb") as f:
+        f.write(_MAGIC + struct.pack("<Q", len(header)) + header)
+        for name, array in arrays.items():
+            f.seek(base + layout[name]["offset"])
+            f.write(np.ascontiguousarray(array).tobytes())
+    os.replace(tmp, path)
+
+
+def _read_arrays(path: Path) -> Tuple[dict, Dict[str, np.ndarray]]:
+    with open(path, "rb") as f:
+        if f.read(len(_MAGIC)) != _MAGIC:
+            raise ValueError(f"{path} không phải file chỉ mục BM25")
+        (size,) = struct.unpack("<Q", f.read(8))
+        header = json.loads(f.read(size))
+    base = -(-(len(_MAGIC) + 8 + size) // _ALIGN) * _ALIGN
+    arrays = {}
+    for name, spec in header["arrays"].items():
+        shape = tuple(spec["shape"])
+        if 0 in shape:
+            arrays[name] = np.zeros(shape, dtype=spec["dtype"])
+        else:
+            arrays[name] = np.memmap(path, dtype=spec["dtype"], mode="r", offset=base + spec["offset"], shape=shape)
+    return header["meta"], arrays
+
+
+def build_sparse_index(texts: Sequence[str], metadatas: Sequence[dict], path: Path,
+                       k1: float = 1.2, b: float = 0.75, name: str = ""):
+    """
+    Build chỉ mục BM25 và ghi ra file (trọng số BM25 của mỗi posting được tính sẵn).
+
+    Args:
+        texts: Text của các chunk
+        metadatas: Metadata tương ứng (lưu kèm để trả về như payload Qdrant)
+        path: File chỉ mục
+        k1: Tham số bão hòa tần suất của BM25
+        b: Tham số chuẩn hóa độ dài của BM25
+        name: Tên (collection) ghi vào meta
+    """
+    started = time.perf_counter()
+    vocab: Dict[str, int] = {}
+    term_ids: List[int] = []
+    lengths = np.zeros(len(texts), dtype=np.int64)
+    for row, text in enumerate(texts):
+        tokens = tokenize(text)
+        lengths[row] = len(tokens)
+        term_ids.extend(vocab.setdefault(token, len(vocab)) for token in tokens)
+
+    num_docs, num_terms = len(texts), len(vocab)
+    terms = np.asarray(term_ids, dtype=np.int64)
+    docs = np.repeat(np.arange(num_docs, dtype=np.int64), lengths)
+    # Tần suất (doc, term) bằng np.unique trên khóa ghép doc * V + term
+    pairs, tf = np.unique(docs * max(num_terms, 1) + terms, return_counts=True)
+    doc_of, term_of = pairs // max(num_terms, 1), pairs % max(num_terms, 1)
+    df = np.bincount(term_of, minlength=num_terms)
+    idf = np.log1p((num_docs - df + 0.5) / (df + 0.5))
+    avgdl = float(lengths.mean()) if num_docs else 0.0
+    norm = k1 * (1 - b + b * lengths[doc_of] / max(avgdl, 1e-9))
+    # float16 đủ chính xác để xếp hạng và giảm một nửa dung lượng
+    weights = (idf[term_of] * tf * (k1 + 1) / (tf + norm)).astype(np.float16)
+
+    # Sắp term theo hash để tra bằng searchsorted; postings của mỗi term nằm liền nhau (CSR)
+    hashes = _term_hashes(list(vocab))
+    order = np.argsort(hashes)
+    rank = np.empty(num_terms, dtype=np.int64)
+    rank[order] = np.arange(num_terms)
+    sorted_terms = rank[term_of]
+    postings_order = np.lexsort((doc_of, sorted_terms))
+    indptr = np.zeros(num_terms + 1, dtype=np.int64)
+    np.cumsum(np.bincount(sorted_terms, minlength=num_terms), out=indptr[1:])
+
+    blobs = [compress(json.dumps({"text": text, "metadata": metadata}, ensure_ascii=False).encode("utf-8"))
+             for text, metadata in zip(texts, metadatas)]
+    payload_offsets = np.zeros(num_docs + 1, dtype=np.int64)
+    np.cumsum([len(blob) for blob in blobs], out=payload_offsets[1:])
+
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    _write_arrays(path, {
+        "term_hashes": hashes[order],
+        "indptr": indptr,
+        "postings": doc_of[postings_order].astype(np.int32),
+        "weights": weights[postings_order],
+        "payload_offsets": payload_offsets,
+        "payloads": np.frombuffer(b"".join(blobs), dtype=np.uint8),
+    }, {"name": name, "docs": num_docs, "terms": num_terms, "avgdl": avgdl, "k1": k1, "b": b,
+        "built_at": time.time()})
+    logger.info(f"Chỉ mục BM25 '{name}': {num_docs} chunk, {num_terms} term, {len(pairs)} posting "
+                f"trong {time.perf_counter() - started:.1f}s -> {path}")
+
+
+class SparseIndex:
+    """
+    Chỉ mục BM25 chỉ đọc, mở bằng memmap (dùng chung giữa các thread).
+    """
+
+    def __init__(self, path: Path):
+        """
+        Args:
+            path: File chỉ mục do build_sparse_index() tạo
+        """
+        self.path = Path(path)
+        self.meta, arrays = _read_arrays(self.path)
+        self.term_hashes = arrays["term_hashes"]
+        self.indptr = arrays["indptr"]
+        self.postings = arrays["postings"]
+        self.weights = arrays["weights"]
+        self.payload_offsets = arrays["payload_offsets"]
+        self.payloads = arrays["payloads"]
+        self.size = self.meta["docs"]
+        self._lock = threading.Lock()
+        self.stats = {"searches": 0, "search_ms": 0.0, "empty": 0}
+
+    def payload(self, row: int) -> dict:
+        """Payload ({"text", "metadata"}) của chunk ở dòng row."""
+        start, end = self.payload_offsets[row], self.payload_offsets[row + 1]
+        return json.loads(decompress(self.payloads[start:end].tobytes()))
+
+    def search(self, query: str, limit: int = 10) -> List[Tuple[int, float]]:
+        """
+        Tìm các chunk khớp nhất với query theo BM25.
+
+        Args:
+            query: Câu hỏi
+            limit: Số kết quả tối đa
+
+        Returns:
+            [(row, score)] theo score giảm dần (chỉ các chunk có ít nhất một term khớp)
+        """
+        started = time.perf_counter()
+        hashes = np.unique(_term_hashes(list(set(tokenize(query)))))
+        results: List[Tuple[int, float]] = []
+        if len(hashes) and len(self.term_hashes):
+            positions = np.searchsorted(self.term_hashes, hashes)
+            found = positions < len(self.term_hashes)
+            positions, hashes = positions[found], hashes[found]
+            positions = positions[self.term_hashes[positions] == hashes]
+            if len(positions):
+                spans = [slice(self.indptr[p], self.indptr[p + 1]) for p in positions]
+                docs = np.concatenate([self.postings[span] for span in spans])
+                weights = np.concatenate([self.weights[span] for span in spans])
+                scores = np.bincount(docs, weights=weights, minlength=self.size)
+                top = min(limit, int(np.count_nonzero(scores)))
+                if top:
+                    best = np.argpartition(-scores, top - 1)[:top]
+                    best = best[np.argsort(-scores[best])]
+                    results = [(int(row), float(scores[row])) for row in best]
+        with self._lock:
+            self.stats["searches"] += 1
+            self.stats["search_ms"] += (time.perf_counter() - started) * 1000
+            self.stats["empty"] += not results
+        return results
+
+    def get_stats(self) -> dict:
+        """
+        Thống kê của chỉ mục.
+
+        Returns:
+            dict: searches, empty, avg_search_ms, docs, terms
+        """
+        with self._lock:
+            stats = dict(self.stats)
+        search_ms = stats.pop("search_ms")
+        stats["avg_search_ms"] = search_ms / stats["searches"] if stats["searches"] else 0.0
+        stats["docs"] = self.size
+        stats["terms"] = self.meta["terms"]
+        return stats
+
+
+def sparse_index_path(collection: str) -> Path:
+    return SPARSE_INDEX_DIR / f"{re.sub(r'[^A-Za-z0-9_.-]+', '_', collection)}.bm25"
+
+
+_registry_lock = threading.Lock()
+_registry: Dict[str, Optional[SparseIndex]] = {}
+
+
+def get_sparse_index(collection: str) -> Optional[SparseIndex]:
+    """
+    Chỉ mục BM25 dùng chung trong process cho một collection.
+
+    Args:
+        collection: Tên collection Qdrant mà chỉ mục được build cùng
+
+    Returns:
+        SparseIndex, hoặc None nếu chưa build (chỉ dùng dense search)
+    """
+    with _registry_lock:
+        if collection not in _registry:
+            path = sparse_index_path(collection)
+            index = None
+            if path.exists():
+                try:
+                    index = SparseIndex(path)
+                    logger.info(f"Chỉ mục BM25 '{collection}': {index.size} chunk")
+                except (OSError, ValueError, KeyError) as e:
+                    logger.warning(f"Không mở được chỉ mục BM25 {path}: {e}")
+            _registry[collection] = index
+        return _registry[collection]
+
+
+def get_sparse_index_stats() -> dict:
+    """
+    Thống kê của mọi chỉ mục BM25 đã mở, theo collection.
+
+    Returns:
+        dict: {collection: stats}
+    """
+    with _registry_lock:
+        indexes = dict(_registry)
+    return {name: index.get_stats() for name, index in indexes.items() if index is not None}
+
+
+def main():
+    from .embed_to_qdrant import DATA_DIR, COLLECTION_NAME, load_all_documents
+
+    parser = argparse.ArgumentParser(description="Build chỉ mục BM25 từ dữ liệu thuốc (cùng cách chunk như embed_to_qdrant)")
+    parser.add_argument("--data-dir", type=Path, default=DATA_DIR, help="Thư mục dữ liệu thuốc")
+    parser.add_argument("--collection", default=COLLECTION_NAME, help="Collection Qdrant đi kèm")
+    parser.add_argument("--output", type=Path, default=None, help="File chỉ mục (mặc định: theo collection)")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    documents = load_all_documents(args.data_dir)
+    build_sparse_index([doc.page_content for doc in documents], [doc.metadata for doc in documents],
+                       args.output or sparse_index_path(args.collection), name=args.collection)
+
+
+if __name__ == "__main__":
+    main()
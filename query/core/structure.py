@@ -11,12 +11,38 @@ class RouteQuery(BaseModel):
     )
     reasoning: str = Field(..., description="Brief for the decision")
 
+class SubQuery(BaseModel):
+    """A sub-query together with its retrieval-optimized rewrite."""
+
+    question: str = Field(..., description="The sub-query, used to generate and evaluate the answer")
+    search_query: str = Field(..., description="Rewrite of the sub-query optimized for vector search")
+
+class PlannedQuery(BaseModel):
+    """Route, split and rewrite a user query in a single step."""
+
+    datasource: Literal["medical_knowledge", "store_database"] = Field(
+        ...,
+        description="Route to store_database for sales-related queries or medical_knowledge for medical queries",
+    )
+    reasoning: str = Field(..., description="Brief for the decision")
+    sub_queries: list[SubQuery] = Field(..., description="1 to 3 independent sub-queries with search rewrites")
+
+    def to_route(self) -> RouteQuery:
+        return RouteQuery(datasource=self.datasource, reasoning=self.reasoning)
+
 class AnswerQuery(BaseModel):
     """Answer a user query with context."""
 
     answer: str = Field(..., description="The answer to the user's query based on the provided context")
     source: str = Field(..., description="The source of the information used to answer the query")
 
+class AnswerWithAssessment(AnswerQuery):
+    """Answer a user query with context and assess how well the context supports the answer."""
+
+    coverage: float = Field(..., description="Fraction (0.0 to 1.0) of the query's parts that the provided context answers")
+    confidence: float = Field(..., description="Confidence (0.0 to 1.0) that the answer is fully grounded in the provided context")
+    missing: str = Field(default="", description="Information the query asks for that is missing from the context")
+
 class RephraseQuery(BaseModel):
     """Rephrase a user query for better retrieval."""
 
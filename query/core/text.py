@@ -0,0 +1,60 @@
+"""
+Các hàm chuẩn hóa văn bản tiếng Việt dùng chung (routing, cache, tìm kiếm).
+"""
+import hashlib
+import re
+import unicodedata
+
+_WHITESPACE_RE = re.compile(r"\s+")
+
+# "đ" không tách được thành ký tự gốc + dấu khi NFD nên phải thay thủ công
+_VIETNAMESE_SPECIAL = str.maketrans({"đ": "d", "Đ": "D"})
+# Các khối dấu kết hợp (Combining Diacritical Marks...) - xóa bằng một regex nhanh hơn duyệt từng ký tự
+_COMBINING_RE = re.compile("[\u0300-\u036f\u1ab0-\u1aff\u1dc0-\u1dff\u20d0-\u20ff\ufe20-\ufe2f]")
+
+
+def fold_diacritics(text: str) -> str:
+    """
+    Bỏ dấu tiếng Việt: "Thống kê tồn kho" -> "Thong ke ton kho".
+
+    Args:
+        text: Văn bản cần bỏ dấu
+
+    Returns:
+        str: Văn bản không dấu
+    """
+    decomposed = unicodedata.normalize("NFD", text.translate(_VIETNAMESE_SPECIAL))
+    return _COMBINING_RE.sub("", decomposed)
+
+
+def normalize_text(text: str, fold: bool = False) -> str:
+    """
+    Chuẩn hóa văn bản: NFC, chữ thường, gộp khoảng trắng, (tùy chọn) bỏ dấu.
+
+    Args:
+        text: Văn bản cần chuẩn hóa
+        fold: Có bỏ dấu tiếng Việt không
+
+    Returns:
+        str: Văn bản đã chuẩn hóa
+    """
+    normalized = unicodedata.normalize("NFC", text).lower()
+    normalized = _WHITESPACE_RE.sub(" ", normalized).strip()
+    if fold:
+        normalized = fold_diacritics(normalized)
+    return normalized
+
+
+def query_fingerprint(text: str, fold: bool = False) -> str:
+    """
+    Fingerprint chuẩn của câu hỏi, dùng làm khóa cache / gộp request trùng lặp.
+    Hai câu hỏi chỉ khác hoa thường, khoảng trắng (và dấu nếu fold=True) có cùng fingerprint.
+
+    Args:
+        text: Câu hỏi
+        fold: Có bỏ dấu tiếng Việt trước khi băm không
+
+    Returns:
+        str: sha1 hex của câu hỏi đã chuẩn hóa
+    """
+    return hashlib.sha1(normalize_text(text, fold=fold).encode("utf-8")).hexdigest()
@@ -0,0 +1,54 @@
+"""
+Đếm token bằng tiktoken (dùng chung cho lịch sử hội thoại, ngân sách context...).
+Nếu tiktoken không có hoặc không tải được bảng mã (máy không có mạng), ước lượng 1 token ≈ 4 ký tự.
+"""
+import threading
+from typing import Optional
+
+try:
+    import tiktoken
+except ImportError:  # tiktoken là dependency tùy chọn
+    tiktoken = None
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+_encodings_lock = threading.Lock()
+_encodings = {}
+
+
+def _get_encoding(model: str):
+    with _encodings_lock:
+        if model in _encodings:
+            return _encodings[model]
+        encoding = None
+        if tiktoken is not None:
+            try:
+                try:
+                    encoding = tiktoken.encoding_for_model(model)
+                except KeyError:
+                    encoding = tiktoken.get_encoding("cl100k_base")
+            except Exception as e:
+                logger.warning(f"Không tải được bảng mã tiktoken cho '{model}', dùng ước lượng theo ký tự: {e}")
+        _encodings[model] = encoding
+        return encoding
+
+
+def count_tokens(text: Optional[str], model: str = "gpt-4o-mini") -> int:
+    """
+    Đếm số token của một đoạn văn bản.
+
+    Args:
+        text: Văn bản cần đếm
+        model: Tên model (chọn bảng mã tiktoken tương ứng)
+
+    Returns:
+        int: Số token
+    """
+    if not text:
+        return 0
+    encoding = _get_encoding(model)
+    if encoding is None:
+        return len(text) // 4 + 1
+    return len(encoding.encode(text, disallowed_special=()))
@@ -0,0 +1,549 @@
+"""
+Bản sao cục bộ (mirror) của một collection Qdrant để search trong process, không qua mạng.
+
+Mỗi phiên bản của mirror là một thư mục CACHE_DIR/qdrant_mirror/<collection>/<version>/:
+- vectors.npy  - ma trận float32 (n, dim) đã chuẩn hóa, mở bằng memmap (chỉ đọc)
+- index.faiss  - đồ thị HNSW trên mã 8-bit (IndexHNSWSQ) để tìm ứng viên; điểm cuối cùng được
+                 tính lại chính xác bằng cosine trên vectors.npy nên score khớp với Qdrant
+- payloads.bin + offsets.npy - payload (kèm id điểm) của từng dòng, nén zstd, đọc bằng mmap
+- keys.json    - chunk_key của từng dòng, để lấy vector đã lưu của một chunk (vectors()) thay vì embed lại
+- meta.json    - version, số điểm, số chiều, thời điểm build
+File CURRENT trỏ tới thư mục đang dùng và được thay bằng os.replace sau khi build xong,
+nên process khác (hoặc lần chạy sau) luôn đọc được một phiên bản hoàn chỉnh.
+
+Đồng bộ: version của collection là fingerprint gồm số điểm, cấu hình vector, id của trang scroll
+đầu tiên (đổi khi collection được embed lại) và hash nội dung (id + payload của mọi điểm, scroll
+không kèm vector) - bắt được cả upsert đè lên điểm cũ mà số điểm không đổi. Thread sync định kỳ so
+fingerprint và build lại mirror (scroll toàn bộ collection kèm vector) khi khác. Upsert chỉ đổi vector
+mà giữ nguyên payload thì fingerprint không thấy: dùng sync(force=True) / --force để build lại.
+Không có faiss thì search exact trên memmap.
+
+Chạy tay:
+    python -m query.core.vector_mirror                    # sync collection của embedding profile
+    python -m query.core.vector_mirror --force            # build lại kể cả khi fingerprint không đổi
+    python -m query.core.vector_mirror --export mirror.tar.gz
+    python -m query.core.vector_mirror --restore mirror.tar.gz
+"""
+import argparse
+import hashlib
+import json
+import mmap
+import os
+import re
+import shutil
+import tarfile
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+from qdrant_client.http.models import ScoredPoint
+
+try:
+    import faiss
+except ImportError:  # faiss là dependency tùy chọn: không có thì search exact trên memmap
+    faiss = None
+
+from .compress import compress, decompress
+from .mock import is_mock_mode
+from .paths import CACHE_DIR
+from .sparse_index import chunk_key
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+MIRROR_DIR = CACHE_DIR / "qdrant_mirror"
+SCROLL_BATCH = 256
+FINGERPRINT_IDS = 64
+# Scroll chỉ lấy payload nên có thể lấy trang lớn hơn
+CONTENT_SCROLL_BATCH = 1024
+
+
+def _normalize(vectors: np.ndarray, out: Optional[np.ndarray] = None) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return np.divide(vectors, np.where(norms > 0, norms, 1.0), out=out)
+
+
+def _resize_vectors(path: Path, matrix: np.ndarray, rows: int, keep: int) -> np.ndarray:
+    """Ghi lại file .npy (memmap) với `rows` dòng, giữ `keep` dòng đầu của matrix."""
+    resize_path = path.with_name(f"resize.{path.name}")
+    resized = np.lib.format.open_memmap(resize_path, mode="w+", dtype=np.float32, shape=(rows, matrix.shape[1]))
+    resized[:keep] = matrix[:keep]
+    os.replace(resize_path, path)
+    return resized
+
+
+def content_hash(client, collection: str) -> str:
+    """
+    Hash của (id, payload) mọi điểm trong collection (scroll không kèm vector).
+
+    Args:
+        client: QdrantClient
+        collection: Tên collection
+
+    Returns:
+        str: blake2b hex
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    offset = None
+    while True:
+        records, offset = client.scroll(collection, limit=CONTENT_SCROLL_BATCH, offset=offset,
+                                        with_payload=True, with_vectors=False)
+        for record in records:
+            digest.update(str(record.id).encode("utf-8"))
+            digest.update(json.dumps(record.payload, sort_keys=True, ensure_ascii=False).encode("utf-8"))
+        if offset is None:
+            return digest.hexdigest()
+
+
+def collection_version(client, collection: str, content: bool = True) -> str:
+    """
+    Fingerprint của collection: số điểm, cấu hình vector, id của trang scroll đầu tiên
+    và (nếu content) hash nội dung của mọi điểm.
+
+    Args:
+        client: QdrantClient
+        collection: Tên collection
+        content: Có tính content_hash không (False: chỉ bắt được collection embed lại / đổi số điểm)
+
+    Returns:
+        str: sha256 hex
+    """
+    info = client.get_collection(collection)
+    records, _ = client.scroll(collection, limit=FINGERPRINT_IDS, with_payload=False, with_vectors=False)
+    return hashlib.sha256(json.dumps({
+        "points": info.points_count,
+        "vectors": str(info.config.params.vectors),
+        "ids": [str(record.id) for record in records],
+        "content": content_hash(client, collection) if content else None,
+    }, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+class _MirrorSnapshot:
+    """Một phiên bản đã build của mirror (chỉ đọc, dùng chung giữa các thread)."""
+
+    def __init__(self, path: Path, ef_search: int):
+        self.path = path
+        self.meta = json.loads((path / "meta.json").read_text(encoding="utf-8"))
+        self.version = self.meta["version"]
+        self.size = self.meta["count"]
+        self.vectors = np.load(path / "vectors.npy", mmap_mode="r") if self.size else np.zeros((0, 0), np.float32)
+        self.offsets = np.load(path / "offsets.npy")
+        self._payload_file = open(path / "payloads.bin", "rb")
+        self.payloads = mmap.mmap(self._payload_file.fileno(), 0, access=mmap.ACCESS_READ) if self.size else b""
+        self.index = None
+        if faiss is not None and (path / "index.faiss").exists():
+            self.index = faiss.read_index(str(path / "index.faiss"))
+            self.index.hnsw.efSearch = ef_search
+        self._rows: Optional[Dict[str, int]] = None
+        self._rows_lock = threading.Lock()
+
+    def record(self, row: int) -> dict:
+        return json.loads(decompress(self.payloads[self.offsets[row]:self.offsets[row + 1]]))
+
+    def rows(self) -> Dict[str, int]:
+        """chunk_key -> dòng (nạp lần đầu khi cần; phiên bản build trước khi có keys.json thì đọc từ payload)."""
+        if self._rows is None:
+            with self._rows_lock:
+                if self._rows is None:
+                    keys_path = self.path / "keys.json"
+                    if keys_path.exists():
+                        keys = json.loads(keys_path.read_text(encoding="utf-8"))
+                    else:
+                        keys = [chunk_key(self.record(row)["payload"] or {}) for row in range(self.size)]
+                    self._rows = {key: row for row, key in enumerate(keys)}
+        return self._rows
+
+    def search(self, query: np.ndarray, limit: int, candidates: int) -> List[ScoredPoint]:
+        if not self.size:
+            return []
+        if self.index is not None:
+            _, found = self.index.search(query[None, :], min(candidates, self.size))
+            rows = np.sort(found[0][found[0] >= 0])
+        else:
+            rows = np.arange(self.size)
+        # Score chính xác trên vector float32 (memmap), như Distance.COSINE của Qdrant
+        scores = np.asarray(self.vectors[rows] @ query)
+        order = np.argsort(-scores)[:limit]
+        hits = []
+        for position in order:
+            record = self.record(int(rows[position]))
+            hits.append(ScoredPoint(id=record["id"], version=0, score=float(scores[position]),
+                                    payload=record["payload"]))
+        return hits
+
+
+class VectorMirror:
+    """
+    Mirror cục bộ của một collection Qdrant: build từ scroll, search HNSW trong process.
+    """
+
+    def __init__(self, collection: str, directory: Path = MIRROR_DIR, hnsw_m: int = 32, ef_construction: int = 200,
+                 ef_search: int = 128, rerank_factor: int = 4, vector_name: Optional[str] = None,
+                 content_fingerprint: bool = True):
+        """
+        Khởi tạo VectorMirror và nạp phiên bản đã build trên đĩa (nếu có).
+
+        Args:
+            collection: Tên collection Qdrant
+            directory: Thư mục gốc chứa các mirror
+            hnsw_m: Số cạnh mỗi nút của đồ thị HNSW
+            ef_construction: Độ rộng tìm kiếm khi build HNSW
+            ef_search: Độ rộng tìm kiếm khi query HNSW
+            rerank_factor: Số ứng viên lấy từ HNSW = limit * rerank_factor (để tính lại score chính xác)
+            vector_name: Tên vector nếu collection dùng named vectors (None: vector mặc định)
+            content_fingerprint: Version gồm cả hash nội dung (bắt được upsert đè, mỗi lần sync scroll payload)
+        """
+        self.collection = collection
+        self.path = Path(directory) / re.sub(r"[^A-Za-z0-9_.-]+", "_", collection)
+        self.hnsw_m = hnsw_m
+        self.ef_construction = ef_construction
+        self.ef_search = ef_search
+        self.rerank_factor = rerank_factor
+        self.vector_name = vector_name
+        self.content_fingerprint = content_fingerprint
+        self._snapshot: Optional[_MirrorSnapshot] = None
+        self._build_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._sync_thread: Optional[threading.Thread] = None
+        self.stats = {"searches": 0, "misses": 0, "errors": 0, "search_ms": 0.0, "syncs": 0, "rebuilds": 0}
+        try:
+            self.load()
+        except (OSError, ValueError, KeyError, RuntimeError) as e:
+            logger.warning(f"Không nạp được mirror của '{collection}': {e}")
+
+    @property
+    def ready(self) -> bool:
+        return self._snapshot is not None
+
+    @property
+    def version(self) -> Optional[str]:
+        snapshot = self._snapshot
+        return snapshot.version if snapshot is not None else None
+
+    # ------------------------------------------------------------------
+    # Nạp / build
+    # ------------------------------------------------------------------
+
+    def load(self) -> bool:
+        """
+        Nạp phiên bản mà CURRENT trỏ tới.
+
+        Returns:
+            bool: True nếu nạp được
+        """
+        current = self.path / "CURRENT"
+        if not current.exists():
+            return False
+        version_dir = self.path / current.read_text(encoding="utf-8").strip()
+        if self._snapshot is not None and self._snapshot.path == version_dir:
+            return True
+        self._snapshot = _MirrorSnapshot(version_dir, self.ef_search)
+        logger.info(f"Mirror '{self.collection}': nạp {self._snapshot.size} điểm ({version_dir.name[:12]})")
+        return True
+
+    def _vector(self, record) -> List[float]:
+        vector = record.vector
+        if isinstance(vector, dict):
+            vector = vector[self.vector_name] if self.vector_name else next(iter(vector.values()))
+        return vector
+
+    def build(self, client, version: Optional[str] = None):
+        """
+        Scroll toàn bộ collection, ghi một phiên bản mới của mirror rồi chuyển sang dùng nó.
+
+        Args:
+            client: QdrantClient
+            version: Fingerprint của collection (None: tính bằng collection_version)
+        """
+        with self._build_lock:
+            started = time.perf_counter()
+            version = version or collection_version(client, self.collection, content=self.content_fingerprint)
+            target = self.path / version
+            tmp = self.path / f".{version}.{os.getpid()}.tmp"
+            shutil.rmtree(tmp, ignore_errors=True)
+            tmp.mkdir(parents=True)
+
+            # Ma trận được cấp sẵn theo points_count (memmap trong tmp) và điền theo từng trang scroll;
+            # số điểm thực tế khác points_count (collection đổi trong lúc scroll) thì ghi lại file cho khớp
+            vectors_path = tmp / "vectors.npy"
+            capacity = client.get_collection(self.collection).points_count or 0
+            matrix: Optional[np.ndarray] = None
+            rows = 0
+            keys: List[str] = []
+            offsets = [0]
+            with open(tmp / "payloads.bin", "wb") as payload_file:
+                offset = None
+                while True:
+                    records, offset = client.scroll(self.collection, limit=SCROLL_BATCH, offset=offset,
+                                                    with_payload=True, with_vectors=True)
+                    if records:
+                        page = np.asarray([self._vector(record) for record in records], dtype=np.float32)
+                        if matrix is None:
+                            matrix = np.lib.format.open_memmap(vectors_path, mode="w+", dtype=np.float32,
+                                                               shape=(max(capacity, len(page)), page.shape[1]))
+                        elif rows + len(page) > len(matrix):
+                            matrix = _resize_vectors(vectors_path, matrix, max(2 * len(matrix), rows + len(page)),
+                                                     rows)
+                        _normalize(page, out=matrix[rows:rows + len(page)])
+                        rows += len(page)
+                    for record in records:
+                        keys.append(chunk_key(record.payload or {}))
+                        blob = compress(json.dumps({"id": record.id, "payload": record.payload},
+                                                   ensure_ascii=False).encode("utf-8"))
+                        payload_file.write(blob)
+                        offsets.append(offsets[-1] + len(blob))
+                    if offset is None:
+                        break
+
+            if matrix is None:
+                matrix = np.zeros((0, 0), np.float32)
+                np.save(vectors_path, matrix)
+            else:
+                if rows < len(matrix):
+                    matrix = _resize_vectors(vectors_path, matrix, rows, rows)
+                matrix.flush()
+            np.save(tmp / "offsets.npy", np.asarray(offsets, dtype=np.int64))
+            (tmp / "keys.json").write_text(json.dumps(keys, ensure_ascii=False), encoding="utf-8")
+            if faiss is not None and len(matrix):
+                index = faiss.IndexHNSWSQ(matrix.shape[1], faiss.ScalarQuantizer.QT_8bit, self.hnsw_m,
+                                          faiss.METRIC_INNER_PRODUCT)
+                index.hnsw.efConstruction = self.ef_construction
+                index.train(matrix)
+                index.add(matrix)
+                faiss.write_index(index, str(tmp / "index.faiss"))
+            (tmp / "meta.json").write_text(json.dumps({
+                "collection": self.collection, "version": version, "count": len(matrix),
+                "dim": int(matrix.shape[1]) if len(matrix) else 0, "built_at": time.time(),
+            }), encoding="utf-8")
+
+            shutil.rmtree(target, ignore_errors=True)
+            os.replace(tmp, target)
+            current_tmp = self.path / f".CURRENT.{os.getpid()}.tmp"
+            current_tmp.write_text(version, encoding="utf-8")
+            os.replace(current_tmp, self.path / "CURRENT")
+            # Search đang chạy vẫn giữ snapshot cũ; memmap/mmap của nó tự đóng khi không còn dùng
+            self._snapshot = _MirrorSnapshot(target, self.ef_search)
+            self._cleanup(keep=version)
+            with self._stats_lock:
+                self.stats["rebuilds"] += 1
+            logger.info(f"Mirror '{self.collection}': build {len(matrix)} điểm trong {time.perf_counter() - started:.1f}s")
+
+    def _cleanup(self, keep: str):
+        """Xóa các phiên bản cũ (process đang mở file cũ vẫn đọc được cho tới khi đóng)."""
+        for child in self.path.iterdir():
+            if child.is_dir() and child.name != keep and not child.name.startswith("."):
+                shutil.rmtree(child, ignore_errors=True)
+
+    def sync(self, client, force: bool = False) -> bool:
+        """
+        So version của collection với mirror, build lại nếu khác.
+
+        Args:
+            client: QdrantClient
+            force: Build lại kể cả khi version không đổi
+
+        Returns:
+            bool: True nếu đã build lại
+        """
+        with self._stats_lock:
+            self.stats["syncs"] += 1
+        version = collection_version(client, self.collection, content=self.content_fingerprint)
+        if not force:
+            # Process khác có thể đã build phiên bản này
+            if version != self.version:
+                self.load()
+            if version == self.version:
+                return False
+        self.build(client, version)
+        return True
+
+    def start_sync(self, client, interval: float = 600.0):
+        """
+        Chạy sync định kỳ trong daemon thread (lần đầu chạy ngay).
+
+        Args:
+            client: QdrantClient
+            interval: Số giây giữa hai lần kiểm tra version
+        """
+        if self._sync_thread is not None:
+            return
+
+        def loop():
+            while True:
+                try:
+                    self.sync(client)
+                except Exception as e:
+                    logger.warning(f"Lỗi khi sync mirror '{self.collection}': {e}")
+                time.sleep(interval)
+
+        self._sync_thread = threading.Thread(target=loop, name=f"mirror-sync-{self.collection}", daemon=True)
+        self._sync_thread.start()
+
+    # ------------------------------------------------------------------
+    # Search
+    # ------------------------------------------------------------------
+
+    def search(self, query_vector, limit: int = 5) -> Optional[List[ScoredPoint]]:
+        """
+        Search trên mirror.
+
+        Args:
+            query_vector: Embedding của câu hỏi
+            limit: Số kết quả
+
+        Returns:
+            List[ScoredPoint] giống QdrantClient.search, hoặc None nếu mirror chưa sẵn sàng / lỗi
+            (caller fallback sang Qdrant remote)
+        """
+        snapshot = self._snapshot
+        if snapshot is None:
+            with self._stats_lock:
+                self.stats["misses"] += 1
+            return None
+        started = time.perf_counter()
+        try:
+            query = _normalize(np.asarray(query_vector, dtype=np.float32))
+            hits = snapshot.search(query, limit, limit * self.rerank_factor)
+        except Exception as e:
+            logger.warning(f"Lỗi khi search mirror '{self.collection}', dùng Qdrant remote: {e}")
+            with self._stats_lock:
+                self.stats["errors"] += 1
+            return None
+        with self._stats_lock:
+            self.stats["searches"] += 1
+            self.stats["search_ms"] += (time.perf_counter() - started) * 1000
+        return hits
+
+    def vectors(self, keys) -> Dict[str, np.ndarray]:
+        """
+        Vector đã lưu (đã chuẩn hóa) của các chunk, để tính cosine mà không phải embed lại text.
+
+        Args:
+            keys: chunk_key của các chunk
+
+        Returns:
+            dict: chunk_key -> vector; chunk không có trong mirror (hoặc mirror chưa sẵn sàng) thì không có mặt
+        """
+        snapshot = self._snapshot
+        if snapshot is None or not snapshot.size:
+            return {}
+        try:
+            rows = snapshot.rows()
+        except Exception as e:
+            logger.warning(f"Không đọc được chunk_key của mirror '{self.collection}': {e}")
+            return {}
+        return {key: np.asarray(snapshot.vectors[rows[key]]) for key in keys if key in rows}
+
+    def get_stats(self) -> dict:
+        """
+        Thống kê của mirror.
+
+        Returns:
+            dict: searches, misses, errors, avg_search_ms, syncs, rebuilds, points, version
+        """
+        with self._stats_lock:
+            stats = dict(self.stats)
+        search_ms = stats.pop("search_ms")
+        stats["avg_search_ms"] = search_ms / stats["searches"] if stats["searches"] else 0.0
+        snapshot = self._snapshot
+        stats["points"] = snapshot.size if snapshot is not None else 0
+        stats["version"] = snapshot.version[:12] if snapshot is not None else None
+        return stats
+
+    # ------------------------------------------------------------------
+    # Export / restore
+    # ------------------------------------------------------------------
+
+    def export(self, archive: Path):
+        """Đóng gói phiên bản hiện tại thành file .tar.gz (để triển khai mà không cần scroll)."""
+        snapshot = self._snapshot
+        if snapshot is None:
+            raise ValueError(f"Mirror '{self.collection}' chưa được build")
+        with tarfile.open(archive, "w:gz") as tar:
+            tar.add(snapshot.path, arcname=snapshot.version)
+
+    def restore(self, archive: Path):
+        """Giải nén file từ export() thành phiên bản hiện tại của mirror."""
+        self.path.mkdir(parents=True, exist_ok=True)
+        with tarfile.open(archive, "r:gz") as tar:
+            version = tar.getmembers()[0].name.split("/")[0]
+            tar.extractall(self.path, filter="data")
+        current_tmp = self.path / f".CURRENT.{os.getpid()}.tmp"
+        current_tmp.write_text(version, encoding="utf-8")
+        os.replace(current_tmp, self.path / "CURRENT")
+        self.load()
+
+
+_registry_lock = threading.Lock()
+_registry: Dict[str, VectorMirror] = {}
+
+
+def get_vector_mirror(collection: str, client=None, sync_interval: Optional[float] = None) -> VectorMirror:
+    """
+    VectorMirror dùng chung trong process cho một collection; khởi động thread sync nếu có client.
+    MEDAGENT_MIRROR_CONTENT_FINGERPRINT=0 bỏ hash nội dung khỏi version (collection rất lớn, chỉ thay
+    bằng cách embed lại toàn bộ).
+
+    Args:
+        collection: Tên collection Qdrant
+        client: QdrantClient để sync (None: chỉ dùng phiên bản đã có trên đĩa)
+        sync_interval: Số giây giữa hai lần sync (None: MEDAGENT_MIRROR_SYNC_INTERVAL, mặc định 600;
+            0: không sync nền)
+
+    Returns:
+        VectorMirror
+    """
+    with _registry_lock:
+        if collection not in _registry:
+            # Mirror của Qdrant mock để riêng, không lẫn với mirror của collection thật cùng tên
+            directory = MIRROR_DIR / "mock" if is_mock_mode() else MIRROR_DIR
+            content_fingerprint = os.getenv("MEDAGENT_MIRROR_CONTENT_FINGERPRINT", "1") != "0"
+            _registry[collection] = VectorMirror(collection, directory=directory,
+                                                 content_fingerprint=content_fingerprint)
+        mirror = _registry[collection]
+    if sync_interval is None:
+        sync_interval = float(os.getenv("MEDAGENT_MIRROR_SYNC_INTERVAL", "600"))
+    if client is not None and sync_interval > 0:
+        mirror.start_sync(client, sync_interval)
+    return mirror
+
+
+def get_vector_mirror_stats() -> dict:
+    """
+    Thống kê của mọi mirror trong process, theo collection.
+
+    Returns:
+        dict: {collection: stats}
+    """
+    with _registry_lock:
+        mirrors = list(_registry.values())
+    return {mirror.collection: mirror.get_stats() for mirror in mirrors}
+
+
+def main():
+    from .embedding import get_embedding_profile
+    from .rag import get_rag_client
+
+    parser = argparse.ArgumentParser(description="Build / sync mirror cục bộ của collection Qdrant")
+    parser.add_argument("--collection", default=None, help="Tên collection (mặc định: theo embedding profile)")
+    parser.add_argument("--force", action="store_true", help="Build lại kể cả khi version không đổi")
+    parser.add_argument("--export", type=Path, default=None, help="Đóng gói mirror hiện tại thành .tar.gz")
+    parser.add_argument("--restore", type=Path, default=None, help="Nạp mirror từ file .tar.gz")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    mirror = VectorMirror(args.collection or get_embedding_profile().collection)
+    if args.restore:
+        mirror.restore(args.restore)
+    else:
+        mirror.sync(get_rag_client(), force=args.force)
+    if args.export:
+        mirror.export(args.export)
+    print(mirror.get_stats())
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,6 @@
 from langchain_core.prompts import ChatPromptTemplate
-from .core import get_llm, EvalAnswer
+from .core import get_llm, AnswerWithAssessment, EvalAnswer, CascadeChain
+from .core.cascade import validate_eval_answer
 from .prompt_templates import EVAL_ANSWER_SYSTEM_PROMPT, EVAL_ANSWER_HUMAN_PROMPT
 
 import logging
@@ -11,20 +12,30 @@ class EvalAnswerHandler:
     """
     Đánh giá chất lượng câu trả lời từ RAG + Answer.
     Dựa trên kiến trúc: RAG + Answer -> Eval Answer -> (loop back nếu try < M) hoặc (Web search nếu try >= M hoặc not satisfactory)
+    
+    Với câu trả lời đã kèm tự đánh giá (AnswerWithAssessment), assess() ra quyết định từ
+    coverage/confidence mà không cần gọi LLM lần nữa; evaluate() là đường cũ (một lần gọi LLM).
     """
     
-    def __init__(self, max_tries: int = 3):
+    def __init__(self, max_tries: int = 3, min_coverage: float = 0.7, min_confidence: float = 0.7,
+                 retry_min_coverage: float = 0.2):
         """
         Khởi tạo EvalAnswerHandler.
         
         Args:
             max_tries: Số lần thử tối đa (M) trước khi chuyển sang web search
+            min_coverage: Coverage tối thiểu để câu trả lời tự đánh giá được coi là đạt
+            min_confidence: Confidence tối thiểu để câu trả lời tự đánh giá được coi là đạt
+            retry_min_coverage: Dưới ngưỡng này context gần như không có thông tin cần thiết,
+                retry RAG không giúp được nên chuyển thẳng sang web search
         """
         self.llm = get_llm()
-        self.structured_llm = self.llm.with_structured_output(EvalAnswer)
         self.prompt = self._create_prompt()
-        self.eval_chain = self.prompt | self.structured_llm
+        self.eval_chain = CascadeChain("eval_answer", self.prompt, EvalAnswer, validator=validate_eval_answer)
         self.max_tries = max_tries
+        self.min_coverage = min_coverage
+        self.min_confidence = min_confidence
+        self.retry_min_coverage = retry_min_coverage
     
     def _create_prompt(self):
         """Tạo prompt template cho việc đánh giá câu trả lời."""
@@ -46,34 +57,84 @@ class EvalAnswerHandler:
             EvalAnswer: Đối tượng chứa kết quả đánh giá và quyết định
         """
         try:
-            result = self.eval_chain.invoke({
-                "query": query,
-                "answer": answer,
-                "try_count": try_count,
-                "max_tries": self.max_tries
-            })
-            
-            # Logic bổ sung: nếu đã thử quá M lần, không nên retry nữa
-            if try_count >= self.max_tries:
-                result.should_retry = False
-                logger.info(f"Max tries ({self.max_tries}) reached, should not retry")
+            result = self.eval_chain.invoke(self._inputs(query, answer, try_count))
+            return self._finalize(result, try_count)
+        except Exception as e:
+            logger.error(f"Error in evaluating answer: {e}")
+            return self._fallback(try_count)
+    
+    async def aevaluate(self, query: str, answer: str, try_count: int) -> EvalAnswer:
+        """
+        Bản async của evaluate().
+        
+        Args:
+            query: Câu hỏi gốc của người dùng
+            answer: Câu trả lời từ RAG + Answer
+            try_count: Số lần đã thử (bắt đầu từ 1)
             
-            logger.info(
-                f"Answer evaluation - Satisfactory: {result.is_satisfactory}, "
-                f"Score: {result.score:.2f}, Should retry: {result.should_retry}, "
-                f"Try: {try_count}/{self.max_tries}"
-            )
-            return result
+        Returns:
+            EvalAnswer: Đối tượng chứa kết quả đánh giá và quyết định
+        """
+        try:
+            result = await self.eval_chain.ainvoke(self._inputs(query, answer, try_count))
+            return self._finalize(result, try_count)
         except Exception as e:
             logger.error(f"Error in evaluating answer: {e}")
-            # Fallback: nếu đã thử quá nhiều lần, không retry
-            should_retry = try_count < self.max_tries
-            return EvalAnswer(
-                is_satisfactory=False,
-                score=0.0,
-                reasoning=f"Fallback due to evaluation error. Try count: {try_count}",
-                should_retry=should_retry
-            )
+            return self._fallback(try_count)
+    
+    def assess(self, answer: AnswerWithAssessment, try_count: int) -> EvalAnswer:
+        """
+        Đánh giá câu trả lời từ phần tự đánh giá đi kèm (không gọi LLM).
+        
+        Args:
+            answer: Câu trả lời kèm coverage/confidence từ RAG + Answer
+            try_count: Số lần đã thử (bắt đầu từ 1)
+            
+        Returns:
+            EvalAnswer: Đối tượng chứa kết quả đánh giá và quyết định
+        """
+        is_satisfactory = answer.coverage >= self.min_coverage and answer.confidence >= self.min_confidence
+        reasoning = f"Self-assessment: coverage={answer.coverage:.2f}, confidence={answer.confidence:.2f}"
+        if answer.missing:
+            reasoning += f", missing: {answer.missing}"
+        result = EvalAnswer(
+            is_satisfactory=is_satisfactory,
+            score=min(answer.coverage, answer.confidence),
+            reasoning=reasoning,
+            should_retry=not is_satisfactory and answer.coverage >= self.retry_min_coverage,
+        )
+        return self._finalize(result, try_count)
+    
+    def _inputs(self, query: str, answer: str, try_count: int) -> dict:
+        return {
+            "query": query,
+            "answer": answer,
+            "try_count": try_count,
+            "max_tries": self.max_tries
+        }
+    
+    def _finalize(self, result: EvalAnswer, try_count: int) -> EvalAnswer:
+        # Logic bổ sung: nếu đã thử quá M lần, không nên retry nữa
+        if try_count >= self.max_tries:
+            result.should_retry = False
+            logger.info(f"Max tries ({self.max_tries}) reached, should not retry")
+        
+        logger.info(
+            f"Answer evaluation - Satisfactory: {result.is_satisfactory}, "
+            f"Score: {result.score:.2f}, Should retry: {result.should_retry}, "
+            f"Try: {try_count}/{self.max_tries}"
+        )
+        return result
+    
+    def _fallback(self, try_count: int) -> EvalAnswer:
+        # Fallback: nếu đã thử quá nhiều lần, không retry
+        should_retry = try_count < self.max_tries
+        return EvalAnswer(
+            is_satisfactory=False,
+            score=0.0,
+            reasoning=f"Fallback due to evaluation error. Try count: {try_count}",
+            should_retry=should_retry
+        )
     
     def should_retry(self, query: str, answer: str, try_count: int) -> bool:
         """
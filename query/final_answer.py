@@ -2,9 +2,11 @@
 Final Answer Handler - Tạo câu trả lời cuối cùng trực tiếp từ các AnswerQuery.
 Đã gộp Summary + Final Answer thành một bước duy nhất.
 """
-from typing import List
+from typing import Callable, List, Optional, Tuple
+from langchain_core.output_parsers import StrOutputParser
 from langchain_core.prompts import ChatPromptTemplate
-from .core import get_llm, FinalAnswer, SummaryAnswer, AnswerQuery
+from .core import get_llm, FinalAnswer, SummaryAnswer, AnswerQuery, CascadeChain
+from .core.cascade import validate_final_answer
 from .prompt_templates import FINAL_ANSWER_SYSTEM_PROMPT, FINAL_ANSWER_HUMAN_PROMPT
 
 import logging
@@ -51,7 +53,9 @@ class FinalAnswerHandler:
             ("system", DIRECT_FINAL_SYSTEM_PROMPT),
             ("human", DIRECT_FINAL_HUMAN_PROMPT),
         ])
-        self.direct_chain = self.direct_prompt | self.structured_llm
+        self.direct_chain = CascadeChain("final_direct", self.direct_prompt, FinalAnswer, validator=validate_final_answer)
+        # Cùng prompt nhưng trả về text thuần để stream từng token
+        self.stream_chain = self.direct_prompt | self.llm | StrOutputParser()
         
         # Prompt cho cách cũ (từ summary) - legacy
         self.legacy_prompt = ChatPromptTemplate.from_messages([
@@ -73,16 +77,7 @@ class FinalAnswerHandler:
             FinalAnswer: Câu trả lời cuối cùng
         """
         try:
-            # Format các answers thành text
-            answers_text = []
-            all_sources = []
-            
-            for i, answer in enumerate(answers, 1):
-                source = answer.source if hasattr(answer, 'source') else f"Nguồn {i}"
-                answers_text.append(f"[Nguồn {i}: {source}]\n{answer.answer}")
-                all_sources.append(source)
-            
-            answers_formatted = "\n\n---\n\n".join(answers_text)
+            answers_formatted, all_sources = self._format_answers(answers)
             
             result = self.direct_chain.invoke({
                 "query": query,
@@ -98,18 +93,101 @@ class FinalAnswerHandler:
             
         except Exception as e:
             logger.error(f"Error generating final answer: {e}")
-            # Fallback: lấy answer đầu tiên
-            if answers:
-                return FinalAnswer(
-                    answer=answers[0].answer,
-                    sources=[answers[0].source] if hasattr(answers[0], 'source') else [],
-                    confidence=0.6
-                )
+            return self._fallback_from_answers(answers)
+    
+    async def agenerate_from_answers(self, query: str, answers: List[AnswerQuery],
+                                     on_token: Optional[Callable[[str], None]] = None) -> FinalAnswer:
+        """
+        Bản async của generate_from_answers().
+        
+        Args:
+            query: Câu hỏi gốc của người dùng
+            answers: Danh sách các câu trả lời từ RAG/Web search
+            on_token: Nếu có, câu trả lời được stream từng token qua callback này
+                (sources và confidence được điền khi stream xong)
+            
+        Returns:
+            FinalAnswer: Câu trả lời cuối cùng
+        """
+        if on_token is not None:
+            return await self._astream_from_answers(query, answers, on_token)
+        try:
+            answers_formatted, all_sources = self._format_answers(answers)
+            
+            result = await self.direct_chain.ainvoke({
+                "query": query,
+                "answers": answers_formatted
+            })
+            
+            if not result.sources:
+                result.sources = all_sources
+            
+            logger.info(f"Generated final answer from {len(answers)} sources")
+            return result
+            
+        except Exception as e:
+            logger.error(f"Error generating final answer: {e}")
+            return self._fallback_from_answers(answers)
+    
+    async def _astream_from_answers(self, query: str, answers: List[AnswerQuery],
+                                    on_token: Callable[[str], None]) -> FinalAnswer:
+        answers_formatted, all_sources = self._format_answers(answers)
+        chunks = []
+        try:
+            async for chunk in self.stream_chain.astream({
+                "query": query,
+                "answers": answers_formatted
+            }):
+                chunks.append(chunk)
+                on_token(chunk)
+        except Exception as e:
+            logger.error(f"Error streaming final answer: {e}")
+            if not chunks:
+                return self._fallback_from_answers(answers)
+        
+        logger.info(f"Streamed final answer from {len(answers)} sources")
+        return FinalAnswer(
+            answer="".join(chunks),
+            sources=list(dict.fromkeys(all_sources)),
+            confidence=self._estimate_confidence(answers)
+        )
+    
+    def _estimate_confidence(self, answers: List[AnswerQuery]) -> float:
+        """
+        Ước lượng confidence khi stream (text thuần không có trường confidence từ LLM):
+        tỷ lệ câu trả lời con có nguồn thật, quy về khoảng [0.5, 0.9].
+        """
+        if not answers:
+            return 0.0
+        no_source = {"Không có nguồn.", "Lỗi hệ thống"}
+        sourced = sum(1 for answer in answers if getattr(answer, "source", None) and answer.source not in no_source)
+        return round(0.5 + 0.4 * sourced / len(answers), 2)
+    
+    def _format_answers(self, answers: List[AnswerQuery]) -> Tuple[str, List[str]]:
+        """Format các answers thành text cho prompt, kèm danh sách nguồn."""
+        answers_text = []
+        all_sources = []
+        
+        for i, answer in enumerate(answers, 1):
+            source = answer.source if hasattr(answer, 'source') else f"Nguồn {i}"
+            answers_text.append(f"[Nguồn {i}: {source}]\n{answer.answer}")
+            all_sources.append(source)
+        
+        return "\n\n---\n\n".join(answers_text), all_sources
+    
+    def _fallback_from_answers(self, answers: List[AnswerQuery]) -> FinalAnswer:
+        # Fallback: lấy answer đầu tiên
+        if answers:
             return FinalAnswer(
-                answer="Xin lỗi, không thể tạo câu trả lời.",
-                sources=[],
-                confidence=0.0
+                answer=answers[0].answer,
+                sources=[answers[0].source] if hasattr(answers[0], 'source') else [],
+                confidence=0.6
             )
+        return FinalAnswer(
+            answer="Xin lỗi, không thể tạo câu trả lời.",
+            sources=[],
+            confidence=0.0
+        )
     
     def generate(self, query: str, summary: SummaryAnswer) -> FinalAnswer:
         """
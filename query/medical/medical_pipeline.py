@@ -1,21 +1,29 @@
 from langchain_core.prompts import ChatPromptTemplate
 
-from ..core import get_llm, get_embedding_model, AnswerQuery, RephraseQuery
+from ..core import get_llm, get_embedding_model, AnswerQuery, AnswerWithAssessment, RephraseQuery, CascadeChain, \
+    ContextAssembler, ContextChunk
+from ..core.cascade import validate_answer, validate_assessed_answer, validate_rephrase
 from .medical_rag import MedicalRAG
 from .medical_search import MedicalSearch
-from ..prompt_templates import MEDICAL_REPHRASE_PROMPT, MEDICAL_ANSWER_PROMPT, MEDICAL_SYSTEM_PROMPT, MEDICAL_HISTORY_PROMPT
+from ..prompt_templates import MEDICAL_REPHRASE_PROMPT, MEDICAL_ANSWER_PROMPT, MEDICAL_ASSESSED_ANSWER_PROMPT, \
+    MEDICAL_SYSTEM_PROMPT, MEDICAL_HISTORY_PROMPT
 
+import logging
+
+logger = logging.getLogger(__name__)
 
 
 class MedicalPipeline:
     def __init__(self):
         self.llm = get_llm()
         self.similarity_threshold = 0.55
-        self.embedder = get_embedding_model()  # Sử dụng model mặc định của Google
+        self.embedder = get_embedding_model()  # Model của embedding profile (mặc định: Google)
         self.medical_rag = MedicalRAG(embedder=self.embedder)
         self.medical_search = MedicalSearch(max_results=3)
         self._init_prompt()
         self._init_chains()
+        self.answer_context = ContextAssembler("medical_answer", prompt=self.answer_prompt)
+        self.assessed_answer_context = ContextAssembler("medical_assessed_answer", prompt=self.assessed_answer_prompt)
     
     def _init_prompt(self):
         self.rephrase_prompt = ChatPromptTemplate.from_messages([
@@ -26,38 +34,97 @@ class MedicalPipeline:
                 ("system", MEDICAL_SYSTEM_PROMPT),
                 ("human", MEDICAL_ANSWER_PROMPT),
             ])
+        self.assessed_answer_prompt = ChatPromptTemplate.from_messages([
+                ("system", MEDICAL_SYSTEM_PROMPT),
+                ("human", MEDICAL_ASSESSED_ANSWER_PROMPT),
+            ])
     
     def _init_chains(self):
-        self.structured_llm_answer = self.llm.with_structured_output(AnswerQuery)
-        self.structured_llm_rephrase = self.llm.with_structured_output(RephraseQuery)
-        self.rephrase_chain = self.rephrase_prompt | self.structured_llm_rephrase
-        self.answer_chain = self.answer_prompt | self.structured_llm_answer
+        self.rephrase_chain = CascadeChain("medical_rephrase", self.rephrase_prompt, RephraseQuery, validator=validate_rephrase)
+        self.answer_chain = CascadeChain("medical_answer", self.answer_prompt, AnswerQuery, validator=validate_answer)
+        # Câu trả lời kèm tự đánh giá (coverage, confidence) - thay cho lần gọi EvalAnswer riêng
+        self.assessed_answer_chain = CascadeChain("medical_assessed_answer", self.assessed_answer_prompt,
+                                                  AnswerWithAssessment, validator=validate_assessed_answer)
+
+    def build_context(self, query: str, results: list, assessed: bool = False) -> str:
+        """
+        Ghép các đoạn có score vượt ngưỡng thành context trong ngân sách token của prompt trả lời.
+
+        Args:
+            query: Câu hỏi (tính vào token của prompt)
+            results: Kết quả Qdrant (ScoredPoint)
+            assessed: Context dùng cho prompt trả lời kèm tự đánh giá
 
-    def process_medical_answer(self, query: str, context: str = "") -> AnswerQuery:
-        results = self.answer_chain.invoke({"query": query, "context": context})
+        Returns:
+            str: Context (rỗng nếu không có đoạn nào vượt ngưỡng)
+        """
+        chunks = [
+            ContextChunk(
+                text=res.payload.get("text", ""),
+                score=res.score,
+                source=str((res.payload.get("metadata") or {}).get("file_name", "")),
+            )
+            for res in results
+            if res.score >= self.similarity_threshold
+        ]
+        if not chunks:
+            return ""
+        assembler = self.assessed_answer_context if assessed else self.answer_context
+        return assembler.assemble(chunks, query=query)
+
+    def process_medical_answer(self, query: str, context: str = "", refresh: bool = False) -> AnswerQuery:
+        # refresh: lần thử lại với cùng context phải gọi model lấy mẫu mới, không trả lại câu trả lời đã cache
+        results = self.answer_chain.invoke({"query": query, "context": context}, refresh=refresh)
         return results
 
+    def process_medical_assessed_answer(self, query: str, context: str = "", refresh: bool = False) -> AnswerWithAssessment:
+        return self.assessed_answer_chain.invoke({"query": query, "context": context}, refresh=refresh)
+
     def process_medical_rephrase(self, query: str) -> str:
         results = self.rephrase_chain.invoke({"query": query})
         return results.rephrased_question
 
+    async def aprocess_medical_answer(self, query: str, context: str = "", refresh: bool = False) -> AnswerQuery:
+        return await self.answer_chain.ainvoke({"query": query, "context": context}, refresh=refresh)
+
+    async def aprocess_medical_assessed_answer(self, query: str, context: str = "",
+                                               refresh: bool = False) -> AnswerWithAssessment:
+        return await self.assessed_answer_chain.ainvoke({"query": query, "context": context}, refresh=refresh)
+
+    async def aprocess_medical_rephrase(self, query: str) -> str:
+        results = await self.rephrase_chain.ainvoke({"query": query})
+        return results.rephrased_question
+
     def query(self, user_query, max_attempts: int = 3) -> AnswerQuery:
         query = user_query
         for attempt in range(max_attempts):
             # 1. Query RAG to extract relevant documents
             results = self.medical_rag.query(query)
-            thresholded_results = [res.payload["text"] for res in results if res.score >= self.similarity_threshold]
+            context = self.build_context(query, results)
             # 2. If threshold is met → run RAG
-            if thresholded_results:
-                context = "\n\n".join(thresholded_results)
+            if context:
                 result = self.process_medical_answer(query, context=context)
                 return result
 
             # 3. If not met → rephrase question
             rephrased = self.process_medical_rephrase(query)
-            print(f"DEBUG: Rephrased: {rephrased}")
+            logger.debug(f"Rephrased: {rephrased}")
             query = rephrased
 
         result = self.medical_search.answer(user_query)
         # 4. If still not met after 3 attempts
-        return result
\ No newline at end of file
+        return result
+
+    async def aquery(self, user_query, max_attempts: int = 3) -> AnswerQuery:
+        query = user_query
+        for attempt in range(max_attempts):
+            results = await self.medical_rag.aquery(query)
+            context = self.build_context(query, results)
+            if context:
+                return await self.aprocess_medical_answer(query, context=context)
+
+            rephrased = await self.aprocess_medical_rephrase(query)
+            logger.debug(f"Rephrased: {rephrased}")
+            query = rephrased
+
+        return await self.medical_search.aanswer(user_query)
@@ -1,23 +1,41 @@
+import asyncio
+from typing import List
+
 import numpy as np
 from qdrant_client import models
 from qdrant_client.http.models import ScoredPoint
 from qdrant_client.http.exceptions import UnexpectedResponse
-from ..core import get_rag_client
+from ..core import get_rag_client, get_async_rag_client, get_embedding_profile, get_vector_mirror, get_sparse_index, \
+    SingleFlight, AsyncSingleFlight, ensure_payload_indexes
+from ..core.sparse_index import chunk_key, reciprocal_rank_fusion, tokenize
 import logging
 
 logger = logging.getLogger(__name__)
 
 class MedicalRAG:
-    def __init__(self, embedder):
+    def __init__(self, embedder, collection_name: str = None, use_mirror: bool = True, use_sparse: bool = True,
+                 rrf_k: int = 60):
         self.rag_client = get_rag_client()
-        self.collection_name = "embedding_data"
+        # Collection phải được embed bằng cùng model với embedder (xem EMBEDDING_PROFILES)
+        self.collection_name = collection_name or get_embedding_profile().collection
         # self.model_name = cfg.RAG_EMBEDDING_MODEL_NAME
         self.model = embedder
         self.limit = 5
+        self._async_client = None
+        # Nhiều sub-query / request giống nhau cùng lúc chỉ embedding + search một lần
+        self._flight = SingleFlight("medical_rag")
+        self._async_flight = AsyncSingleFlight("medical_rag")
         self._check_collection_exists()
+        # Mirror HNSW cục bộ của collection (sync nền theo version); chưa sẵn sàng thì search remote
+        self.mirror = get_vector_mirror(self.collection_name, client=self.rag_client) if use_mirror else None
+        # BM25 (tên thuốc, hàm lượng chính xác) gộp với dense bằng RRF; không có chỉ mục thì chỉ dùng dense
+        self.sparse_index = get_sparse_index(self.collection_name) if use_sparse else None
+        self.rrf_k = rrf_k
+        # Khi hybrid, mỗi bên lấy gấp đôi số ứng viên trước khi gộp
+        self.candidates = self.limit * 2 if self.sparse_index is not None else self.limit
         
     def _check_collection_exists(self):
-        """Kiểm tra xem collection có tồn tại không."""
+        """Kiểm tra xem collection có tồn tại không (và có đủ payload index cho fetch_drugs())."""
         try:
             collections = self.rag_client.get_collections()
             collection_names = [col.name for col in collections.collections]
@@ -27,8 +45,15 @@ class MedicalRAG:
                     f"Các collection có sẵn: {collection_names}. "
                     "Hệ thống sẽ fallback sang web search khi RAG không khả dụng."
                 )
+                return
         except Exception as e:
             logger.warning(f"Không thể kiểm tra collections: {e}. Hệ thống sẽ fallback sang web search.")
+            return
+        # Collection embed trước khi có index file_name: tạo bổ sung (idempotent)
+        try:
+            ensure_payload_indexes(self.rag_client, self.collection_name)
+        except Exception as e:
+            logger.warning(f"Không thể tạo payload index cho '{self.collection_name}': {e}")
         
     def query(self, query: str):
         """
@@ -37,15 +62,264 @@ class MedicalRAG:
         Returns:
             List[ScoredPoint]: Danh sách kết quả tìm kiếm, hoặc empty list nếu có lỗi
         """
+        return list(self._flight.do(query, self._query, query))
+    
+    def _query(self, query: str):
         try:
             embeddings = self.model.encode([query], convert_to_numpy=True).tolist()[0]
-            hits = self.rag_client.search(
-                collection_name=self.collection_name,
-                query_vector=embeddings,
-                limit=self.limit
-            )
+            hits = self._search_mirror(embeddings)
+            if hits is None:
+                hits = self.rag_client.search(
+                    collection_name=self.collection_name,
+                    query_vector=embeddings,
+                    limit=self.candidates
+                )
+            hits, unscored = self._fuse(query, hits)
+            self._score_sparse([(0, hit) for hit in unscored], [embeddings])
             return hits
-        except UnexpectedResponse as e:
+        except Exception as e:
+            return self._handle_error(e)
+    
+    async def aquery(self, query: str):
+        """
+        Bản async của query(): embedding + AsyncQdrantClient.
+        
+        Returns:
+            List[ScoredPoint]: Danh sách kết quả tìm kiếm, hoặc empty list nếu có lỗi
+        """
+        return list(await self._async_flight.do(query, self._aquery, query))
+    
+    async def _aquery(self, query: str):
+        try:
+            if hasattr(self.model, "aencode"):
+                embeddings = await self.model.aencode([query], convert_to_numpy=True)
+            else:
+                embeddings = await asyncio.to_thread(self.model.encode, [query], convert_to_numpy=True)
+            hits = self._search_mirror(embeddings.tolist()[0])
+            if hits is None:
+                if self._async_client is None:
+                    self._async_client = get_async_rag_client()
+                hits = await self._async_client.search(
+                    collection_name=self.collection_name,
+                    query_vector=embeddings.tolist()[0],
+                    limit=self.candidates
+                )
+            hits, unscored = self._fuse(query, hits)
+            self._score_sparse([(0, hit) for hit in unscored], [embeddings[0]])
+            return hits
+        except Exception as e:
+            return self._handle_error(e)
+    
+    def query_batch(self, queries: List[str], dedupe: bool = True) -> List[list]:
+        """
+        Query RAG cho nhiều câu hỏi con cùng lúc: một lần embedding cho cả K câu và một request
+        search_batch tới Qdrant (câu nào mirror trả lời được thì không cần gửi).
+        
+        Args:
+            queries: Các câu truy vấn
+            dedupe: Mỗi chunk chỉ giữ ở câu hỏi con có score cao nhất (để không lặp context giữa các câu trả lời)
+            
+        Returns:
+            List[List[ScoredPoint]]: Kết quả theo thứ tự queries (list rỗng cho mọi câu nếu có lỗi)
+        """
+        if not queries:
+            return []
+        try:
+            vectors = self.model.encode(list(queries), convert_to_numpy=True).tolist()
+            dense = [self._search_mirror(vector) for vector in vectors]
+            missing = [i for i, hits in enumerate(dense) if hits is None]
+            if missing:
+                results = self.rag_client.search_batch(collection_name=self.collection_name,
+                                                       requests=self._search_requests([vectors[i] for i in missing]))
+                for i, hits in zip(missing, results):
+                    dense[i] = hits
+            fused = [self._fuse(query, hits) for query, hits in zip(queries, dense)]
+            self._score_sparse([(i, hit) for i, (_, pending) in enumerate(fused) for hit in pending], vectors)
+            results = [hits for hits, _ in fused]
+        except Exception as e:
+            self._handle_error(e)
+            return [[] for _ in queries]
+        return self._dedupe_across(results) if dedupe else results
+    
+    async def aquery_batch(self, queries: List[str], dedupe: bool = True) -> List[list]:
+        """Bản async của query_batch()."""
+        if not queries:
+            return []
+        try:
+            vectors = (await self._aencode(list(queries))).tolist()
+            dense = [self._search_mirror(vector) for vector in vectors]
+            missing = [i for i, hits in enumerate(dense) if hits is None]
+            if missing:
+                if self._async_client is None:
+                    self._async_client = get_async_rag_client()
+                results = await self._async_client.search_batch(
+                    collection_name=self.collection_name,
+                    requests=self._search_requests([vectors[i] for i in missing])
+                )
+                for i, hits in zip(missing, results):
+                    dense[i] = hits
+            fused = [self._fuse(query, hits) for query, hits in zip(queries, dense)]
+            self._score_sparse([(i, hit) for i, (_, pending) in enumerate(fused) for hit in pending], vectors)
+            results = [hits for hits, _ in fused]
+        except Exception as e:
+            self._handle_error(e)
+            return [[] for _ in queries]
+        return self._dedupe_across(results) if dedupe else results
+    
+    async def _aencode(self, texts: List[str]):
+        if hasattr(self.model, "aencode"):
+            return await self.model.aencode(texts, convert_to_numpy=True)
+        return await asyncio.to_thread(self.model.encode, texts, convert_to_numpy=True)
+    
+    def _search_requests(self, vectors: list) -> List[models.SearchRequest]:
+        return [models.SearchRequest(vector=vector, limit=self.candidates, with_payload=True) for vector in vectors]
+    
+    def _score_sparse(self, unscored: list, query_vectors: list):
+        """
+        Gán cosine cho các hit chỉ BM25 tìm thấy bằng vector đã lưu trong mirror (không embed lại text
+        trên đường query). Chunk không có trong mirror giữ score tạm theo thứ hạng RRF (xem _fuse()).
+        
+        Args:
+            unscored: [(i, hit)] - hit của câu hỏi thứ i
+            query_vectors: Embedding của từng câu hỏi
+        """
+        if not unscored or self.mirror is None:
+            return
+        stored = self.mirror.vectors([hit.id for _, hit in unscored])
+        for i, hit in unscored:
+            vector = stored.get(hit.id)
+            if vector is not None:
+                self._score([hit], query_vectors[i], [vector])
+    
+    @staticmethod
+    def _dedupe_across(results: List[list]) -> List[list]:
+        """
+        Bỏ chunk trùng giữa các câu hỏi con: chunk chỉ giữ ở câu có score cao nhất,
+        nhưng mỗi câu luôn giữ hit tốt nhất của mình để vẫn có context.
+        """
+        owner = {}
+        for i, hits in enumerate(results):
+            for hit in hits:
+                key = chunk_key(hit.payload or {})
+                if key not in owner or hit.score > owner[key][0]:
+                    owner[key] = (hit.score, i)
+        deduped = []
+        for i, hits in enumerate(results):
+            kept = [hit for rank, hit in enumerate(hits) if rank == 0 or owner[chunk_key(hit.payload or {})][1] == i]
+            deduped.append(kept)
+        return deduped
+    
+    def fetch_drugs(self, query: str, file_names) -> list:
+        """
+        Lấy thẳng mọi chunk của các thuốc đã biết tên (lọc payload metadata.file_name), không embedding/search.
+        
+        Args:
+            query: Câu hỏi, dùng để xếp các chunk (chunk chứa nhiều từ của câu hỏi hơn đứng trước)
+            file_names: file_name (slug) của các thuốc
+            
+        Returns:
+            List[ScoredPoint]: Các chunk, hoặc empty list nếu không có / có lỗi
+        """
+        try:
+            records, offset = [], None
+            while True:
+                page, offset = self.rag_client.scroll(collection_name=self.collection_name,
+                                                      scroll_filter=self._drug_filter(file_names),
+                                                      limit=64, offset=offset, with_payload=True)
+                records.extend(page)
+                if offset is None:
+                    return self._rank_drug_chunks(query, records)
+        except Exception as e:
+            return self._handle_error(e)
+    
+    async def afetch_drugs(self, query: str, file_names) -> list:
+        """Bản async của fetch_drugs()."""
+        try:
+            if self._async_client is None:
+                self._async_client = get_async_rag_client()
+            records, offset = [], None
+            while True:
+                page, offset = await self._async_client.scroll(collection_name=self.collection_name,
+                                                               scroll_filter=self._drug_filter(file_names),
+                                                               limit=64, offset=offset, with_payload=True)
+                records.extend(page)
+                if offset is None:
+                    return self._rank_drug_chunks(query, records)
+        except Exception as e:
+            return self._handle_error(e)
+    
+    @staticmethod
+    def _drug_filter(file_names) -> models.Filter:
+        return models.Filter(must=[
+            models.FieldCondition(key="metadata.file_name", match=models.MatchAny(any=list(file_names)))
+        ])
+    
+    @staticmethod
+    def _rank_drug_chunks(query: str, records: list) -> list:
+        """
+        Chuyển Record thành ScoredPoint theo thứ tự chunk của tài liệu; score (0.9-1.0, luôn trên ngưỡng
+        similarity) tăng theo tỉ lệ từ của câu hỏi có trong chunk để ContextAssembler ưu tiên đúng phần
+        (liều dùng, tác dụng phụ...) khi không đủ ngân sách cho cả tài liệu.
+        """
+        terms = set(tokenize(query))
+        records = sorted(records, key=lambda record: ((record.payload or {}).get("metadata") or {}).get("chunk_index", 0))
+        hits = []
+        for record in records:
+            payload = record.payload or {}
+            coverage = len(terms & set(tokenize(payload.get("text", "")))) / len(terms) if terms else 0.0
+            hits.append(ScoredPoint(id=record.id, version=0, score=0.9 + 0.1 * coverage, payload=payload))
+        return hits
+    
+    def _search_mirror(self, embeddings):
+        """Search trên mirror cục bộ (dưới 1ms, không chặn event loop); None nếu cần fallback remote."""
+        if self.mirror is None:
+            return None
+        return self.mirror.search(embeddings, limit=self.candidates)
+    
+    def _fuse(self, query: str, dense_hits: list):
+        """
+        Gộp dense hits với kết quả BM25 bằng reciprocal rank fusion.
+        
+        Returns:
+            (hits, unscored): limit kết quả theo thứ tự RRF, và các hit chỉ BM25 tìm thấy (chưa có cosine
+            score; tạm lấy score của dense hit thấp nhất xếp trên nó, để cùng số phận với similarity_threshold)
+        """
+        if self.sparse_index is None:
+            return dense_hits[:self.limit], []
+        sparse = self.sparse_index.search(query, limit=self.candidates)
+        if not sparse:
+            return dense_hits[:self.limit], []
+        dense_by_key = {}
+        for hit in dense_hits:
+            dense_by_key.setdefault(chunk_key(hit.payload or {}), hit)
+        sparse_by_key = {}
+        for row, _ in sparse:
+            payload = self.sparse_index.payload(row)
+            sparse_by_key.setdefault(chunk_key(payload), payload)
+        fused = reciprocal_rank_fusion([list(dense_by_key), list(sparse_by_key)], k=self.rrf_k)[:self.limit]
+        hits, unscored = [], []
+        # Hit BM25 đứng trước mọi dense hit lấy score của dense hit tốt nhất
+        floor = max((hit.score for hit in dense_by_key.values()), default=0.0)
+        for key, _ in fused:
+            hit = dense_by_key.get(key)
+            if hit is None:
+                hit = ScoredPoint(id=key, version=0, score=floor, payload=sparse_by_key[key])
+                unscored.append(hit)
+            else:
+                floor = min(floor, hit.score)
+            hits.append(hit)
+        return hits, unscored
+    
+    @staticmethod
+    def _score(hits: list, query_vector, vectors):
+        """Gán cosine similarity giữa query và text của từng hit (cùng thang với score của Qdrant)."""
+        query_vector = np.asarray(query_vector, dtype=np.float32)
+        query_vector = query_vector / (np.linalg.norm(query_vector) or 1.0)
+        for hit, vector in zip(hits, np.asarray(vectors, dtype=np.float32)):
+            hit.score = float(vector @ query_vector / (np.linalg.norm(vector) or 1.0))
+    
+    def _handle_error(self, e: Exception) -> list:
+        if isinstance(e, UnexpectedResponse):
             if "doesn't exist" in str(e) or "404" in str(e):
                 logger.warning(
                     f"Collection '{self.collection_name}' không tồn tại. "
@@ -53,7 +327,6 @@ class MedicalRAG:
                 )
             else:
                 logger.error(f"Lỗi khi query RAG: {e}")
-            return []
-        except Exception as e:
+        else:
             logger.error(f"Lỗi không mong đợi khi query RAG: {e}")
-            return []
+        return []
@@ -1,11 +1,12 @@
+import asyncio
 import requests
 import numpy as np
 from ddgs import DDGS
 from bs4 import BeautifulSoup
 from playwright.sync_api import sync_playwright, TimeoutError, Error as PlaywrightError
+from playwright.async_api import async_playwright
 from langchain_core.documents import Document
 from langchain_community.vectorstores import FAISS
-from langchain_google_genai import GoogleGenerativeAIEmbeddings
 import os
 from dotenv import load_dotenv
 
@@ -16,7 +17,8 @@ from langchain_core.prompts import ChatPromptTemplate
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from query.core.structure import RouteQuery
 
-from ..core import AnswerQuery, get_llm
+from ..core import AnswerQuery, get_llm, get_embedding_model, SingleFlight, AsyncSingleFlight, ContextAssembler, ContextChunk
+from ..core.mock import is_mock_mode, mock_web_pages, amock_web_pages
 from ..prompt_templates import MEDICAL_ANSWER_PROMPT, MEDICAL_SYSTEM_PROMPT
 
 def web_search(query: str, max_results: int = 5):
@@ -66,6 +68,35 @@ def crawl_page(url: str, timeout: int = 10000) -> str:
         print(f"[WARN] Lỗi khi crawl {url}: {e}")
         return ""
 
+async def acrawl_page(browser, url: str, timeout: int = 10000) -> str:
+    """
+    Bản async của crawl_page(), dùng chung một browser đã mở.
+    
+    Args:
+        browser: Browser của async Playwright
+        url: URL cần crawl
+        timeout: Timeout cho việc load trang (ms)
+        
+    Returns:
+        str: Text content của trang, hoặc empty string nếu có lỗi
+    """
+    page = None
+    try:
+        page = await browser.new_page()
+        await page.goto(url, timeout=timeout)
+        content = await page.content()
+        soup = BeautifulSoup(content, "html.parser")
+        return clean_text(soup)
+    except (PlaywrightError, TimeoutError) as e:
+        print(f"[WARN] Không thể truy cập {url}: {e}")
+        return ""
+    except Exception as e:
+        print(f"[WARN] Lỗi khi crawl {url}: {e}")
+        return ""
+    finally:
+        if page is not None:
+            await page.close()
+
 class WebSearchCrawler:
     def __init__(self, max_results: int = 5):
         self.max_results = max_results
@@ -82,21 +113,49 @@ class WebSearchCrawler:
         return crawled_texts
 
     def search_and_crawl(self, query: str):
+        if is_mock_mode():
+            return mock_web_pages(query, self.max_results)
         results = self.search(query)
         if not results:
             print("No search results found.")
             return {}
         crawled_texts = self.crawl(results)
         return crawled_texts
+
+    async def asearch(self, query: str):
+        # DDGS chỉ có API đồng bộ
+        return await asyncio.to_thread(web_search, query, self.max_results)
+
+    async def acrawl(self, results):
+        """Crawl song song tất cả URL trên một browser."""
+        if not results:
+            return {}
+        try:
+            async with async_playwright() as p:
+                browser = await p.chromium.launch(headless=True)
+                try:
+                    texts = await asyncio.gather(*(acrawl_page(browser, url) for url in results))
+                finally:
+                    await browser.close()
+        except Exception as e:
+            print(f"[WARN] Không thể khởi động browser: {e}")
+            return {url: "" for url in results}
+        return dict(zip(results, texts))
+
+    async def asearch_and_crawl(self, query: str):
+        if is_mock_mode():
+            return await amock_web_pages(query, self.max_results)
+        results = await self.asearch(query)
+        if not results:
+            print("No search results found.")
+            return {}
+        return await self.acrawl(results)
     
 class WebInfoRetriever:
     def __init__(self, top_k: int = 5, threshold: float = 0.1):
         self.splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=50)
-        # Sử dụng model embedding text-embedding-004 của Google
-        self.embedder = GoogleGenerativeAIEmbeddings(
-            model="models/text-embedding-004",
-            google_api_key=os.getenv("GOOGLE_API_KEY"),
-        )
+        # Model embedding của profile hiện tại (Google qua rate limiter dùng chung, hoặc local)
+        self.embedder = get_embedding_model()
         self.top_k = top_k
         self.threshold = threshold
 
@@ -104,7 +163,7 @@ class WebInfoRetriever:
         chunks = self.splitter.split_text(text)
         return chunks
     
-    def retrieve(self, contexts: dict):
+    def _to_documents(self, contexts: dict):
         relevant_chunks = []
         for url, text in contexts.items():
             chunks = self.chunk_text(text)
@@ -114,6 +173,10 @@ class WebInfoRetriever:
                     metadata={"source": url, "chunk_id": i}
                 )
                 relevant_chunks.append(doc)
+        return relevant_chunks
+
+    def retrieve(self, contexts: dict):
+        relevant_chunks = self._to_documents(contexts)
         if not relevant_chunks:
             print("No relevant chunks found.")
             return None
@@ -121,6 +184,14 @@ class WebInfoRetriever:
         retriever = vectorstore.as_retriever(search_kwargs={"k": self.top_k})
         return retriever
 
+    async def aretrieve(self, contexts: dict):
+        relevant_chunks = self._to_documents(contexts)
+        if not relevant_chunks:
+            print("No relevant chunks found.")
+            return None
+        vectorstore = await FAISS.afrom_documents(relevant_chunks, self.embedder)
+        return vectorstore.as_retriever(search_kwargs={"k": self.top_k})
+
 
 
 class MedicalSearch:
@@ -132,6 +203,10 @@ class MedicalSearch:
         self.web_crawler = WebSearchCrawler(max_results=self.max_results)
         self.info_retriever = WebInfoRetriever()
         self.search_chain = self.prompt | self.structured_llm
+        self.context_assembler = ContextAssembler("medical_search", prompt=self.prompt, label="[Nguồn: {source}] {text}")
+        # Web search + crawl rất chậm: request trùng câu hỏi đang chạy thì chờ kết quả chung
+        self._flight = SingleFlight("medical_search")
+        self._async_flight = AsyncSingleFlight("medical_search")
         
     def _create_prompt(self):
         return ChatPromptTemplate.from_messages([
@@ -145,18 +220,44 @@ class MedicalSearch:
         return response
 
 
+    async def aanswer_query(self, query: str, context: str):
+        return await self.search_chain.ainvoke({"query": query, "context": context})
+
+    def _no_result(self) -> AnswerQuery:
+        return AnswerQuery(answer="Xin lỗi, tôi không tìm thấy thông tin phù hợp để trả lời câu hỏi của bạn.", source="Không có nguồn.")
+
+    def _combine_context(self, query: str, relevant_docs) -> str:
+        print(f"Found {len(relevant_docs)} relevant documents.")
+        # Retriever trả về theo độ liên quan giảm dần: dùng thứ hạng làm score
+        chunks = [
+            ContextChunk(text=doc.page_content, score=float(len(relevant_docs) - rank),
+                         source=doc.metadata.get("source", ""))
+            for rank, doc in enumerate(relevant_docs)
+        ]
+        return self.context_assembler.assemble(chunks, query=query)
+
     def answer(self, query: str):
+        return self._flight.do(query, self._answer, query)
+
+    def _answer(self, query: str):
         web_infos = self.web_crawler.search_and_crawl(query)
         retriever = self.info_retriever.retrieve(web_infos)
         if not retriever:
-            return AnswerQuery(answer="Xin lỗi, tôi không tìm thấy thông tin phù hợp để trả lời câu hỏi của bạn.", source="Không có nguồn.")
+            return self._no_result()
         relevant_docs = retriever.invoke(query)
-        print(f"Found {len(relevant_docs)} relevant documents.")
-        combined_context = "\n\n".join(
-            f"[Nguồn: {doc.metadata.get('source', 'unknown')}] {doc.page_content}"
-            for doc in relevant_docs
-        )
-        return self.answer_query(query, combined_context)
+        return self.answer_query(query, self._combine_context(query, relevant_docs))
+
+    async def aanswer(self, query: str):
+        """Bản async của answer(): crawl song song bằng async Playwright."""
+        return await self._async_flight.do(query, self._aanswer, query)
+
+    async def _aanswer(self, query: str):
+        web_infos = await self.web_crawler.asearch_and_crawl(query)
+        retriever = await self.info_retriever.aretrieve(web_infos)
+        if not retriever:
+            return self._no_result()
+        relevant_docs = await retriever.ainvoke(query)
+        return await self.aanswer_query(query, self._combine_context(query, relevant_docs))
 
 if __name__ == "__main__":
     medical_search = MedicalSearch(max_results=3)
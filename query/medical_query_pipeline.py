@@ -1,4 +1,5 @@
 
+import asyncio
 from typing import Optional, List, Tuple
 from concurrent.futures import ThreadPoolExecutor, as_completed
 from .split_query import SplitQueryHandler
@@ -6,12 +7,16 @@ from .medical.medical_pipeline import MedicalPipeline
 from .medical.medical_search import MedicalSearch
 from .eval_answer import EvalAnswerHandler
 from .final_answer import FinalAnswerHandler
-from .core import AnswerQuery, FinalAnswer
+from .core import AnswerQuery, AnswerWithAssessment, FinalAnswer, PlannedQuery, get_drug_resolver
+from .router import RoutingContext, StepLog, timed_stage
 
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Câu hỏi nhắc tới tối đa chừng này thuốc thì lấy thẳng tài liệu của các thuốc đó
+MAX_DIRECT_DRUGS = 2
+
 
 class MedicalQueryPipeline:
     """
@@ -20,16 +25,40 @@ class MedicalQueryPipeline:
     -> (loop back nếu try < M) hoặc (Web search nếu try >= M) -> Final Answer
     
     Đã bỏ bước Summary - Final Answer nhận trực tiếp các answers đã eval.
+    
+    Khi có QueryPlanner, bước Split Query được thay bằng kế hoạch của planner (lấy từ
+    routing.plan nếu Router đã lập, nếu không thì gọi planner): mỗi câu hỏi con đi kèm
+    câu truy vấn tìm kiếm đã viết lại, dùng để search Qdrant; câu hỏi con gốc vẫn dùng
+    để sinh và đánh giá câu trả lời. SplitQueryHandler chỉ còn là fallback khi planner lỗi.
+    
+    Khi fused_eval bật, RAG + Answer trả về câu trả lời kèm tự đánh giá (AnswerWithAssessment)
+    và quyết định retry / web search được lấy từ đó - mỗi lần thử chỉ còn một lần gọi LLM.
+    
+    Khi resolve_drugs bật và câu hỏi con nhắc đích danh thuốc (DrugNameResolver), các chunk của thuốc
+    đó được lấy thẳng theo file_name - đạt thì bỏ qua vector search và vòng retry; chưa đạt thì câu hỏi con
+    quay về vòng RAG + retry thông thường (vector search, rồi web search nếu vẫn không đạt).
+    
+    Với K câu hỏi con, lần retrieval đầu của cả K câu là một lượt MedicalRAG.query_batch (một lần
+    embedding, một request search_batch), chunk trùng giữa các câu được bỏ trước khi sinh câu trả lời.
     """
     
-    def __init__(self, max_retries: int = 1, max_workers: int = 1):
+    def __init__(self, max_retries: int = 1, max_workers: int = 1, planner=None, fused_eval: bool = True,
+                 resolve_drugs: bool = True):
         """
         Khởi tạo pipeline.
         
         Args:
             max_retries: Số lần thử tối đa (M) cho RAG + Answer trước khi chuyển sang web search
             max_workers: Số thread tối đa cho xử lý song song
+            planner: QueryPlanner thay cho SplitQueryHandler (None: chỉ dùng SplitQueryHandler)
+            fused_eval: Sinh câu trả lời kèm tự đánh giá thay cho lần gọi EvalAnswer riêng
+            resolve_drugs: Tra tên thuốc trong câu hỏi để lấy thẳng tài liệu của thuốc
         """
+        self.planner = planner
+        self.fused_eval = fused_eval
+        self.resolve_drugs = resolve_drugs
+        if resolve_drugs:
+            get_drug_resolver()  # Bắt đầu build từ điển tên thuốc ở background
         self.split_handler = SplitQueryHandler()
         self.medical_pipeline = MedicalPipeline()
         self.medical_search = MedicalSearch(max_results=3)
@@ -38,12 +67,14 @@ class MedicalQueryPipeline:
         self.max_retries = max_retries
         self.max_workers = max_workers
     
-    def process_query(self, user_query: str) -> FinalAnswer:
+    def process_query(self, user_query: str, routing: Optional[RoutingContext] = None) -> FinalAnswer:
         """
         Xử lý câu hỏi người dùng theo pipeline hoàn chỉnh.
         
         Args:
             user_query: Câu hỏi từ người dùng
+            routing: Quyết định routing từ RouterPipeline (chỉ đọc, không routing lại).
+                Nếu có, thời gian từng stage được ghi vào routing.timings.
             
         Returns:
             FinalAnswer: Câu trả lời cuối cùng
@@ -51,16 +82,23 @@ class MedicalQueryPipeline:
         logger.info(f"Processing query: {user_query}")
         steps = []
         
-        # Bước 1: Split Query thành K Queries
-        split_result = self.split_handler.split(user_query)
-        k_queries = split_result.queries
-        logger.info(f"Split into {len(k_queries)} sub-queries")
-        steps.append(f"2. Split Query: Tach thanh {len(k_queries)} cau hoi con")
-        if len(k_queries) > 1:
-            steps.append(f"   Cac cau hoi: {', '.join([f'Q{i+1}' for i in range(len(k_queries))])}")
+        # Bước 1: Query Planner (hoặc Split Query) thành K Queries + câu truy vấn tìm kiếm
+        with timed_stage(routing, "medical.split"):
+            plan = routing.plan if routing is not None and routing.plan is not None else None
+            if plan is None and self.planner is not None:
+                plan = self.planner.plan(user_query)
+            if plan is None:
+                k_queries, search_queries = self.split_handler.split(user_query).queries, None
+            else:
+                k_queries, search_queries = self._unpack_plan(plan)
+        self._append_split_steps(steps, k_queries, planned=search_queries is not None)
         
         # Bước 2: Xử lý từng query bằng RAG + Answer + Eval (song song nếu nhiều queries)
-        all_answers = self._process_queries_parallel(k_queries, steps)
+        # Kết quả RAG chạy trước (speculative) cho câu hỏi gốc chỉ dùng được khi không tách câu hỏi
+        prefetched_hits = routing.prefetch.get("rag_hits") if routing is not None and len(k_queries) == 1 else None
+        with timed_stage(routing, "medical.answer"):
+            all_answers = self._process_queries_parallel(k_queries, steps, prefetched_hits=prefetched_hits,
+                                                         search_queries=search_queries)
         
         # Bước 3: Nếu không có answer nào, trả về câu trả lời mặc định
         if not all_answers:
@@ -73,42 +111,134 @@ class MedicalQueryPipeline:
         
         # Bước 4: Final Answer - trực tiếp từ các answers (bỏ Summary)
         steps.append(f"{len(steps) + 1}. Final Answer: Tong hop ket qua tu {len(all_answers)} nguon")
-        final_answer = self.final_handler.generate_from_answers(user_query, all_answers)
+        with timed_stage(routing, "medical.final"):
+            final_answer = self.final_handler.generate_from_answers(user_query, all_answers)
+        logger.info("Generated final answer")
+        final_answer.steps = steps
+        
+        return final_answer
+    
+    async def aprocess_query(self, user_query: str, routing: Optional[RoutingContext] = None) -> FinalAnswer:
+        """
+        Bản async của process_query(): các câu hỏi con chạy đồng thời trên event loop.
+        
+        Args:
+            user_query: Câu hỏi từ người dùng
+            routing: Quyết định routing từ RouterPipeline (chỉ đọc, không routing lại).
+                Nếu routing.streaming, các bước và token của câu trả lời cuối được phát qua routing.listener.
+            
+        Returns:
+            FinalAnswer: Câu trả lời cuối cùng
+        """
+        logger.info(f"Processing query (async): {user_query}")
+        # Khi stream, mỗi bước được phát ngay cho người dùng
+        steps = StepLog(routing)
+        
+        with timed_stage(routing, "medical.split"):
+            plan = routing.plan if routing is not None and routing.plan is not None else None
+            if plan is None and self.planner is not None:
+                plan = await self.planner.aplan(user_query)
+            if plan is None:
+                k_queries, search_queries = (await self.split_handler.asplit(user_query)).queries, None
+            else:
+                k_queries, search_queries = self._unpack_plan(plan)
+        self._append_split_steps(steps, k_queries, planned=search_queries is not None)
+        
+        prefetched_hits = routing.prefetch.get("rag_hits") if routing is not None and len(k_queries) == 1 else None
+        with timed_stage(routing, "medical.answer"):
+            all_answers = await self._aprocess_queries_parallel(k_queries, steps, prefetched_hits=prefetched_hits,
+                                                                search_queries=search_queries)
+        
+        if not all_answers:
+            return FinalAnswer(
+                answer="Xin lỗi, tôi không tìm thấy thông tin phù hợp để trả lời câu hỏi của bạn.",
+                sources=[],
+                confidence=0.0,
+                steps=steps
+            )
+        
+        steps.append(f"{len(steps) + 1}. Final Answer: Tong hop ket qua tu {len(all_answers)} nguon")
+        with timed_stage(routing, "medical.final"):
+            final_answer = await self.final_handler.agenerate_from_answers(
+                user_query, all_answers,
+                on_token=routing.token_listener() if routing is not None else None
+            )
         logger.info("Generated final answer")
         final_answer.steps = steps
         
         return final_answer
     
-    def _process_queries_parallel(self, queries: List[str], steps: List[str]) -> List[AnswerQuery]:
+    @staticmethod
+    def _unpack_plan(plan: PlannedQuery) -> Tuple[List[str], List[str]]:
+        """Tách kế hoạch thành (câu hỏi con, câu truy vấn tìm kiếm tương ứng)."""
+        return [sub.question for sub in plan.sub_queries], [sub.search_query for sub in plan.sub_queries]
+    
+    @staticmethod
+    def _append_split_steps(steps: List[str], k_queries: List[str], planned: bool):
+        logger.info(f"Split into {len(k_queries)} sub-queries ({'planner' if planned else 'split handler'})")
+        if planned:
+            steps.append(f"2. Query Planner: Tach thanh {len(k_queries)} cau hoi con + viet lai truy van tim kiem")
+        else:
+            steps.append(f"2. Split Query: Tach thanh {len(k_queries)} cau hoi con")
+        if len(k_queries) > 1:
+            steps.append(f"   Cac cau hoi: {', '.join([f'Q{i+1}' for i in range(len(k_queries))])}")
+    
+    def prefetch(self, query: str) -> list:
+        """
+        Phần việc rẻ có thể chạy trước khi routing xong: embedding câu hỏi + Qdrant search.
+        
+        Args:
+            query: Câu hỏi gốc của người dùng
+            
+        Returns:
+            List[ScoredPoint]: Kết quả RAG cho câu hỏi gốc
+        """
+        return self.medical_pipeline.medical_rag.query(query)
+    
+    async def aprefetch(self, query: str) -> list:
+        """Bản async của prefetch()."""
+        return await self.medical_pipeline.medical_rag.aquery(query)
+    
+    def _process_queries_parallel(self, queries: List[str], steps: List[str],
+                                  prefetched_hits: Optional[list] = None,
+                                  search_queries: Optional[List[str]] = None) -> List[AnswerQuery]:
         """
         Xử lý nhiều queries SONG SONG, mỗi query qua RAG + Answer + Eval.
         
         Args:
             queries: Danh sách các câu hỏi cần xử lý
             steps: Danh sách các bước xử lý để cập nhật
+            prefetched_hits: Kết quả RAG đã có sẵn cho queries[0] (chỉ dùng khi có 1 query)
+            search_queries: Câu truy vấn tìm kiếm của từng query (None: search bằng chính query)
             
         Returns:
             List[AnswerQuery]: Danh sách các câu trả lời đã được eval
         """
         all_answers = []
         step_num = len(steps) + 1
+        search_queries = search_queries or [None] * len(queries)
         
         # Nếu chỉ có 1 query, xử lý trực tiếp
         if len(queries) == 1:
             steps.append(f"{step_num}. Xu ly cau hoi: RAG + Answer + Eval")
-            answer, query_steps = self._process_single_query(queries[0])
+            answer, query_steps = self._process_single_query(queries[0], prefetched_hits=prefetched_hits,
+                                                             search_query=search_queries[0])
             if answer:
                 all_answers.append(answer)
                 if query_steps:
                     steps.extend(query_steps)
             return all_answers
         
-        # Xử lý song song nhiều queries
+        # Xử lý song song nhiều queries (retrieval lần đầu của cả K câu gộp thành một lượt)
         steps.append(f"{step_num}. Xu ly {len(queries)} cau hoi song song")
+        drug_files, to_search = self._prefetch_batch(queries, search_queries)
+        batch_hits = iter(self.medical_pipeline.medical_rag.query_batch(to_search) if to_search else [])
         with ThreadPoolExecutor(max_workers=min(len(queries), self.max_workers)) as executor:
             future_to_query = {
-                executor.submit(self._process_single_query, query): query 
-                for query in queries
+                executor.submit(self._process_single_query, query,
+                                prefetched_hits=None if files else next(batch_hits) or None,
+                                search_query=search_query, drug_files=files): query 
+                for query, search_query, files in zip(queries, search_queries, drug_files)
             }
             
             for idx, future in enumerate(as_completed(future_to_query), 1):
@@ -126,24 +256,94 @@ class MedicalQueryPipeline:
         
         return all_answers
     
-    def _process_single_query(self, query: str) -> Tuple[Optional[AnswerQuery], List[str]]:
+    async def _aprocess_queries_parallel(self, queries: List[str], steps: List[str],
+                                         prefetched_hits: Optional[list] = None,
+                                         search_queries: Optional[List[str]] = None) -> List[AnswerQuery]:
+        """
+        Bản async của _process_queries_parallel(): tối đa max_workers câu hỏi con chạy đồng thời.
+        
+        Args:
+            queries: Danh sách các câu hỏi cần xử lý
+            steps: Danh sách các bước xử lý để cập nhật
+            prefetched_hits: Kết quả RAG đã có sẵn cho queries[0] (chỉ dùng khi có 1 query)
+            search_queries: Câu truy vấn tìm kiếm của từng query (None: search bằng chính query)
+            
+        Returns:
+            List[AnswerQuery]: Danh sách các câu trả lời đã được eval
+        """
+        all_answers = []
+        step_num = len(steps) + 1
+        search_queries = search_queries or [None] * len(queries)
+        
+        if len(queries) == 1:
+            steps.append(f"{step_num}. Xu ly cau hoi: RAG + Answer + Eval")
+            answer, query_steps = await self._aprocess_single_query(queries[0], prefetched_hits=prefetched_hits,
+                                                                    search_query=search_queries[0])
+            if answer:
+                all_answers.append(answer)
+                if query_steps:
+                    steps.extend(query_steps)
+            return all_answers
+        
+        steps.append(f"{step_num}. Xu ly {len(queries)} cau hoi song song")
+        semaphore = asyncio.Semaphore(max(1, self.max_workers))
+        drug_files, to_search = self._prefetch_batch(queries, search_queries)
+        batch_hits = iter(await self.medical_pipeline.medical_rag.aquery_batch(to_search) if to_search else [])
+        
+        async def run(query: str, search_query: Optional[str], files: List[str], hits: Optional[list]):
+            async with semaphore:
+                return await self._aprocess_single_query(query, prefetched_hits=hits or None, search_query=search_query,
+                                                         drug_files=files)
+        
+        results = await asyncio.gather(*(run(query, search_query, files, None if files else next(batch_hits))
+                                         for query, search_query, files in zip(queries, search_queries, drug_files)),
+                                       return_exceptions=True)
+        for idx, (query, result) in enumerate(zip(queries, results), 1):
+            if isinstance(result, Exception):
+                logger.error(f"Error processing query '{query}': {result}")
+                steps.append(f"   Q{idx}: Loi - {str(result)[:50]}")
+                continue
+            answer, query_steps = result
+            if answer:
+                all_answers.append(answer)
+                if query_steps:
+                    steps.append(f"   Q{idx}: {query_steps[-1] if query_steps else 'Hoan thanh'}")
+                logger.info(f"Got answer for: {query[:50]}...")
+        
+        return all_answers
+    
+    def _process_single_query(self, query: str, prefetched_hits: Optional[list] = None,
+                              search_query: Optional[str] = None,
+                              drug_files: Optional[List[str]] = None) -> Tuple[Optional[AnswerQuery], List[str]]:
         """
         Xử lý một câu hỏi: RAG + Answer -> Eval Answer -> (loop back hoặc Web search).
         
         Args:
             query: Câu hỏi
+            prefetched_hits: Kết quả RAG đã có sẵn, dùng cho lần thử đầu tiên
+            search_query: Câu truy vấn tìm kiếm đã viết lại (None: search bằng chính query)
+            drug_files: Thuốc đã tra sẵn cho câu hỏi (None: tự tra tên thuốc)
             
         Returns:
             tuple: (AnswerQuery hoặc None, danh sách các bước xử lý)
         """
         query_steps = []
         
+        # Câu hỏi về thuốc cụ thể: lấy thẳng tài liệu của thuốc, không search / retry;
+        # tài liệu của thuốc không trả lời được thì dùng RAG thường bên dưới
+        drug_hits = self._drug_hits(query, search_query, query_steps, file_names=drug_files)
+        if drug_hits:
+            rag_answer = self._get_rag_answer(query, hits=drug_hits)
+            if rag_answer and self._accept_direct_answer(rag_answer, self._evaluate(query, rag_answer), query_steps):
+                return rag_answer, query_steps
+        
         # Thử RAG + Answer với retry logic
         for try_count in range(1, self.max_retries + 1):
             logger.info(f"Attempt {try_count}/{self.max_retries} for RAG + Answer")
             
             # RAG + Answer
-            rag_answer = self._get_rag_answer(query)
+            rag_answer = self._get_rag_answer(query, hits=prefetched_hits if try_count == 1 else None,
+                                              search_query=search_query, refresh=try_count > 1)
             
             if not rag_answer:
                 # Nếu không có kết quả từ RAG, chuyển sang web search ngay
@@ -155,8 +355,11 @@ class MedicalQueryPipeline:
             
             query_steps.append(f"   - RAG (lan {try_count}): Tim thay {len(rag_answer.source.split(',')) if hasattr(rag_answer, 'source') else 1} nguon")
             
-            # Eval Answer
-            eval_result = self.eval_handler.evaluate(query, rag_answer.answer, try_count)
+            # Eval Answer (dùng phần tự đánh giá nếu có, không gọi LLM lần nữa)
+            if isinstance(rag_answer, AnswerWithAssessment):
+                eval_result = self.eval_handler.assess(rag_answer, try_count)
+            else:
+                eval_result = self.eval_handler.evaluate(query, rag_answer.answer, try_count)
             logger.info(f"Evaluation: satisfactory={eval_result.is_satisfactory}, score={eval_result.score:.2f}")
             query_steps.append(f"   - Eval: Diem {eval_result.score:.2f}, {'Dat' if eval_result.is_satisfactory else 'Chua dat'}")
             
@@ -185,34 +388,180 @@ class MedicalQueryPipeline:
         query_steps.append("   - Web Search: Hoan thanh")
         return answer, query_steps
     
-    def _get_rag_answer(self, query: str) -> Optional[AnswerQuery]:
+    async def _aprocess_single_query(self, query: str, prefetched_hits: Optional[list] = None,
+                                     search_query: Optional[str] = None,
+                                     drug_files: Optional[List[str]] = None) -> Tuple[Optional[AnswerQuery], List[str]]:
+        """
+        Bản async của _process_single_query().
+        
+        Args:
+            query: Câu hỏi
+            prefetched_hits: Kết quả RAG đã có sẵn, dùng cho lần thử đầu tiên
+            search_query: Câu truy vấn tìm kiếm đã viết lại (None: search bằng chính query)
+            drug_files: Thuốc đã tra sẵn cho câu hỏi (None: tự tra tên thuốc)
+            
+        Returns:
+            tuple: (AnswerQuery hoặc None, danh sách các bước xử lý)
+        """
+        query_steps = []
+        
+        drug_hits = await self._adrug_hits(query, search_query, query_steps, file_names=drug_files)
+        if drug_hits:
+            rag_answer = await self._aget_rag_answer(query, hits=drug_hits)
+            if rag_answer and self._accept_direct_answer(rag_answer, await self._aevaluate(query, rag_answer),
+                                                         query_steps):
+                return rag_answer, query_steps
+        
+        for try_count in range(1, self.max_retries + 1):
+            logger.info(f"Attempt {try_count}/{self.max_retries} for RAG + Answer")
+            
+            rag_answer = await self._aget_rag_answer(query, hits=prefetched_hits if try_count == 1 else None,
+                                                     search_query=search_query, refresh=try_count > 1)
+            
+            if not rag_answer:
+                logger.info("No RAG results, switching to web search")
+                query_steps.append("   - RAG: Khong co ket qua -> Chuyen sang Web Search")
+                answer = await self._aget_web_search_answer(query)
+                query_steps.append("   - Web Search: Hoan thanh")
+                return answer, query_steps
+            
+            query_steps.append(f"   - RAG (lan {try_count}): Tim thay {len(rag_answer.source.split(',')) if hasattr(rag_answer, 'source') else 1} nguon")
+            
+            if isinstance(rag_answer, AnswerWithAssessment):
+                eval_result = self.eval_handler.assess(rag_answer, try_count)
+            else:
+                eval_result = await self.eval_handler.aevaluate(query, rag_answer.answer, try_count)
+            logger.info(f"Evaluation: satisfactory={eval_result.is_satisfactory}, score={eval_result.score:.2f}")
+            query_steps.append(f"   - Eval: Diem {eval_result.score:.2f}, {'Dat' if eval_result.is_satisfactory else 'Chua dat'}")
+            
+            if eval_result.is_satisfactory:
+                logger.info("Answer is satisfactory, returning RAG answer")
+                query_steps.append("   - Ket qua: Su dung cau tra loi tu RAG")
+                return rag_answer, query_steps
+            
+            if not eval_result.should_retry:
+                logger.info("Should not retry, switching to web search")
+                query_steps.append("   - Chuyen sang Web Search (khong retry)")
+                answer = await self._aget_web_search_answer(query)
+                query_steps.append("   - Web Search: Hoan thanh")
+                return answer, query_steps
+            
+            logger.info(f"Retrying RAG + Answer (try {try_count}/{self.max_retries})")
+            query_steps.append(f"   - Retry lan {try_count + 1}")
+        
+        logger.info("Max retries reached, switching to web search")
+        query_steps.append(f"   - Da thu het {self.max_retries} lan -> Chuyen sang Web Search")
+        answer = await self._aget_web_search_answer(query)
+        query_steps.append("   - Web Search: Hoan thanh")
+        return answer, query_steps
+    
+    def _resolve_drugs(self, query: str, search_query: Optional[str]) -> List[str]:
+        """file_name của các thuốc được nhắc đích danh trong câu hỏi (rỗng nếu không có / quá nhiều / chưa build xong)."""
+        resolver = get_drug_resolver() if self.resolve_drugs else None
+        if resolver is None:
+            return []
+        matches = resolver.resolve_one(query, max_drugs=MAX_DIRECT_DRUGS)
+        if not matches and search_query:
+            matches = resolver.resolve_one(search_query, max_drugs=MAX_DIRECT_DRUGS)
+        if matches:
+            logger.info(f"Resolved drugs: {[match.name for match in matches]}")
+        return [file_name for match in matches for file_name in match.file_names]
+    
+    def _prefetch_batch(self, queries: List[str],
+                        search_queries: List[Optional[str]]) -> Tuple[List[List[str]], List[str]]:
+        """
+        Tra tên thuốc cho từng câu hỏi con trước khi gộp retrieval: câu đã tra được thuốc
+        lấy thẳng tài liệu của thuốc, chỉ các câu còn lại mới vào lượt embed + search chung.
+        
+        Returns:
+            tuple: (file_name của thuốc theo từng câu, các câu truy vấn cần search theo thứ tự)
+        """
+        drug_files = [self._resolve_drugs(query, search_query) for query, search_query in zip(queries, search_queries)]
+        to_search = [search_query or query
+                     for query, search_query, files in zip(queries, search_queries, drug_files) if not files]
+        return drug_files, to_search
+    
+    def _drug_hits(self, query: str, search_query: Optional[str], query_steps: List[str],
+                   file_names: Optional[List[str]] = None) -> list:
+        """
+        Các chunk của thuốc được nhắc đích danh trong câu hỏi.
+        
+        Args:
+            file_names: Thuốc đã tra sẵn (None: tra từ query / search_query)
+        
+        Returns:
+            List[ScoredPoint]: Rỗng nếu câu hỏi không nói về thuốc cụ thể (dùng RAG thường)
+        """
+        if file_names is None:
+            file_names = self._resolve_drugs(query, search_query)
+        if not file_names:
+            return []
+        hits = self.medical_pipeline.medical_rag.fetch_drugs(query, file_names)
+        if hits:
+            query_steps.append(f"   - Tra ten thuoc: {', '.join(file_names)} -> {len(hits)} doan (khong vector search)")
+        return hits
+    
+    async def _adrug_hits(self, query: str, search_query: Optional[str], query_steps: List[str],
+                          file_names: Optional[List[str]] = None) -> list:
+        """Bản async của _drug_hits()."""
+        if file_names is None:
+            file_names = self._resolve_drugs(query, search_query)
+        if not file_names:
+            return []
+        hits = await self.medical_pipeline.medical_rag.afetch_drugs(query, file_names)
+        if hits:
+            query_steps.append(f"   - Tra ten thuoc: {', '.join(file_names)} -> {len(hits)} doan (khong vector search)")
+        return hits
+    
+    def _evaluate(self, query: str, rag_answer: AnswerQuery):
+        if isinstance(rag_answer, AnswerWithAssessment):
+            return self.eval_handler.assess(rag_answer, self.max_retries)
+        return self.eval_handler.evaluate(query, rag_answer.answer, self.max_retries)
+    
+    async def _aevaluate(self, query: str, rag_answer: AnswerQuery):
+        if isinstance(rag_answer, AnswerWithAssessment):
+            return self.eval_handler.assess(rag_answer, self.max_retries)
+        return await self.eval_handler.aevaluate(query, rag_answer.answer, self.max_retries)
+    
+    @staticmethod
+    def _accept_direct_answer(rag_answer: AnswerQuery, eval_result, query_steps: List[str]) -> bool:
+        """Câu trả lời từ tài liệu của thuốc có dùng được không (không retry: tài liệu sẽ không đổi)."""
+        logger.info(f"Evaluation (direct): satisfactory={eval_result.is_satisfactory}, score={eval_result.score:.2f}")
+        query_steps.append(f"   - Eval: Diem {eval_result.score:.2f}, {'Dat' if eval_result.is_satisfactory else 'Chua dat'}")
+        if eval_result.is_satisfactory:
+            query_steps.append("   - Ket qua: Su dung cau tra loi tu tai lieu cua thuoc")
+            return True
+        query_steps.append("   - Chuyen sang RAG thuong")
+        return False
+    
+    def _get_rag_answer(self, query: str, hits: Optional[list] = None,
+                        search_query: Optional[str] = None, refresh: bool = False) -> Optional[AnswerQuery]:
         """
         Lấy câu trả lời từ RAG.
         
         Args:
             query: Câu hỏi
+            hits: Kết quả RAG đã có sẵn (nếu None sẽ query Qdrant)
+            search_query: Câu truy vấn dùng để search Qdrant (None: dùng query)
+            refresh: Lần thử lại - bỏ qua câu trả lời đã cache cho cùng context
             
         Returns:
             AnswerQuery hoặc None nếu không tìm thấy hoặc có lỗi
         """
         try:
-            # Query RAG để lấy documents
-            results = self.medical_pipeline.medical_rag.query(query)
+            # Query RAG để lấy documents (trừ khi đã có kết quả chạy trước)
+            results = hits if hits is not None else self.medical_pipeline.medical_rag.query(search_query or query)
             
             # Nếu không có kết quả (có thể do collection không tồn tại hoặc lỗi)
             if not results:
                 logger.info("RAG không trả về kết quả, sẽ fallback sang web search")
                 return None
             
-            thresholded_results = [
-                res.payload.get("text", "") 
-                for res in results 
-                if res.score >= self.medical_pipeline.similarity_threshold
-            ]
-            
-            if thresholded_results:
-                context = "\n\n".join(thresholded_results)
-                answer = self.medical_pipeline.process_medical_answer(query, context=context)
+            context = self._build_context(query, results)
+            if context:
+                if self.fused_eval:
+                    return self.medical_pipeline.process_medical_assessed_answer(query, context=context, refresh=refresh)
+                answer = self.medical_pipeline.process_medical_answer(query, context=context, refresh=refresh)
                 return answer
             
             return None
@@ -220,6 +569,41 @@ class MedicalQueryPipeline:
             logger.error(f"Error in RAG query: {e}")
             return None
     
+    async def _aget_rag_answer(self, query: str, hits: Optional[list] = None,
+                               search_query: Optional[str] = None, refresh: bool = False) -> Optional[AnswerQuery]:
+        """
+        Bản async của _get_rag_answer().
+        
+        Args:
+            query: Câu hỏi
+            hits: Kết quả RAG đã có sẵn (nếu None sẽ query Qdrant)
+            search_query: Câu truy vấn dùng để search Qdrant (None: dùng query)
+            refresh: Lần thử lại - bỏ qua câu trả lời đã cache cho cùng context
+            
+        Returns:
+            AnswerQuery hoặc None nếu không tìm thấy hoặc có lỗi
+        """
+        try:
+            results = hits if hits is not None else await self.medical_pipeline.medical_rag.aquery(search_query or query)
+            if not results:
+                logger.info("RAG không trả về kết quả, sẽ fallback sang web search")
+                return None
+            
+            context = self._build_context(query, results)
+            if context:
+                if self.fused_eval:
+                    return await self.medical_pipeline.aprocess_medical_assessed_answer(query, context=context,
+                                                                                        refresh=refresh)
+                return await self.medical_pipeline.aprocess_medical_answer(query, context=context, refresh=refresh)
+            return None
+        except Exception as e:
+            logger.error(f"Error in RAG query: {e}")
+            return None
+    
+    def _build_context(self, query: str, results: list) -> str:
+        """Ghép các đoạn văn bản có score vượt ngưỡng thành context trong ngân sách token (rỗng nếu không có)."""
+        return self.medical_pipeline.build_context(query, results, assessed=self.fused_eval)
+    
     def _get_web_search_answer(self, query: str) -> Optional[AnswerQuery]:
         """
         Lấy câu trả lời từ Web search.
@@ -239,3 +623,22 @@ class MedicalQueryPipeline:
                 answer="Xin lỗi, không thể tìm kiếm thông tin trên web.",
                 source="Lỗi hệ thống"
             )
+    
+    async def _aget_web_search_answer(self, query: str) -> Optional[AnswerQuery]:
+        """
+        Bản async của _get_web_search_answer().
+        
+        Args:
+            query: Câu hỏi
+            
+        Returns:
+            AnswerQuery: Câu trả lời từ web search
+        """
+        try:
+            return await self.medical_search.aanswer(query)
+        except Exception as e:
+            logger.error(f"Error in web search: {e}")
+            return AnswerQuery(
+                answer="Xin lỗi, không thể tìm kiếm thông tin trên web.",
+                source="Lỗi hệ thống"
+            )
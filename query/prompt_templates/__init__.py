@@ -1,5 +1,5 @@
-__all__ = ["ROUTER_SYSTEM_PROMPT", "ROUTER_HUMAN_PROMPT",
-           "MEDICAL_REPHRASE_PROMPT", "MEDICAL_ANSWER_PROMPT", "MEDICAL_SYSTEM_PROMPT", "MEDICAL_HISTORY_PROMPT",
+__all__ = ["ROUTER_SYSTEM_PROMPT", "ROUTER_HUMAN_PROMPT", "QUERY_PLANNER_SYSTEM_PROMPT", "QUERY_PLANNER_HUMAN_PROMPT",
+           "MEDICAL_REPHRASE_PROMPT", "MEDICAL_ANSWER_PROMPT", "MEDICAL_ASSESSED_ANSWER_PROMPT", "MEDICAL_SYSTEM_PROMPT", "MEDICAL_HISTORY_PROMPT",
            "SPLIT_QUERY_SYSTEM_PROMPT", "SPLIT_QUERY_HUMAN_PROMPT",
            "EVAL_ANSWER_SYSTEM_PROMPT", "EVAL_ANSWER_HUMAN_PROMPT",
            "SUMMARY_SYSTEM_PROMPT", "SUMMARY_HUMAN_PROMPT",
@@ -7,7 +7,8 @@ __all__ = ["ROUTER_SYSTEM_PROMPT", "ROUTER_HUMAN_PROMPT",
            "SYSTEM_STORE_PLAN_PROMPT", "SYSTEM_STORE_ANSWER_PROMPT", "USER_STORE_ANSWER_PROM5T"]
 
 from .router import ROUTER_SYSTEM_PROMPT, ROUTER_HUMAN_PROMPT
-from .medical import MEDICAL_REPHRASE_PROMPT, MEDICAL_ANSWER_PROMPT, MEDICAL_SYSTEM_PROMPT, MEDICAL_HISTORY_PROMPT
+from .planner import QUERY_PLANNER_SYSTEM_PROMPT, QUERY_PLANNER_HUMAN_PROMPT
+from .medical import MEDICAL_REPHRASE_PROMPT, MEDICAL_ANSWER_PROMPT, MEDICAL_ASSESSED_ANSWER_PROMPT, MEDICAL_SYSTEM_PROMPT, MEDICAL_HISTORY_PROMPT
 from .base import (SPLIT_QUERY_SYSTEM_PROMPT, SPLIT_QUERY_HUMAN_PROMPT, 
                    EVAL_ANSWER_SYSTEM_PROMPT, EVAL_ANSWER_HUMAN_PROMPT,
                    SUMMARY_SYSTEM_PROMPT, SUMMARY_HUMAN_PROMPT,
@@ -18,6 +18,19 @@ Dựa trên thông tin sau, hãy trả lời ngắn gọn:
 Câu hỏi: {query}
 """
 
+MEDICAL_ASSESSED_ANSWER_PROMPT = """
+Dựa trên thông tin sau, hãy trả lời ngắn gọn:
+
+{context}
+
+Câu hỏi: {query}
+
+Chỉ dùng thông tin ở trên để trả lời, sau đó tự đánh giá câu trả lời:
+- coverage: tỷ lệ (0.0 - 1.0) các phần của câu hỏi được thông tin ở trên trả lời
+- confidence: mức độ (0.0 - 1.0) câu trả lời được thông tin ở trên hỗ trợ trực tiếp, không suy đoán
+- missing: thông tin câu hỏi cần nhưng không có trong thông tin ở trên (để trống nếu đủ)
+"""
+
 MEDICAL_REWRITE_SEARCH_PROMPT = """
 Nhiệm vụ của bạn là viết lại câu hỏi y tế của người dùng để tối ưu hóa việc tìm kiếm thông tin trên web.
 Hãy đảm bảo rằng câu hỏi được viết lại rõ ràng, cụ thể và bao gồm các từ khóa quan trọng liên quan đến chủ đề y tế. Tránh sử dụng các từ ngữ mơ hồ hoặc không cần thiết.
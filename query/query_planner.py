@@ -0,0 +1,69 @@
+from typing import Optional
+from langchain_core.prompts import ChatPromptTemplate
+from .core import PlannedQuery, CascadeChain
+from .core.cascade import validate_planned_query
+from .prompt_templates import QUERY_PLANNER_SYSTEM_PROMPT, QUERY_PLANNER_HUMAN_PROMPT
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class QueryPlanner:
+    """
+    Gộp ba bước Router (LLM) -> Split Query -> Rephrase thành MỘT lần gọi LLM.
+    Kết quả (PlannedQuery) gồm datasource, các câu hỏi con và câu truy vấn tìm kiếm
+    đã được viết lại cho từng câu hỏi con.
+
+    Khi planner lỗi (trả về None), pipeline quay về các handler cũ:
+    Router.router_chain, SplitQueryHandler và câu hỏi con gốc làm câu truy vấn tìm kiếm.
+    """
+    
+    def __init__(self):
+        self.prompt = self._create_prompt()
+        # Chỉ cache exact: kế hoạch chứa nguyên văn tên thuốc / hàm lượng của câu hỏi, câu gần giống
+        # ("Alenta 10mg" vs "Alenta 5mg") không dùng lại được kế hoạch của nhau
+        self.plan_chain = CascadeChain("query_planner", self.prompt, PlannedQuery, validator=validate_planned_query)
+    
+    def _create_prompt(self):
+        """Tạo prompt template cho query planner."""
+        return ChatPromptTemplate.from_messages([
+            ("system", QUERY_PLANNER_SYSTEM_PROMPT),
+            ("human", QUERY_PLANNER_HUMAN_PROMPT),
+        ])
+    
+    def plan(self, question: str) -> Optional[PlannedQuery]:
+        """
+        Lập kế hoạch xử lý câu hỏi: routing, chia câu hỏi con và viết lại câu truy vấn tìm kiếm.
+        
+        Args:
+            question: Câu hỏi gốc từ người dùng
+            
+        Returns:
+            PlannedQuery hoặc None nếu lỗi (pipeline dùng các handler cũ)
+        """
+        try:
+            result = self.plan_chain.invoke({"question": question})
+            logger.info(f"Planned query: {result.datasource}, {len(result.sub_queries)} sub-queries - {result.reasoning}")
+            return result
+        except Exception as e:
+            logger.warning(f"Query planner lỗi, dùng router/split cũ: {e}")
+            return None
+    
+    async def aplan(self, question: str) -> Optional[PlannedQuery]:
+        """
+        Bản async của plan().
+        
+        Args:
+            question: Câu hỏi gốc từ người dùng
+            
+        Returns:
+            PlannedQuery hoặc None nếu lỗi (pipeline dùng các handler cũ)
+        """
+        try:
+            result = await self.plan_chain.ainvoke({"question": question})
+            logger.info(f"Planned query: {result.datasource}, {len(result.sub_queries)} sub-queries - {result.reasoning}")
+            return result
+        except Exception as e:
+            logger.warning(f"Query planner lỗi, dùng router/split cũ: {e}")
+            return None
@@ -2,6 +2,9 @@
 Router module for routing queries to appropriate pipelines.
 """
 from .router import Router
+from .context import RoutingContext, StepLog, timed_stage
+from .fast_router import CentroidRouter
+from .rules import RuleRouter
+from .cache import RouteCache
 
-__all__ = ["Router"]
-
+__all__ = ["Router", "RoutingContext", "StepLog", "timed_stage", "CentroidRouter", "RuleRouter", "RouteCache"]
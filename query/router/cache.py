@@ -0,0 +1,157 @@
+"""
+Route cache - cache quyết định routing theo fingerprint chuẩn của câu hỏi.
+
+Hai tầng:
+- LRU trong process (OrderedDict) cho các câu hỏi lặp lại liên tục
+- SQLite trên đĩa (WAL mode) để quyết định còn sau khi khởi động lại
+  và được chia sẻ giữa nhiều worker process
+Mỗi entry có TTL riêng.
+"""
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Optional
+
+from ..core import RouteQuery
+from ..core.paths import CACHE_DIR
+from ..core.text import query_fingerprint
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class RouteCache:
+    """
+    Cache LRU + TTL cho RouteQuery, có tầng SQLite dùng chung giữa các process.
+    """
+
+    def __init__(self, path: Path = CACHE_DIR / "route_cache.sqlite3", max_entries: int = 10000,
+                 ttl: float = 7 * 24 * 3600, fold_diacritics: bool = True):
+        """
+        Khởi tạo RouteCache.
+
+        Args:
+            path: File SQLite của tầng đĩa (None: chỉ dùng LRU trong process)
+            max_entries: Số entry tối đa của tầng LRU trong process
+            ttl: Thời gian sống mặc định (giây) của một entry
+            fold_diacritics: Có bỏ dấu khi tạo fingerprint không
+                ("thong ke ton kho" và "thống kê tồn kho" dùng chung entry)
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.fold_diacritics = fold_diacritics
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._conn = self._connect(Path(path)) if path is not None else None
+
+    def _connect(self, path: Path) -> sqlite3.Connection:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(str(path), check_same_thread=False, timeout=5.0)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS route_cache ("
+            " fingerprint TEXT PRIMARY KEY,"
+            " datasource TEXT NOT NULL,"
+            " reasoning TEXT NOT NULL,"
+            " expires_at REAL NOT NULL)"
+        )
+        conn.execute("DELETE FROM route_cache WHERE expires_at <= ?", (time.time(),))
+        conn.commit()
+        return conn
+
+    def _key(self, question: str) -> str:
+        return query_fingerprint(question, fold=self.fold_diacritics)
+
+    def _remember(self, key: str, route: RouteQuery, expires_at: float):
+        self._memory[key] = (route, expires_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def get(self, question: str) -> Optional[RouteQuery]:
+        """
+        Lấy quyết định routing đã cache cho câu hỏi.
+
+        Args:
+            question: Câu hỏi từ người dùng
+
+        Returns:
+            RouteQuery hoặc None nếu chưa có / đã hết hạn
+        """
+        key = self._key(question)
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                route, expires_at = entry
+                if expires_at > now:
+                    self._memory.move_to_end(key)
+                    self.memory_hits += 1
+                    return route
+                del self._memory[key]
+
+            if self._conn is not None:
+                try:
+                    row = self._conn.execute(
+                        "SELECT datasource, reasoning, expires_at FROM route_cache WHERE fingerprint = ?",
+                        (key,),
+                    ).fetchone()
+                except sqlite3.Error as e:
+                    logger.warning(f"Lỗi khi đọc route cache: {e}")
+                    row = None
+                if row is not None and row[2] > now:
+                    route = RouteQuery(datasource=row[0], reasoning=row[1])
+                    self._remember(key, route, row[2])
+                    self.disk_hits += 1
+                    return route
+
+            self.misses += 1
+            return None
+
+    def put(self, question: str, route: RouteQuery, ttl: Optional[float] = None):
+        """
+        Lưu quyết định routing cho câu hỏi.
+
+        Args:
+            question: Câu hỏi từ người dùng
+            route: Quyết định routing
+            ttl: Thời gian sống (giây) của entry này (mặc định: self.ttl)
+        """
+        key = self._key(question)
+        expires_at = time.time() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._remember(key, route, expires_at)
+            if self._conn is None:
+                return
+            try:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO route_cache (fingerprint, datasource, reasoning, expires_at) "
+                    "VALUES (?, ?, ?, ?)",
+                    (key, route.datasource, route.reasoning, expires_at),
+                )
+                self._conn.commit()
+            except sqlite3.Error as e:
+                logger.warning(f"Lỗi khi ghi route cache: {e}")
+
+    def get_stats(self) -> dict:
+        """
+        Thống kê hit/miss của cache.
+
+        Returns:
+            dict: memory_hits, disk_hits, misses, hit_rate, size
+        """
+        total = self.memory_hits + self.disk_hits + self.misses
+        return {
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": (self.memory_hits + self.disk_hits) / total if total else 0.0,
+            "size": len(self._memory),
+        }
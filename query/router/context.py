@@ -0,0 +1,112 @@
+"""
+RoutingContext - mang quyết định routing của một request qua toàn bộ pipeline.
+
+Router chỉ được gọi MỘT lần cho mỗi request. Các stage phía sau
+(RouterPipeline.process_query, MedicalQueryPipeline.process_query, StorePipeline.query)
+đọc lại RouteQuery từ context thay vì gọi Router lần nữa.
+
+Khi stream (RouterPipeline.astream_query_unified), context còn mang listener nhận
+các event "step" / "token" do các stage phát ra trong lúc xử lý.
+"""
+import time
+from contextlib import contextmanager, nullcontext
+from typing import Any, Callable, Dict, List, Optional
+from pydantic import BaseModel, Field
+
+from ..core import RouteQuery, PlannedQuery
+
+
+class RoutingContext(BaseModel):
+    """Quyết định routing kèm thời gian xử lý và lý do của một request."""
+
+    query: str = Field(..., description="Câu hỏi gốc của người dùng")
+    route: RouteQuery = Field(..., description="Quyết định routing (datasource + reasoning)")
+    source: str = Field(default="llm", description="Tầng đã đưa ra quyết định: rules | cache | centroid | planner | llm | fallback")
+    llm_calls: int = Field(default=0, description="Số lần gọi LLM để đưa ra quyết định routing")
+    started_at: float = Field(default_factory=time.perf_counter, description="Thời điểm bắt đầu request (perf_counter)")
+    timings: Dict[str, float] = Field(default_factory=dict, description="Thời gian (ms) của từng stage")
+    plan: Optional[PlannedQuery] = Field(
+        default=None,
+        description="Kế hoạch của QueryPlanner (câu hỏi con + câu truy vấn tìm kiếm) nếu routing do planner quyết định",
+    )
+    prefetch: Dict[str, Any] = Field(
+        default_factory=dict,
+        description="Kết quả chạy trước (speculative) của nhánh thắng, ví dụ rag_hits hoặc store_plan",
+    )
+    listener: Optional[Callable[[dict], None]] = Field(
+        default=None,
+        exclude=True,
+        description="Nhận event {'type': 'step' | 'token', 'text': ...} khi stream",
+    )
+
+    @property
+    def datasource(self) -> str:
+        return self.route.datasource
+
+    @property
+    def reasoning(self) -> str:
+        return self.route.reasoning
+
+    @property
+    def streaming(self) -> bool:
+        return self.listener is not None
+
+    def emit(self, event_type: str, text: str):
+        """Phát một event cho listener (không làm gì nếu không stream)."""
+        if self.listener is not None:
+            self.listener({"type": event_type, "text": text})
+
+    def token_listener(self) -> Optional[Callable[[str], None]]:
+        """Callback nhận từng token của câu trả lời, hoặc None nếu không stream."""
+        if self.listener is None:
+            return None
+        return lambda token: self.emit("token", token)
+
+    def record(self, stage: str, elapsed_ms: float):
+        """Ghi lại thời gian (ms) của một stage, cộng dồn nếu stage chạy nhiều lần."""
+        self.timings[stage] = self.timings.get(stage, 0.0) + elapsed_ms
+
+    @contextmanager
+    def timed(self, stage: str):
+        """Context manager đo thời gian một stage và ghi vào timings."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, (time.perf_counter() - start) * 1000)
+
+    def elapsed_ms(self) -> float:
+        """Tổng thời gian (ms) kể từ khi bắt đầu request."""
+        return (time.perf_counter() - self.started_at) * 1000
+
+    def to_steps(self) -> List[str]:
+        """Các bước xử lý của Router để hiển thị cho người dùng."""
+        steps = [
+            f"1. Router: Phan loai cau hoi -> {self.datasource}",
+            f"   Ly do: {self.reasoning}",
+        ]
+        if self.prefetch:
+            steps.append(f"   Speculative: Dung lai ket qua chay truoc ({', '.join(self.prefetch)})")
+        return steps
+
+
+def timed_stage(routing: Optional[RoutingContext], stage: str):
+    """Đo thời gian stage vào routing.timings; không làm gì nếu không có routing context."""
+    return routing.timed(stage) if routing is not None else nullcontext()
+
+
+class StepLog(list):
+    """Danh sách các bước xử lý; mỗi bước mới được phát ngay cho listener của routing."""
+
+    def __init__(self, routing: Optional[RoutingContext] = None):
+        super().__init__()
+        self._routing = routing
+
+    def append(self, step: str):
+        super().append(step)
+        if self._routing is not None:
+            self._routing.emit("step", step)
+
+    def extend(self, steps):
+        for step in steps:
+            self.append(step)
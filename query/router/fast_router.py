@@ -0,0 +1,114 @@
+"""
+Fast router cục bộ - routing bằng nearest centroid trên embedding của câu hỏi.
+
+Centroid của mỗi nhánh được tính từ các câu hỏi mẫu đã gán nhãn trong
+data/route_examples.json. Embedding của câu hỏi mẫu được cache ra đĩa nên chỉ
+phải embed lại khi file mẫu hoặc model embedding thay đổi.
+Router chỉ gọi LLM khi margin giữa hai centroid gần nhất nhỏ hơn ngưỡng.
+"""
+import hashlib
+import json
+from pathlib import Path
+from typing import Dict, List
+
+import numpy as np
+from pydantic import BaseModel, Field
+
+from ..core.paths import CACHE_DIR
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+EXAMPLES_PATH = Path(__file__).resolve().parent / "data" / "route_examples.json"
+
+
+class CentroidPrediction(BaseModel):
+    """Kết quả dự đoán của CentroidRouter."""
+
+    datasource: str = Field(..., description="Nhánh có centroid gần nhất")
+    margin: float = Field(..., description="Chênh lệch cosine giữa centroid gần nhất và gần thứ hai")
+    scores: Dict[str, float] = Field(..., description="Cosine similarity tới centroid của từng nhánh")
+
+
+class CentroidRouter:
+    """
+    Phân loại câu hỏi theo centroid gần nhất của embedding các câu hỏi mẫu.
+    """
+
+    def __init__(self, embedder, examples_path: Path = EXAMPLES_PATH, cache_dir: Path = CACHE_DIR):
+        """
+        Khởi tạo CentroidRouter.
+
+        Args:
+            embedder: Embedding model có method .encode() (xem get_embedding_model)
+            examples_path: File JSON {datasource: [câu hỏi mẫu, ...]}
+            cache_dir: Thư mục cache embedding của câu hỏi mẫu
+        """
+        self.embedder = embedder
+        self.examples_path = Path(examples_path)
+        self.cache_dir = Path(cache_dir)
+        self.labels, self.centroids = self._fit()
+        logger.info(f"CentroidRouter initialized with labels: {self.labels}")
+
+    def _load_examples(self) -> Dict[str, List[str]]:
+        with open(self.examples_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def _embed_examples(self, texts: List[str]) -> np.ndarray:
+        """Embed câu hỏi mẫu, dùng lại cache trên đĩa nếu file mẫu và model không đổi."""
+        model_name = getattr(self.embedder, "model_name", type(self.embedder).__name__)
+        digest = hashlib.sha256(
+            json.dumps([model_name, texts], ensure_ascii=False).encode("utf-8")
+        ).hexdigest()[:16]
+        cache_path = self.cache_dir / f"route_examples_{digest}.npy"
+
+        if cache_path.exists():
+            return np.load(cache_path)
+
+        embeddings = np.asarray(self.embedder.encode(texts, convert_to_numpy=True), dtype=np.float32)
+        try:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            np.save(cache_path, embeddings)
+        except OSError as e:
+            logger.warning(f"Không thể lưu cache embedding câu hỏi mẫu: {e}")
+        return embeddings
+
+    def _fit(self):
+        examples = self._load_examples()
+        labels = sorted(examples)
+        texts = [text for label in labels for text in examples[label]]
+        embeddings = _normalize(self._embed_examples(texts))
+
+        centroids = []
+        offset = 0
+        for label in labels:
+            count = len(examples[label])
+            centroids.append(embeddings[offset:offset + count].mean(axis=0))
+            offset += count
+        return labels, _normalize(np.stack(centroids))
+
+    def predict(self, question: str) -> CentroidPrediction:
+        """
+        Tính cosine similarity giữa câu hỏi và centroid của từng nhánh.
+
+        Args:
+            question: Câu hỏi từ người dùng
+
+        Returns:
+            CentroidPrediction: Nhánh gần nhất, margin và điểm của từng nhánh
+        """
+        embedding = _normalize(np.asarray(self.embedder.encode([question], convert_to_numpy=True), dtype=np.float32))[0]
+        scores = self.centroids @ embedding
+        order = np.argsort(scores)[::-1]
+        margin = float(scores[order[0]] - scores[order[1]]) if len(order) > 1 else float(scores[order[0]])
+        return CentroidPrediction(
+            datasource=self.labels[order[0]],
+            margin=margin,
+            scores={label: float(score) for label, score in zip(self.labels, scores)},
+        )
+
+
+def _normalize(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    return matrix / np.maximum(norms, 1e-12)
@@ -1,7 +1,13 @@
-from typing import Literal
+import asyncio
+import time
+from typing import Literal, Optional
 from langchain_core.prompts import ChatPromptTemplate
-from ..core import get_llm, RouteQuery
+from ..core import get_llm, get_embedding_model, RouteQuery
 from ..prompt_templates import ROUTER_SYSTEM_PROMPT, ROUTER_HUMAN_PROMPT
+from .context import RoutingContext
+from .fast_router import CentroidRouter
+from .rules import RuleRouter
+from .cache import RouteCache
 
 import logging
 
@@ -12,21 +18,67 @@ class Router:
     Router quyết định câu hỏi nên được xử lý bởi:
     - medical_knowledge: RAG cho câu hỏi về y tế, thuốc, sức khỏe
     - store_database: Database cho câu hỏi về kho, thống kê, biểu đồ
+
+    Thứ tự quyết định:
+    1. RuleRouter (regex tất định) - nếu câu hỏi chỉ khớp luật kho (luật y tế chỉ là gợi ý)
+    2. RouteCache (LRU + SQLite) - quyết định đã có của câu hỏi giống hệt trước đó
+    3. CentroidRouter (embedding cục bộ) - nếu margin >= margin_threshold
+    4. QueryPlanner (nếu có) - một lần gọi LLM trả về cả route, câu hỏi con và câu truy vấn
+       tìm kiếm; kế hoạch được gắn vào RoutingContext.plan để pipeline không phải split lại
+    5. LLM router_chain - khi các tầng trên không đủ chắc chắn hoặc planner lỗi
+    Quyết định của tầng 3, 4 và 5 được lưu vào RouteCache.
     """
     
-    def __init__(self, model: str = "gpt-4o-mini"):
+    def __init__(self, model: str = "gpt-4o-mini", use_rules: bool = True, use_cache: bool = True,
+                 use_fast_router: bool = True, margin_threshold: float = 0.05, planner=None):
         """
         Khởi tạo Router với GPT model.
         
         Args:
             model: Loại model sử dụng (mặc định: gpt-4o-mini)
+            use_rules: Có dùng RuleRouter (query/router/data/route_rules.yaml) trước không
+            use_cache: Có dùng RouteCache cho các câu hỏi lặp lại không
+            use_fast_router: Có dùng CentroidRouter trước khi gọi LLM không
+            margin_threshold: Margin tối thiểu giữa hai centroid để chấp nhận quyết định
+                của fast router; nhỏ hơn ngưỡng này sẽ gọi planner / router_chain
+            planner: QueryPlanner thay cho router_chain (None: chỉ dùng router_chain)
         """
         self.llm = get_llm(model)
         self.structured_llm = self.llm.with_structured_output(RouteQuery)
         self.prompt = self._create_prompt()
         self.router_chain = self.prompt | self.structured_llm
+        self.planner = planner
+        self.margin_threshold = margin_threshold
+        self.rule_router = self._init_rule_router() if use_rules else None
+        self.cache = self._init_cache() if use_cache else None
+        self.fast_router = self._init_fast_router() if use_fast_router else None
+        self.requests = 0
+        self.rule_hits = 0
+        self.fast_path_hits = 0
+        self.llm_calls = 0
         logger.info(f"Router initialized with {model}")
 
+    def _init_rule_router(self):
+        try:
+            return RuleRouter()
+        except Exception as e:
+            logger.warning(f"Không thể load routing rules, bỏ qua RuleRouter: {e}")
+            return None
+
+    def _init_cache(self):
+        try:
+            return RouteCache()
+        except Exception as e:
+            logger.warning(f"Không thể mở route cache trên đĩa, chỉ dùng cache trong process: {e}")
+            return RouteCache(path=None)
+
+    def _init_fast_router(self):
+        try:
+            return CentroidRouter(embedder=get_embedding_model())
+        except Exception as e:
+            logger.warning(f"Không thể khởi tạo CentroidRouter, chỉ dùng LLM router: {e}")
+            return None
+
     def _create_prompt(self):
 
         return ChatPromptTemplate.from_messages(
@@ -37,14 +89,197 @@ class Router:
         )
 
     def route(self, question: str) -> RouteQuery:
+        return self.route_with_context(question).route
+
+    def route_with_context(self, question: str) -> RoutingContext:
+        """
+        Routing câu hỏi và trả về RoutingContext để truyền xuống các pipeline phía sau.
+
+        Args:
+            question: Câu hỏi từ người dùng
+
+        Returns:
+            RoutingContext: Quyết định routing kèm thời gian và lý do
+        """
+        started_at = time.perf_counter()
+        routing = self.fast_route(question, started_at=started_at)
+        if routing is not None:
+            return routing
+        return self.llm_route(question, started_at=started_at)
+
+    def fast_route(self, question: str, started_at: Optional[float] = None) -> Optional[RoutingContext]:
+        """
+        Chỉ dùng các tầng cục bộ (luật, centroid), không gọi LLM.
+
+        Args:
+            question: Câu hỏi từ người dùng
+            started_at: Thời điểm bắt đầu request (perf_counter)
+
+        Returns:
+            RoutingContext hoặc None nếu các tầng cục bộ không đủ chắc chắn
+        """
+        if started_at is None:
+            started_at = time.perf_counter()
+        self.requests += 1
+
+        # Tầng 1: luật regex tất định
+        if self.rule_router is not None:
+            datasource = self.rule_router.decide(question)
+            if datasource is not None:
+                self.rule_hits += 1
+                result = RouteQuery(datasource=datasource, reasoning="Khop luat routing (route_rules.yaml)")
+                logger.info(f"Rule-routed question to: {result.datasource}")
+                return self._build_context(question, result, "rules", 0, started_at)
+
+        # Tầng 2: cache quyết định của các câu hỏi đã gặp
+        if self.cache is not None:
+            cached = self.cache.get(question)
+            if cached is not None:
+                logger.info(f"Cache-routed question to: {cached.datasource}")
+                return self._build_context(question, cached, "cache", 0, started_at)
+
+        # Tầng 3: fast router cục bộ
+        if self.fast_router is not None:
+            try:
+                prediction = self.fast_router.predict(question)
+            except Exception as e:
+                logger.warning(f"CentroidRouter lỗi, chuyển sang LLM router: {e}")
+                prediction = None
+            if prediction is not None and prediction.margin >= self.margin_threshold:
+                self.fast_path_hits += 1
+                result = RouteQuery(
+                    datasource=prediction.datasource,
+                    reasoning=f"Centroid router (margin={prediction.margin:.3f})",
+                )
+                logger.info(f"Fast-routed question to: {result.datasource} - {result.reasoning}")
+                if self.cache is not None:
+                    self.cache.put(question, result)
+                return self._build_context(question, result, "centroid", 0, started_at)
+
+        return None
+
+    def llm_route(self, question: str, started_at: Optional[float] = None) -> RoutingContext:
+        """
+        Tầng 4-5: routing bằng QueryPlanner, nếu planner lỗi thì bằng LLM router_chain
+        (fallback về medical_knowledge nếu cả hai lỗi).
+
+        Args:
+            question: Câu hỏi từ người dùng
+            started_at: Thời điểm bắt đầu request (perf_counter)
+
+        Returns:
+            RoutingContext: Quyết định routing của LLM
+        """
+        if started_at is None:
+            started_at = time.perf_counter()
+        self.llm_calls += 1
+        if self.planner is not None:
+            plan = self.planner.plan(question)
+            if plan is not None:
+                return self._build_plan_context(question, plan, started_at)
+            self.llm_calls += 1
         try:
             result = self.router_chain.invoke({"question": question})
             logger.info(f"Routed question to: {result.datasource} - {result.reasoning}")
-            return result
+            source = "llm"
+            if self.cache is not None:
+                self.cache.put(question, result)
         except Exception as e:
             logger.error(f"Error in routing: {e}")
             # Default to medical knowledge if routing fails
-            return RouteQuery(
+            result = RouteQuery(
                 datasource="medical_knowledge",
                 reasoning="Fallback due to routing error",
             )
+            source = "fallback"
+
+        return self._build_context(question, result, source, 1 if self.planner is None else 2, started_at)
+
+    async def aroute_with_context(self, question: str) -> RoutingContext:
+        """
+        Bản async của route_with_context().
+
+        Args:
+            question: Câu hỏi từ người dùng
+
+        Returns:
+            RoutingContext: Quyết định routing kèm thời gian và lý do
+        """
+        started_at = time.perf_counter()
+        routing = await self.afast_route(question, started_at=started_at)
+        if routing is not None:
+            return routing
+        return await self.allm_route(question, started_at=started_at)
+
+    async def afast_route(self, question: str, started_at: Optional[float] = None) -> Optional[RoutingContext]:
+        """
+        Bản async của fast_route(). Luật và cache chỉ mất vài micro giây nhưng centroid router
+        cần gọi embedding (đồng bộ), nên cả hàm chạy trong thread để không chặn event loop.
+        """
+        return await asyncio.to_thread(self.fast_route, question, started_at)
+
+    async def allm_route(self, question: str, started_at: Optional[float] = None) -> RoutingContext:
+        """
+        Bản async của llm_route().
+
+        Args:
+            question: Câu hỏi từ người dùng
+            started_at: Thời điểm bắt đầu request (perf_counter)
+
+        Returns:
+            RoutingContext: Quyết định routing của LLM
+        """
+        if started_at is None:
+            started_at = time.perf_counter()
+        self.llm_calls += 1
+        if self.planner is not None:
+            plan = await self.planner.aplan(question)
+            if plan is not None:
+                return self._build_plan_context(question, plan, started_at)
+            self.llm_calls += 1
+        try:
+            result = await self.router_chain.ainvoke({"question": question})
+            logger.info(f"Routed question to: {result.datasource} - {result.reasoning}")
+            source = "llm"
+            if self.cache is not None:
+                self.cache.put(question, result)
+        except Exception as e:
+            logger.error(f"Error in routing: {e}")
+            result = RouteQuery(
+                datasource="medical_knowledge",
+                reasoning="Fallback due to routing error",
+            )
+            source = "fallback"
+
+        return self._build_context(question, result, source, 1 if self.planner is None else 2, started_at)
+
+    def _build_context(self, question: str, result: RouteQuery, source: str, llm_calls: int, started_at: float) -> RoutingContext:
+        routing = RoutingContext(query=question, route=result, source=source, llm_calls=llm_calls, started_at=started_at)
+        routing.record("router", (time.perf_counter() - started_at) * 1000)
+        return routing
+
+    def _build_plan_context(self, question: str, plan, started_at: float) -> RoutingContext:
+        result = plan.to_route()
+        logger.info(f"Routed question to: {result.datasource} (planner) - {result.reasoning}")
+        if self.cache is not None:
+            self.cache.put(question, result)
+        routing = self._build_context(question, result, "planner", 1, started_at)
+        routing.plan = plan
+        return routing
+
+    def get_stats(self) -> dict:
+        """
+        Thống kê routing: số request, số lần quyết định bởi luật / cache / fast router, số lần gọi LLM.
+
+        Returns:
+            dict: requests, rule_hits, fast_path_hits, llm_calls, rule_rate, fast_path_rate, cache
+        """
+        return {
+            "requests": self.requests,
+            "rule_hits": self.rule_hits,
+            "fast_path_hits": self.fast_path_hits,
+            "llm_calls": self.llm_calls,
+            "rule_rate": self.rule_hits / self.requests if self.requests else 0.0,
+            "fast_path_rate": self.fast_path_hits / self.requests if self.requests else 0.0,
+            "cache": self.cache.get_stats() if self.cache is not None else None,
+        }
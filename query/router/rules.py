@@ -0,0 +1,135 @@
+"""
+Rule router - routing tất định bằng regex cho các intent rất đều đặn
+(giá, tồn kho, doanh thu, thống kê, biểu đồ, top N, nhà cung cấp, hạn sử dụng...).
+
+Toàn bộ luật trong data/route_rules.yaml được bỏ dấu và biên dịch thành MỘT regex
+alternation, so khớp trên câu hỏi đã bỏ dấu, nên quyết định chỉ mất vài micro giây.
+File luật được load lại tự động khi thay đổi.
+
+Luật của các nhánh hint_only (mặc định medical_knowledge) không tự quyết định:
+chúng chỉ khiến câu hỏi có cả tín hiệu của nhánh khác trở thành không chắc chắn.
+"""
+import os
+import re
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+import yaml
+
+from ..core.text import fold_diacritics, normalize_text
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+RULES_PATH = Path(__file__).resolve().parent / "data" / "route_rules.yaml"
+HINT_ONLY_DATASOURCES = ("medical_knowledge",)
+
+
+def compile_rules(rules: Dict[str, List[str]]) -> re.Pattern:
+    """
+    Biên dịch luật thành một regex duy nhất, mỗi datasource là một named group.
+
+    Args:
+        rules: {datasource: [pattern, ...]}
+
+    Returns:
+        re.Pattern: Regex alternation trên văn bản đã bỏ dấu
+    """
+    groups = []
+    for datasource, patterns in rules.items():
+        if not patterns:
+            continue
+        alternation = "|".join(f"(?:{fold_diacritics(str(p))})" for p in patterns)
+        groups.append(rf"(?P<{datasource}>\b(?:{alternation})\b)")
+    if not groups:
+        # Regex không bao giờ khớp
+        return re.compile(r"(?!x)x")
+    return re.compile("|".join(groups))
+
+
+class RuleRouter:
+    """
+    Quyết định routing cho các trường hợp hiển nhiên trước khi dùng tới embedding hay LLM.
+    """
+
+    def __init__(self, rules_path: Path = RULES_PATH, reload_interval: float = 2.0,
+                 hint_only: Iterable[str] = HINT_ONLY_DATASOURCES):
+        """
+        Khởi tạo RuleRouter.
+
+        Args:
+            rules_path: Đường dẫn file YAML chứa luật
+            reload_interval: Chu kỳ tối thiểu (giây) giữa hai lần kiểm tra file luật thay đổi
+            hint_only: Các datasource mà luật chỉ là gợi ý - khớp một mình không đủ để quyết định
+        """
+        self.rules_path = Path(rules_path)
+        self.reload_interval = reload_interval
+        self.hint_only = frozenset(hint_only)
+        self._lock = threading.Lock()
+        self._mtime = None
+        self._last_check = 0.0
+        self._pattern = None
+        self._load()
+
+    def _load(self):
+        mtime = os.path.getmtime(self.rules_path)
+        with open(self.rules_path, "r", encoding="utf-8") as f:
+            rules = yaml.safe_load(f) or {}
+        pattern = compile_rules(rules)
+        # Gán một lần để các thread đang đọc luôn thấy regex hoàn chỉnh
+        self._pattern = pattern
+        self._mtime = mtime
+        logger.info(f"Loaded routing rules from {self.rules_path} ({sum(len(v or []) for v in rules.values())} patterns)")
+
+    def _maybe_reload(self):
+        now = time.monotonic()
+        if now - self._last_check < self.reload_interval:
+            return
+        with self._lock:
+            if now - self._last_check < self.reload_interval:
+                return
+            self._last_check = now
+            try:
+                if os.path.getmtime(self.rules_path) != self._mtime:
+                    self._load()
+            except Exception as e:
+                # Giữ lại luật cũ nếu file mới bị lỗi
+                logger.error(f"Không thể load lại routing rules: {e}")
+
+    def match(self, question: str) -> List[str]:
+        """
+        Trả về danh sách datasource có luật khớp với câu hỏi.
+
+        Args:
+            question: Câu hỏi từ người dùng
+
+        Returns:
+            list[str]: Các datasource khớp (không trùng lặp)
+        """
+        self._maybe_reload()
+        text = normalize_text(question, fold=True)
+        matched = []
+        for m in self._pattern.finditer(text):
+            for datasource, value in m.groupdict().items():
+                if value is not None and datasource not in matched:
+                    matched.append(datasource)
+        return matched
+
+    def decide(self, question: str) -> Optional[str]:
+        """
+        Quyết định datasource nếu câu hỏi chỉ khớp luật của đúng một nhánh
+        và nhánh đó không phải hint_only.
+
+        Args:
+            question: Câu hỏi từ người dùng
+
+        Returns:
+            str hoặc None: datasource, hoặc None nếu không chắc chắn
+        """
+        matched = self.match(question)
+        if len(matched) != 1 or matched[0] in self.hint_only:
+            return None
+        return matched[0]
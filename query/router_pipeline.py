@@ -3,33 +3,66 @@ Pipeline router tích hợp hai nhánh:
 1. RAG (MedicalQueryPipeline) - cho câu hỏi về kiến thức y tế
 2. Database Search (StorePipeline) - cho câu hỏi về kho hàng, giá cả, tồn kho
 """
-from typing import Union
-from .router import Router
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from typing import AsyncIterator, Optional, Union
+from .router import Router, RoutingContext
 from .medical_query_pipeline import MedicalQueryPipeline
+from .query_planner import QueryPlanner
 from .store.store_pipeline import StorePipeline
-from .core import FinalAnswer
+from .core import FinalAnswer, SingleFlight, AsyncSingleFlight
 
 import logging
 
 logger = logging.getLogger(__name__)
 
 
+def _log_warmup_error(task: asyncio.Task):
+    """Lấy lỗi của task làm nóng schema (tránh cảnh báo "exception was never retrieved")."""
+    if not task.cancelled() and task.exception() is not None:
+        logger.warning(f"Speculative store_schema lỗi: {task.exception()}")
+
+
 class RouterPipeline:
     """
     Pipeline chính sử dụng Router để quyết định nhánh xử lý:
     - medical_knowledge -> MedicalQueryPipeline (RAG)
     - store_database -> StorePipeline (Database Search)
+    
+    Speculative mode: khi các tầng routing cục bộ không chắc chắn và phải chờ LLM router,
+    phần việc rẻ của cả hai nhánh được chạy trước song song với router:
+    - medical: embedding câu hỏi + Qdrant search
+    - store: lấy schema + tạo query plan chỉ bằng tier đầu của cascade (1 lần gọi LLM, tính vào
+      speculative_max_llm_calls); tier đầu không cho plan hợp lệ thì nhánh store tự lập plan lại
+    Khi route có kết quả, nhánh thắng dùng lại kết quả chạy trước, nhánh thua bị hủy
+    (nếu chưa bắt đầu) hoặc bỏ kết quả.
     """
     
-    def __init__(self, max_retries: int = 2):
+    def __init__(self, max_retries: int = 2, router_margin_threshold: float = 0.05,
+                 speculative: bool = False, speculative_max_llm_calls: int = 1,
+                 speculative_max_inflight: int = 4, speculative_timeout: float = 30.0,
+                 coalesce: bool = True, use_planner: bool = True):
         """
         Khởi tạo router pipeline.
         
         Args:
             max_retries: Số lần thử tối đa cho Final Answer evaluation
+            router_margin_threshold: Margin tối thiểu để fast router quyết định mà không cần gọi LLM
+            speculative: Bật chạy trước hai nhánh khi phải chờ LLM router
+            speculative_max_llm_calls: Số lần gọi LLM tối đa được chạy trước cho mỗi request
+                (0: chỉ chạy phần không tốn LLM - Qdrant search và lấy schema)
+            speculative_max_inflight: Số tác vụ chạy trước tối đa cùng lúc trên toàn process;
+                hết chỗ thì request đó không chạy trước
+            speculative_timeout: Thời gian tối đa (giây) chờ kết quả chạy trước của nhánh thắng
+            coalesce: Gộp các request trùng câu hỏi đang chạy đồng thời thành một lần xử lý
+            use_planner: Dùng QueryPlanner (một lần gọi LLM cho route + split + rewrite)
+                thay cho LLM router + SplitQueryHandler
         """
-        self.router = Router()
-        self.medical_pipeline = MedicalQueryPipeline(max_retries=max_retries)
+        self.planner = QueryPlanner() if use_planner else None
+        self.router = Router(margin_threshold=router_margin_threshold, planner=self.planner)
+        self.medical_pipeline = MedicalQueryPipeline(max_retries=max_retries, planner=self.planner)
         
         # Khởi tạo StorePipeline với xử lý lỗi
         try:
@@ -43,14 +76,121 @@ class RouterPipeline:
             self.store_pipeline = None
             self.store_pipeline_available = False
         
+        self.speculative = speculative
+        self.speculative_max_llm_calls = speculative_max_llm_calls
+        self.speculative_timeout = speculative_timeout
+        self._speculation_slots = threading.BoundedSemaphore(speculative_max_inflight)
+        self._speculation_executor = (
+            ThreadPoolExecutor(max_workers=speculative_max_inflight, thread_name_prefix="speculative")
+            if speculative else None
+        )
+        self.speculation_stats = {"started": 0, "used": 0, "cancelled": 0, "discarded": 0, "skipped": 0}
+        self._stats_lock = threading.Lock()
+        
+        self.coalesce = coalesce
+        self._flight = SingleFlight("router_pipeline")
+        self._async_flight = AsyncSingleFlight("router_pipeline")
+        
         logger.info("RouterPipeline initialized")
     
-    def process_query(self, user_query: str) -> Union[FinalAnswer, dict]:
+    def route(self, user_query: str) -> RoutingContext:
+        """
+        Routing câu hỏi một lần cho cả request.
+        Các tầng cục bộ (luật, centroid) được thử trước; nếu phải gọi LLM router
+        và speculative mode đang bật thì chạy trước hai nhánh trong lúc chờ.
+        
+        Args:
+            user_query: Câu hỏi từ người dùng
+            
+        Returns:
+            RoutingContext: Quyết định routing (kèm kết quả chạy trước của nhánh thắng nếu có)
+        """
+        started_at = time.perf_counter()
+        routing = self.router.fast_route(user_query, started_at=started_at)
+        if routing is not None:
+            return routing
+        if not self.speculative:
+            return self.router.llm_route(user_query, started_at=started_at)
+        return self._route_speculatively(user_query, started_at)
+    
+    def _count(self, key: str, n: int = 1):
+        """Cập nhật speculation_stats (được gọi từ nhiều thread/task cùng lúc)."""
+        with self._stats_lock:
+            self.speculation_stats[key] += n
+    
+    def _submit_speculative(self, fn, *args):
+        """Chạy trước một tác vụ nếu còn chỗ; trả về None nếu đã đạt speculative_max_inflight."""
+        if not self._speculation_slots.acquire(blocking=False):
+            self._count("skipped")
+            return None
+        try:
+            future = self._speculation_executor.submit(fn, *args)
+        except Exception:
+            self._speculation_slots.release()
+            raise
+        # Chỉ trả chỗ khi tác vụ thực sự kết thúc (kể cả khi kết quả bị bỏ)
+        future.add_done_callback(lambda _: self._speculation_slots.release())
+        self._count("started")
+        return future
+    
+    def _start_speculative(self, fn, *args) -> Optional[asyncio.Task]:
+        """Bản async của _submit_speculative(): tạo task nếu còn chỗ, trả về None nếu đã đạt speculative_max_inflight."""
+        if not self._speculation_slots.acquire(blocking=False):
+            self._count("skipped")
+            return None
+        try:
+            task = asyncio.create_task(fn(*args))
+        except Exception:
+            self._speculation_slots.release()
+            raise
+        # Chỉ trả chỗ khi task thực sự kết thúc (kể cả khi bị cancel)
+        task.add_done_callback(lambda _: self._speculation_slots.release())
+        self._count("started")
+        return task
+    
+    def _route_speculatively(self, user_query: str, started_at: float) -> RoutingContext:
+        futures = {"rag_hits": self._submit_speculative(self.medical_pipeline.prefetch, user_query)}
+        if self.store_pipeline_available:
+            if self.speculative_max_llm_calls >= 1:
+                futures["store_plan"] = self._submit_speculative(self.store_pipeline.plan, user_query, 1)
+            else:
+                # Không được tốn LLM: chỉ làm nóng cache schema
+                futures["store_schema"] = self._submit_speculative(self.store_pipeline.get_schema)
+        
+        routing = self.router.llm_route(user_query, started_at=started_at)
+        winner = "rag_hits" if routing.datasource == "medical_knowledge" else "store_plan"
+        
+        for key, future in futures.items():
+            if future is None or key == "store_schema":
+                continue
+            if key != winner:
+                # Nhánh thua: hủy nếu chưa chạy, nếu đang chạy thì bỏ kết quả
+                if future.cancel():
+                    self._count("cancelled")
+                else:
+                    self._count("discarded")
+                continue
+            try:
+                wait_started = time.perf_counter()
+                routing.prefetch[key] = future.result(timeout=self.speculative_timeout)
+                routing.record("speculative.wait", (time.perf_counter() - wait_started) * 1000)
+                self._count("used")
+            except FutureTimeoutError:
+                logger.warning(f"Speculative {key} quá thời gian chờ, nhánh sẽ tự chạy lại")
+                self._count("discarded")
+            except Exception as e:
+                logger.warning(f"Speculative {key} lỗi, nhánh sẽ tự chạy lại: {e}")
+        
+        logger.info(f"Speculative routing -> {routing.datasource}, dung lai: {list(routing.prefetch)}")
+        return routing
+    
+    def process_query(self, user_query: str, routing: Optional[RoutingContext] = None) -> Union[FinalAnswer, dict]:
         """
         Xử lý câu hỏi người dùng bằng cách routing đến pipeline phù hợp.
         
         Args:
             user_query: Câu hỏi từ người dùng
+            routing: Quyết định routing đã có (nếu None sẽ gọi Router một lần)
             
         Returns:
             FinalAnswer: Nếu route đến medical_knowledge (RAG)
@@ -61,38 +201,40 @@ class RouterPipeline:
         """
         logger.info(f"Processing query: {user_query}")
         
-        # Bước 1: Router quyết định nhánh
-        route_result = self.router.route(user_query)
+        # Bước 1: Router quyết định nhánh (chỉ khi chưa có quyết định từ trước)
+        if routing is None:
+            routing = self.route(user_query)
+        route_result = routing.route
         logger.info(f"Routed to: {route_result.datasource} - {route_result.reasoning}")
         
         # Bước 2: Xử lý theo nhánh được chọn
         if route_result.datasource == "medical_knowledge":
             # Nhánh RAG - xử lý câu hỏi y tế
             logger.info("Using MedicalQueryPipeline (RAG)")
-            result = self.medical_pipeline.process_query(user_query)
+            result = self.medical_pipeline.process_query(user_query, routing=routing)
             return result
         
         elif route_result.datasource == "store_database":
             # Nhánh Database Search - xử lý câu hỏi về kho hàng
             if not self.store_pipeline_available:
                 logger.warning("StorePipeline không khả dụng, fallback sang RAG")
-                result = self.medical_pipeline.process_query(user_query)
+                result = self.medical_pipeline.process_query(user_query, routing=routing)
                 return result
             
             logger.info("Using StorePipeline (Database Search)")
             try:
-                result = self.store_pipeline.query(user_query)
+                result = self.store_pipeline.query(user_query, routing=routing)
                 return result
             except Exception as e:
                 logger.error(f"Lỗi khi query database: {e}")
                 logger.info("Fallback sang RAG pipeline")
-                result = self.medical_pipeline.process_query(user_query)
+                result = self.medical_pipeline.process_query(user_query, routing=routing)
                 return result
         
         else:
             # Fallback: mặc định dùng RAG
             logger.warning(f"Unknown datasource: {route_result.datasource}, falling back to RAG")
-            result = self.medical_pipeline.process_query(user_query)
+            result = self.medical_pipeline.process_query(user_query, routing=routing)
             return result
     
     def process_query_unified(self, user_query: str) -> dict:
@@ -110,16 +252,29 @@ class RouterPipeline:
                 - is_image: bool - Có phải hình ảnh không (mặc định False)
                 - image: Optional - Hình ảnh nếu có (mặc định None)
                 - steps: list[str] - Danh sách các bước xử lý
+                - timings: dict[str, float] - Thời gian (ms) của từng stage
         """
-        steps = []
-        
-        # Bước 1: Router phân loại
-        route_result = self.router.route(user_query)
-        steps.append(f"1. Router: Phan loai cau hoi -> {route_result.datasource}")
-        steps.append(f"   Ly do: {route_result.reasoning}")
-        
-        result = self.process_query(user_query)
+        if not self.coalesce:
+            return self._process_query_unified(user_query)
+        # Request trùng câu hỏi đang chạy cùng lúc dùng chung một lần xử lý
+        return self._copy_unified(self._flight.do(user_query, self._process_query_unified, user_query))
+    
+    def _process_query_unified(self, user_query: str) -> dict:
+        # Bước 1: Router phân loại - quyết định này được truyền xuống, không routing lại
+        routing = self.route(user_query)
+        steps = routing.to_steps()
         
+        result = self.process_query(user_query, routing=routing)
+        routing.record("total", routing.elapsed_ms())
+        return self._to_unified(result, steps, routing)
+    
+    @staticmethod
+    def _copy_unified(result: dict) -> dict:
+        """Bản sao nông của kết quả dùng chung, để mỗi request sửa steps/timings không ảnh hưởng nhau."""
+        return {**result, "steps": list(result["steps"]), "timings": dict(result["timings"])}
+    
+    def _to_unified(self, result: Union[FinalAnswer, dict], steps: list, routing: RoutingContext) -> dict:
+        """Chuyển kết quả của một nhánh về format thống nhất."""
         # Nếu là FinalAnswer (từ RAG)
         if isinstance(result, FinalAnswer):
             # Lấy steps từ result nếu có
@@ -131,7 +286,8 @@ class RouterPipeline:
                 "confidence": result.confidence,
                 "is_image": False,
                 "image": None,
-                "steps": steps
+                "steps": steps,
+                "timings": routing.timings
             }
         
         # Nếu là dict (từ StorePipeline)
@@ -145,7 +301,8 @@ class RouterPipeline:
                 "confidence": 0.9 if result.get("is_image", False) else 0.85,
                 "is_image": result.get("is_image", False),
                 "image": result.get("image", None),
-                "steps": steps
+                "steps": steps,
+                "timings": routing.timings
             }
         
         # Fallback
@@ -156,6 +313,167 @@ class RouterPipeline:
                 "confidence": 0.0,
                 "is_image": False,
                 "image": None,
-                "steps": steps
+                "steps": steps,
+                "timings": routing.timings
             }
-
+    
+    async def aroute(self, user_query: str) -> RoutingContext:
+        """
+        Bản async của route(). Speculative mode dùng asyncio task thay cho thread pool;
+        nhánh thua bị cancel ngay khi có quyết định routing.
+        
+        Args:
+            user_query: Câu hỏi từ người dùng
+            
+        Returns:
+            RoutingContext: Quyết định routing
+        """
+        started_at = time.perf_counter()
+        routing = await self.router.afast_route(user_query, started_at=started_at)
+        if routing is not None:
+            return routing
+        if not self.speculative:
+            return await self.router.allm_route(user_query, started_at=started_at)
+        
+        tasks = {"rag_hits": self._start_speculative(self.medical_pipeline.aprefetch, user_query)}
+        if self.store_pipeline_available:
+            if self.speculative_max_llm_calls >= 1:
+                tasks["store_plan"] = self._start_speculative(self.store_pipeline.aplan, user_query, 1)
+            else:
+                # Không được tốn LLM: chỉ làm nóng cache schema
+                tasks["store_schema"] = self._start_speculative(asyncio.to_thread, self.store_pipeline.get_schema)
+        
+        try:
+            routing = await self.router.allm_route(user_query, started_at=started_at)
+        except BaseException:
+            for key, task in tasks.items():
+                if task is not None and key != "store_schema":
+                    task.cancel()
+            raise
+        winner = "rag_hits" if routing.datasource == "medical_knowledge" else "store_plan"
+        
+        for key, task in tasks.items():
+            if task is None:
+                continue
+            if key == "store_schema":
+                # Làm nóng schema chạy tiếp ở nền; lỗi chỉ ghi log, nhánh store tự lấy lại schema
+                task.add_done_callback(_log_warmup_error)
+                continue
+            if key != winner:
+                task.cancel()
+                self._count("cancelled")
+                continue
+            try:
+                wait_started = time.perf_counter()
+                routing.prefetch[key] = await asyncio.wait_for(task, timeout=self.speculative_timeout)
+                routing.record("speculative.wait", (time.perf_counter() - wait_started) * 1000)
+                self._count("used")
+            except asyncio.TimeoutError:
+                logger.warning(f"Speculative {key} quá thời gian chờ, nhánh sẽ tự chạy lại")
+                self._count("discarded")
+            except Exception as e:
+                logger.warning(f"Speculative {key} lỗi, nhánh sẽ tự chạy lại: {e}")
+        
+        return routing
+    
+    async def aprocess_query(self, user_query: str, routing: Optional[RoutingContext] = None) -> Union[FinalAnswer, dict]:
+        """
+        Bản async của process_query().
+        
+        Args:
+            user_query: Câu hỏi từ người dùng
+            routing: Quyết định routing đã có (nếu None sẽ gọi Router một lần)
+            
+        Returns:
+            FinalAnswer hoặc dict: Giống process_query()
+        """
+        logger.info(f"Processing query (async): {user_query}")
+        if routing is None:
+            routing = await self.aroute(user_query)
+        route_result = routing.route
+        logger.info(f"Routed to: {route_result.datasource} - {route_result.reasoning}")
+        
+        if route_result.datasource == "store_database" and self.store_pipeline_available:
+            logger.info("Using StorePipeline (Database Search)")
+            try:
+                return await self.store_pipeline.aquery(user_query, routing=routing)
+            except Exception as e:
+                logger.error(f"Lỗi khi query database: {e}")
+                logger.info("Fallback sang RAG pipeline")
+        elif route_result.datasource == "store_database":
+            logger.warning("StorePipeline không khả dụng, fallback sang RAG")
+        elif route_result.datasource != "medical_knowledge":
+            logger.warning(f"Unknown datasource: {route_result.datasource}, falling back to RAG")
+        
+        logger.info("Using MedicalQueryPipeline (RAG)")
+        return await self.medical_pipeline.aprocess_query(user_query, routing=routing)
+    
+    async def aprocess_query_unified(self, user_query: str) -> dict:
+        """
+        Bản async của process_query_unified(): không giữ thread nào trong lúc chờ
+        LLM, Qdrant hay crawl web, nên một process phục vụ được nhiều cuộc hội thoại đồng thời.
+        
+        Args:
+            user_query: Câu hỏi từ người dùng
+            
+        Returns:
+            dict: Cùng format với process_query_unified()
+        """
+        if not self.coalesce:
+            return await self._aprocess_query_unified(user_query)
+        return self._copy_unified(await self._async_flight.do(user_query, self._aprocess_query_unified, user_query))
+    
+    async def _aprocess_query_unified(self, user_query: str) -> dict:
+        routing = await self.aroute(user_query)
+        steps = routing.to_steps()
+        
+        result = await self.aprocess_query(user_query, routing=routing)
+        routing.record("total", routing.elapsed_ms())
+        return self._to_unified(result, steps, routing)
+    
+    async def astream_query_unified(self, user_query: str) -> AsyncIterator[dict]:
+        """
+        Xử lý câu hỏi và stream tiến trình cho giao diện.
+        
+        Args:
+            user_query: Câu hỏi từ người dùng
+            
+        Yields:
+            dict: Các event theo thứ tự xảy ra:
+                - {"type": "step", "text": str} - một bước xử lý mới
+                - {"type": "token", "text": str} - một đoạn của câu trả lời cuối
+                - {"type": "final", "result": dict} - kết quả cùng format với process_query_unified()
+        """
+        if not self.coalesce:
+            async for event in self._astream_query_unified(user_query):
+                yield event
+            return
+        # Request trùng đến sau nhận lại các event đã phát rồi stream tiếp cùng request đầu
+        async for event in self._async_flight.stream(user_query, lambda: self._astream_query_unified(user_query)):
+            if event["type"] == "final":
+                event = {"type": "final", "result": self._copy_unified(event["result"])}
+            yield event
+    
+    async def _astream_query_unified(self, user_query: str) -> AsyncIterator[dict]:
+        queue: asyncio.Queue = asyncio.Queue()
+        routing = await self.aroute(user_query)
+        steps = routing.to_steps()
+        for step in steps:
+            yield {"type": "step", "text": step}
+        
+        routing.listener = queue.put_nowait
+        task = asyncio.create_task(self.aprocess_query(user_query, routing=routing))
+        # None đánh dấu pipeline đã xong (kể cả khi lỗi)
+        task.add_done_callback(lambda _: queue.put_nowait(None))
+        try:
+            while (event := await queue.get()) is not None:
+                if event["type"] == "token" and "first_token" not in routing.timings:
+                    routing.record("first_token", routing.elapsed_ms())
+                yield event
+            result = task.result()
+        finally:
+            # Người dùng ngắt kết nối giữa chừng -> dừng pipeline
+            task.cancel()
+        
+        routing.record("total", routing.elapsed_ms())
+        yield {"type": "final", "result": self._to_unified(result, steps, routing)}
@@ -1,5 +1,6 @@
 from langchain_core.prompts import ChatPromptTemplate
-from .core import get_llm, SplitQuery
+from .core import get_llm, SplitQuery, CascadeChain
+from .core.cascade import validate_split
 from .prompt_templates import SPLIT_QUERY_SYSTEM_PROMPT, SPLIT_QUERY_HUMAN_PROMPT
 
 import logging
@@ -15,9 +16,9 @@ class SplitQueryHandler:
     
     def __init__(self):
         self.llm = get_llm()
-        self.structured_llm = self.llm.with_structured_output(SplitQuery)
         self.prompt = self._create_prompt()
-        self.split_chain = self.prompt | self.structured_llm
+        # Chỉ cache exact: câu hỏi con chứa nguyên văn tên thuốc của câu hỏi gốc
+        self.split_chain = CascadeChain("split_query", self.prompt, SplitQuery, validator=validate_split)
     
     def _create_prompt(self):
         """Tạo prompt template cho việc chia câu hỏi."""
@@ -48,6 +49,27 @@ class SplitQueryHandler:
                 reasoning="Fallback due to splitting error - using original query"
             )
     
+    async def asplit(self, query: str) -> SplitQuery:
+        """
+        Bản async của split().
+        
+        Args:
+            query: Câu hỏi gốc từ người dùng
+            
+        Returns:
+            SplitQuery: Đối tượng chứa danh sách các câu hỏi con và lý do chia
+        """
+        try:
+            result = await self.split_chain.ainvoke({"query": query})
+            logger.info(f"Split query into {len(result.queries)} sub-queries: {result.reasoning}")
+            return result
+        except Exception as e:
+            logger.error(f"Error in splitting query: {e}")
+            return SplitQuery(
+                queries=[query],
+                reasoning="Fallback due to splitting error - using original query"
+            )
+    
     def get_queries(self, query: str) -> list[str]:
         """
         Lấy danh sách các câu hỏi con từ câu hỏi gốc.
@@ -5,6 +5,7 @@ Sử dụng GPT để tạo SQL query và vẽ biểu đồ thống kê.
 from query.core import get_llm
 from pydantic import BaseModel
 from typing import Optional
+import asyncio
 import io
 import logging
 from pathlib import Path
@@ -37,12 +38,15 @@ except ImportError:
     except ImportError:
         HAS_PIL = False
 
+from langchain_core.output_parsers import StrOutputParser
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_community.utilities import SQLDatabase
 from langchain_core.tools import tool
 from sqlalchemy import text
 from ..prompt_templates import SYSTEM_STORE_PLAN_PROMPT, SYSTEM_STORE_ANSWER_PROMPT, USER_STORE_ANSWER_PROMPT
-from ..core import AnswerQuery, QueryPlan
+from ..core import AnswerQuery, QueryPlan, CascadeChain, ContextAssembler
+from ..core.cascade import validate_answer, make_sql_validator
+from ..router import RoutingContext, StepLog, timed_stage
 
 # Cấu hình logger
 logger = logging.getLogger(__name__)
@@ -235,8 +239,6 @@ class StorePipeline:
         
         # Sử dụng GPT thay vì openai-oss
         llm = get_llm("gpt-4o-mini")  # Dùng GPT-4o-mini cho tốc độ và chi phí
-        plan_llm = llm.with_structured_output(QueryPlan)
-        answer_llm = llm.with_structured_output(AnswerQuery)
         
         # Kiểm tra và tạo database nếu chưa tồn tại
         if not DB_PATH.exists():
@@ -257,11 +259,16 @@ class StorePipeline:
             logger.error(f"Đường dẫn database: {db_path}")
             raise
         
+        self._schema = None
         self._get_prompt()
-        self.plan_chain = self.plan_prompt | plan_llm 
-        self.answer_chain = self.answer_prompt | answer_llm
+        self.plan_chain = CascadeChain("store_plan", self.plan_prompt, QueryPlan, validator=make_sql_validator(self.db))
+        self.answer_chain = CascadeChain("store_answer", self.answer_prompt, AnswerQuery, validator=validate_answer)
+        # Cùng prompt nhưng trả về text thuần để stream từng token
+        self.answer_stream_chain = self.answer_prompt | llm | StrOutputParser()
+        # Số dòng đưa vào prompt trả lời được giới hạn theo ngân sách token (tối đa 50 dòng)
+        self.answer_context = ContextAssembler("store_answer", prompt=self.answer_prompt)
         
-        logger.info("StorePipeline initialized with GPT-4o-mini")
+        logger.info(f"StorePipeline initialized with cascade {self.plan_chain.tiers}")
     
     def _get_prompt(self):
         """Khởi tạo các prompt templates."""
@@ -271,12 +278,42 @@ class StorePipeline:
             ("human", USER_STORE_ANSWER_PROMPT),
         ])
 
-    def query(self, query: str) -> dict:
+    def get_schema(self) -> str:
+        """
+        Lấy schema database (cache lại sau lần đầu vì schema hầu như không đổi).
+        
+        Returns:
+            str: Mô tả các bảng dùng trong prompt tạo SQL
+        """
+        if self._schema is None:
+            self._schema = self.db.get_table_info()
+        return self._schema
+
+    def plan(self, query: str, max_tiers: Optional[int] = None) -> Optional[QueryPlan]:
+        """
+        Tạo query plan (SQL + cấu hình biểu đồ) cho câu hỏi.
+        
+        Args:
+            query: Câu hỏi từ người dùng
+            max_tiers: Số tier tối đa của cascade được gọi (None: mọi tier)
+        
+        Returns:
+            QueryPlan: SQL và cấu hình biểu đồ (None nếu max_tiers tier đầu không cho plan hợp lệ)
+        """
+        return self.plan_chain.invoke({
+            "question": query,
+            "schema": self.get_schema()
+        }, max_tiers=max_tiers)
+
+    def query(self, query: str, routing: Optional[RoutingContext] = None) -> dict:
         """
         Xử lý câu hỏi về kho hàng/thống kê.
         
         Args:
             query: Câu hỏi từ người dùng
+            routing: Quyết định routing từ RouterPipeline (chỉ đọc, không routing lại).
+                Nếu có, thời gian từng stage được ghi vào routing.timings và
+                query plan đã chạy trước (routing.prefetch["store_plan"]) được dùng lại.
         
         Returns:
             dict với keys:
@@ -290,45 +327,33 @@ class StorePipeline:
         
         # Bước 1: Tạo query plan (SQL + chart config)
         steps.append("2. Query Plan: Tao SQL query va cau hinh bieu do")
-        plan: QueryPlan = self.plan_chain.invoke({
-            "question": query,
-            "schema": self.db.get_table_info()
-        })
+        plan: Optional[QueryPlan] = routing.prefetch.get("store_plan") if routing is not None else None
+        if plan is None:
+            with timed_stage(routing, "store.plan"):
+                plan = self.plan(query)
         
-        logger.info(f"Generated SQL: {plan.sql}")
-        logger.info(f"Need chart: {plan.need_chart}, Type: {plan.chart_type}")
-        steps.append(f"   - SQL: {plan.sql[:100]}..." if len(plan.sql) > 100 else f"   - SQL: {plan.sql}")
-        steps.append(f"   - Can bieu do: {'Co' if plan.need_chart else 'Khong'}")
-        if plan.need_chart:
-            steps.append(f"   - Loai bieu do: {plan.chart_type}")
+        self._log_plan(plan, steps)
         
         # Bước 2: Thực thi SQL
         steps.append("3. Execute SQL: Thuc thi query tren database")
         try:
-            with self.db._engine.connect() as conn:
-                result = conn.execute(text(plan.sql))
-                df = pd.DataFrame(result.fetchall(), columns=result.keys())
+            with timed_stage(routing, "store.sql"):
+                df = self._execute_sql(plan.sql)
             
             logger.info(f"Query returned {len(df)} rows")
             steps.append(f"   - Ket qua: {len(df)} dong du lieu")
         except Exception as e:
-            logger.error(f"SQL execution error: {e}")
-            steps.append(f"   - Loi: {str(e)}")
-            return {
-                'text': f"Lỗi khi thực thi truy vấn: {str(e)}",
-                'is_image': False,
-                'image': None,
-                'steps': steps
-            }
+            return self._sql_error(e, steps)
         
         # Bước 3: Nếu không cần chart, trả về text answer
         if not plan.need_chart:
             steps.append("4. Generate Answer: Tao cau tra loi tu du lieu")
-            df_string = dataframe_to_markdown(df)
-            res_ans = self.answer_chain.invoke({
-                'context': df_string,
-                'query': query
-            })
+            df_string = self._table_context(df, query)
+            with timed_stage(routing, "store.answer"):
+                res_ans = self.answer_chain.invoke({
+                    'context': df_string,
+                    'query': query
+                })
             steps.append("   - Hoan thanh: Tra ve cau tra loi text")
             return {
                 'text': res_ans.answer,
@@ -340,37 +365,14 @@ class StorePipeline:
         # Bước 4: Vẽ biểu đồ
         steps.append("4. Create Chart: Ve bieu do thong ke")
         try:
-            # Xác định cột x và y
-            x_col = plan.x if plan.x and plan.x in df.columns else df.columns[0]
-            y_col = plan.y if plan.y and plan.y in df.columns else df.columns[1] if len(df.columns) > 1 else df.columns[0]
-            
-            image = create_chart(
-                chart_type=plan.chart_type or "bar",
-                df=df,
-                x=x_col,
-                y=y_col,
-                title=plan.title or "Biểu đồ thống kê"
-            )
-            
-            # Tạo text mô tả kèm theo
-            df_string = dataframe_to_markdown(df, max_rows=10)
-            description = f"**{plan.title or 'Biểu đồ thống kê'}**\n\nDữ liệu chi tiết:\n\n{df_string}"
-            
-            logger.info("Chart generated successfully")
-            steps.append(f"   - Hoan thanh: Bieu do {plan.chart_type} da duoc tao")
-            
-            return {
-                'text': description,
-                'is_image': True,
-                'image': image,
-                'steps': steps
-            }
+            with timed_stage(routing, "store.chart"):
+                return self._chart_result(plan, df, steps)
             
         except Exception as e:
             logger.error(f"Chart generation error: {e}")
             steps.append(f"   - Loi: {str(e)} -> Fallback ve text")
             # Fallback: trả về text nếu không vẽ được chart
-            df_string = dataframe_to_markdown(df)
+            df_string = self._table_context(df, query)
             res_ans = self.answer_chain.invoke({
                 'context': df_string,
                 'query': query
@@ -383,6 +385,157 @@ class StorePipeline:
             }
 
 
+    async def aplan(self, query: str, max_tiers: Optional[int] = None) -> Optional[QueryPlan]:
+        """
+        Bản async của plan().
+        
+        Args:
+            query: Câu hỏi từ người dùng
+            max_tiers: Số tier tối đa của cascade được gọi (None: mọi tier)
+        
+        Returns:
+            QueryPlan: SQL và cấu hình biểu đồ (None nếu max_tiers tier đầu không cho plan hợp lệ)
+        """
+        schema = self._schema if self._schema is not None else await asyncio.to_thread(self.get_schema)
+        return await self.plan_chain.ainvoke({
+            "question": query,
+            "schema": schema
+        }, max_tiers=max_tiers)
+
+    async def aquery(self, query: str, routing: Optional[RoutingContext] = None) -> dict:
+        """
+        Bản async của query(): LLM chạy bằng ainvoke, SQL và vẽ biểu đồ chạy trong thread
+        để không chặn event loop.
+        
+        Args:
+            query: Câu hỏi từ người dùng
+            routing: Quyết định routing từ RouterPipeline (chỉ đọc, không routing lại).
+                Nếu routing.streaming, các bước và token của câu trả lời được phát qua routing.listener.
+        
+        Returns:
+            dict: Cùng format với query()
+        """
+        logger.info(f"Processing store query (async): {query}")
+        steps = StepLog(routing)
+        
+        steps.append("2. Query Plan: Tao SQL query va cau hinh bieu do")
+        plan: Optional[QueryPlan] = routing.prefetch.get("store_plan") if routing is not None else None
+        if plan is None:
+            with timed_stage(routing, "store.plan"):
+                plan = await self.aplan(query)
+        self._log_plan(plan, steps)
+        
+        steps.append("3. Execute SQL: Thuc thi query tren database")
+        try:
+            with timed_stage(routing, "store.sql"):
+                df = await asyncio.to_thread(self._execute_sql, plan.sql)
+            logger.info(f"Query returned {len(df)} rows")
+            steps.append(f"   - Ket qua: {len(df)} dong du lieu")
+        except Exception as e:
+            return self._sql_error(e, steps)
+        
+        if not plan.need_chart:
+            steps.append("4. Generate Answer: Tao cau tra loi tu du lieu")
+            with timed_stage(routing, "store.answer"):
+                answer_text = await self._agenerate_answer(df, query, routing)
+            steps.append("   - Hoan thanh: Tra ve cau tra loi text")
+            return {
+                'text': answer_text,
+                'is_image': False,
+                'image': None,
+                'steps': steps
+            }
+        
+        steps.append("4. Create Chart: Ve bieu do thong ke")
+        try:
+            with timed_stage(routing, "store.chart"):
+                return await asyncio.to_thread(self._chart_result, plan, df, steps)
+        except Exception as e:
+            logger.error(f"Chart generation error: {e}")
+            steps.append(f"   - Loi: {str(e)} -> Fallback ve text")
+            res_ans = await self.answer_chain.ainvoke({
+                'context': self._table_context(df, query),
+                'query': query
+            })
+            return {
+                'text': res_ans.answer + f"\n\n(Không thể vẽ biểu đồ: {str(e)})",
+                'is_image': False,
+                'image': None,
+                'steps': steps
+            }
+
+    async def _agenerate_answer(self, df: pd.DataFrame, query: str, routing: Optional[RoutingContext]) -> str:
+        inputs = {
+            'context': self._table_context(df, query),
+            'query': query
+        }
+        if routing is None or not routing.streaming:
+            res_ans = await self.answer_chain.ainvoke(inputs)
+            return res_ans.answer
+        
+        chunks = []
+        async for chunk in self.answer_stream_chain.astream(inputs):
+            chunks.append(chunk)
+            routing.emit("token", chunk)
+        return "".join(chunks)
+
+    def _table_context(self, df: pd.DataFrame, query: str, max_rows: int = 50) -> str:
+        """Markdown của nhiều dòng đầu nhất (tối đa max_rows) mà prompt trả lời vẫn vừa ngân sách token."""
+        return self.answer_context.fit_rows(
+            lambda n: dataframe_to_markdown(df, max_rows=n), len(df), max_rows=max_rows, query=query
+        )
+
+    def _log_plan(self, plan: QueryPlan, steps: list):
+        logger.info(f"Generated SQL: {plan.sql}")
+        logger.info(f"Need chart: {plan.need_chart}, Type: {plan.chart_type}")
+        steps.append(f"   - SQL: {plan.sql[:100]}..." if len(plan.sql) > 100 else f"   - SQL: {plan.sql}")
+        steps.append(f"   - Can bieu do: {'Co' if plan.need_chart else 'Khong'}")
+        if plan.need_chart:
+            steps.append(f"   - Loai bieu do: {plan.chart_type}")
+
+    def _execute_sql(self, sql: str) -> pd.DataFrame:
+        with self.db._engine.connect() as conn:
+            result = conn.execute(text(sql))
+            return pd.DataFrame(result.fetchall(), columns=result.keys())
+
+    def _sql_error(self, e: Exception, steps: list) -> dict:
+        logger.error(f"SQL execution error: {e}")
+        steps.append(f"   - Loi: {str(e)}")
+        return {
+            'text': f"Lỗi khi thực thi truy vấn: {str(e)}",
+            'is_image': False,
+            'image': None,
+            'steps': steps
+        }
+
+    def _chart_result(self, plan: QueryPlan, df: pd.DataFrame, steps: list) -> dict:
+        # Xác định cột x và y
+        x_col = plan.x if plan.x and plan.x in df.columns else df.columns[0]
+        y_col = plan.y if plan.y and plan.y in df.columns else df.columns[1] if len(df.columns) > 1 else df.columns[0]
+        
+        image = create_chart(
+            chart_type=plan.chart_type or "bar",
+            df=df,
+            x=x_col,
+            y=y_col,
+            title=plan.title or "Biểu đồ thống kê"
+        )
+        
+        # Tạo text mô tả kèm theo
+        df_string = dataframe_to_markdown(df, max_rows=10)
+        description = f"**{plan.title or 'Biểu đồ thống kê'}**\n\nDữ liệu chi tiết:\n\n{df_string}"
+        
+        logger.info("Chart generated successfully")
+        steps.append(f"   - Hoan thanh: Bieu do {plan.chart_type} da duoc tao")
+        
+        return {
+            'text': description,
+            'is_image': True,
+            'image': image,
+            'steps': steps
+        }
+
+
 if __name__ == "__main__":
     # Test StorePipeline
     pipeline = StorePipeline()
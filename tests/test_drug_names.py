@@ -0,0 +1,51 @@
+"""
+Test cho từ điển tên thuốc (query/core/drug_names.py) trên một danh sách thuốc nhỏ.
+"""
+import pytest
+
+from query.core.drug_names import DrugEntry, DrugNameResolver
+
+ENTRIES = [
+    DrugEntry("thuoc-toganin-500mg-truong-tho-12x5-37164", "Thuốc Toganin 500 Trường Thọ Pharma điều trị đau đầu",
+              "giam-dau"),
+    DrugEntry("extra-deep-heat-4056", "Kem xoa bóp Extra Deep Heat giảm đau cơ", "giam-dau"),
+    DrugEntry("alenta-10mg-4810", "Thuốc Alenta 10mg điều trị dị ứng", "di-ung"),
+]
+# Số thuốc có mỗi từ trong phần mô tả: từ phổ biến thì không phải tên riêng
+WORD_DOCS = {"dau": 200, "thuoc": 500, "dieu": 300, "tri": 300, "giam": 200, "co": 100, "kem": 80, "xoa": 50}
+
+
+@pytest.fixture(scope="module")
+def resolver():
+    return DrugNameResolver(ENTRIES, ingredient_tokens={"paracetamol"}, word_docs=WORD_DOCS)
+
+
+def test_resolves_typo_with_strength(resolver):
+    matches = resolver.resolve("toganim 500 uống thế nào")
+    assert [match.file_names for match in matches] == [("thuoc-toganin-500mg-truong-tho-12x5-37164",)]
+    assert matches[0].corrections == 1
+
+
+def test_single_prefix_word_does_not_resolve(resolver):
+    # "extra" là tiền tố của "extra deep heat" nhưng câu hỏi nói về Panadol Extra
+    assert resolver.resolve("Panadol extra có tác dụng phụ không") == []
+
+
+def test_full_name_resolves(resolver):
+    matches = resolver.resolve("Extra Deep Heat dùng cho trẻ em được không")
+    assert [match.file_names for match in matches] == [("extra-deep-heat-4056",)]
+
+
+def test_ingredient_name_does_not_resolve(resolver):
+    assert resolver.resolve("paracetamol có tác dụng gì") == []
+
+
+def test_resolve_one_limits_number_of_drugs(resolver):
+    query = "alenta 10mg và toganin 500 dùng chung được không"
+    assert len(resolver.resolve(query)) == 2
+    assert resolver.resolve_one(query) == []
+    assert len(resolver.resolve_one(query, max_drugs=2)) == 2
+
+
+def test_complete_prefix(resolver):
+    assert [entry.file_name for entry in resolver.complete("toganin")] == [ENTRIES[0].file_name]
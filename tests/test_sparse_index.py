@@ -0,0 +1,60 @@
+"""
+Test cho chỉ mục BM25 (query/core/sparse_index.py): tách từ có đơn vị hàm lượng, build + search.
+"""
+from query.core.sparse_index import SparseIndex, build_sparse_index, chunk_key, reciprocal_rank_fusion, tokenize
+
+CORPUS = [
+    ("Paracetamol 500mg giảm đau, hạ sốt. Liều dùng: 1 viên mỗi 4-6 giờ.", "paracetamol-500mg"),
+    ("Siro ho Prospan 2,5mg/5ml cho trẻ em, uống 2 lần mỗi ngày.", "prospan-siro"),
+    ("Ibuprofen 400mg chống viêm, giảm đau. Không dùng cho người loét dạ dày.", "ibuprofen-400mg"),
+    ("Vitamin C 500mg tăng sức đề kháng.", "vitamin-c-500mg"),
+]
+
+
+def _build(tmp_path):
+    path = tmp_path / "test.bm25"
+    build_sparse_index([text for text, _ in CORPUS],
+                       [{"file_name": name, "chunk_id": name} for _, name in CORPUS], path, name="test")
+    return SparseIndex(path)
+
+
+def test_tokenize_keeps_dose_units_together():
+    assert "2.5mg/5ml" in tokenize("Siro 2,5mg/5ml", bigrams=False)
+    assert "2.5mg/5ml" in tokenize("liều 2.5 mg / 5 ml", bigrams=False)
+    assert "500mg" in tokenize("Paracetamol 500 mg", bigrams=False)
+
+
+def test_tokenize_folds_diacritics_and_adds_bigrams():
+    tokens = tokenize("Giảm đau")
+    assert tokens == ["giam", "dau", "giam_dau"]
+
+
+def test_search_ranks_exact_dose_first(tmp_path):
+    index = _build(tmp_path)
+    rows = index.search("paracetamol 500mg", limit=3)
+    assert index.payload(rows[0][0])["metadata"]["file_name"] == "paracetamol-500mg"
+    # "500mg" một mình vẫn tìm được cả hai thuốc 500mg
+    names = {index.payload(row)["metadata"]["file_name"] for row, _ in index.search("500mg", limit=4)}
+    assert {"paracetamol-500mg", "vitamin-c-500mg"} <= names
+
+
+def test_search_matches_unit_token(tmp_path):
+    index = _build(tmp_path)
+    rows = index.search("siro 2.5 mg/5 ml", limit=1)
+    assert index.payload(rows[0][0])["metadata"]["file_name"] == "prospan-siro"
+
+
+def test_search_unknown_terms_returns_nothing(tmp_path):
+    assert _build(tmp_path).search("metformin", limit=3) == []
+
+
+def test_payload_round_trip_and_chunk_key(tmp_path):
+    index = _build(tmp_path)
+    payload = index.payload(1)
+    assert payload["text"] == CORPUS[1][0]
+    assert chunk_key(payload) == "prospan-siro"
+
+
+def test_reciprocal_rank_fusion_prefers_items_in_both_rankings():
+    fused = reciprocal_rank_fusion([["a", "b", "c"], ["c", "d"]], k=60)
+    assert [key for key, _ in fused][:2] == ["c", "a"]